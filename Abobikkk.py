@@ -1,16 +1,34 @@
+import asyncio
 import logging
+import sys
 import json
+import bisect
+import functools
+import threading
+import hashlib
+import zlib
 from datetime import datetime, timedelta
 from zoneinfo import ZoneInfo, ZoneInfoNotFoundError
+from typing import Iterable, Iterator
 import time
-from telegram import Update, InlineKeyboardButton, InlineKeyboardMarkup, InputMediaPhoto
+from telegram import (
+    Update,
+    InlineKeyboardButton,
+    InlineKeyboardMarkup,
+    InputMediaPhoto,
+    InlineQueryResultArticle,
+    InputTextMessageContent,
+)
 from telegram.ext import (
     Application,
+    ApplicationHandlerStop,
     CommandHandler,
     ContextTypes,
     CallbackQueryHandler,
     ConversationHandler,
+    InlineQueryHandler,
     MessageHandler,
+    TypeHandler,
     filters,
 )
 import telegram
@@ -65,6 +83,28 @@ def contains_profanity(text: str) -> bool:
 
 # --- ІНТЕГРАЦІЯ: Імпорт SQLManaging ---
 from SQManager import SQLManaging
+from bot_metrics import (
+    BROADCAST_MESSAGES,
+    METRICS,
+    TimedConnection,
+    instrument_callback,
+    monitor_event_loop_lag,
+    start_metrics_server,
+)
+from bot_profiling import ProfilingSession
+from bot_tracing import (
+    TRACE_SAMPLE_RATE,
+    completed_traces,
+    export_traces_json,
+    get_slowest_traces,
+    span,
+    summarize_trace_spans,
+    trace_update,
+)
+from broadcast_engine import run_broadcast
+from hyperloglog import HyperLogLog
+from sqlite_persistence import SQLitePersistence
+from telegram_rate_limiter import LANE_BROADCAST, LANE_DLQ, LaneRateLimiter
 # ---------------------------------------
 
 load_dotenv()
@@ -182,6 +222,53 @@ sql_manager: SQLManaging | None = None
 
 schedule_cache = None
 
+# Версія знімку розкладу: збільшується при кожному (пере)завантаженні кешу.
+# Усі похідні кеші (рендери, індекси) прив'язані до неї.
+
+schedule_cache_version = 0
+
+schedule_render_cache: dict = {}
+
+schedule_render_stats: dict[str, dict[str, int]] = {}  # view -> {"hits": ..., "misses": ...}
+
+schedule_prefix_index: list[tuple[str, str, str]] = []  # (нормалізований ключ, тип, назва)
+
+# Часова шкала дзвінків: [початок_1, кінець_1, початок_2, ...] у хвилинах від півночі
+
+bell_timeline: list[int] = []
+
+bell_slots: list[tuple[int, int, str]] = []  # (початок, кінець, номер пари)
+
+# (група, день, тип тижня) -> (рядки пар по слотах, індекс наступної пари для кожного слота)
+
+now_slot_renders: dict[tuple[str, str, str], tuple[list, list]] = {}
+
+# Нечіткий пошук викладачів: триграмний індекс по іменах з розкладу та таблиці teachers
+
+teacher_index_entries: list[dict] = []
+
+teacher_trigram_index: dict[str, list[int]] = {}
+
+teacher_lessons_by_schedule_name: dict[str, list[dict]] = {}
+
+# Версія індексу викладачів (кнопки ft_{версія}_{індекс}): позиції зсуваються при кожній перебудові
+
+teacher_index_version = 0
+
+TEACHER_RENDER_VIEWS = ("teacher_day", "teacher_full", "teacher_week")
+
+TEACHER_MATCH_THRESHOLD = float(os.getenv("TEACHER_MATCH_THRESHOLD", "0.6"))
+
+# Конфлікти розкладу (викладач або аудиторія в двох місцях одночасно)
+
+schedule_conflicts: list[dict] = []
+
+CONFLICT_IGNORED_ROOMS = {"", "-", "с/з", "спортзал", "спорт", "дист", "дистанційно", "online", "онлайн"}
+
+INLINE_QUERY_CACHE_TIME = int(os.getenv("INLINE_QUERY_CACHE_TIME", "300"))
+
+INLINE_QUERY_MAX_RESULTS = 20
+
 # ----------------------------------------------------
 
 # --- Конфігурація для спеціальностей ---
@@ -224,6 +311,40 @@ except ValueError:
     BASE_DATE = datetime(2025, 6, 2, 0, 0, 0, tzinfo=KYIV_TZ)
 
 
+# --- Конфігурація експорту розкладу в ICS ---
+
+SEMESTER_END_DATE_STR = os.getenv("SEMESTER_END_DATE")  # Формат YYYY-MM-DD
+
+ICS_EXPORT_WEEKS = int(os.getenv("ICS_EXPORT_WEEKS", "18"))
+
+SEMESTER_END_DATE = None
+
+if SEMESTER_END_DATE_STR:
+
+    try:
+
+        _naive_semester_end = datetime.strptime(SEMESTER_END_DATE_STR, "%Y-%m-%d")
+
+        SEMESTER_END_DATE = datetime(
+            _naive_semester_end.year,
+            _naive_semester_end.month,
+            _naive_semester_end.day,
+            23,
+            59,
+            59,
+            tzinfo=KYIV_TZ,
+        )
+
+    except ValueError:
+
+        logger.error(
+            f"Некоректний формат SEMESTER_END_DATE ('{SEMESTER_END_DATE_STR}'). "
+            f"Експорт ICS охоплюватиме {ICS_EXPORT_WEEKS} тижнів."
+        )
+
+# -------------------------------------------
+
+
 maintenance_mode_active = False
 
 maintenance_message = "Бот на технічному обслуговуванні. Будь ласка, спробуйте пізніше."
@@ -232,8 +353,225 @@ maintenance_end_time = None
 
 MAINTENANCE_JOB_NAME = "disable_maintenance_job"
 
+# Під час ТО: не більше одного сповіщення на чат за вікно (callback'и отримують лише alert)
+
+MAINTENANCE_NOTICE_THROTTLE_SECONDS = int(os.getenv("MAINTENANCE_NOTICE_THROTTLE_SECONDS", "60"))
+
+MAINTENANCE_GATE_GROUP = -2  # Раніше за трекінг активності (-1) і всі звичайні обробники
+
+maintenance_notice_text = ""  # Готовий текст сповіщення (refresh_maintenance_notice)
+
+maintenance_alert_text = ""  # Той самий текст, обрізаний до ліміту alert'а callback'а
+
+CALLBACK_ALERT_MAX_LENGTH = 200  # Ліміт Bot API для тексту answerCallbackQuery
+
+maintenance_notice_sent_at: dict[int, float] = {}  # {chat_id: time.monotonic()}
+
+# Стан ТО зберігається в БД (maintenance_state); інші екземпляри підхоплюють його цією задачею
+
+MAINTENANCE_STATE_SYNC_JOB_NAME = "maintenance_state_sync"
+
+MAINTENANCE_STATE_SYNC_INTERVAL_SECONDS = int(
+    os.getenv("MAINTENANCE_STATE_SYNC_INTERVAL_SECONDS", "30")
+)
+
+maintenance_state_version = None  # updated_at останнього запису/читання maintenance_state
+
 FTP_SYNC_JOB_NAME = "ftp_sync_db_job"
 
+BROADCAST_WORKER_JOB_NAME = "broadcast_worker_job"
+
+BROADCAST_WORKER_INTERVAL_SECONDS = int(os.getenv("BROADCAST_WORKER_INTERVAL_SECONDS", "3"))
+
+BROADCAST_CHUNK_SIZE = int(os.getenv("BROADCAST_CHUNK_SIZE", "100"))
+
+# Результати доставки пишуться в БД кожні N отримувачів: після перезапуску повторно
+# отримають повідомлення не більше N людей (1 - запис після кожного отримувача)
+
+BROADCAST_OUTCOME_FLUSH_SIZE = max(1, int(os.getenv("BROADCAST_OUTCOME_FLUSH_SIZE", "10")))
+
+BROADCAST_STATUS_DISPLAY = {
+    "pending": "🕓 в черзі",
+    "running": "▶️ виконується",
+    "paused": "⏸ на паузі",
+    "cancelled": "✖️ скасовано",
+    "completed": "✅ завершено",
+    "failed": "❌ зупинено (помилка вмісту)",
+}
+
+# Відкладені оголошення: зберігаються в scheduled_announcements і ставляться в job_queue при старті
+
+SCHEDULED_ANNOUNCEMENT_JOB_PREFIX = "scheduled_announcement_"
+
+# Непікові слоти (ГГ:ХХ за Києвом) поза ранковим/вечірнім переглядом розкладу - пропонуються кнопками
+
+ANNOUNCE_OFF_PEAK_SLOTS = [
+    slot.strip()
+    for slot in os.getenv("ANNOUNCE_OFF_PEAK_SLOTS", "10:00,14:30,20:30").split(",")
+    if slot.strip()
+]
+
+ANNOUNCE_OFF_PEAK_SLOT_CHOICES = 4
+
+# Сегменти аудиторії (бітові карти над user_ordinals), які адмін комбінує через AND / OR / NOT
+
+AUDIENCE_SEGMENT_REFRESH_JOB_NAME = "audience_segment_refresh_job"
+
+AUDIENCE_SEGMENT_REFRESH_INTERVAL_SECONDS = int(
+    os.getenv("AUDIENCE_SEGMENT_REFRESH_INTERVAL_SECONDS", "60")
+)
+
+AUDIENCE_ACTIVE_DAYS = (7, 30)
+
+AUDIENCE_ROLE_SEGMENTS = {
+    "student": "Студенти",
+    "teacher": "Викладачі",
+    "staff": "Працівники",
+    "guest": "Гості",
+}
+
+# Рік набору в назві групи залежить від курсу і навчального року (get_course_year_suffixes)
+
+COURSE_COUNT = 4
+
+ACADEMIC_YEAR_START_MONTH = 9  # Навчальний рік починається у вересні
+
+audience_segment_bitmaps: dict[str, int] = {}  # {назва сегмента: бітова карта (int)}
+
+audience_dirty_user_ids: set[int] = set()  # Користувачі, чиє членство треба перерахувати
+
+pending_user_activity: dict[int, int] = {}  # {user_id: unix-час} - скидається в БД пакетом
+
+# Буферизовані лічильники: команди/кнопки та воронка реєстрації (скидаються в БД пакетом)
+
+STATS_FLUSH_JOB_NAME = "stats_flush"
+
+STATS_FLUSH_INTERVAL_SECONDS = 30
+
+pending_command_stats: dict[str, int] = {}
+
+pending_funnel_counts: dict[tuple[str, str], int] = {}  # (день когорти, крок) -> кількість
+
+pending_funnel_durations: dict[tuple[str, int], int] = {}  # (день когорти, кошик с) -> кількість
+
+REGISTRATION_FUNNEL_STEPS = ("start", "role_student", "course", "group")
+
+REGISTRATION_FUNNEL_STEP_LABELS = {
+    "start": "1. Показано вибір ролі",
+    "role_student": "2. Обрано роль «Студент»",
+    "course": "3. Обрано курс",
+    "group": "4. Обрано групу",
+}
+
+REGISTRATION_FUNNEL_KEY = "registration_funnel"
+
+REGISTRATION_FUNNEL_TTL_SECONDS = 86400
+
+REGISTRATION_FUNNEL_MAX_DAYS = 90
+
+# Верхні межі кошиків часу реєстрації (с) для медіани
+
+REGISTRATION_DURATION_BUCKETS = (5, 10, 15, 20, 30, 45, 60, 90, 120, 180, 300, 600, 1800, 3600, 86400)
+
+# DAU/WAU/MAU: денні HyperLogLog-скетчі за вимірами ("all", "group:...", "role:...")
+
+ACTIVITY_SKETCH_PRECISION = 11  # 2 КіБ на скетч (у БД - стиснуто zlib), похибка ~2.3%
+
+ACTIVITY_SKETCH_RETENTION_DAYS = 90
+
+ACTIVITY_ATTRIBUTION_CHUNK_SIZE = 500  # Менше ліміту параметрів SQLite (999)
+
+ACTIVITY_WINDOWS = {"DAU": 1, "WAU": 7, "MAU": 30}
+
+ACTIVITY_TOP_GROUPS = 10
+
+# Зміни з останнього скидання: (день, вимір) -> скетч; у БД зливаються з уже збереженими
+
+activity_sketches: dict[tuple[str, str], HyperLogLog] = {}
+
+# pending_user_activity і activity_sketches змінюються і з циклу подій, і з фонових потоків
+# (ensure_audience_segments_async): усі зміни - лише під activity_lock
+
+activity_lock = threading.Lock()
+
+activity_sketches_flush_lock = threading.Lock()  # Одне злиття скетчів з БД за раз
+
+audience_segments_refreshed_at = 0
+
+audience_segments_lock = asyncio.Lock()  # Один перерахунок сегментів у фоновому потоці за раз
+
+SCHEDULED_ANNOUNCEMENT_STATUS_DISPLAY = {
+    "scheduled": "🕒 заплановано",
+    "sent": "📨 передано в розсилку",
+    "cancelled": "✖️ скасовано",
+    "failed": "❌ помилка",
+}
+
+DLQ_REDELIVERY_JOB_NAME = "dlq_redelivery_job"
+
+DLQ_REDELIVERY_INTERVAL_SECONDS = int(os.getenv("DLQ_REDELIVERY_INTERVAL_SECONDS", "60"))
+
+DLQ_REDELIVERY_BATCH_SIZE = int(os.getenv("DLQ_REDELIVERY_BATCH_SIZE", "50"))
+
+DLQ_MAX_ATTEMPTS = int(os.getenv("DLQ_MAX_ATTEMPTS", "5"))
+
+DLQ_RETRY_BASE_DELAY_SECONDS = 60
+
+DLQ_RETRY_MAX_DELAY_SECONDS = 6 * 60 * 60
+
+DLQ_CLASS_PERMANENT = "permanent"
+
+DLQ_CLASS_TRANSIENT = "transient"
+
+# Помилка у вмісті розсилки (задовгий текст, зламана розмітка) - вина відправника, а не отримувача
+
+DLQ_CLASS_PAYLOAD = "payload"
+
+# Фрагменти тексту BadRequest (у нижньому регістрі), за якими розрізняємо причину помилки
+
+RECIPIENT_GONE_ERROR_MARKERS = ("chat not found", "user not found", "peer_id_invalid")
+
+PAYLOAD_ERROR_MARKERS = (
+    "message is too long",
+    "caption is too long",
+    "can't parse entities",
+    "message text is empty",
+    "wrong file identifier",
+    "wrong remote file identifier",
+    "failed to get http url content",
+    "wrong type of the web page content",
+)
+
+# Записи DLQ зі старої схеми (без класу помилки), старші за цей вік, не доставляються повторно
+
+DLQ_LEGACY_MAX_AGE_DAYS = int(os.getenv("DLQ_LEGACY_MAX_AGE_DAYS", "3"))
+
+DLQ_MEDIA_PREFIX = "[Оголошення з фото]"
+
+# Користувач вважається недоступним, якщо заблокував бота або має стільки невдач поспіль
+
+USER_UNREACHABLE_FAILURE_THRESHOLD = int(os.getenv("USER_UNREACHABLE_FAILURE_THRESHOLD", "3"))
+
+REACHABLE_USERS_SQL = (
+    "(COALESCE(last_delivery_status, 'ok') != 'blocked' AND COALESCE(consecutive_failures, 0) < ?)"
+)
+
+# Смуги спільного планувальника запитів (telegram_rate_limiter): масові відправки не блокують відповіді
+
+BROADCAST_LANE_ARGS = {"lane": LANE_BROADCAST}
+
+DLQ_LANE_ARGS = {"lane": LANE_DLQ}
+
+# Розмір пакета для посторінкового (keyset) перебору користувачів - пам'ять не залежить від аудиторії
+
+USER_ID_CHUNK_SIZE = int(os.getenv("USER_ID_CHUNK_SIZE", "1000"))
+
+broadcast_worker_busy = False
+
+dlq_redelivery_busy = False
+
+broadcast_job_status_overrides = {}  # {job_id: "paused" | "cancelled" | "failed"} - миттєва зупинка поточного пакета
+
 # Змінна для зберігання ID повідомлень про технічне обслуговування
 
 # Використовуємо словник для зберігання message_id для кожного чату
@@ -300,6 +638,10 @@ SELECTING_ADMISSION_FORM = TYPING_FEEDBACK + 12  # НОВА МІНІМАЛЬНА
 
 VIEWING_ADMISSION_DOCS = SELECTING_ADMISSION_FORM + 1
 
+ANNOUNCE_SELECT_SEND_TIME = VIEWING_ADMISSION_DOCS + 1
+
+ANNOUNCE_TYPING_SEGMENT_EXPRESSION = ANNOUNCE_SELECT_SEND_TIME + 1
+
 # Кінець єдиного блоку констант
 
 # Кінець єдиного блоку констант
@@ -324,6 +666,102 @@ FTP_REMOTE_DB_PATH = os.getenv("FTP_REMOTE_DB_PATH")
 
 PROGRESS_UPDATE_INTERVAL = 50  # Update every 50 messages sent
 
+# Метрики Prometheus: локальний HTTP /metrics (див. bot_metrics.py)
+
+ENABLE_METRICS = os.getenv("ENABLE_METRICS", "true").lower() == "true"
+
+METRICS_HOST = os.getenv("METRICS_HOST", "127.0.0.1")
+
+METRICS_PORT = int(os.getenv("METRICS_PORT", "9108"))
+
+EVENT_LOOP_LAG_CHECK_INTERVAL_SECONDS = 1.0
+
+TRACES_MAX_LIMIT = 20  # /traces N: не більше стількох trace'ів за раз
+
+PROFILE_MAX_SECONDS = 300
+
+PROFILE_JOB_NAME = "admin_profile_finish"
+
+active_profiling_session = None
+
+# Отримання оновлень: long polling (за замовчуванням) або webhook за TLS-проксі (nginx, Caddy)
+
+BOT_RUN_MODE = os.getenv("BOT_RUN_MODE", "polling").lower()
+
+WEBHOOK_LISTEN = os.getenv("WEBHOOK_LISTEN", "127.0.0.1")  # TLS завершує проксі перед ботом
+
+WEBHOOK_PORT = int(os.getenv("WEBHOOK_PORT", "8080"))
+
+WEBHOOK_URL = os.getenv("WEBHOOK_URL")  # Публічна https-адреса проксі
+
+WEBHOOK_PATH = os.getenv("WEBHOOK_PATH", "telegram").strip("/")
+
+WEBHOOK_SECRET_TOKEN = os.getenv("WEBHOOK_SECRET_TOKEN")
+
+WEBHOOK_MAX_CONNECTIONS = int(os.getenv("WEBHOOK_MAX_CONNECTIONS", "40"))
+
+# Лише типи оновлень, для яких є обробники (edited_message, chat_member тощо бот не обробляє)
+
+ALLOWED_UPDATES = [Update.MESSAGE, Update.CALLBACK_QUERY, Update.INLINE_QUERY]
+
+# Стан сесій: тимчасові ключі user_data з TTL і тайм-аут покинутих діалогів
+
+SESSION_TRANSIENT_KEY = "_transient"
+
+SESSION_TRANSIENT_PRUNE_THRESHOLD = 50
+
+CALLBACK_ANSWERED_TTL_SECONDS = 300
+
+CONVERSATION_TIMEOUT_SECONDS = int(os.getenv("CONVERSATION_TIMEOUT_SECONDS", "900"))
+
+SESSION_STATE_SWEEP_JOB_NAME = "session_state_sweep"
+
+SESSION_STATE_SWEEP_INTERVAL_SECONDS = 600
+
+SESSION_REPORT_TOP = 10
+
+# Проміжні дані діалогів (за name ConversationHandler) - видаляються при тайм-ауті цього діалогу
+
+MESSAGE_FLOW_USER_DATA_KEYS = (
+    "chat_id_for_delete",
+    "chat_id_for_edit",
+    "message_to_delete_id",
+    "message_to_edit_id",
+)
+
+CONVERSATION_OWNED_USER_DATA_KEYS = {
+    "announce": (
+        "announce_include_unreachable",
+        "announce_media_type",
+        "announce_segment_expression",
+        "announce_send_at",
+        "announce_target_group",
+        "announcement_caption",
+        "media_group_photos",
+    ),
+    "report": MESSAGE_FLOW_USER_DATA_KEYS,
+    "feedback": MESSAGE_FLOW_USER_DATA_KEYS,
+    "suggestion": MESSAGE_FLOW_USER_DATA_KEYS,
+    "manage_teachers": ("edit_teacher_id", "teacher_add_name", "otp_teacher_id"),
+    "maintenance": ("maintenance_duration", "maintenance_setter_id"),
+    "role_selection": ("selected_course",),
+    "change_group": ("selected_course",),
+}
+
+CONVERSATION_STATES_KEY = "_conversation_states"  # {name діалогу: поточний стан} у user_data
+
+CONVERSATION_INPUT_STATES: dict[str, set] = {}  # Стани, що чекають на введення користувача
+
+metrics_server = None
+
+event_loop_lag_task = None
+
+
+def connect_db() -> sqlite3.Connection:
+    """З'єднання з БД користувачів; час кожного запиту потрапляє в метрики."""
+
+    return sqlite3.connect(DATABASE_NAME, factory=TimedConnection)
+
 
 # --- ІНТЕГРАЦІЯ: Функція ініціалізації БД розкладу ---
 
@@ -397,7 +835,7 @@ def initialize_database():
 
     try:
 
-        with sqlite3.connect(DATABASE_NAME) as conn:
+        with connect_db() as conn:
 
             cursor = conn.cursor()
 
@@ -477,6 +915,28 @@ def initialize_database():
 
             logger.info("БД Користувачів: Додано стовпець 'role'.")  #
 
+        if "last_delivery_status" not in existing_columns:
+
+            cursor.execute("ALTER TABLE users ADD COLUMN last_delivery_status TEXT DEFAULT NULL")
+
+        if "consecutive_failures" not in existing_columns:
+
+            cursor.execute("ALTER TABLE users ADD COLUMN consecutive_failures INTEGER DEFAULT 0")
+
+            logger.info("БД Користувачів: Додано стовпці статусу доставки.")
+
+        if "last_active_at" not in existing_columns:
+
+            # Unix-час останньої взаємодії з ботом (для сегментів "активні за N днів")
+
+            cursor.execute("ALTER TABLE users ADD COLUMN last_active_at INTEGER DEFAULT NULL")
+
+            logger.info("БД Користувачів: Додано стовпець 'last_active_at'.")
+
+        cursor.execute(
+            "CREATE INDEX IF NOT EXISTS idx_users_last_active_at ON users (last_active_at)"
+        )
+
         # ---- ДОДАЙТЕ ЦЕЙ БЛОК ДЛЯ СТВОРЕННЯ ТАБЛИЦІ ВИКЛАДАЧІВ ----
 
         cursor.execute(
@@ -512,4914 +972,10000 @@ def initialize_database():
         )
 
         cursor.execute(
-            "CREATE TABLE IF NOT EXISTS dead_letter_queue (id INTEGER PRIMARY KEY AUTOINCREMENT, user_id INTEGER NOT NULL, message_text TEXT NOT NULL, error_message TEXT, failed_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP, status TEXT DEFAULT 'new')"
+            "CREATE TABLE IF NOT EXISTS maintenance_state (id INTEGER PRIMARY KEY CHECK (id = 1), active INTEGER NOT NULL DEFAULT 0, message TEXT, end_time TEXT, updated_at REAL)"
         )
 
-        conn.commit()
+        # Сповіщення про ТО окремо від стану: запис одного чату не перезаписує решту
 
-        logger.info(f"БД Користувачів: '{DATABASE_NAME}' готова.")
+        cursor.execute(
+            "CREATE TABLE IF NOT EXISTS maintenance_notices (chat_id INTEGER PRIMARY KEY, message_id INTEGER NOT NULL)"
+        )
 
-    except sqlite3.Error as e:
+        cursor.execute(
+            "CREATE TABLE IF NOT EXISTS registration_funnel (day TEXT NOT NULL, step TEXT NOT NULL, count INTEGER DEFAULT 0, PRIMARY KEY (day, step))"
+        )
 
-        logger.critical(f"БД Користувачів: Критична помилка SQLite під час ініціалізації: {e}")
+        cursor.execute(
+            "CREATE TABLE IF NOT EXISTS registration_funnel_durations (day TEXT NOT NULL, bucket_seconds INTEGER NOT NULL, count INTEGER DEFAULT 0, PRIMARY KEY (day, bucket_seconds))"
+        )
 
-        raise
+        cursor.execute(
+            "CREATE TABLE IF NOT EXISTS dead_letter_queue (id INTEGER PRIMARY KEY AUTOINCREMENT, user_id INTEGER NOT NULL, message_text TEXT NOT NULL, error_message TEXT, failed_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP, status TEXT DEFAULT 'new')"
+        )
 
-    except Exception as e:
+        dlq_columns = [
+            col[1] for col in cursor.execute("PRAGMA table_info(dead_letter_queue)").fetchall()
+        ]
 
-        logger.critical(f"БД Користувачів: Критична помилка під час ініціалізації: {e}")
+        if "error_class" not in dlq_columns:
 
-        raise
+            cursor.execute(
+                "ALTER TABLE dead_letter_queue ADD COLUMN error_class TEXT DEFAULT 'transient'"
+            )
 
+            # Старі записи отримали 'transient' за замовчуванням - відновлюємо клас з тексту помилки
 
-def add_or_update_user_in_db(
-    user_id: int,
-    username: str | None,
-    first_name: str | None,
-    last_name: str | None,
-    group_name: str | None = "ASK_LATER",
-    referrer_id: int | None = None,
-):
+            for error_class, markers in (
+                (DLQ_CLASS_PERMANENT, ("forbidden", "blocked", *RECIPIENT_GONE_ERROR_MARKERS)),
+                (DLQ_CLASS_PAYLOAD, PAYLOAD_ERROR_MARKERS),
+            ):
 
-    try:
+                marker_conditions = " OR ".join("LOWER(error_message) LIKE ?" for _ in markers)
 
-        with sqlite3.connect(DATABASE_NAME) as conn:
+                cursor.execute(
+                    f"""
 
-            cursor = conn.cursor()
+                    UPDATE dead_letter_queue SET error_class = ?, status = 'dead'
 
-            cursor.execute("SELECT * FROM users WHERE user_id = ?", (user_id,))
+                    WHERE status = 'new' AND ({marker_conditions})
 
-            existing_user = cursor.fetchone()
+                """,
+                    (error_class, *(f"%{marker}%" for marker in markers)),
+                )
 
-            if existing_user:
+            # Давні оголошення вже неактуальні - не розсилаємо їх після оновлення
 
-                cursor.execute(
-                    """
+            cursor.execute(
+                "UPDATE dead_letter_queue SET status = 'dead' WHERE status = 'new' AND failed_at < datetime('now', ?)",
+                (f"-{DLQ_LEGACY_MAX_AGE_DAYS} days",),
+            )
 
-                    UPDATE users SET
+            logger.info(
+                f"БД Користувачів: DLQ - класи помилок відновлено, записи старші за {DLQ_LEGACY_MAX_AGE_DAYS} дн. позначено 'dead'."
+            )
 
-                        username = ?,
+        if "attempts" not in dlq_columns:
 
-                        first_name = ?,
+            cursor.execute("ALTER TABLE dead_letter_queue ADD COLUMN attempts INTEGER DEFAULT 0")
 
-                        last_name = ?
+        if "next_attempt_at" not in dlq_columns:
 
-                    WHERE user_id = ?
+            cursor.execute("ALTER TABLE dead_letter_queue ADD COLUMN next_attempt_at TIMESTAMP")
 
-                """,
-                    (username, first_name, last_name, user_id),
-                )
+            logger.info("БД Користувачів: DLQ розширено полями для повторної доставки.")
 
-            else:
+        if "broadcast_id" not in dlq_columns:
 
-                cursor.execute(
-                    """
+            # Текст/медіа розсилки зберігаються один раз у broadcasts, DLQ посилається на них
 
-                    INSERT INTO users (user_id, username, first_name, last_name, group_name, referrer_id)
+            cursor.execute("ALTER TABLE dead_letter_queue ADD COLUMN broadcast_id INTEGER")
 
-                    VALUES (?, ?, ?, ?, ?, ?)
+        # --- Вміст розсилок (один запис на розсилку, на нього посилаються завдання та DLQ) ---
 
-                """,
-                    (user_id, username, first_name, last_name, group_name, referrer_id),
-                )
+        cursor.execute(
+            """
 
-            conn.commit()
+            CREATE TABLE IF NOT EXISTS broadcasts (
 
-            if not existing_user and referrer_id:
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
 
-                increment_referred_count(referrer_id)
+                created_by INTEGER,
 
-                logger.info(
-                    f"БД Користувачів: Користувач {user_id} доданий за рефералом {referrer_id}. Лічильник рефералів для {referrer_id} збільшено."
-                )
-
-            else:
-
-                logger.info(
-                    f"БД Користувачів: Користувач {user_id} збережений/оновлений. Група: {get_user_group_from_db(user_id)}"
-                )
+                kind TEXT NOT NULL DEFAULT 'text',
 
-    except sqlite3.Error as e:
-
-        logger.error(f"БД Користувачів: Помилка збереження користувача {user_id}: {e}")
+                message_text TEXT,
 
+                media_json TEXT,
 
-def get_user_data_from_db(user_id: int) -> dict | None:
-    try:
-        with sqlite3.connect(DATABASE_NAME) as conn:
-            conn.row_factory = sqlite3.Row
-            cursor = conn.cursor()
-            cursor.execute("SELECT * FROM users WHERE user_id = ?", (user_id,))
-            result = cursor.fetchone()
-            return dict(result) if result else None
-    except sqlite3.Error as e:
-        logger.error(f"БД Користувачів: Помилка отримання даних користувача {user_id}: {e}")
-        return None
+                parse_mode TEXT,
 
+                created_at TEXT
 
-def set_user_group_in_db(user_id: int, group_name: str | None) -> bool:
-    try:
-        with sqlite3.connect(DATABASE_NAME) as conn:
-            cursor = conn.cursor()
-            cursor.execute(
-                "UPDATE users SET group_name = ? WHERE user_id = ?", 
-                (group_name, user_id)
             )
-            conn.commit()
-        
-        logger.info(f"БД Користувачів: Для {user_id} встановлено групу: {group_name}")
-        return True
-    except sqlite3.Error as e:
-        logger.error(f"БД Користувачів: Помилка встановлення групи для {user_id}: {e}")
-        return False
 
+        """
+        )
 
-def set_user_role_in_db(user_id: int, role: str) -> bool:
-    try:
-        with sqlite3.connect(DATABASE_NAME) as conn:
-            cursor = conn.cursor()
-            cursor.execute("UPDATE users SET role = ? WHERE user_id = ?", (role, user_id))
-            conn.commit()
-        logger.info(f"БД Користувачів: Для {user_id} встановлено роль: {role}")
-        return True
-    except sqlite3.Error as e:
-        logger.error(f"БД Користувачів: Помилка встановлення ролі для {user_id}: {e}")
-        return False
-
+        cursor.execute(
+            "CREATE TABLE IF NOT EXISTS ics_exports (content_hash TEXT PRIMARY KEY, file_id TEXT NOT NULL, created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP)"
+        )
 
-def get_user_role_from_db(user_id: int) -> str | None:
-    try:
-        with sqlite3.connect(DATABASE_NAME) as conn:
-            cursor = conn.cursor()
-            cursor.execute("SELECT role FROM users WHERE user_id = ?", (user_id,))
-            result = cursor.fetchone()
-            return result[0] if result and result[0] else None
-    except sqlite3.Error as e:
-        logger.error(f"БД Користувачів: Помилка отримання ролі для {user_id}: {e}")
-        return None
+        # --- Збережені завдання розсилок (відновлюються після перезапуску) ---
 
+        cursor.execute(
+            """
 
-def get_user_group_from_db(user_id: int) -> str | None:
-    try:
-        with sqlite3.connect(DATABASE_NAME) as conn:
-            cursor = conn.cursor()
-            cursor.execute("SELECT group_name FROM users WHERE user_id = ?", (user_id,))
-            result = cursor.fetchone()
-            return result[0] if result and result[0] else None
-    except sqlite3.Error as e:
-        logger.error(f"БД Користувачів: Помилка отримання групи для {user_id}: {e}")
-        return None
+            CREATE TABLE IF NOT EXISTS broadcast_jobs (
 
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
 
-def get_all_user_ids_from_db(group_name: str | None = None) -> set[int]:
-    try:
-        with sqlite3.connect(DATABASE_NAME) as conn:
-            cursor = conn.cursor()
-            if group_name == "__ALL_USERS_WITH_GROUP__":
-                cursor.execute("SELECT user_id FROM users WHERE group_name IS NOT NULL")
-            elif group_name:
-                cursor.execute("SELECT user_id FROM users WHERE group_name = ?", (group_name,))
-            else:
-                cursor.execute("SELECT user_id FROM users")
-            return {row[0] for row in cursor.fetchall()}
-    except sqlite3.Error as e:
-        logger.error(f"БД Користувачів: Помилка отримання ID (група: {group_name}): {e}")
-        return set()
+                created_by INTEGER,
 
+                kind TEXT NOT NULL DEFAULT 'text',
 
-# --- НОВІ ФУНКЦІЇ ДЛЯ РОБОТИ З ТАБЛИЦЕЮ ВИКЛАДАЧІВ ---
+                message_text TEXT,
 
+                media_json TEXT,
 
-def add_or_update_teacher_in_db(full_name: str, curated_group_name: str | None) -> bool:
-    """Додає нового викладача (без user_id) або оновлює дані існуючого за ПІБ."""
+                target_description TEXT,
 
-    try:
+                status TEXT NOT NULL DEFAULT 'pending',
 
-        with sqlite3.connect(DATABASE_NAME) as conn:
+                total INTEGER DEFAULT 0,
 
-            cursor = conn.cursor()
+                sent INTEGER DEFAULT 0,
 
-            cursor.execute(
-                """
+                failed INTEGER DEFAULT 0,
 
-                INSERT INTO teachers (full_name, curated_group_name)
+                progress_chat_id INTEGER,
 
-                VALUES (?, ?)
+                progress_message_id INTEGER,
 
-                ON CONFLICT(full_name) DO UPDATE SET
+                created_at TEXT,
 
-                    curated_group_name = excluded.curated_group_name
+                updated_at TEXT
 
-            """,
-                (full_name, curated_group_name),
             )
 
-            conn.commit()
+        """
+        )
 
-        logger.info(f"БД Викладачів: Додано/Оновлено викладача {full_name}.")
+        cursor.execute(
+            """
 
-        return True
+            CREATE TABLE IF NOT EXISTS broadcast_job_recipients (
 
-    except sqlite3.Error as e:
+                job_id INTEGER NOT NULL,
 
-        logger.error(f"БД Викладачів: Помилка при додаванні/оновленні викладача {full_name}: {e}")
+                user_id INTEGER NOT NULL,
 
-        return False
+                status TEXT NOT NULL DEFAULT 'pending',
 
+                error TEXT,
 
-def update_teacher_name_in_db(teacher_id: int, new_full_name: str) -> bool:
-    """Оновлює ПІБ викладача за його teacher_id."""
+                processed_at TEXT,
 
-    try:
+                PRIMARY KEY (job_id, user_id),
 
-        with sqlite3.connect(DATABASE_NAME) as conn:
+                FOREIGN KEY (job_id) REFERENCES broadcast_jobs(id) ON DELETE CASCADE
 
-            cursor = conn.cursor()
+            )
 
-            cursor.execute(
-                """
+        """
+        )
 
-                UPDATE teachers SET full_name = ?
+        cursor.execute(
+            "CREATE INDEX IF NOT EXISTS idx_broadcast_recipients_pending ON broadcast_job_recipients (job_id, status, user_id)"
+        )
 
-                WHERE teacher_id = ?
+        broadcast_job_columns = [
+            col[1] for col in cursor.execute("PRAGMA table_info(broadcast_jobs)").fetchall()
+        ]
 
-            """,
-                (new_full_name, teacher_id),
-            )
+        if "broadcast_id" not in broadcast_job_columns:
 
-            conn.commit()
+            cursor.execute("ALTER TABLE broadcast_jobs ADD COLUMN broadcast_id INTEGER")
 
-        logger.info(
-            f"БД Викладачів: Оновлено ім'я викладача (teacher_id={teacher_id}) на '{new_full_name}'."
-        )
+        cursor.execute(
+            """
 
-        return True
+            CREATE TABLE IF NOT EXISTS scheduled_announcements (
 
-    except sqlite3.Error as e:
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
 
-        logger.error(
-            f"БД Викладачів: Помилка оновлення імені викладача (teacher_id={teacher_id}): {e}"
-        )
+                created_by INTEGER,
 
-        return False
+                kind TEXT NOT NULL DEFAULT 'text',
 
+                message_text TEXT,
 
-def update_teacher_curated_group_in_db(teacher_id: int, curated_group_name: str | None) -> bool:
-    """Оновлює кураторську групу викладача. Якщо None – очищає поле."""
+                media_json TEXT,
 
-    try:
+                group_name TEXT,
 
-        with sqlite3.connect(DATABASE_NAME) as conn:
+                include_unreachable INTEGER DEFAULT 0,
 
-            cursor = conn.cursor()
+                target_description TEXT,
 
-            cursor.execute(
-                """
+                send_at TEXT NOT NULL,
 
-                UPDATE teachers SET curated_group_name = ?
+                status TEXT NOT NULL DEFAULT 'scheduled',
 
-                WHERE teacher_id = ?
+                broadcast_job_id INTEGER,
 
-            """,
-                (curated_group_name, teacher_id),
-            )
+                created_at TEXT,
 
-            conn.commit()
+                updated_at TEXT
 
-        logger.info(
-            f"БД Викладачів: Оновлено кураторську групу (teacher_id={teacher_id}) на '{curated_group_name}'."
+            )
+
+        """
         )
 
-        return True
+        scheduled_columns = [
+            col[1]
+            for col in cursor.execute("PRAGMA table_info(scheduled_announcements)").fetchall()
+        ]
 
-    except sqlite3.Error as e:
+        if "segment_expression" not in scheduled_columns:
 
-        logger.error(
-            f"БД Викладачів: Помилка оновлення кураторської групи (teacher_id={teacher_id}): {e}"
-        )
+            cursor.execute(
+                "ALTER TABLE scheduled_announcements ADD COLUMN segment_expression TEXT DEFAULT NULL"
+            )
 
-        return False
+        # Сегменти аудиторії: щільні порядкові номери користувачів + стиснені бітові карти
 
+        cursor.execute(
+            """
 
-def delete_teacher_in_db(teacher_id: int) -> bool:
-    """Видаляє викладача за його teacher_id."""
+            CREATE TABLE IF NOT EXISTS user_ordinals (
 
-    try:
+                ordinal INTEGER PRIMARY KEY AUTOINCREMENT,
 
-        with sqlite3.connect(DATABASE_NAME) as conn:
+                user_id INTEGER NOT NULL UNIQUE
 
-            cursor = conn.cursor()
+            )
 
-            cursor.execute("DELETE FROM teachers WHERE teacher_id = ?", (teacher_id,))
+        """
+        )
 
-            conn.commit()
+        cursor.execute(
+            """
 
-        logger.info(f"БД Викладачів: Видалено викладача teacher_id={teacher_id}.")
+            CREATE TABLE IF NOT EXISTS audience_segments (
 
-        return True
+                name TEXT PRIMARY KEY,
 
-    except sqlite3.Error as e:
+                bitmap BLOB NOT NULL,
 
-        logger.error(f"БД Викладачів: Помилка видалення викладача teacher_id={teacher_id}: {e}")
+                member_count INTEGER DEFAULT 0,
 
-        return False
+                updated_at TEXT
 
+            )
 
-def get_teacher_data_from_db(user_id: int) -> dict | None:
-    """Отримує дані викладача за його user_id."""
+        """
+        )
 
-    try:
+        cursor.execute(
+            """
 
-        with sqlite3.connect(DATABASE_NAME) as conn:
+            CREATE TABLE IF NOT EXISTS activity_sketches (
 
-            conn.row_factory = sqlite3.Row
+                day TEXT NOT NULL,
 
-            cursor = conn.cursor()
+                dimension TEXT NOT NULL,
 
-            cursor.execute("SELECT * FROM teachers WHERE user_id = ?", (user_id,))
+                registers BLOB NOT NULL,
 
-            result = cursor.fetchone()
+                updated_at INTEGER,
 
-            return dict(result) if result else None
+                PRIMARY KEY (day, dimension)
 
-    except sqlite3.Error as e:
+            )
 
-        logger.error(f"БД Викладачів: Помилка отримання даних для викладача {user_id}: {e}")
+        """
+        )
 
-        return None
+        # Персистентність Application (SQLitePersistence): user_data, chat_data, bot_data, розмови
 
+        cursor.execute(
+            """
 
-def set_teacher_otp_by_id(teacher_id: int, otp_lifetime_minutes: int) -> str | None:
-    """Генерує, хешує та зберігає OTP для викладача за його ID в таблиці teachers."""
+            CREATE TABLE IF NOT EXISTS persisted_user_data (
 
-    try:
+                user_id INTEGER PRIMARY KEY,
 
-        otp = secrets.token_hex(4)
+                data BLOB NOT NULL,
 
-        hashed_otp = bcrypt.hashpw(otp.encode("utf-8"), bcrypt.gensalt())
+                updated_at INTEGER
 
-        expires_at = datetime.now(KYIV_TZ) + timedelta(minutes=otp_lifetime_minutes)
+            )
 
-        with sqlite3.connect(DATABASE_NAME) as conn:
+        """
+        )
 
-            cursor = conn.cursor()
+        cursor.execute(
+            """
 
-            cursor.execute(
-                """
+            CREATE TABLE IF NOT EXISTS persisted_chat_data (
 
-                UPDATE teachers SET one_time_password_hash = ?, password_expires_at = ?
+                chat_id INTEGER PRIMARY KEY,
 
-                WHERE teacher_id = ?
+                data BLOB NOT NULL,
 
-            """,
-                (hashed_otp, expires_at.isoformat(), teacher_id),
-            )
+                updated_at INTEGER
 
-            conn.commit()
+            )
 
-        logger.info(
-            f"OTP: Згенеровано новий пароль для викладача (teacher_id={teacher_id}), дійсний до {expires_at}."
+        """
         )
 
-        return otp
+        cursor.execute(
+            """
 
-    except sqlite3.Error as e:
+            CREATE TABLE IF NOT EXISTS persisted_bot_data (
 
-        logger.error(
-            f"OTP: Помилка при встановленні пароля для викладача (teacher_id={teacher_id}): {e}"
-        )
+                id INTEGER PRIMARY KEY CHECK (id = 1),
 
-        return None
+                data BLOB NOT NULL,
 
+                updated_at INTEGER
 
-def verify_otp_and_claim_profile(entered_otp: str, claimer_user_id: int) -> tuple[bool, str]:
-    """Перевіряє OTP. Якщо він вірний, 'прив'язує' профіль викладача до Telegram ID користувача."""
+            )
 
-    try:
+        """
+        )
 
-        with sqlite3.connect(DATABASE_NAME) as conn:
+        cursor.execute(
+            """
 
-            conn.row_factory = sqlite3.Row
+            CREATE TABLE IF NOT EXISTS persisted_conversations (
 
-            cursor = conn.cursor()
+                name TEXT NOT NULL,
 
-            cursor.execute("SELECT * FROM teachers WHERE one_time_password_hash IS NOT NULL")
+                conversation_key TEXT NOT NULL,
 
-            potential_teachers = cursor.fetchall()
+                state BLOB NOT NULL,
 
-            for teacher_row in potential_teachers:
+                updated_at INTEGER,
 
-                hashed_otp = teacher_row["one_time_password_hash"]
+                PRIMARY KEY (name, conversation_key)
 
-                if bcrypt.checkpw(entered_otp.encode("utf-8"), hashed_otp):
+            )
 
-                    expires_at = datetime.fromisoformat(teacher_row["password_expires_at"])
+        """
+        )
 
-                    if datetime.now(KYIV_TZ) > expires_at:
+        conn.commit()
 
-                        cursor.execute(
-                            "UPDATE teachers SET one_time_password_hash = NULL, password_expires_at = NULL WHERE teacher_id = ?",
-                            (teacher_row["teacher_id"],),
-                        )
+        logger.info(f"БД Користувачів: '{DATABASE_NAME}' готова.")
 
-                        conn.commit()
+    except sqlite3.Error as e:
 
-                        return (False, "Термін дії вашого пароля минув.")
+        logger.critical(f"БД Користувачів: Критична помилка SQLite під час ініціалізації: {e}")
 
-                    previous_user_id = teacher_row["user_id"]
+        raise
 
-                    # Дозволяємо перевипуск та перев'язку навіть якщо профіль вже активований
+    except Exception as e:
 
-                    cursor.execute(
-                        "UPDATE teachers SET user_id = ?, one_time_password_hash = NULL, password_expires_at = NULL WHERE teacher_id = ?",
-                        (claimer_user_id, teacher_row["teacher_id"]),
-                    )
+        logger.critical(f"БД Користувачів: Критична помилка під час ініціалізації: {e}")
 
-                    conn.commit()
+        raise
 
-                    if previous_user_id and previous_user_id != claimer_user_id:
 
-                        logger.info(
-                            f"OTP: Профіль викладача {teacher_row['full_name']} перев'язано з user_id {previous_user_id} на {claimer_user_id}."
-                        )
+def add_or_update_user_in_db(
+    user_id: int,
+    username: str | None,
+    first_name: str | None,
+    last_name: str | None,
+    group_name: str | None = "ASK_LATER",
+    referrer_id: int | None = None,
+):
 
-                    else:
+    try:
 
-                        logger.info(
-                            f"OTP: Профіль викладача {teacher_row['full_name']} успішно прив'язано до user_id {claimer_user_id}."
-                        )
+        with connect_db() as conn:
 
-                    return (True, "Вхід успішний!")
+            cursor = conn.cursor()
 
-            return (False, "Невірний пароль.")
+            cursor.execute("SELECT * FROM users WHERE user_id = ?", (user_id,))
 
-    except Exception as e:
+            existing_user = cursor.fetchone()
 
-        logger.error(f"OTP: Критична помилка під час верифікації OTP: {e}")
+            if existing_user:
 
-        return (False, "Сталася системна помилка. Спробуйте пізніше.")
+                cursor.execute(
+                    """
 
+                    UPDATE users SET
 
-def update_command_stats(command_name: str) -> None:
+                        username = ?,
 
-    try:
+                        first_name = ?,
 
-        with sqlite3.connect(DATABASE_NAME) as conn:
+                        last_name = ?,
 
-            cursor = conn.cursor()
+                        last_delivery_status = NULL,
 
-            cursor.execute(
-                """
+                        consecutive_failures = 0
 
-                INSERT INTO command_stats (command, count) VALUES (?, 1)
+                    WHERE user_id = ?
 
-                ON CONFLICT(command) DO UPDATE SET count = count + 1
+                """,
+                    (username, first_name, last_name, user_id),
+                )
 
-            """,
-                (command_name,),
-            )
+            else:
 
-            conn.commit()
+                cursor.execute(
+                    """
 
-    except sqlite3.Error as e:
+                    INSERT INTO users (user_id, username, first_name, last_name, group_name, referrer_id)
 
-        logger.error(f"Статистика: Помилка оновлення лічильника для '{command_name}': {e}")
+                    VALUES (?, ?, ?, ?, ?, ?)
 
+                """,
+                    (user_id, username, first_name, last_name, group_name, referrer_id),
+                )
 
-def add_to_dlq(user_id: int, message_text: str, error_message: str) -> None:
+            conn.commit()
 
-    try:
+            audience_dirty_user_ids.add(user_id)
 
-        with sqlite3.connect(DATABASE_NAME) as conn:
+            if not existing_user and referrer_id:
 
-            cursor = conn.cursor()
+                increment_referred_count(referrer_id)
 
-            cursor.execute(
-                """
+                logger.info(
+                    f"БД Користувачів: Користувач {user_id} доданий за рефералом {referrer_id}. Лічильник рефералів для {referrer_id} збільшено."
+                )
 
-                INSERT INTO dead_letter_queue (user_id, message_text, error_message, status)
+            else:
 
-                VALUES (?, ?, ?, 'new')
+                logger.info(
+                    f"БД Користувачів: Користувач {user_id} збережений/оновлений. Група: {get_user_group_from_db(user_id)}"
+                )
 
-            """,
-                (user_id, message_text, error_message),
-            )
+    except sqlite3.Error as e:
 
-            conn.commit()
+        logger.error(f"БД Користувачів: Помилка збереження користувача {user_id}: {e}")
 
-        logger.info(f"DLQ: Повідомлення для {user_id} додано до DLQ. Помилка: {error_message}")
 
+def get_user_data_from_db(user_id: int) -> dict | None:
+    try:
+        with connect_db() as conn:
+            conn.row_factory = sqlite3.Row
+            cursor = conn.cursor()
+            cursor.execute("SELECT * FROM users WHERE user_id = ?", (user_id,))
+            result = cursor.fetchone()
+            return dict(result) if result else None
     except sqlite3.Error as e:
+        logger.error(f"БД Користувачів: Помилка отримання даних користувача {user_id}: {e}")
+        return None
 
-        logger.error(f"DLQ: Помилка запису в DLQ для {user_id}: {e}")
-
-
-def clear_dlq(status: str = "new", older_than_days: int = 30) -> int:
-    """
 
-    Очищає записи з Dead Letter Queue.
+def set_user_group_in_db(user_id: int, group_name: str | None) -> bool:
+    try:
+        with connect_db() as conn:
+            cursor = conn.cursor()
+            cursor.execute(
+                "UPDATE users SET group_name = ? WHERE user_id = ?", 
+                (group_name, user_id)
+            )
+            conn.commit()
+        audience_dirty_user_ids.add(user_id)
+        logger.info(f"БД Користувачів: Для {user_id} встановлено групу: {group_name}")
+        return True
+    except sqlite3.Error as e:
+        logger.error(f"БД Користувачів: Помилка встановлення групи для {user_id}: {e}")
+        return False
 
-    Видаляє записи зі вказаним статусом, старші ніж older_than_days.
 
-    Повертає кількість видалених записів.
+def set_user_role_in_db(user_id: int, role: str) -> bool:
+    try:
+        with connect_db() as conn:
+            cursor = conn.cursor()
+            cursor.execute("UPDATE users SET role = ? WHERE user_id = ?", (role, user_id))
+            conn.commit()
+        audience_dirty_user_ids.add(user_id)
+        logger.info(f"БД Користувачів: Для {user_id} встановлено роль: {role}")
+        return True
+    except sqlite3.Error as e:
+        logger.error(f"БД Користувачів: Помилка встановлення ролі для {user_id}: {e}")
+        return False
 
-    """
 
+def get_user_role_from_db(user_id: int) -> str | None:
     try:
+        with connect_db() as conn:
+            cursor = conn.cursor()
+            cursor.execute("SELECT role FROM users WHERE user_id = ?", (user_id,))
+            result = cursor.fetchone()
+            return result[0] if result and result[0] else None
+    except sqlite3.Error as e:
+        logger.error(f"БД Користувачів: Помилка отримання ролі для {user_id}: {e}")
+        return None
 
-        with sqlite3.connect(DATABASE_NAME) as conn:
 
+def get_user_group_from_db(user_id: int) -> str | None:
+    try:
+        with connect_db() as conn:
             cursor = conn.cursor()
+            cursor.execute("SELECT group_name FROM users WHERE user_id = ?", (user_id,))
+            result = cursor.fetchone()
+            return result[0] if result and result[0] else None
+    except sqlite3.Error as e:
+        logger.error(f"БД Користувачів: Помилка отримання групи для {user_id}: {e}")
+        return None
 
-            # Визначаємо дату, до якої записи вважаються "старими"
 
-            threshold_date = datetime.now(KYIV_TZ) - timedelta(days=older_than_days)
+def _build_user_filter(
+    group_name: str | None = None, role: str | None = None, include_unreachable: bool = False
+) -> tuple[str, tuple]:
+    """Повертає (умова WHERE, параметри) для вибірки користувачів за групою, роллю та доступністю."""
+    conditions, params = ["1 = 1"], []
+    if group_name == "__ALL_USERS_WITH_GROUP__":
+        conditions.append("group_name IS NOT NULL")
+    elif group_name:
+        conditions.append("group_name = ?")
+        params.append(group_name)
+    if role:
+        conditions.append("role = ?")
+        params.append(role)
+    if not include_unreachable:
+        conditions.append(REACHABLE_USERS_SQL)
+        params.append(USER_UNREACHABLE_FAILURE_THRESHOLD)
+    return " AND ".join(conditions), tuple(params)
+
+
+def iter_user_rows_chunks(
+    where_sql: str = "1 = 1",
+    params: tuple = (),
+    columns: str = "user_id",
+    chunk_size: int = USER_ID_CHUNK_SIZE,
+) -> Iterator[list[tuple]]:
+    """Посторінково (keyset по user_id) віддає рядки users пакетами; першим стовпцем має бути user_id.
+
+    sqlite3.Error не перехоплюється - викликач вирішує, чи можна працювати з неповною вибіркою.
+    """
+    last_user_id = None
+    while True:
+        keyset_sql = "" if last_user_id is None else " AND user_id > ?"
+        keyset_params = () if last_user_id is None else (last_user_id,)
+        # Окреме з'єднання на кожен пакет - не тримаємо транзакцію читання між пакетами
+        with connect_db() as conn:
+            rows = conn.execute(
+                f"SELECT {columns} FROM users WHERE ({where_sql}){keyset_sql} "
+                "ORDER BY user_id LIMIT ?",
+                params + keyset_params + (chunk_size,),
+            ).fetchall()
+        if not rows:
+            return
+        last_user_id = rows[-1][0]
+        yield rows
+        if len(rows) < chunk_size:
+            return
 
-            threshold_date_str = threshold_date.isoformat()
 
-            # Видаляємо записи, які відповідають статусу і старші за поріг
+def iter_user_id_chunks(
+    group_name: str | None = None,
+    role: str | None = None,
+    include_unreachable: bool = False,
+    chunk_size: int = USER_ID_CHUNK_SIZE,
+) -> Iterator[list[int]]:
+    """Віддає ID користувачів пакетами (пам'ять обмежена chunk_size незалежно від аудиторії).
 
-            cursor.execute(
-                "DELETE FROM dead_letter_queue WHERE status = ? AND failed_at < ?",
-                (status, threshold_date_str),
-            )
+    sqlite3.Error пробрасується: обірвана вибірка не повинна стати "повною" аудиторією розсилки.
+    """
+    where_sql, params = _build_user_filter(group_name, role, include_unreachable)
+    for rows in iter_user_rows_chunks(where_sql, params, chunk_size=chunk_size):
+        yield [row[0] for row in rows]
 
-            deleted_count = cursor.rowcount
 
-            conn.commit()
+# Пишемо лише при зміні статусу - типова успішна доставка не чіпає БД і сегменти
 
-            logger.info(
-                f"DLQ: Видалено {deleted_count} записів зі статусом '{status}' старших за {older_than_days} днів."
-            )
+USER_DELIVERY_OK_SQL = """
 
-            return deleted_count
+    UPDATE users SET last_delivery_status = 'ok', consecutive_failures = 0
 
-    except sqlite3.Error as e:
+    WHERE user_id = ? AND (COALESCE(last_delivery_status, 'ok') != 'ok'
 
-        logger.error(f"DLQ: Помилка під час очищення DLQ: {e}")
+                           OR COALESCE(consecutive_failures, 0) != 0)
 
-        return -1
+"""
 
+USER_DELIVERY_FAILED_SQL = """
 
-def get_cached_schedule():
+    UPDATE users SET last_delivery_status = ?,
 
-    global schedule_cache, sql_manager
+        consecutive_failures = COALESCE(consecutive_failures, 0) + 1
 
-    if sql_manager is None:
+    WHERE user_id = ?
 
-        logger.error("SQLManager не ініціалізовано. Неможливо завантажити розклад.")
+"""
 
-        return {"розклади_груп": {}, "дзвінки": []}
 
-    if schedule_cache is None:
+def record_user_delivery_outcome(user_id: int, delivered: bool, blocked: bool = False) -> None:
+    """
+    Запам'ятовує результат доставки: заблоковані/постійно недоступні випадають з розсилок.
 
-        logger.info("Кеш розкладу порожній. Завантаження з бази даних через SQLManager...")
+    blocked=True - лише коли отримувача точно немає (див. is_recipient_gone_error); решта
+    невдач рахується в consecutive_failures і відсікає користувача після порогу.
 
-        try:
+    """
 
-            schedule_cache = sql_manager.get_info()
+    try:
 
-            if (
-                not schedule_cache
-                or "розклади_груп" not in schedule_cache
-                or "дзвінки" not in schedule_cache
-            ):
+        with connect_db() as conn:
 
-                logger.error("SQLManager.get_info() повернув некоректні або неповні дані.")
+            if delivered:
 
-                schedule_cache = {"розклади_груп": {}, "дзвінки": []}
+                cursor = conn.execute(USER_DELIVERY_OK_SQL, (user_id,))
 
             else:
 
-                logger.info("Розклад успішно завантажено з БД та кешовано.")
+                status = "blocked" if blocked else "failed"
 
-        except Exception as e:
+                cursor = conn.execute(USER_DELIVERY_FAILED_SQL, (status, user_id))
 
-            logger.error(f"Помилка завантаження розкладу з БД через SQLManager: {e}", exc_info=True)
+            conn.commit()
 
-            schedule_cache = {"розклади_груп": {}, "дзвінки": []}
+        if cursor.rowcount:
 
-    return schedule_cache
+            audience_dirty_user_ids.add(user_id)
 
+    except sqlite3.Error as e:
 
-def clear_schedule_cache_data():
+        logger.error(f"БД Користувачів: Помилка запису статусу доставки для {user_id}: {e}")
 
-    global schedule_cache
 
-    schedule_cache = None
+def count_unreachable_users() -> int:
 
-    logger.info("Кеш розкладу очищено. Наступний запит оновить його з БД.")
+    try:
 
+        with connect_db() as conn:
 
-def load_specialties_data():
+            return conn.execute(
+                f"SELECT COUNT(*) FROM users WHERE NOT {REACHABLE_USERS_SQL}",
+                (USER_UNREACHABLE_FAILURE_THRESHOLD,),
+            ).fetchone()[0]
 
-    global specialties_cache
+    except sqlite3.Error as e:
 
-    if specialties_cache is None:
+        logger.error(f"БД Користувачів: Помилка підрахунку недоступних користувачів: {e}")
 
-        logger.info(
-            f"Кеш спеціальностей порожній. Завантаження з файлу '{SPECIALTIES_JSON_FILE}'..."
-        )
+        return 0
 
-        if not os.path.exists(SPECIALTIES_JSON_FILE):
 
-            logger.error(
-                f"Файл спеціальностей '{SPECIALTIES_JSON_FILE}' не знайдено! Функціонал спеціальностей не працюватиме."
-            )
+# --- Сегменти аудиторії (бітові карти) ---
 
-            specialties_cache = {"specialties": {}}
+AUDIENCE_SEGMENT_USER_COLUMNS = (
+    "user_id, (SELECT ordinal FROM user_ordinals o WHERE o.user_id = users.user_id), role, "
+    "group_name, is_raffle_participant, last_delivery_status, consecutive_failures, last_active_at"
+)
 
-            return specialties_cache
+AUDIENCE_LOOKUP_CHUNK_SIZE = 500  # Не більше змінних у IN (...), ніж дозволяє старий SQLite
 
-        try:
 
-            with open(SPECIALTIES_JSON_FILE, "r", encoding="utf-8") as f:
+def get_course_year_suffixes(today: datetime | None = None) -> dict[int, str]:
+    """Курс -> дві останні цифри року набору; у 2025/26 навчальному році {1: "25", 2: "24", ...}."""
 
-                specialties_cache = json.load(f)
+    today = today or datetime.now(KYIV_TZ)
 
-            logger.info(f"Спеціальності успішно завантажено з '{SPECIALTIES_JSON_FILE}'.")
+    admission_year = today.year if today.month >= ACADEMIC_YEAR_START_MONTH else today.year - 1
 
-        except json.JSONDecodeError as e:
+    return {
+        course: f"{(admission_year - course + 1) % 100:02d}"
+        for course in range(1, COURSE_COUNT + 1)
+    }
 
-            logger.error(f"Помилка декодування JSON у файлі '{SPECIALTIES_JSON_FILE}': {e}")
 
-            specialties_cache = {"specialties": {}}
+def get_course_for_group(group_name: str | None) -> int | None:
 
-        except Exception as e:
+    if not group_name:
 
-            logger.error(f"Невідома помилка при завантаженні спеціальностей: {e}")
+        return None
 
-            specialties_cache = {"specialties": {}}
+    for course, year in get_course_year_suffixes().items():
 
-    return specialties_cache.get("specialties", {})
+        if group_name.endswith(f"-{year}") or f"-{year} (" in group_name:
 
+            return course
 
-def load_admission_docs_data():
+    return None
 
-    global admission_docs_cache
 
-    if admission_docs_cache is None:
+def get_audience_segment_labels() -> dict[str, str]:
+    """Сегменти, доступні у виразах оголошень (назва -> опис)."""
 
-        logger.info(
-            f"Кеш документів для вступу порожній. Завантаження з файлу '{ADMISSION_DOCS_JSON_FILE}'..."
-        )
+    labels = {"all": "Всі користувачі"}
 
-        if not os.path.exists(ADMISSION_DOCS_JSON_FILE):
+    for role, label in AUDIENCE_ROLE_SEGMENTS.items():
 
-            logger.error(
-                f"Файл документів для вступу '{ADMISSION_DOCS_JSON_FILE}' не знайдено! Функціонал документів не працюватиме."
-            )
+        labels[f"role_{role}"] = label
 
-            admission_docs_cache = {}
+    for course in range(1, COURSE_COUNT + 1):
 
-            return admission_docs_cache
+        labels[f"course_{course}"] = f"{course} курс"
 
-        try:
+    labels["raffle"] = "Учасники розіграшу"
 
-            with open(ADMISSION_DOCS_JSON_FILE, "r", encoding="utf-8") as f:
+    for days in AUDIENCE_ACTIVE_DAYS:
 
-                admission_docs_cache = json.load(f)
+        labels[f"active_{days}"] = f"Активні за {days} дн."
 
-            logger.info(f"Документи для вступу успішно завантажено з '{ADMISSION_DOCS_JSON_FILE}'.")
+    labels["unreachable"] = "Недоступні (заблокували бота / невдачі доставки)"
 
-        except json.JSONDecodeError as e:
+    return labels
 
-            logger.error(f"Помилка декодування JSON у файлі '{ADMISSION_DOCS_JSON_FILE}': {e}")
 
-            admission_docs_cache = {}
+def get_user_segment_names(row: tuple, now_ts: int) -> list[str]:
+    """Сегменти, до яких належить користувач (рядок у форматі AUDIENCE_SEGMENT_USER_COLUMNS)."""
 
-        except Exception as e:
+    (
+        _,
+        _,
+        role,
+        group_name,
+        is_raffle_participant,
+        last_delivery_status,
+        consecutive_failures,
+        last_active_at,
+    ) = row
 
-            logger.error(f"Невідома помилка при завантаженні документів для вступу: {e}")
+    segment_names = ["all"]
 
-            admission_docs_cache = {}
+    if role in AUDIENCE_ROLE_SEGMENTS:
 
-    return admission_docs_cache
+        segment_names.append(f"role_{role}")
 
+    course = get_course_for_group(group_name)
 
-def get_admission_docs_by_form(form_type: str) -> dict | None:
+    if course:
 
-    all_docs = load_admission_docs_data()
+        segment_names.append(f"course_{course}")
 
-    return all_docs.get(
-        f"{form_type}_form"
-    )  # Використовуємо f-рядок для "day_form" або "extramural_form"
+    if group_name and group_name != "ASK_LATER":
 
+        # Службові сегменти груп - для вибору "Конкретній групі"
 
-def get_all_specialties() -> dict:
+        segment_names.append(f"group:{group_name}")
 
-    return load_specialties_data()
+    if is_raffle_participant:
 
+        segment_names.append("raffle")
 
-def get_specialty_by_id(specialty_id: str) -> dict | None:
+    # Та сама умова, що й REACHABLE_USERS_SQL, але навпаки
 
-    all_specialties = get_all_specialties()
+    if (
+        last_delivery_status == "blocked"
+        or (consecutive_failures or 0) >= USER_UNREACHABLE_FAILURE_THRESHOLD
+    ):
 
-    return all_specialties.get(specialty_id)
+        segment_names.append("unreachable")
 
+    if last_active_at:
 
-def get_all_group_names_from_cache() -> list[str]:
+        for days in AUDIENCE_ACTIVE_DAYS:
 
-    global sql_manager
+            if last_active_at >= now_ts - days * 86400:
 
-    if sql_manager is None:
+                segment_names.append(f"active_{days}")
 
-        logger.warning("SQLManager не ініціалізовано при спробі отримати назви груп.")
+    return segment_names
 
-        cache = get_cached_schedule()
 
-        return sorted(list(cache.get("розклади_груп", {}).keys()))
+def bitmap_to_bytes(bitmap: int) -> bytearray:
 
-    try:
+    return bytearray(bitmap.to_bytes((bitmap.bit_length() + 7) // 8, "little"))
 
-        groups_static_data = sql_manager.get_static().get("Groups", {})
 
-        group_names = [details["Name"] for details in groups_static_data.values()]
+def set_bitmap_bit(bits: bytearray, ordinal: int, value: bool) -> bool:
+    """Встановлює/знімає біт у bytearray; повертає True, якщо значення змінилось."""
 
-        return sorted(group_names)
+    byte_index, mask = ordinal >> 3, 1 << (ordinal & 7)
 
-    except Exception as e:
+    if byte_index >= len(bits):
 
-        logger.error(f"Помилка отримання назв груп з SQLManager: {e}", exc_info=True)
+        if not value:
 
-        cache_fallback = schedule_cache if schedule_cache else {"розклади_груп": {}}
+            return False
 
-        return sorted(list(cache_fallback.get("розклади_груп", {}).keys()))
+        bits.extend(bytes(byte_index - len(bits) + 1))
 
+    if bool(bits[byte_index] & mask) == value:
 
-def get_schedule_data_for_group(group_name: str) -> dict | None:
+        return False
 
-    cache = get_cached_schedule()
+    bits[byte_index] ^= mask
 
-    return cache.get("розклади_груп", {}).get(group_name)
+    return True
 
 
-def get_current_week_type_for_schedule(current_date: datetime) -> str:
+def iter_bitmap_ordinals(bitmap: int) -> Iterator[int]:
 
-    # Якщо current_date не має timezone info, додаємо його
+    for byte_index, byte in enumerate(bitmap_to_bytes(bitmap)):
 
-    if current_date.tzinfo is None or current_date.tzinfo.utcoffset(current_date) is None:
+        if byte:
 
-        current_date = current_date.replace(tzinfo=KYIV_TZ)
+            for bit in range(8):
 
-    delta_days = (current_date - BASE_DATE).days
+                if byte >> bit & 1:
 
-    weeks_passed = delta_days // 7
+                    yield byte_index * 8 + bit
 
-    return "чисельник" if weeks_passed % 2 == 0 else "знаменник"
 
+def assign_user_ordinals(user_ids: Iterable[int] | None = None) -> None:
+    """Видає порядкові номери (біти в сегментах) новим користувачам; усім, якщо user_ids не задано."""
 
-# --- Функції для реферальної системи ---
+    try:
 
+        with connect_db() as conn:
 
-def increment_referred_count(user_id: int) -> None:
+            if user_ids is None:
+
+                conn.execute(
+                    "INSERT OR IGNORE INTO user_ordinals (user_id) SELECT user_id FROM users ORDER BY user_id"
+                )
+
+            else:
+
+                conn.executemany(
+                    "INSERT OR IGNORE INTO user_ordinals (user_id) VALUES (?)",
+                    ((user_id,) for user_id in user_ids),
+                )
+
+            conn.commit()
+
+    except sqlite3.Error as e:
+
+        logger.error(f"Сегменти: Помилка видачі порядкових номерів користувачам: {e}")
+
+
+def save_audience_segments(segment_names: Iterable[str], replace_all: bool = False) -> None:
+    """Зберігає бітові карти сегментів у БД (zlib-стиснення)."""
+
+    now_iso = datetime.now(KYIV_TZ).isoformat()
 
     try:
 
-        with sqlite3.connect(DATABASE_NAME) as conn:
+        with connect_db() as conn:
 
-            cursor = conn.cursor()
+            if replace_all:
 
-            cursor.execute(
-                "UPDATE users SET referred_count = referred_count + 1 WHERE user_id = ?", (user_id,)
+                conn.execute("DELETE FROM audience_segments")
+
+            conn.executemany(
+                "INSERT OR REPLACE INTO audience_segments (name, bitmap, member_count, updated_at) VALUES (?, ?, ?, ?)",
+                (
+                    (
+                        name,
+                        zlib.compress(bytes(bitmap_to_bytes(audience_segment_bitmaps[name]))),
+                        audience_segment_bitmaps[name].bit_count(),
+                        now_iso,
+                    )
+                    for name in segment_names
+                ),
             )
 
             conn.commit()
 
-        logger.info(f"Лічильник рефералів для користувача {user_id} збільшено.")
-
     except sqlite3.Error as e:
 
-        logger.error(f"Помилка збільшення лічильника рефералів для {user_id}: {e}")
+        logger.error(f"Сегменти: Помилка збереження бітових карт: {e}")
 
 
-def get_referred_count(user_id: int) -> int:
+def load_audience_segments() -> int:
+    """Завантажує збережені бітові карти сегментів (щоб розсилки працювали одразу після старту)."""
 
     try:
 
-        with sqlite3.connect(DATABASE_NAME) as conn:
+        with connect_db() as conn:
 
-            cursor = conn.cursor()
+            rows = conn.execute("SELECT name, bitmap FROM audience_segments").fetchall()
 
-            cursor.execute("SELECT referred_count FROM users WHERE user_id = ?", (user_id,))
+    except sqlite3.Error as e:
 
-            result = cursor.fetchone()
+        logger.error(f"Сегменти: Помилка завантаження бітових карт: {e}")
 
-            return result[0] if result else 0
+        return 0
 
-    except sqlite3.Error as e:
+    audience_segment_bitmaps.clear()
 
-        logger.error(f"Помилка отримання лічильника рефералів для {user_id}: {e}")
+    for name, blob in rows:
 
-        return 0
+        audience_segment_bitmaps[name] = int.from_bytes(zlib.decompress(blob), "little")
 
+    return len(rows)
 
-def set_raffle_participant_status(user_id: int, status: bool) -> bool:
 
-    try:
+def rebuild_audience_segments() -> None:
+    """Повний перерахунок усіх сегментів одним keyset-проходом по users."""
 
-        with sqlite3.connect(DATABASE_NAME) as conn:
+    global audience_segments_refreshed_at
 
-            cursor = conn.cursor()
+    assign_user_ordinals()
 
-            current_time = datetime.now(KYIV_TZ).isoformat() if status else None
+    now_ts = int(time.time())
 
-            cursor.execute(
-                "UPDATE users SET is_raffle_participant = ?, raffle_participation_date = ? WHERE user_id = ?",
-                (status, current_time, user_id),
-            )
+    segment_bits = {name: bytearray() for name in get_audience_segment_labels()}
 
-            conn.commit()
+    handled_dirty_user_ids = set(audience_dirty_user_ids)
 
-        logger.info(f"Статус учасника розіграшу для {user_id} встановлено на {status}.")
+    try:
 
-        return True
+        for rows in iter_user_rows_chunks(columns=AUDIENCE_SEGMENT_USER_COLUMNS):
+
+            for row in rows:
+
+                if row[1] is None:
+
+                    continue
+
+                for name in get_user_segment_names(row, now_ts):
+
+                    set_bitmap_bit(segment_bits.setdefault(name, bytearray()), row[1], True)
 
     except sqlite3.Error as e:
 
-        logger.error(f"Помилка встановлення статусу учасника розіграшу для {user_id}: {e}")
+        logger.error(f"Сегменти: Помилка повного перерахунку: {e}")
 
-        return False
+        return
 
+    # Може виконуватись у фоновому потоці: словник не спорожнюємо, щоб читачі не бачили пустих карт
 
-def get_raffle_participant_status(user_id: int) -> bool:
+    for name, bits in segment_bits.items():
 
-    try:
+        audience_segment_bitmaps[name] = int.from_bytes(bits, "little")
 
-        with sqlite3.connect(DATABASE_NAME) as conn:
+    for name in set(audience_segment_bitmaps) - set(segment_bits):
 
-            cursor = conn.cursor()
+        audience_segment_bitmaps.pop(name, None)
 
-            cursor.execute("SELECT is_raffle_participant FROM users WHERE user_id = ?", (user_id,))
+    # Зміни, що надійшли під час проходу, лишаються для наступного інкрементального оновлення
 
-            result = cursor.fetchone()
+    audience_dirty_user_ids.difference_update(handled_dirty_user_ids)
 
-            return bool(result[0]) if result else False
+    audience_segments_refreshed_at = now_ts
 
-    except sqlite3.Error as e:
+    save_audience_segments(list(audience_segment_bitmaps), replace_all=True)
 
-        logger.error(f"Помилка отримання статусу учасника розіграшу для {user_id}: {e}")
+    logger.info(
+        f"Сегменти: Перераховано {len(audience_segment_bitmaps)} сегментів "
+        f"({audience_segment_bitmaps['all'].bit_count()} користувачів)."
+    )
 
-        return False
 
+def flush_user_activity() -> None:
+    """Записує накопичені часи активності в users.last_active_at одним пакетом."""
 
-def user_exists(user_id: int) -> bool:
+    with activity_lock:
 
-    try:
+        activity = [
+            (user_id, pending_user_activity.pop(user_id, None))
+            for user_id in list(pending_user_activity)
+        ]
 
-        with sqlite3.connect(DATABASE_NAME) as conn:
+    activity = [(user_id, active_at) for user_id, active_at in activity if active_at is not None]
 
-            cursor = conn.cursor()
+    if not activity:
 
-            cursor.execute("SELECT 1 FROM users WHERE user_id = ?", (user_id,))
+        return
 
-            return cursor.fetchone() is not None
+    try:
+
+        with connect_db() as conn:
+
+            conn.executemany(
+                "UPDATE users SET last_active_at = ? WHERE user_id = ?",
+                ((active_at, user_id) for user_id, active_at in activity),
+            )
+
+            conn.commit()
 
     except sqlite3.Error as e:
 
-        logger.error(f"Помилка перевірки існування користувача {user_id}: {e}")
+        logger.error(f"Сегменти: Помилка запису активності користувачів: {e}")
 
-        return False
+        return
 
+    audience_dirty_user_ids.update(user_id for user_id, _ in activity)
 
-# --- Клавіатури ---
+    attribute_activity_dimensions(activity)
 
-# Нові клавіатури для вибору ролі та курсу
 
+# --- Активні користувачі (DAU/WAU/MAU) на денних HyperLogLog-скетчах ---
 
-def get_role_selection_keyboard() -> InlineKeyboardMarkup:
 
-    keyboard = [
-        [InlineKeyboardButton("🎓 Я студент", callback_data="select_role_student")],
-        [InlineKeyboardButton("👨‍🏫 Я викладач", callback_data="select_role_teacher")],
-        [InlineKeyboardButton("🚶‍♂️ Я гість", callback_data="select_role_guest")],
-        [InlineKeyboardButton("👷‍♂️ Я працівник", callback_data="select_role_staff")],
-    ]
+def get_activity_day(timestamp: float | None = None) -> str:
 
-    return InlineKeyboardMarkup(keyboard)
+    return datetime.fromtimestamp(timestamp or time.time(), KYIV_TZ).strftime("%Y-%m-%d")
 
 
-def get_student_course_selection_keyboard() -> InlineKeyboardMarkup:
+def record_activity_in_sketch(day: str, dimension: str, user_id: int) -> None:
+    """Додає користувача в денний скетч виміру ("all", "group:...", "role:...")."""
 
-    keyboard = [
-        [InlineKeyboardButton("Курс 1", callback_data="select_course_1")],
-        [InlineKeyboardButton("Курс 2", callback_data="select_course_2")],
-        [InlineKeyboardButton("Курс 3", callback_data="select_course_3")],
-        [InlineKeyboardButton("Курс 4", callback_data="select_course_4")],
-        [InlineKeyboardButton("⬅️ Назад до вибору ролі", callback_data="back_to_role_selection")],
-    ]
+    with activity_lock:
 
-    return InlineKeyboardMarkup(keyboard)
+        sketch = activity_sketches.get((day, dimension))
 
+        if sketch is None:
 
-def get_back_to_role_selection_keyboard() -> InlineKeyboardMarkup:
+            sketch = activity_sketches[(day, dimension)] = HyperLogLog(ACTIVITY_SKETCH_PRECISION)
 
-    return InlineKeyboardMarkup(
-        [[InlineKeyboardButton("⬅️ Назад до вибору ролі", callback_data="back_to_role_selection")]]
-    )
+        sketch.add(user_id)
 
 
-def get_floor_by_auditorium(auditorium: str) -> str:
-    """Визначає поверх за номером аудиторії"""
+def attribute_activity_dimensions(activity: list[tuple[int, int]]) -> None:
+    """Додає активних користувачів у скетчі їхніх груп і ролей (один SELECT на пакет)."""
 
-    if not auditorium or auditorium.lower() in ["с/з", "спортзал", "спорт", ""]:
+    for start in range(0, len(activity), ACTIVITY_ATTRIBUTION_CHUNK_SIZE):
 
-        return ""
+        chunk = dict(activity[start : start + ACTIVITY_ATTRIBUTION_CHUNK_SIZE])
 
-    # Видаляємо всі нецифрові символи для перевірки
+        placeholders = ",".join("?" * len(chunk))
 
-    import re
+        try:
 
-    clean_aud = re.sub(r"[^\d]", "", str(auditorium))
+            with connect_db() as conn:
 
-    if not clean_aud:
+                rows = conn.execute(
+                    f"SELECT user_id, group_name, role FROM users WHERE user_id IN ({placeholders})",
+                    tuple(chunk),
+                ).fetchall()
 
-        return ""
+        except sqlite3.Error as e:
 
-    aud_num = int(clean_aud)
+            logger.error(f"Активність: Помилка читання груп/ролей: {e}")
 
-    # 1 поверх: ауд. 1, 2, 3, 4, 5, 6, 9, 10
+            return
 
-    if aud_num in [1, 2, 3, 4, 5, 6, 9, 10]:
+        for user_id, group_name, role in rows:
 
-        return "1 Поверх"
+            day = get_activity_day(chunk[user_id])
 
-    # 2 поверх: ауд. 16, 17, 18, 19, 21
+            if group_name and group_name != "ASK_LATER":
 
-    elif aud_num in [16, 17, 18, 19, 21]:
+                record_activity_in_sketch(day, f"group:{group_name}", user_id)
 
-        return "2 Поверх"
+            if role in AUDIENCE_ROLE_SEGMENTS:
 
-    # 3 поверх: ауд. 26, 28, 29, 30, 31, 32, 33, 34, 37, 38, 39, 42, 41
+                record_activity_in_sketch(day, f"role:{role}", user_id)
 
-    elif aud_num in [26, 28, 29, 30, 31, 32, 33, 34, 37, 38, 39, 42, 41]:
 
-        return "3 Поверх"
+def flush_activity_sketches() -> None:
+    """Зливає накопичені в пам'яті скетчі з БД: один рядок на день і вимір, не на клік."""
 
-    # 4 поверх: ауд. 43, 44, 45, 46, 47, 48, 49, 50, 52, 63, 53, 54, 55, 56
+    # Два паралельні злиття (цикл подій і фоновий потік) перезаписали б рядки одне одного
 
-    elif aud_num in [43, 44, 45, 46, 47, 48, 49, 50, 52, 63, 53, 54, 55, 56]:
+    with activity_sketches_flush_lock:
 
-        return "4 Поверх"
+        _flush_activity_sketches_locked()
 
-    # Якщо аудиторія не знайдена в списку, повертаємо порожній рядок
 
-    return ""
+def _flush_activity_sketches_locked() -> None:
 
+    with activity_lock:
 
-def get_textbooks_menu_keyboard() -> InlineKeyboardMarkup:
-    """Створює клавіатуру з навчальними книжками"""
+        pending = dict(activity_sketches)
 
-    keyboard = [
-        [
-            InlineKeyboardButton(
-                "📖 Українська мова 10 клас Авраменко",
-                url="https://pidruchnyk.com.ua/1168-ukrainska-mova-10-klas-avramenko.html",
-            )
-        ],
-        [
-            InlineKeyboardButton(
-                "📖 Українська мова 11 клас Авраменко",
-                url="https://pidruchnyk.com.ua/1239-ukrainska-mova-11-klas-avramenko.html",
-            )
-        ],
-        [
-            InlineKeyboardButton(
-                "📖 Українська література 10 клас Авраменко",
-                url="https://pidruchnyk.com.ua/392-ukrayinska-lteratura-avramenko-paharenko-10-klas.html",
-            )
-        ],
-        [
-            InlineKeyboardButton(
-                "📖 Українська література 11 клас Авраменко",
-                url="https://pidruchnyk.com.ua/1237-ukrliteratura-avramenko-11klas.html",
-            )
-        ],
-        [
-            InlineKeyboardButton(
-                "📖 Зарубіжна література 10 клас Ніколенко",
-                url="https://pidruchnyk.com.ua/1146-zarubizhna-literatura-10-klas-nikolenko.html",
-            )
-        ],
-        [
-            InlineKeyboardButton(
-                "📖 Зарубіжна література 11 клас Ніколенко",
-                url="https://pidruchnyk.com.ua/1256-zarubizhna-literatura-11-klas-nikolenko.html",
-            )
-        ],
-        [
-            InlineKeyboardButton(
-                "📖 Англійська мова 10 клас Карпюк",
-                url="https://pidruchnyk.com.ua/425-anglyska-mova-karpyuk-10-klas.html",
-            )
-        ],
-        [
-            InlineKeyboardButton(
-                "📖 Англійська мова 11 клас Карпюк",
-                url="https://pidruchnyk.com.ua/454-anglyska-mova-karpyuk-11-klas.html",
-            )
-        ],
-        [
-            InlineKeyboardButton(
-                "📖 Граматика англійської мови Верба",
-                url="https://ifccyc1.pnu.edu.ua/wp-content/uploads/sites/106/2019/12/%D0%93%D1%80%D0%B0%D0%BC%D0%B0%D1%82%D0%B8%D0%BA%D0%B0-%D0%B0%D0%BD%D0%B3%D0%BB.pdf",
-            )
-        ],
-        [
-            InlineKeyboardButton(
-                "📖 Logistics Victoria Evans",
-                url="https://www.expresspublishing.co.uk/files/Logistics.pdf",
-            )
-        ],
-        [
-            InlineKeyboardButton(
-                "📖 Information technology Victoria Evans",
-                url="https://www.expresspublishing.co.uk/files/Informechnew.pdf",
-            )
-        ],
-        [
-            InlineKeyboardButton(
-                "📖 Hotels and Catering Virginia Evans",
-                url="https://language-teachings.com/wp-content/uploads/2021/04/Virginia-Evans.-Hotels-Catering.pdf",
-            )
-        ],
-        [
-            InlineKeyboardButton(
-                "📖 English for logistics Marion Grussendorf",
-                url="https://mzientek.v.prz.edu.pl/fcp/qGBUKOQtTKlQhbx08SlkTVARGUWRuHQwFDBoIVURNWHxSFVZpCFghUHcKVigEQUw/704/englishlogisticsbook-1.pdf",
-            )
-        ],
-        [InlineKeyboardButton("⬅️ Назад до головного меню", callback_data="back_to_main_menu")],
-    ]
+        activity_sketches.clear()
 
-    return InlineKeyboardMarkup(keyboard)
+    if not pending:
 
+        return
 
-def get_guest_menu_keyboard() -> InlineKeyboardMarkup:
+    oldest_day = get_activity_day(time.time() - ACTIVITY_SKETCH_RETENTION_DAYS * 86400)
 
-    return InlineKeyboardMarkup(
-        [
-            [
-                InlineKeyboardButton(
-                    "ℹ️ Інформація про коледж", callback_data="about_college_from_guest"
-                )
-            ],
-            [
-                InlineKeyboardButton(
-                    "⬅️ Назад до вибору, щоб увійти", callback_data="back_to_role_selection"
+    try:
+
+        with connect_db() as conn:
+
+            for (day, dimension), sketch in pending.items():
+
+                row = conn.execute(
+                    "SELECT registers FROM activity_sketches WHERE day = ? AND dimension = ?",
+                    (day, dimension),
+                ).fetchone()
+
+                if row:
+
+                    sketch.merge(HyperLogLog.from_bytes(zlib.decompress(row[0])))
+
+                conn.execute(
+                    "INSERT OR REPLACE INTO activity_sketches (day, dimension, registers, updated_at) "
+                    "VALUES (?, ?, ?, ?)",
+                    (day, dimension, zlib.compress(sketch.to_bytes()), int(time.time())),
                 )
-            ],
-        ]
-    )
 
+            conn.execute("DELETE FROM activity_sketches WHERE day < ?", (oldest_day,))
 
-def get_about_college_menu_keyboard(user_role: str | None = None) -> InlineKeyboardMarkup:
+            conn.commit()
 
-    keyboard_buttons = [
-        [InlineKeyboardButton("📚 Спеціальності", callback_data="about_college_specialties")],
-        [InlineKeyboardButton("🌟 Чому ми?", callback_data="about_college_why_us")],
-        [
-            InlineKeyboardButton(
-                "📄 Документи для вступу", callback_data="about_college_admission_docs"
-            )
-        ],
-        [InlineKeyboardButton("📞 Зв'язки з нами", callback_data="about_college_contacts")],
-        [InlineKeyboardButton("🌐 Соцмережі", callback_data="about_college_social_media")],
-        [
-            InlineKeyboardButton(
-                "🗺️ Віртуальна екскурсія",
-                url="https://view.genially.com/66578acef2390b0015a681f8/interactive-image-virtualna-ekskursiya-mistom",
-            )
-        ],
-    ]
+    except (sqlite3.Error, ValueError, zlib.error) as e:
 
-    if user_role == "guest":
+        logger.error(f"Активність: Помилка запису скетчів: {e}")
 
-        keyboard_buttons.append(
-            [
-                InlineKeyboardButton(
-                    "⬅️ Назад до вибору, щоб увійти", callback_data="back_to_role_selection"
-                )
-            ]
-        )
+        # Повертаємо незаписане, щоб не втратити активність
 
-    else:
+        with activity_lock:
 
-        keyboard_buttons.append(
-            [InlineKeyboardButton("⬅️ Назад до головного меню", callback_data="back_to_main_menu")]
-        )
+            for key, sketch in pending.items():
 
-    return InlineKeyboardMarkup(keyboard_buttons)
+                if key in activity_sketches:
 
+                    activity_sketches[key].merge(sketch)
 
-def get_specialties_list_keyboard() -> InlineKeyboardMarkup:
+                else:
 
-    all_specialties = get_all_specialties()
+                    activity_sketches[key] = sketch
 
-    specialty_keys = sorted(list(all_specialties.keys()))
 
-    emoji_map = {"F2": "💻", "G19": "🏗️", "G16": "🛢️", "D5": "📈", "D7": "🛒", "D2": "💰"}
+def get_active_user_counts() -> dict[str, dict[str, int]]:
+    """
+    {вимір: {"DAU": ..., "WAU": ..., "MAU": ...}} - злиття денних скетчів за вікнами.
 
-    if not specialty_keys:
+    Важке для циклу подій - викликайте через asyncio.to_thread (спільний стан під activity_lock).
 
-        return InlineKeyboardMarkup(
-            [
-                [
-                    InlineKeyboardButton(
-                        "Немає доступних спеціальностей", callback_data="no_specialties"
-                    )
-                ],
-                [
-                    InlineKeyboardButton(
-                        "⬅️ Назад до меню коледжу", callback_data="back_to_about_college_menu"
-                    )
-                ],
-            ]
-        )
+    """
 
-    keyboard = []
+    flush_user_activity()
 
-    for specialty_id in specialty_keys:
+    flush_activity_sketches()
 
-        specialty_info = all_specialties.get(specialty_id)
+    today = datetime.now(KYIV_TZ).date()
 
-        if specialty_info:
+    window_days = {
+        label: {(today - timedelta(days=offset)).isoformat() for offset in range(days)}
+        for label, days in ACTIVITY_WINDOWS.items()
+    }
 
-            emoji = emoji_map.get(specialty_id, "")
+    merged: dict[tuple[str, str], HyperLogLog] = {}
 
-            button_text = f"{emoji} {specialty_info.get('name', specialty_id)}"
+    try:
 
-            keyboard.append(
-                [
-                    InlineKeyboardButton(
-                        button_text.strip(), callback_data=f"show_specialty_details_{specialty_id}"
-                    )
-                ]
-            )
+        with connect_db() as conn:
 
-    keyboard.append(
-        [
-            InlineKeyboardButton(
-                "⬅️ Назад до меню коледжу", callback_data="back_to_about_college_menu"
-            )
-        ]
-    )
+            rows = conn.execute(
+                "SELECT day, dimension, registers FROM activity_sketches WHERE day >= ?",
+                ((today - timedelta(days=max(ACTIVITY_WINDOWS.values()) - 1)).isoformat(),),
+            ).fetchall()
 
-    return InlineKeyboardMarkup(keyboard)
+    except sqlite3.Error as e:
 
+        logger.error(f"Активність: Помилка читання скетчів: {e}")
 
-def get_back_to_specialties_list_keyboard(user_role: str | None = None) -> InlineKeyboardMarkup:
+        return {}
 
-    # Оновлюємо callback_data для "Назад до меню коледжу" в залежності від ролі
+    for day, dimension, registers in rows:
 
-    back_to_college_callback = (
-        "about_college_from_guest" if user_role == "guest" else "back_to_about_college_menu"
-    )
+        try:
 
-    return InlineKeyboardMarkup(
-        [
-            [
-                InlineKeyboardButton(
-                    "⬅️ Назад до списку спеціальностей", callback_data="about_college_specialties"
-                )
-            ],
-            [
-                InlineKeyboardButton(
-                    "🏠 Назад до меню коледжу", callback_data=back_to_college_callback
-                )
-            ],
-        ]
-    )
+            sketch = HyperLogLog.from_bytes(zlib.decompress(registers))
 
+        except (ValueError, zlib.error) as e:
 
-def get_back_to_about_college_menu_keyboard(
-    user_role: str | None = None,
-) -> InlineKeyboardMarkup:  # ДОДАНО user_role
+            logger.warning(f"Активність: Пошкоджений скетч {dimension} за {day} пропущено: {e}")
 
-    callback_data = "about_college_from_guest" if user_role == "guest" else "about_college"
+            continue
 
-    return InlineKeyboardMarkup(
-        [[InlineKeyboardButton("⬅️ Назад до меню коледжу", callback_data=callback_data)]]
-    )
+        for label, days in window_days.items():
 
+            if day not in days:
 
-def get_admission_form_selection_keyboard(user_role: str | None = None) -> InlineKeyboardMarkup:
+                continue
 
-    # Оновлюємо callback_data для "Назад до меню коледжу" в залежності від ролі
+            merged.setdefault(
+                (dimension, label), HyperLogLog(sketch.precision)
+            ).merge(sketch)
 
-    back_to_college_callback = (
-        "about_college_from_guest" if user_role == "guest" else "back_to_about_college_menu"
-    )
+    counts: dict[str, dict[str, int]] = {}
 
-    keyboard = [
-        [InlineKeyboardButton("📚 Денна форма навчання", callback_data="show_admission_docs_day")],
-        [
-            InlineKeyboardButton(
-                "📖 Заочна форма навчання", callback_data="show_admission_docs_extramural"
-            )
-        ],
-        # --- НОВЕ: Додаємо кнопку "Абітурієнту" тут, над кнопкою "Назад" ---
-        [InlineKeyboardButton("🙋 Абітурієнту", url="https://dvnzchgek.edu.ua/abituriyentu")],
-        # ------------------------------------------------------------------
-        [InlineKeyboardButton("⬅️ Назад до меню коледжу", callback_data=back_to_college_callback)],
-    ]
+    for (dimension, label), sketch in merged.items():
 
-    return InlineKeyboardMarkup(keyboard)
+        counts.setdefault(dimension, {})[label] = sketch.count()
 
+    return counts
 
-def get_back_to_admission_form_selection_keyboard(
-    user_role: str | None = None,
-) -> InlineKeyboardMarkup:
 
-    # Оновлюємо callback_data для "Назад до меню коледжу" в залежності від ролі
+def get_active_users_stats_formatted() -> str:
+    """Блок статистики активних користувачів для show_stats_handler."""
 
-    back_to_college_callback = (
-        "about_college_from_guest" if user_role == "guest" else "back_to_about_college_menu"
-    )
+    counts = get_active_user_counts()
 
-    return InlineKeyboardMarkup(
-        [
-            [
-                InlineKeyboardButton(
-                    "⬅️ Назад до вибору форми", callback_data="about_college_admission_docs"
-                )
-            ],  # Повертає до вибору денна/заочна
-            [
-                InlineKeyboardButton(
-                    "🏠 Назад до меню коледжу", callback_data=back_to_college_callback
-                )
-            ],
-        ]
+    if not counts:
+
+        return "\n*🔥 Активні користувачі:* _даних ще немає._\n"
+
+    def format_windows(dimension: str) -> str:
+
+        dimension_counts = counts.get(dimension, {})
+
+        return " / ".join(str(dimension_counts.get(label, 0)) for label in ACTIVITY_WINDOWS)
+
+    windows_header = "/".join(ACTIVITY_WINDOWS)
+
+    text = (
+        f"\n*🔥 Активні користувачі ({windows_header}, оцінка HyperLogLog):*\n"
+        f"  • Усі: {format_windows('all')}\n"
     )
 
+    for role, label in AUDIENCE_ROLE_SEGMENTS.items():
 
-# -------------------------------------
+        if f"role:{role}" in counts:
 
+            text += f"  • {label}: {format_windows(f'role:{role}')}\n"
 
-# --- Обробники для меню "Про коледж" ---
+    group_dimensions = sorted(
+        (dimension for dimension in counts if dimension.startswith("group:")),
+        key=lambda dimension: counts[dimension].get("WAU", 0),
+        reverse=True,
+    )[:ACTIVITY_TOP_GROUPS]
 
+    if group_dimensions:
 
-async def about_college_handler(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+        text += f"\n*👥 Найактивніші групи ({windows_header}):*\n"
 
-    query = update.callback_query
+        for dimension in group_dimensions:
 
-    if query and query.from_user:
+            text += f"  • {dimension.removeprefix('group:')}: {format_windows(dimension)}\n"
 
-        user_id = query.from_user.id
+    return text
 
-    else:
 
-        user_id = update.effective_user.id if update.effective_user else None
+def refresh_audience_segments_incremental() -> int:
+    """Оновлює біти лише змінених користувачів і тих, хто випав з вікна "активні за N днів"."""
 
-    user_role = get_user_role_from_db(user_id) if user_id is not None else None  # Отримуємо роль
+    global audience_segments_refreshed_at
 
-    if query:
+    flush_user_activity()
 
-        await query.answer()
+    now_ts = int(time.time())
 
-    text = "ℹ️ *Про коледж: Що вас цікавить?*"
+    previous_ts = audience_segments_refreshed_at or now_ts
 
-    reply_markup = get_about_college_menu_keyboard(user_role=user_role)  # Передаємо роль
+    dirty_user_ids = set(audience_dirty_user_ids)
 
-    if query and query.message:
+    audience_dirty_user_ids.difference_update(dirty_user_ids)
 
-        try:
+    try:
 
-            await query.message.edit_text(text, reply_markup=reply_markup, parse_mode="Markdown")  # type: ignore
+        with connect_db() as conn:
 
-        except telegram.error.BadRequest as e:
+            for days in AUDIENCE_ACTIVE_DAYS:
 
-            if "Message is not modified" in str(e):
+                rows = conn.execute(
+                    "SELECT user_id FROM users WHERE last_active_at >= ? AND last_active_at < ?",
+                    (previous_ts - days * 86400, now_ts - days * 86400),
+                ).fetchall()
 
-                logger.debug(
-                    f"Повідомлення не модифіковано (кнопка back_to_about_college_menu): {e}"
-                )
+                dirty_user_ids.update(row[0] for row in rows)
 
-            else:
+    except sqlite3.Error as e:
 
-                logger.error(
-                    f"Помилка при редагуванні повідомлення в about_college_handler: {e}",
-                    exc_info=True,
-                )
+        logger.error(f"Сегменти: Помилка пошуку користувачів, що вийшли з вікна активності: {e}")
 
-    elif update.message:
+    audience_segments_refreshed_at = now_ts
 
-        await update.message.reply_text(text, reply_markup=reply_markup, parse_mode="Markdown")  # type: ignore
+    if not dirty_user_ids:
 
-    else:
+        return 0
 
-        logger.warning("about_college_handler викликано без відповідного об'єкта Update.")
+    assign_user_ordinals(dirty_user_ids)
 
+    # Зміни вносимо в bytearray (O(1) на біт) і лише потім перетворюємо назад на int
 
-async def show_specialties_list_handler(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+    segment_bits = {}
 
-    query = update.callback_query
+    def get_segment_bits(name: str) -> bytearray:
 
-    user_id = None
+        if name not in segment_bits:
 
-    if query and query.from_user:
+            segment_bits[name] = bitmap_to_bytes(audience_segment_bitmaps.get(name, 0))
 
-        user_id = query.from_user.id
+        return segment_bits[name]
 
-    elif update.effective_user:
+    changed_segments = set()
 
-        user_id = update.effective_user.id
+    dirty_list = sorted(dirty_user_ids)
 
-    if user_id is None:
+    try:
 
-        logger.warning("show_specialties_list_handler: не вдалося отримати user_id")
+        for start in range(0, len(dirty_list), AUDIENCE_LOOKUP_CHUNK_SIZE):
 
-        return
+            chunk = dirty_list[start : start + AUDIENCE_LOOKUP_CHUNK_SIZE]
 
-    user_role = get_user_role_from_db(user_id)  # Отримуємо роль
+            placeholders = ",".join("?" * len(chunk))
 
-    text = "📚 *Оберіть спеціальність:*"
+            for rows in iter_user_rows_chunks(
+                f"user_id IN ({placeholders})",
+                tuple(chunk),
+                columns=AUDIENCE_SEGMENT_USER_COLUMNS,
+            ):
 
-    reply_markup = get_specialties_list_keyboard()
+                for row in rows:
 
-    # Модифікуємо кнопку "Назад до меню коледжу", якщо користувач гість
+                    if row[1] is None:
 
-    if user_role == "guest":
+                        continue
 
-        modified_keyboard_buttons = []
+                    member_of = set(get_user_segment_names(row, now_ts))
 
-        for row in reply_markup.inline_keyboard:
+                    for name in member_of | set(audience_segment_bitmaps):
 
-            new_row = []
+                        if set_bitmap_bit(get_segment_bits(name), row[1], name in member_of):
 
-            for button in row:
+                            changed_segments.add(name)
 
-                if button.callback_data == "back_to_about_college_menu":
+    except sqlite3.Error as e:
 
-                    new_row.append(
-                        InlineKeyboardButton(
-                            "⬅️ Назад до меню коледжу", callback_data="about_college_from_guest"
-                        )
-                    )
+        logger.error(f"Сегменти: Помилка інкрементального оновлення: {e}")
 
-                else:
+        audience_dirty_user_ids.update(dirty_user_ids)
 
-                    new_row.append(button)
+        return 0
 
-            modified_keyboard_buttons.append(new_row)
+    for name in changed_segments:
 
-        reply_markup = InlineKeyboardMarkup(modified_keyboard_buttons)
+        audience_segment_bitmaps[name] = int.from_bytes(segment_bits[name], "little")
 
-    if query:
+    if changed_segments:
 
-        await query.edit_message_text(text, reply_markup=reply_markup, parse_mode="Markdown")  # type: ignore
+        save_audience_segments(changed_segments)
 
-    elif update.message:
+    return len(dirty_user_ids)
 
-        await update.message.reply_text(text, reply_markup=reply_markup, parse_mode="Markdown")  # type: ignore
 
+def ensure_audience_segments() -> None:
+    """Гарантує актуальні сегменти: повна побудова після старту, далі - лише незастосовані зміни."""
 
-async def show_specialty_details_handler(
-    update: Update, context: ContextTypes.DEFAULT_TYPE
-) -> None:
+    if not audience_segments_refreshed_at:
 
-    query = update.callback_query
+        rebuild_audience_segments()
 
-    if not query or not query.from_user:
+    else:
 
-        logger.warning(
-            "show_specialty_details_handler викликано без відповідного query або from_user"
-        )
+        refresh_audience_segments_incremental()
 
-        return
 
-    user_id = query.from_user.id  # Отримуємо user_id з query
+async def ensure_audience_segments_async() -> None:
+    """ensure_audience_segments у фоновому потоці: повний перерахунок не блокує цикл подій."""
 
-    user_role = get_user_role_from_db(user_id)  # Отримуємо роль
+    async with audience_segments_lock:
 
-    if not query.data:
+        await asyncio.to_thread(ensure_audience_segments)
 
-        logger.warning("show_specialty_details_handler викликано без query.data")
 
-        return
+def evaluate_segment_expression(expression: str) -> int:
+    """
+    Обчислює вираз над сегментами, напр. "role_student AND (course_1 OR course_2) AND NOT unreachable".
 
-    specialty_id = query.data.replace("show_specialty_details_", "")
+    Пріоритет: NOT > AND > OR. Невідомий сегмент або синтаксична помилка - ValueError.
+    """
 
-    specialty_info = get_specialty_by_id(specialty_id)
+    tokens = expression.replace("(", " ( ").replace(")", " ) ").split()
 
-    if not specialty_info:
+    known_segments = set(get_audience_segment_labels())
 
-        await query.edit_message_text(
-            "❌ Інформацію про спеціальність не знайдено.",
-            reply_markup=get_back_to_specialties_list_keyboard(user_role=user_role),
-        )  # Передаємо роль
+    position = 0
 
-        return
+    def peek() -> str | None:
 
-    text = f"📚 *{specialty_info.get('name', 'Невідома спеціальність').upper()}*\n\n"
+        return tokens[position].upper() if position < len(tokens) else None
 
-    for detail_block in specialty_info.get("details", []):
+    def take() -> str:
 
-        text += f"*{detail_block.get('title', '')}:*\n"
+        nonlocal position
 
-        for point in detail_block.get("points", []):
+        position += 1
 
-            text += f"  • {point}\n"
+        return tokens[position - 1]
 
-        text += "\n"
+    def parse_or() -> int:
 
-    if specialty_info.get("duration"):
+        result = parse_and()
 
-        text += f"*Термін навчання:* {specialty_info.get('duration')}\n\n"
+        while peek() == "OR":
 
-    reply_markup = get_back_to_specialties_list_keyboard(user_role=user_role)  # Передаємо роль
+            take()
 
-    await query.edit_message_text(text, reply_markup=reply_markup, parse_mode="Markdown")  # type: ignore
+            result |= parse_and()
 
+        return result
 
-def get_why_us_text() -> str:
+    def parse_and() -> int:
 
-    return (
-        "🌟 *Чому саме наш коледж?*\n\n"
-        "• *ПРОФЕСІЙНИЙ ПЕДАГОГІЧНИЙ КОЛЕКТИВ:*\n"
-        "  наш висококваліфікований та досвідчений педагогічний колектив гарантує якісну освіту та індивідуальний підхід до кожного студента.\n\n"
-        "• *СУЧАСНА МАТЕРІАЛЬНО-ТЕХНІЧНА БАЗА:*\n"
-        "  завдяки сучасній матеріально-технічній базі наші студенти мають можливість вчитися та досліджувати в новітніх умовах, що сприяє їхньому академічному розвитку.\n\n"
-        "• *ПРАКТИКА:*\n"
-        "  наша програма включає практичний підхід до навчання, що дозволяє студентам отримати реальний досвід у своїй галузі та готує їх до успішного впровадження у професійну діяльність.\n\n"
-        "• *ВЛАСНІ УКРИТТЯ:*\n"
-        "  коледж забезпечує безпекові умови для студентів, маючи власні укриття, де кожен може знаходитися під час повітряних тривог, гарантуючи їхню захищеність та спокій у таких ситуаціях.\n\n"
-        "• *ВЛАСНА ЇДАЛЬНЯ:*\n"
-        "  наша власна комфортна їдальня гарантує смачне та збалансоване харчування для студентів.\n\n"
-        "• *ГУРТОЖИТОК:*\n"
-        "  надаючи комфортні умови проживання, наш гуртожиток з сучасним ремонтом забезпечує студентам затишок та безпеку. Гуртожиток знаходиться поруч з коледжем та має 175 місць для проживання."
-    )
+        result = parse_not()
 
+        while peek() == "AND":
 
-async def about_college_why_us_handler(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+            take()
 
-    query = update.callback_query
+            result &= parse_not()
 
-    user_id = None
+        return result
 
-    if query and query.from_user:
+    def parse_not() -> int:
 
-        user_id = query.from_user.id
+        token = peek()
 
-    elif update.effective_user:
+        if token is None:
 
-        user_id = update.effective_user.id
+            raise ValueError("Вираз обірвався - очікувався сегмент.")
 
-    if user_id is None:
+        if token == "NOT":
 
-        logger.warning("about_college_why_us_handler: не вдалося отримати user_id")
+            take()
 
-        return
+            return audience_segment_bitmaps.get("all", 0) & ~parse_not()
 
-    user_role = get_user_role_from_db(user_id)  # Отримуємо роль
+        if token == "(":
 
-    if query:
+            take()
 
-        await query.answer()
+            result = parse_or()
 
-    text = get_why_us_text()
+            if peek() != ")":
 
-    reply_markup = get_back_to_about_college_menu_keyboard(user_role=user_role)  # Передаємо роль
+                raise ValueError("Не закрита дужка.")
 
-    if query and query.message:
+            take()
 
-        await query.message.edit_text(text, reply_markup=reply_markup, parse_mode="Markdown")  # type: ignore
+            return result
 
-    else:
+        name = take().lower()
 
-        logger.warning("about_college_why_us_handler викликано без відповідного об'єкта Update.")
+        if name not in known_segments:
 
+            raise ValueError(f"Невідомий сегмент '{name}'.")
 
-def get_contacts_info_text() -> str:
+        return audience_segment_bitmaps.get(name, 0)
 
-    return (
-        "📞 *Зв'язки з нами:*\n\n"
-        "🏢 *Адреса:*\n"
-        "  м. Шептицький\n"
-        "  вул. Василя Стуса, 17\n\n"
-        "🗓️ *Графік приймальної комісії:*\n"
-        "  Пн-Пт: 09:00 - 17:00\n"
-        "  Сб: 09:00 - 14:00\n"
-        "  Нд: вихідний\n\n"
-        "☎️ *Телефони:*\n"
-        "  Приймальна: `+38 (032) 493 11 47`\n"
-        "  Гуртожиток: `+38 (032) 493 15 03`\n\n"
-        "📧 *Email:*\n"
-        "  `cher.collage@gmail.com`"
-    )
+    if not tokens:
 
+        raise ValueError("Порожній вираз.")
 
-async def about_college_contacts_handler(
-    update: Update, context: ContextTypes.DEFAULT_TYPE
-) -> None:
+    result = parse_or()
 
-    query = update.callback_query
+    if position < len(tokens):
 
-    user_id = None
+        raise ValueError(f"Зайвий фрагмент: '{tokens[position]}'.")
 
-    if query and query.from_user:
+    return result
 
-        user_id = query.from_user.id
 
-    elif update.effective_user:
+async def resolve_audience_bitmap(
+    group_name: str | None = None,
+    include_unreachable: bool = False,
+    segment_expression: str | None = None,
+) -> int:
+    """Аудиторія оголошення як бітова карта: вираз сегментів, одна група або всі."""
 
-        user_id = update.effective_user.id
+    await ensure_audience_segments_async()
 
-    if user_id is None:
+    if segment_expression:
 
-        logger.warning("about_college_contacts_handler: не вдалося отримати user_id")
+        bitmap = evaluate_segment_expression(segment_expression)
 
-        return
+    elif group_name:
 
-    user_role = get_user_role_from_db(user_id)  # Отримуємо роль
+        bitmap = audience_segment_bitmaps.get(f"group:{group_name}", 0)
 
-    if query:
+    else:
 
-        await query.answer()
+        bitmap = audience_segment_bitmaps.get("all", 0)
 
-    text = get_contacts_info_text()
+    if not include_unreachable:
 
-    reply_markup = get_back_to_about_college_menu_keyboard(user_role=user_role)  # Передаємо роль
+        bitmap &= ~audience_segment_bitmaps.get("unreachable", 0)
 
-    if query and query.message:
+    return bitmap
 
-        await query.message.edit_text(text, reply_markup=reply_markup, parse_mode="Markdown")  # type: ignore
 
-    else:
+def iter_bitmap_user_ids(bitmap: int) -> Iterator[int]:
+    """
+    Перетворює бітову карту на user_id пакетами через user_ordinals.
 
-        logger.warning("about_college_contacts_handler викликано без відповідного об'єкта Update.")
+    sqlite3.Error пробрасується: create_broadcast_job тоді не створить завдання
+    з частковою аудиторією.
 
+    """
 
-### НОВЕ: Функція для отримання тексту "Соцмережі"
+    ordinals_iter = iter_bitmap_ordinals(bitmap)
 
+    while True:
 
-def get_social_media_text() -> str:
+        chunk = [ordinal for _, ordinal in zip(range(AUDIENCE_LOOKUP_CHUNK_SIZE), ordinals_iter)]
 
-    return (
-        "🌐 *Наші соцмережі:*\n\n"
-        "🔗 [Наш сайт](https://dvnzchgek.edu.ua/)\n"
-        "📘 [Facebook](https://www.facebook.com/koledzh.org/)\n"
-        "📸 [Instagram](https://www.instagram.com/gefk_ua/)\n"
-        "✈️ [Telegram](https://t.me/chgek)\n"
-    )
+        if not chunk:
 
+            return
 
-### НОВЕ: Обробник для кнопки "Соцмережі"
+        placeholders = ",".join("?" * len(chunk))
 
+        with connect_db() as conn:
 
-async def about_college_social_media_handler(
-    update: Update, context: ContextTypes.DEFAULT_TYPE
-) -> None:
+            rows = conn.execute(
+                f"SELECT user_id FROM user_ordinals WHERE ordinal IN ({placeholders}) "
+                "ORDER BY ordinal",
+                chunk,
+            ).fetchall()
 
-    query = update.callback_query
+        yield from (row[0] for row in rows)
 
-    user_id = None
 
-    if query and query.from_user:
+def get_audience_segments_overview() -> str:
+    """Список сегментів з кількістю учасників (для кроку вводу виразу)."""
 
-        user_id = query.from_user.id
+    lines = []
 
-    elif update.effective_user:
+    for name, label in get_audience_segment_labels().items():
 
-        user_id = update.effective_user.id
+        count = audience_segment_bitmaps.get(name, 0).bit_count()
 
-    if user_id is None:
+        lines.append(f"`{name}` - {label}: {count}")
 
-        logger.warning("about_college_social_media_handler: не вдалося отримати user_id")
+    return "\n".join(lines)
 
-        return
 
-    user_role = get_user_role_from_db(user_id)  # Отримуємо роль
+async def track_user_activity_handler(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+    """Запам'ятовує час активності (у БД потрапляє пакетом в audience_segment_refresh_job_callback)."""
 
-    if query:
+    if update.effective_user:
 
-        await query.answer()
+        now_ts = int(time.time())
 
-    text = get_social_media_text()
+        with activity_lock:
 
-    reply_markup = get_back_to_about_college_menu_keyboard(user_role=user_role)  # Передаємо роль
+            pending_user_activity[update.effective_user.id] = now_ts
 
-    if query and query.message:
+        # Скетч "усі" - одразу (день кліку); групи та ролі - пакетом у flush_user_activity()
 
-        await query.message.edit_text(text, reply_markup=reply_markup, parse_mode="Markdown", disable_web_page_preview=False)  # type: ignore
+        record_activity_in_sketch(get_activity_day(now_ts), "all", update.effective_user.id)
 
-    else:
 
-        logger.warning(
-            "about_college_social_media_handler викликано без відповідного об'єкта Update."
-        )
+async def audience_segment_refresh_job_callback(context: ContextTypes.DEFAULT_TYPE) -> None:
+    """Періодичне оновлення сегментів (перший запуск після старту - повний перерахунок)."""
 
+    try:
 
-async def show_textbooks_menu_handler(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
-    """Обробник для показу меню навчальних книжок"""
+        await ensure_audience_segments_async()
 
-    query = update.callback_query
+        await asyncio.to_thread(flush_activity_sketches)
 
-    if not query:
+    except Exception as e:
 
-        return
+        logger.error(f"Сегменти: Неочікувана помилка оновлення: {e}", exc_info=True)
 
-    await query.answer()
 
-    text = """📚 *Навчальні книжки*
+# --- НОВІ ФУНКЦІЇ ДЛЯ РОБОТИ З ТАБЛИЦЕЮ ВИКЛАДАЧІВ ---
 
 
+def add_or_update_teacher_in_db(full_name: str, curated_group_name: str | None) -> bool:
+    """Додає нового викладача (без user_id) або оновлює дані існуючого за ПІБ."""
 
-Оберіть підручник, який вас цікавить. При натисканні на назву книжки вона відкриється в браузері.
+    try:
 
+        with connect_db() as conn:
 
+            cursor = conn.cursor()
 
-*Доступні підручники:*"""
+            cursor.execute(
+                """
 
-    reply_markup = get_textbooks_menu_keyboard()
+                INSERT INTO teachers (full_name, curated_group_name)
 
-    await query.edit_message_text(text, reply_markup=reply_markup, parse_mode="Markdown")
+                VALUES (?, ?)
 
+                ON CONFLICT(full_name) DO UPDATE SET
 
-# --- НОВІ ОБРОБНИКИ ДЛЯ ДОКУМЕНТІВ ---
+                    curated_group_name = excluded.curated_group_name
 
+            """,
+                (full_name, curated_group_name),
+            )
 
-async def about_college_admission_docs_handler(
-    update: Update, context: ContextTypes.DEFAULT_TYPE
-) -> int:
+            conn.commit()
 
-    query = update.callback_query
+        logger.info(f"БД Викладачів: Додано/Оновлено викладача {full_name}.")
 
-    if not query or not query.from_user:
+        refresh_teacher_name_index()
 
-        logger.warning(
-            "about_college_admission_docs_handler: не вдалося отримати query або from_user"
-        )
+        return True
 
-        return SELECTING_ADMISSION_FORM
+    except sqlite3.Error as e:
 
-    user_id = query.from_user.id
+        logger.error(f"БД Викладачів: Помилка при додаванні/оновленні викладача {full_name}: {e}")
 
-    user_role = get_user_role_from_db(user_id)
+        return False
 
-    if query:
 
-        await query.answer()
+def update_teacher_name_in_db(teacher_id: int, new_full_name: str) -> bool:
+    """Оновлює ПІБ викладача за його teacher_id."""
 
-    text = "📄 *Документи для вступу: Оберіть форму навчання:*"
+    try:
 
-    reply_markup = get_admission_form_selection_keyboard(user_role=user_role)
+        with connect_db() as conn:
 
-    if query and query.message:
+            cursor = conn.cursor()
 
-        await query.message.edit_text(text, reply_markup=reply_markup, parse_mode="Markdown")  # type: ignore
+            cursor.execute(
+                """
 
-    elif update.message:  # Це на випадок, якщо викликаємо не через callback
+                UPDATE teachers SET full_name = ?
 
-        await update.message.reply_text(text, reply_markup=reply_markup, parse_mode="Markdown")  # type: ignore
+                WHERE teacher_id = ?
 
-    return SELECTING_ADMISSION_FORM  # Переходимо в новий стан розмови
+            """,
+                (new_full_name, teacher_id),
+            )
 
+            conn.commit()
 
-# Функція для виведення списку документів (поки заглушка)
+        logger.info(
+            f"БД Викладачів: Оновлено ім'я викладача (teacher_id={teacher_id}) на '{new_full_name}'."
+        )
 
+        refresh_teacher_name_index()
 
-async def show_admission_docs_handler(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
+        return True
 
-    query = update.callback_query
+    except sqlite3.Error as e:
 
-    if not query or not query.from_user:
+        logger.error(
+            f"БД Викладачів: Помилка оновлення імені викладача (teacher_id={teacher_id}): {e}"
+        )
 
-        logger.warning("show_admission_docs_handler: не вдалося отримати query або from_user")
+        return False
 
-        return VIEWING_ADMISSION_DOCS
 
-    user_id = query.from_user.id
+def update_teacher_curated_group_in_db(teacher_id: int, curated_group_name: str | None) -> bool:
+    """Оновлює кураторську групу викладача. Якщо None – очищає поле."""
 
-    user_role = get_user_role_from_db(user_id)
+    try:
 
-    if query:
+        with connect_db() as conn:
 
-        await query.answer()
+            cursor = conn.cursor()
 
-    if not query.data:
+            cursor.execute(
+                """
 
-        logger.warning("show_admission_docs_handler: не вдалося отримати query.data")
+                UPDATE teachers SET curated_group_name = ?
 
-        return VIEWING_ADMISSION_DOCS
+                WHERE teacher_id = ?
 
-    form_type = query.data.replace("show_admission_docs_", "")  # 'day' або 'extramural'
+            """,
+                (curated_group_name, teacher_id),
+            )
 
-    docs_data = get_admission_docs_by_form(form_type)
+            conn.commit()
 
-    if not docs_data:
+        logger.info(
+            f"БД Викладачів: Оновлено кураторську групу (teacher_id={teacher_id}) на '{curated_group_name}'."
+        )
 
-        text = "❌ Інформацію про документи для цієї форми навчання не знайдено."
+        return True
 
-    else:
+    except sqlite3.Error as e:
 
-        text = f"📄 *{docs_data.get('title', 'Документи для вступу')}*\n\n"
+        logger.error(
+            f"БД Викладачів: Помилка оновлення кураторської групи (teacher_id={teacher_id}): {e}"
+        )
 
-        # Блок "admission_dates" був видалений з JSON і тому не буде тут відображатися.
+        return False
 
-        # Якщо знову знадобиться, його треба буде додати назад в JSON і тоді в цей код.
 
-        text += "*ПЕРЕЛІК ДОКУМЕНТІВ:*\n"
+def delete_teacher_in_db(teacher_id: int) -> bool:
+    """Видаляє викладача за його teacher_id."""
 
-        if "required_documents" in docs_data and docs_data["required_documents"]:
+    try:
 
-            for doc in docs_data["required_documents"]:
+        with connect_db() as conn:
 
-                text += f"• {doc}\n"
+            cursor = conn.cursor()
 
-        else:
+            cursor.execute("DELETE FROM teachers WHERE teacher_id = ?", (teacher_id,))
 
-            text += "_Список документів відсутній._\n"
+            conn.commit()
 
-        # Додаємо додаткові примітки, якщо вони є
+        logger.info(f"БД Викладачів: Видалено викладача teacher_id={teacher_id}.")
 
-        if docs_data.get("additional_notes"):
+        refresh_teacher_name_index()
 
-            text += f"\n_{docs_data['additional_notes']}_"
+        return True
 
-    reply_markup = get_back_to_admission_form_selection_keyboard(user_role=user_role)
+    except sqlite3.Error as e:
 
-    if query and query.message:
+        logger.error(f"БД Викладачів: Помилка видалення викладача teacher_id={teacher_id}: {e}")
 
-        try:
+        return False
 
-            await query.message.edit_text(text, reply_markup=reply_markup, parse_mode="Markdown", disable_web_page_preview=True)  # type: ignore
 
-        except telegram.error.BadRequest as e:
+def get_teacher_data_from_db(user_id: int) -> dict | None:
+    """Отримує дані викладача за його user_id."""
 
-            if "Message is not modified" in str(e):
+    try:
 
-                logger.debug(f"Повідомлення документів не модифіковано: {e}")
+        with connect_db() as conn:
 
-            else:
-
-                logger.error(
-                    f"Помилка при редагуванні повідомлення show_admission_docs_handler: {e}",
-                    exc_info=True,
-                )
+            conn.row_factory = sqlite3.Row
 
-                # Якщо не вдалося відредагувати, спробуємо надіслати нове
+            cursor = conn.cursor()
 
-                await query.message.reply_text(text, reply_markup=reply_markup, parse_mode="Markdown", disable_web_page_preview=True)  # type: ignore
+            cursor.execute("SELECT * FROM teachers WHERE user_id = ?", (user_id,))
 
-    elif update.message:
+            result = cursor.fetchone()
 
-        await update.message.reply_text(text, reply_markup=reply_markup, parse_mode="Markdown", disable_web_page_preview=True)  # type: ignore
+            return dict(result) if result else None
 
-    return VIEWING_ADMISSION_DOCS
+    except sqlite3.Error as e:
 
+        logger.error(f"БД Викладачів: Помилка отримання даних для викладача {user_id}: {e}")
 
-# --- Клавіатури ---
+        return None
 
-# Оновлений код
 
+def set_teacher_otp_by_id(teacher_id: int, otp_lifetime_minutes: int) -> str | None:
+    """Генерує, хешує та зберігає OTP для викладача за його ID в таблиці teachers."""
 
-def get_main_menu_keyboard(user_id: int, user_group: str | None) -> InlineKeyboardMarkup:
+    try:
 
-    group_text = f" ({user_group})" if user_group else " (Група не обрана)"
+        otp = secrets.token_hex(4)
 
-    keyboard_buttons = [
-        [
-            InlineKeyboardButton(
-                f"📅 Показати розклад{group_text}", callback_data="show_schedule_menu"
-            )
-        ],
-        [
-            InlineKeyboardButton(
-                "🌐 Відкрити веб‑додаток",
-                web_app=telegram.WebAppInfo(url=_build_webapp_url_for_user(user_id)),
-            )
-        ],
-        [InlineKeyboardButton("🔄 Змінити/Вказати групу", callback_data="change_set_group_prompt")],
-        [InlineKeyboardButton("📚 Навчальні книжки", callback_data="show_textbooks_menu")],
-        [InlineKeyboardButton("ℹ️ Про коледж", callback_data="about_college")],
-        [InlineKeyboardButton("💰 Підтримати бота", callback_data="show_donation_info")],
-        [
-            InlineKeyboardButton("📝 Анонімний відгук", callback_data="send_feedback_prompt")
-        ],  # НОВА КНОПКА
-        [
-            InlineKeyboardButton(
-                "💡 Як покращити коледж?", callback_data="suggest_improvement_prompt"
-            )
-        ],
-        [
-            InlineKeyboardButton(
-                "💡 Пропозиція / 🐞 Повідомити про проблему",
-                callback_data="report_bug_button_prompt",
-            )
-        ],
-    ]
+        with span("bcrypt.hashpw", "bcrypt"):
 
-    if RAFFLE_ACTIVE and datetime.now(KYIV_TZ) < RAFFLE_END_DATE:
+            hashed_otp = bcrypt.hashpw(otp.encode("utf-8"), bcrypt.gensalt())
 
-        # Вставка кнопки розіграшу перед "Як покращити коледж?" або "Повідомити про проблему"
+        expires_at = datetime.now(KYIV_TZ) + timedelta(minutes=otp_lifetime_minutes)
 
-        # Щоб вона була на логічному місці. Тепер 'Відгуки' на 4й позиції, тому 5
+        with connect_db() as conn:
 
-        insert_index = 5  # ЗМІНЕНО: тепер після "Відгуки"
+            cursor = conn.cursor()
 
-        keyboard_buttons.insert(
-            insert_index,
-            [
-                InlineKeyboardButton(
-                    f"🎁 Розіграш {RAFFLE_PRIZE.upper()} 🎁", callback_data="show_raffle_info"
-                )
-            ],
-        )
+            cursor.execute(
+                """
 
-    if user_id in ADMIN_USER_IDS:
+                UPDATE teachers SET one_time_password_hash = ?, password_expires_at = ?
 
-        keyboard_buttons.append(
-            [InlineKeyboardButton("🛠️ Панель адміністратора", callback_data="show_admin_panel")]
-        )
+                WHERE teacher_id = ?
 
-    return InlineKeyboardMarkup(keyboard_buttons)
+            """,
+                (hashed_otp, expires_at.isoformat(), teacher_id),
+            )
 
+            conn.commit()
 
-# --- ДОДАЙТЕ ЦЮ НОВУ УНІВЕРСАЛЬНУ ФУНКЦІЮ ---
+        logger.info(
+            f"OTP: Згенеровано новий пароль для викладача (teacher_id={teacher_id}), дійсний до {expires_at}."
+        )
 
+        return otp
 
-def get_correct_main_menu_keyboard(user_id: int) -> InlineKeyboardMarkup:
-    """
+    except sqlite3.Error as e:
 
-    Перевіряє роль користувача і повертає відповідну клавіатуру головного меню.
+        logger.error(
+            f"OTP: Помилка при встановленні пароля для викладача (teacher_id={teacher_id}): {e}"
+        )
 
-    """
+        return None
 
-    user_role = get_user_role_from_db(user_id)
 
-    if user_role == "teacher":
+def verify_otp_and_claim_profile(entered_otp: str, claimer_user_id: int) -> tuple[bool, str]:
+    """Перевіряє OTP. Якщо він вірний, 'прив'язує' профіль викладача до Telegram ID користувача."""
 
-        # Для викладача повертаємо меню викладача
+    try:
 
-        return get_teacher_menu_keyboard(user_id)
+        with connect_db() as conn:
 
-    else:
+            conn.row_factory = sqlite3.Row
 
-        # Для всіх інших (студент, гість, тощо) повертаємо стандартне меню
+            cursor = conn.cursor()
 
-        user_group = get_user_group_from_db(user_id)
+            cursor.execute("SELECT * FROM teachers WHERE one_time_password_hash IS NOT NULL")
 
-        return get_main_menu_keyboard(user_id, user_group)
+            potential_teachers = cursor.fetchall()
 
+            for teacher_row in potential_teachers:
 
-# --- НОВІ ФУНКЦІЇ ДЛЯ МЕНЮ ВИКЛАДАЧА ---
+                hashed_otp = teacher_row["one_time_password_hash"]
 
+                with span("bcrypt.checkpw", "bcrypt"):
 
-def get_teacher_menu_keyboard(user_id: int) -> InlineKeyboardMarkup:
+                    otp_matches = bcrypt.checkpw(entered_otp.encode("utf-8"), hashed_otp)
 
-    teacher_data = get_teacher_data_from_db(user_id)
+                if otp_matches:
 
-    keyboard = [[InlineKeyboardButton("📅 Мій розклад", callback_data="teacher_my_schedule")]]
+                    expires_at = datetime.fromisoformat(teacher_row["password_expires_at"])
 
-    # Додаємо кнопку для куратора, якщо є кураторська група
+                    if datetime.now(KYIV_TZ) > expires_at:
 
-    if teacher_data and teacher_data.get("curated_group_name"):
+                        cursor.execute(
+                            "UPDATE teachers SET one_time_password_hash = NULL, password_expires_at = NULL WHERE teacher_id = ?",
+                            (teacher_row["teacher_id"],),
+                        )
 
-        keyboard.append(
-            [
-                InlineKeyboardButton(
-                    f"🎓 Розклад моєї групи ({teacher_data['curated_group_name']})",
-                    callback_data="teacher_curated_group_schedule",
-                )
-            ]
-        )
+                        conn.commit()
 
-    elif teacher_data and teacher_data.get("curated_group_name"):
+                        return (False, "Термін дії вашого пароля минув.")
 
-        keyboard.append(
-            [
-                InlineKeyboardButton(
-                    f"🎓 Мій клас: {teacher_data['curated_group_name']} (в розробці)",
-                    callback_data="teacher_curated_group",
-                )
-            ]
-        )
+                    previous_user_id = teacher_row["user_id"]
 
-    # Додаємо кнопку для перегляду розкладу будь-якої групи
+                    # Дозволяємо перевипуск та перев'язку навіть якщо профіль вже активований
 
-    keyboard.append(
-        [
-            InlineKeyboardButton(
-                "🔍 Розклад будь-якої групи", callback_data="teacher_any_group_schedule"
-            )
-        ]
-    )
+                    cursor.execute(
+                        "UPDATE teachers SET user_id = ?, one_time_password_hash = NULL, password_expires_at = NULL WHERE teacher_id = ?",
+                        (claimer_user_id, teacher_row["teacher_id"]),
+                    )
 
-    keyboard.extend(
-        [
-            [
-                InlineKeyboardButton(
-                    "🌐 Відкрити веб‑додаток",
-                    web_app=telegram.WebAppInfo(url=_build_webapp_url_for_user(user_id)),
-                )
-            ],
-            [InlineKeyboardButton("📚 Навчальні книжки", callback_data="show_textbooks_menu")],
-            [InlineKeyboardButton("ℹ️ Про коледж", callback_data="about_college")],
-            [InlineKeyboardButton("💰 Підтримати бота", callback_data="show_donation_info")],
-            [
-                InlineKeyboardButton(
-                    "💡 Пропозиція / 🐞 Повідомити про проблему",
-                    callback_data="report_bug_button_prompt",
-                )
-            ],
-            [
-                InlineKeyboardButton(
-                    "🔄 Змінити роль / Вийти", callback_data="back_to_role_selection"
-                )
-            ],
-        ]
-    )
+                    conn.commit()
 
-    if user_id in ADMIN_USER_IDS:
+                    if previous_user_id and previous_user_id != claimer_user_id:
 
-        keyboard.append(
-            [InlineKeyboardButton("🛠️ Панель адміністратора", callback_data="show_admin_panel")]
-        )
+                        logger.info(
+                            f"OTP: Профіль викладача {teacher_row['full_name']} перев'язано з user_id {previous_user_id} на {claimer_user_id}."
+                        )
 
-    return InlineKeyboardMarkup(keyboard)
+                    else:
 
+                        logger.info(
+                            f"OTP: Профіль викладача {teacher_row['full_name']} успішно прив'язано до user_id {claimer_user_id}."
+                        )
 
-async def show_teacher_menu_handler(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+                    return (True, "Вхід успішний!")
 
-    user = update.effective_user
+            return (False, "Невірний пароль.")
 
-    if not user:
+    except Exception as e:
 
-        logger.warning("show_teacher_menu_handler викликано без effective_user")
+        logger.error(f"OTP: Критична помилка під час верифікації OTP: {e}")
 
-        return
+        return (False, "Сталася системна помилка. Спробуйте пізніше.")
 
-    teacher_data = get_teacher_data_from_db(user.id)
 
-    teacher_name = teacher_data.get("full_name", user.full_name) if teacher_data else user.full_name
+def update_command_stats(command_name: str) -> None:
+    """Лічильник команд/кнопок: накопичується в пам'яті, у БД пишеться пакетом."""
 
-    text = f"Вітаю, *{teacher_name}*!\nВи увійшли як викладач. Чим можу допомогти?"
+    pending_command_stats[command_name] = pending_command_stats.get(command_name, 0) + 1
 
-    reply_markup = get_teacher_menu_keyboard(user.id)
 
-    if update.callback_query:
+def record_registration_funnel_step(user_data: dict | None, step: str) -> None:
+    """Фіксує крок воронки реєстрації (кожен крок - один раз за спробу, когорта - день старту)."""
 
-        await update.callback_query.edit_message_text(
-            text, reply_markup=reply_markup, parse_mode="Markdown"
-        )
+    if user_data is None:
 
-    elif update.message:
+        return
 
-        await update.message.reply_text(text, reply_markup=reply_markup, parse_mode="Markdown")
+    funnel = get_transient_state(user_data, REGISTRATION_FUNNEL_KEY)
 
+    if funnel is None:
 
-async def teacher_my_schedule_handler(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+        if step != REGISTRATION_FUNNEL_STEPS[0]:
 
-    query = update.callback_query
+            return  # Не реєстрація (напр. зміна групи з меню)
 
-    if not query:
+        funnel = {"started_at": time.time(), "steps": []}
 
-        logger.warning("teacher_my_schedule_handler викликано без callback_query")
+    if step in funnel["steps"]:
 
         return
 
-    await query.answer("Цей функціонал наразі в розробці.", show_alert=True)
-
+    funnel["steps"].append(step)
 
-async def teacher_curated_group_schedule_handler(
-    update: Update, context: ContextTypes.DEFAULT_TYPE
-) -> None:
+    cohort_day = get_activity_day(funnel["started_at"])
 
-    query = update.callback_query
+    pending_funnel_counts[(cohort_day, step)] = pending_funnel_counts.get((cohort_day, step), 0) + 1
 
-    if not query or not query.from_user:
+    if step != REGISTRATION_FUNNEL_STEPS[-1]:
 
-        logger.warning("teacher_curated_group_schedule_handler викликано без query або from_user")
+        set_transient_state(
+            user_data, REGISTRATION_FUNNEL_KEY, funnel, REGISTRATION_FUNNEL_TTL_SECONDS
+        )
 
         return
 
-    user = query.from_user
-
-    teacher_data = get_teacher_data_from_db(user.id)
-
-    if not teacher_data or not teacher_data.get("curated_group_name"):
+    pop_transient_state(user_data, REGISTRATION_FUNNEL_KEY)
 
-        await query.answer("У вас не вказано кураторську групу.", show_alert=True)
+    elapsed = time.time() - funnel["started_at"]
 
-        return
+    bucket = next(
+        (bound for bound in REGISTRATION_DURATION_BUCKETS if elapsed <= bound),
+        REGISTRATION_DURATION_BUCKETS[-1],
+    )
 
-    group_name = teacher_data["curated_group_name"]
+    pending_funnel_durations[(cohort_day, bucket)] = (
+        pending_funnel_durations.get((cohort_day, bucket), 0) + 1
+    )
 
-    group_schedule_data = get_schedule_data_for_group(group_name)
 
-    if not group_schedule_data:
+def flush_stats_buffers() -> None:
+    """Скидає накопичені лічильники команд і воронки в БД однією транзакцією."""
 
-        await query.edit_message_text(
-            f"На жаль, розклад для групи *{group_name}* не знайдено.",
-            reply_markup=get_teacher_menu_keyboard(user.id),
-            parse_mode="Markdown",
-        )
+    if not (pending_command_stats or pending_funnel_counts or pending_funnel_durations):
 
         return
 
-    # Зберігаємо групу в контексті для подальшого використання
+    command_counts = dict(pending_command_stats)
 
-    if context.user_data is None:
+    funnel_counts = dict(pending_funnel_counts)
 
-        context.user_data = {}
+    funnel_durations = dict(pending_funnel_durations)
 
-    context.user_data["curated_group_name"] = group_name
+    pending_command_stats.clear()
 
-    text = f"📅 Меню розкладу для групи: *{group_name}*.\nОберіть пункт:"
+    pending_funnel_counts.clear()
 
-    reply_markup = get_schedule_menu_keyboard(group_name)
+    pending_funnel_durations.clear()
 
-    await query.edit_message_text(text, reply_markup=reply_markup, parse_mode="Markdown")
+    try:
 
+        with connect_db() as conn:
 
-async def teacher_any_group_schedule_handler(
-    update: Update, context: ContextTypes.DEFAULT_TYPE
-) -> None:
+            conn.executemany(
+                "INSERT INTO command_stats (command, count) VALUES (?, ?) "
+                "ON CONFLICT(command) DO UPDATE SET count = count + excluded.count",
+                command_counts.items(),
+            )
 
-    query = update.callback_query
+            conn.executemany(
+                "INSERT INTO registration_funnel (day, step, count) VALUES (?, ?, ?) "
+                "ON CONFLICT(day, step) DO UPDATE SET count = count + excluded.count",
+                ((day, step, count) for (day, step), count in funnel_counts.items()),
+            )
 
-    if not query or not query.from_user:
+            conn.executemany(
+                "INSERT INTO registration_funnel_durations (day, bucket_seconds, count) "
+                "VALUES (?, ?, ?) "
+                "ON CONFLICT(day, bucket_seconds) DO UPDATE SET count = count + excluded.count",
+                ((day, bucket, count) for (day, bucket), count in funnel_durations.items()),
+            )
 
-        logger.warning("teacher_any_group_schedule_handler викликано без query або from_user")
+            conn.commit()
 
-        return
+    except sqlite3.Error as e:
 
-    # Позначаємо, що викладач переглядає розклад будь-якої групи
+        logger.error(f"Статистика: Помилка пакетного запису лічильників: {e}")
 
-    if context.user_data is None:
+        # Повертаємо в буфер - запишуться наступного разу
 
-        context.user_data = {}
+        for pending, snapshot in (
+            (pending_command_stats, command_counts),
+            (pending_funnel_counts, funnel_counts),
+            (pending_funnel_durations, funnel_durations),
+        ):
 
-    context.user_data["teacher_viewing_any_group"] = True
+            for key, count in snapshot.items():
 
-    # Крок 1: показуємо вибір курсу
+                pending[key] = pending.get(key, 0) + count
 
-    text = "🎓 Оберіть курс, а потім групу:"
 
-    reply_markup = get_teacher_course_selection_keyboard()
+async def stats_flush_job_callback(context: ContextTypes.DEFAULT_TYPE) -> None:
 
-    await query.edit_message_text(text, reply_markup=reply_markup, parse_mode="Markdown")
+    flush_stats_buffers()
 
 
-def get_teacher_group_selection_keyboard(all_groups):
+def classify_delivery_error(error: Exception) -> str:
+    """
+    Класифікує помилку доставки для DLQ.
 
-    keyboard = []
+    permanent - повтор не допоможе (бот заблокований, чат не існує, некоректний запит);
+    payload - некоректний сам вміст (задовгий текст, зламана розмітка), отримувач не винен;
+    transient - тимчасова проблема (RetryAfter, таймаут, мережа).
 
-    row = []
+    """
 
-    for group_name in all_groups:
+    if isinstance(error, telegram.error.Forbidden):
 
-        row.append(
-            InlineKeyboardButton(group_name, callback_data=f"teacher_view_group_{group_name}")
-        )
+        return DLQ_CLASS_PERMANENT
 
-        if len(row) == 2:  # 2 групи в рядку для кращого відображення
+    if isinstance(error, (telegram.error.RetryAfter, telegram.error.TimedOut)):
 
-            keyboard.append(row)
+        return DLQ_CLASS_TRANSIENT
 
-            row = []
+    if isinstance(error, telegram.error.BadRequest):
 
-    if row:
+        error_text = str(error).lower()
 
-        keyboard.append(row)
+        if any(marker in error_text for marker in PAYLOAD_ERROR_MARKERS):
 
-    keyboard.append(
-        [InlineKeyboardButton("⬅️ Назад до меню викладача", callback_data="back_to_main_menu")]
-    )
+            return DLQ_CLASS_PAYLOAD
 
-    return InlineKeyboardMarkup(keyboard)
+        return DLQ_CLASS_PERMANENT
 
+    if isinstance(error, telegram.error.NetworkError):
 
-# --- ФУНКЦІЇ ДЛЯ РОЗКЛАДУ ВИКЛАДАЧІВ ---
+        return DLQ_CLASS_TRANSIENT
 
+    return DLQ_CLASS_TRANSIENT
 
-def get_teacher_name_from_callback_data(callback_data: str, prefix: str) -> str:
-    """Отримує оригінальне ім'я викладача з callback_data, замінюючи підкреслення на пробіли."""
 
-    if not callback_data.startswith(prefix):
+def is_recipient_gone_error(error: Exception) -> bool:
+    """Бот заблокований або чату/користувача не існує - доставка цьому отримувачу неможлива."""
 
-        return ""
+    if isinstance(error, telegram.error.Forbidden):
 
-    # Видаляємо префікс
+        return True
 
-    name_part = callback_data[len(prefix) :]
+    if isinstance(error, telegram.error.BadRequest):
 
-    # Замінюємо підкреслення на пробіли
+        error_text = str(error).lower()
 
-    return name_part.replace("_", " ")
+        return any(marker in error_text for marker in RECIPIENT_GONE_ERROR_MARKERS)
 
+    return False
 
-def normalize_teacher_name_for_matching(full_name: str) -> str:
-    """Нормалізує повне ім'я викладача для зіставлення зі скороченим."""
 
-    if not full_name:
+DLQ_INSERT_SQL = """
 
-        return ""
+    INSERT INTO dead_letter_queue (user_id, message_text, broadcast_id, error_message, status,
+                                   error_class, attempts, next_attempt_at)
 
-    # Розбиваємо на частини
+    VALUES (?, ?, ?, ?, ?, ?, 0, datetime('now', ?))
 
-    parts = full_name.strip().split()
+"""
 
-    if len(parts) < 2:
 
-        return full_name.strip()
+def dlq_insert_params(
+    user_id: int,
+    message_text: str | None,
+    error_message: str,
+    error_class: str,
+    broadcast_id: int | None,
+) -> tuple:
+    """Параметри DLQ_INSERT_SQL для одного запису."""
 
-    # Беремо прізвище та ініціали
+    # Постійні помилки і помилки вмісту одразу позначаємо як 'dead' - повторювати їх немає сенсу
 
-    surname = parts[0]
+    status = "new" if error_class == DLQ_CLASS_TRANSIENT else "dead"
 
-    initials = ""
+    return (
+        user_id,
+        "" if broadcast_id else message_text,  # message_text - NOT NULL у старій схемі
+        broadcast_id,
+        error_message,
+        status,
+        error_class,
+        f"+{DLQ_RETRY_BASE_DELAY_SECONDS} seconds",
+    )
 
-    for part in parts[1:]:
 
-        if part and len(part) > 0:
+def get_due_dlq_entries(limit: int) -> list[dict]:
+    """Записи DLQ, час повторної доставки яких настав."""
 
-            initials += part[0].upper() + "."
+    try:
 
-    return f"{surname} {initials}".strip()
+        with connect_db() as conn:
 
+            conn.row_factory = sqlite3.Row
 
-def find_teacher_lessons_in_schedule(teacher_full_name: str) -> list:
-    """Знаходить всі пари викладача в розкладі всіх груп."""
+            rows = conn.execute(
+                """
 
-    schedule_data = get_cached_schedule()
+                SELECT d.id, d.user_id, d.message_text, d.broadcast_id, d.attempts
 
-    if not schedule_data or "розклади_груп" not in schedule_data:
+                FROM dead_letter_queue d
 
-        return []
+                WHERE d.status = 'new' AND COALESCE(d.error_class, 'transient') = 'transient'
 
-    # Нормалізуємо ім'я викладача
+                  AND (d.next_attempt_at IS NULL OR d.next_attempt_at <= datetime('now'))
 
-    normalized_teacher_name = normalize_teacher_name_for_matching(teacher_full_name)
+                ORDER BY d.next_attempt_at, d.id LIMIT ?
 
-    teacher_lessons = []
+            """,
+                (limit,),
+            ).fetchall()
 
-    # Проходимо по всіх групах
+            return [dict(row) for row in rows]
 
-    for group_name, group_data in schedule_data["розклади_груп"].items():
+    except sqlite3.Error as e:
 
-        if "тиждень" not in group_data:
+        logger.error(f"DLQ: Помилка вибірки записів для повторної доставки: {e}")
 
-            continue
+        return []
 
-        # Проходимо по всіх днях тижня
 
-        for day_name, day_lessons in group_data["тиждень"].items():
+def mark_dlq_entry_processed(dlq_id: int) -> None:
 
-            if not isinstance(day_lessons, list):
+    try:
 
-                continue
+        with connect_db() as conn:
 
-            # Проходимо по всіх парах дня
+            conn.execute(
+                "UPDATE dead_letter_queue SET status = 'processed', attempts = attempts + 1 WHERE id = ?",
+                (dlq_id,),
+            )
 
-            for lesson in day_lessons:
+            conn.commit()
 
-                if not isinstance(lesson, dict) or "викладач" not in lesson:
+    except sqlite3.Error as e:
 
-                    continue
+        logger.error(f"DLQ: Помилка позначення запису {dlq_id} як обробленого: {e}")
 
-                lesson_teacher = lesson.get("викладач", "").strip()
 
-                # Перевіряємо збіг імен та що це не "Немає пари"
+def reschedule_dlq_entry(dlq_id: int, attempts: int, error_message: str, error_class: str) -> str:
+    """Після невдалої спроби: або відкладає запис з експоненційною затримкою, або позначає 'dead'."""
 
-                if (
-                    lesson_teacher == normalized_teacher_name
-                    or lesson_teacher == teacher_full_name
-                    or lesson_teacher in teacher_full_name
-                    or teacher_full_name in lesson_teacher
-                ):
+    attempts += 1
 
-                    # Перевіряємо назву предмету
+    if error_class != DLQ_CLASS_TRANSIENT or attempts >= DLQ_MAX_ATTEMPTS:
 
-                    subject_name = lesson.get("назва", "").strip()
+        status = "dead"
 
-                    if subject_name and subject_name.lower() not in [
-                        "виховна година",
-                        "виховна",
-                        "",
-                    ]:
+        delay_seconds = 0
 
-                        # Додаємо інформацію про групу до уроку
+    else:
 
-                        lesson_with_group = lesson.copy()
+        status = "new"
 
-                        lesson_with_group["група"] = group_name
+        delay_seconds = min(
+            DLQ_RETRY_BASE_DELAY_SECONDS * (2**attempts), DLQ_RETRY_MAX_DELAY_SECONDS
+        )
 
-                        lesson_with_group["день"] = day_name
+    try:
 
-                        teacher_lessons.append(lesson_with_group)
+        with connect_db() as conn:
 
-    return teacher_lessons
+            conn.execute(
+                """
 
+                UPDATE dead_letter_queue
 
-def get_teacher_schedule_for_day(
-    teacher_full_name: str, day_name: str, week_type: str = "завжди"
-) -> str:
-    """Генерує розклад викладача на конкретний день та тип тижня.
+                SET status = ?, attempts = ?, error_message = ?, error_class = ?,
 
+                    next_attempt_at = datetime('now', ?)
 
+                WHERE id = ?
 
-    Показує ВСІ пари по фіксованих слотах часу у правильному порядку.
+            """,
+                (
+                    status,
+                    attempts,
+                    error_message,
+                    error_class,
+                    f"+{delay_seconds} seconds",
+                    dlq_id,
+                ),
+            )
 
-    Якщо в слоті немає пари, виводить "Немає пари". Без зайвих порожніх рядків.
+            conn.commit()
 
-    """
+    except sqlite3.Error as e:
 
-    lessons = find_teacher_lessons_in_schedule(teacher_full_name)
+        logger.error(f"DLQ: Помилка оновлення запису {dlq_id} після невдалої спроби: {e}")
 
-    # Фільтруємо по дню та типу тижня
+    return status
 
-    day_lessons = []
 
-    for lesson in lessons:
+def get_dlq_class_counts() -> dict[tuple[str, str], int]:
+    """Кількість записів DLQ за (клас помилки, статус)."""
 
-        if lesson.get("день") == day_name:
+    try:
 
-            lesson_week_type = lesson.get("тип_тижня", "завжди")
+        with connect_db() as conn:
 
-            if lesson_week_type == "завжди" or lesson_week_type == week_type:
+            rows = conn.execute("""
 
-                day_lessons.append(lesson)
+                SELECT COALESCE(error_class, 'transient'), status, COUNT(*)
 
-    response_header = f"👨‍🏫 Розклад *{teacher_full_name}* на *{day_name}* ({week_type}):\n\n"
+                FROM dead_letter_queue GROUP BY 1, 2
 
-    # Якщо взагалі немає жодного запису на цей день і тип тижня
+            """).fetchall()
 
-    if not day_lessons:
+            return {(error_class, status): count for error_class, status, count in rows}
 
-        return (
-            response_header
-            + "• 08:00-09:20 - Немає пари\n"
-            + "• 09:30-10:50 - Немає пари\n"
-            + "• 11:40-13:00 - Немає пари\n"
-            + "• 13:10-14:30 - Немає пари"
-        )
+    except sqlite3.Error as e:
 
-    # Групуємо пари за часом
+        logger.error(f"DLQ: Помилка підрахунку записів за класами: {e}")
 
-    lessons_by_time: dict[str, list] = {}
+        return {}
 
-    for lesson in day_lessons:
 
-        time = lesson.get("час", "")
+def clear_dlq(status: str = "new", older_than_days: int = 30) -> int:
+    """
 
-        if time not in lessons_by_time:
+    Очищає записи з Dead Letter Queue.
 
-            lessons_by_time[time] = []
+    Видаляє записи зі вказаним статусом, старші ніж older_than_days.
 
-        lessons_by_time[time].append(lesson)
+    Повертає кількість видалених записів.
 
-    # Фіксований порядок слотів часу
+    """
 
-    canonical_times = [
-        "08:00-09:20",
-        "09:30-10:50",
-        "11:40-13:00",
-        "13:10-14:30",
-    ]
+    try:
 
-    lines: list[str] = []
+        with connect_db() as conn:
 
-    for time in canonical_times:
+            cursor = conn.cursor()
 
-        time_lessons = lessons_by_time.get(time, [])
+            # Визначаємо дату, до якої записи вважаються "старими"
 
-        # Відкидаємо псевдо-записи типу "Немає пари"
+            threshold_date = datetime.now(KYIV_TZ) - timedelta(days=older_than_days)
 
-        real_lessons = [
-            lesson
-            for lesson in time_lessons
-            if lesson.get("назва", "").strip().lower() not in ["немає пари", "немає", "відсутня"]
-        ]
+            threshold_date_str = threshold_date.isoformat()
 
-        if real_lessons:
+            # Видаляємо записи, які відповідають статусу і старші за поріг
 
-            # Може бути кілька груп у той самий час – виводимо кожну окремо
+            cursor.execute(
+                "DELETE FROM dead_letter_queue WHERE status = ? AND failed_at < ?",
+                (status, threshold_date_str),
+            )
 
-            for lesson in real_lessons:
+            deleted_count = cursor.rowcount
 
-                subject = lesson.get("назва", "")
+            conn.commit()
 
-                group = lesson.get("група", "")
+            logger.info(
+                f"DLQ: Видалено {deleted_count} записів зі статусом '{status}' старших за {older_than_days} днів."
+            )
 
-                room = lesson.get("аудиторія", "")
+            return deleted_count
 
-                lines.append(f"• {time} - {subject}")
+    except sqlite3.Error as e:
 
-                # Формуємо інформацію про аудиторію з поверхом
+        logger.error(f"DLQ: Помилка під час очищення DLQ: {e}")
 
-                room_info = ""
+        return -1
 
-                if room:
 
-                    floor = get_floor_by_auditorium(room)
+def create_broadcast_job(
+    created_by: int,
+    kind: str,
+    message_text: str,
+    media_file_ids: list[str] | None,
+    target_description: str,
+    user_ids: Iterable[int],
+    progress_chat_id: int | None = None,
+    progress_message_id: int | None = None,
+    scheduled_announcement_id: int | None = None,
+) -> int | None:
+    """Зберігає завдання розсилки та всіх його отримувачів зі статусом 'pending'.
+
+    user_ids може бути генератором (iter_bitmap_user_ids) - отримувачі записуються потоково.
+    Помилка БД під час читання аудиторії скасовує все завдання (повертається None).
+    scheduled_announcement_id - відкладене оголошення позначається 'sent' у тій самій транзакції
+    (лише якщо воно ще 'scheduled'), тож після перезапуску воно не запуститься вдруге.
+    """
 
-                    if floor:
+    try:
 
-                        room_info = f"🏢 Ауд. {room} ({floor})"
+        with connect_db() as conn:
 
-                    else:
+            cursor = conn.cursor()
 
-                        room_info = f"🏢 Ауд. {room}"
+            cursor.execute(
+                """
 
-                else:
+                INSERT INTO broadcasts (created_by, kind, message_text, media_json, parse_mode, created_at)
 
-                    room_info = "🏢 Ауд. -"
+                VALUES (?, ?, ?, ?, ?, ?)
 
-                lines.append(f"  📚 Група: {group} | {room_info}")
+            """,
+                (
+                    created_by,
+                    kind,
+                    message_text,
+                    json.dumps(media_file_ids) if media_file_ids else None,
+                    "Markdown" if kind == "media" else None,  # Підпис до фото - Markdown, текст - як є
+                    datetime.now(KYIV_TZ).isoformat(),
+                ),
+            )
 
-        else:
+            broadcast_id = cursor.lastrowid
 
-            lines.append(f"• {time} - Немає пари")
+            cursor.execute(
+                """
 
-    return (response_header + "\n".join(lines)).strip()
+                INSERT INTO broadcast_jobs (created_by, kind, broadcast_id, target_description, total,
+                                            progress_chat_id, progress_message_id, created_at, updated_at)
 
+                VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)
 
-def get_full_teacher_schedule(teacher_full_name: str) -> str:
-    """Генерує повний розклад викладача на тиждень."""
+            """,
+                (
+                    created_by,
+                    kind,
+                    broadcast_id,
+                    target_description,
+                    0,
+                    progress_chat_id,
+                    progress_message_id,
+                    datetime.now(KYIV_TZ).isoformat(),
+                    datetime.now(KYIV_TZ).isoformat(),
+                ),
+            )
 
-    lessons = find_teacher_lessons_in_schedule(teacher_full_name)
+            job_id = cursor.lastrowid
 
-    if not lessons:
+            cursor.executemany(
+                "INSERT OR IGNORE INTO broadcast_job_recipients (job_id, user_id) VALUES (?, ?)",
+                ((job_id, user_id) for user_id in user_ids),
+            )
 
-        return f"👨‍🏫 У *{teacher_full_name}* немає пар в розкладі."
+            total = cursor.execute(
+                "SELECT COUNT(*) FROM broadcast_job_recipients WHERE job_id = ?", (job_id,)
+            ).fetchone()[0]
 
-    # Групуємо по днях та типах тижня
+            cursor.execute("UPDATE broadcast_jobs SET total = ? WHERE id = ?", (total, job_id))
 
-    schedule_by_day = {}
+            if scheduled_announcement_id is not None:
 
-    for lesson in lessons:
+                cursor.execute(
+                    """
 
-        day = lesson.get("день", "")
+                    UPDATE scheduled_announcements
 
-        week_type = lesson.get("тип_тижня", "завжди")
+                    SET status = 'sent', broadcast_job_id = ?, updated_at = ?
 
-        if day not in schedule_by_day:
+                    WHERE id = ? AND status = 'scheduled'
 
-            schedule_by_day[day] = {"завжди": [], "чисельник": [], "знаменник": []}
+                """,
+                    (job_id, datetime.now(KYIV_TZ).isoformat(), scheduled_announcement_id),
+                )
 
-        if week_type in schedule_by_day[day]:
+                if not cursor.rowcount:
 
-            schedule_by_day[day][week_type].append(lesson)
+                    conn.rollback()
 
-    # Сортуємо пари по часу в кожному дні
+                    logger.warning(
+                        f"Розсилки: Оголошення #{scheduled_announcement_id} вже оброблено "
+                        "або скасовано - завдання не створено."
+                    )
 
-    for day_data in schedule_by_day.values():
+                    return None
 
-        for week_type_lessons in day_data.values():
+            conn.commit()
 
-            week_type_lessons.sort(key=lambda x: x.get("час", ""))
+        logger.info(f"Розсилки: Створено завдання #{job_id} ({total} отримувачів).")
 
-    # Формуємо відповідь
+        return job_id
 
-    response = f"👨‍🏫 Повний розклад *{teacher_full_name}* на тиждень:\n\n"
+    except sqlite3.Error as e:
 
-    days_order = ["понеділок", "вівторок", "середа", "четвер", "п'ятниця", "субота", "неділя"]
+        logger.error(f"Розсилки: Помилка створення завдання розсилки: {e}")
 
-    for day in days_order:
+        return None
 
-        if day not in schedule_by_day:
 
-            continue
+# Завдання разом із вмістом розсилки; старі завдання (до таблиці broadcasts) мають власні копії тексту
 
-        day_data = schedule_by_day[day]
+BROADCAST_JOB_SELECT_SQL = """
 
-        has_lessons = any(day_data[wt] for wt in ["завжди", "чисельник", "знаменник"])
+    SELECT j.id, j.created_by, j.broadcast_id, COALESCE(b.kind, j.kind) AS kind,
 
-        if not has_lessons:
+           COALESCE(b.message_text, j.message_text) AS message_text,
 
-            continue
+           COALESCE(b.media_json, j.media_json) AS media_json,
 
-        response += f"*{day.capitalize()}*:\n"
+           CASE WHEN j.broadcast_id IS NULL AND j.kind = 'media' THEN 'Markdown' ELSE b.parse_mode END AS parse_mode,
 
-        # Показуємо пари для кожного типу тижня
+           j.target_description, j.status, j.total, j.sent, j.failed,
 
-        for week_type in ["завжди", "чисельник", "знаменник"]:
+           j.progress_chat_id, j.progress_message_id, j.created_at, j.updated_at
 
-            week_lessons = day_data.get(week_type, [])
+    FROM broadcast_jobs j LEFT JOIN broadcasts b ON b.id = j.broadcast_id
 
-            if week_lessons:
+"""
 
-                week_type_display = (
-                    "Чисельник"
-                    if week_type == "чисельник"
-                    else "Знаменник" if week_type == "знаменник" else "Завжди"
-                )
 
-                response += f"  {week_type_display}:\n"
+def get_broadcast_payload(broadcast_id: int) -> dict | None:
+    """Вміст розсилки (kind, message_text, media_json, parse_mode) для повторної доставки з DLQ."""
 
-                # Групуємо пари за часом
+    try:
 
-                lessons_by_time = {}
+        with connect_db() as conn:
 
-                for lesson in week_lessons:
+            conn.row_factory = sqlite3.Row
 
-                    time = lesson.get("час", "")
+            row = conn.execute(
+                "SELECT id, kind, message_text, media_json, parse_mode FROM broadcasts WHERE id = ?",
+                (broadcast_id,),
+            ).fetchone()
 
-                    if time not in lessons_by_time:
+            return dict(row) if row else None
 
-                        lessons_by_time[time] = []
+    except sqlite3.Error as e:
 
-                    lessons_by_time[time].append(lesson)
+        logger.error(f"Розсилки: Помилка читання вмісту розсилки #{broadcast_id}: {e}")
 
-                # Сортуємо по часу
+        return None
 
-                sorted_times = sorted(lessons_by_time.keys())
 
-                for time in sorted_times:
+def get_broadcast_job(job_id: int) -> dict | None:
 
-                    time_lessons = lessons_by_time[time]
+    try:
 
-                    # Перевіряємо, чи є реальні пари (не "Немає пари")
+        with connect_db() as conn:
 
-                    real_lessons = [
-                        lesson
-                        for lesson in time_lessons
-                        if lesson.get("назва", "").strip().lower()
-                        not in ["немає пари", "немає", "відсутня"]
-                    ]
+            conn.row_factory = sqlite3.Row
 
-                    if real_lessons:
+            row = conn.execute(f"{BROADCAST_JOB_SELECT_SQL} WHERE j.id = ?", (job_id,)).fetchone()
 
-                        # Показуємо реальні пари
+            return dict(row) if row else None
 
-                        for lesson in real_lessons:
+    except sqlite3.Error as e:
 
-                            subject = lesson.get("назва", "")
+        logger.error(f"Розсилки: Помилка читання завдання #{job_id}: {e}")
 
-                            group = lesson.get("група", "")
+        return None
 
-                            room = lesson.get("аудиторія", "")
 
-                            response += f"    • {time} - {subject} | {group} | Ауд. {room}\n"
+def get_next_active_broadcast_job() -> dict | None:
+    """Найстаріше завдання, яке ще потрібно відправляти (в т.ч. перерване перезапуском)."""
 
-                    else:
+    try:
 
-                        # Якщо тільки "Немає пари", показуємо один раз
+        with connect_db() as conn:
 
-                        response += f"    • {time} - Немає пари\n"
+            conn.row_factory = sqlite3.Row
 
-        response += "\n"
+            row = conn.execute(
+                f"{BROADCAST_JOB_SELECT_SQL} WHERE j.status IN ('pending', 'running') ORDER BY j.id LIMIT 1"
+            ).fetchone()
 
-    return response.strip()
+            return dict(row) if row else None
 
+    except sqlite3.Error as e:
 
-def get_teacher_schedule_by_week_type(teacher_full_name: str, week_type: str) -> str:
-    """Генерує розклад викладача на конкретний тип тижня."""
+        logger.error(f"Розсилки: Помилка пошуку активного завдання: {e}")
 
-    lessons = find_teacher_lessons_in_schedule(teacher_full_name)
+        return None
 
-    # Фільтруємо по типу тижня
 
-    filtered_lessons = []
+def get_recent_broadcast_jobs(limit: int = 10) -> list[dict]:
 
-    for lesson in lessons:
+    try:
 
-        lesson_week_type = lesson.get("тип_тижня", "завжди")
+        with connect_db() as conn:
 
-        if lesson_week_type == "завжди" or lesson_week_type == week_type:
+            conn.row_factory = sqlite3.Row
 
-            filtered_lessons.append(lesson)
+            rows = conn.execute(
+                f"{BROADCAST_JOB_SELECT_SQL} ORDER BY j.id DESC LIMIT ?", (limit,)
+            ).fetchall()
 
-    if not filtered_lessons:
+            return [dict(row) for row in rows]
 
-        week_type_display = (
-            "Чисельник"
-            if week_type == "чисельник"
-            else "Знаменник" if week_type == "знаменник" else week_type
-        )
+    except sqlite3.Error as e:
 
-        return f"👨‍🏫 У *{teacher_full_name}* немає пар на *{week_type_display}*."
+        logger.error(f"Розсилки: Помилка читання списку завдань: {e}")
 
-    # Групуємо по днях
+        return []
 
-    schedule_by_day = {}
 
-    for lesson in filtered_lessons:
+def get_pending_broadcast_recipients(job_id: int, limit: int) -> list[int]:
 
-        day = lesson.get("день", "")
+    try:
 
-        if day not in schedule_by_day:
+        with connect_db() as conn:
 
-            schedule_by_day[day] = []
+            rows = conn.execute(
+                """
 
-        schedule_by_day[day].append(lesson)
+                SELECT user_id FROM broadcast_job_recipients
 
-    # Сортуємо пари по часу в кожному дні
+                WHERE job_id = ? AND status = 'pending'
 
-    for day_lessons in schedule_by_day.values():
+                ORDER BY user_id LIMIT ?
 
-        day_lessons.sort(key=lambda x: x.get("час", ""))
+            """,
+                (job_id, limit),
+            ).fetchall()
 
-    # Формуємо відповідь
+            return [row[0] for row in rows]
 
-    week_type_display = (
-        "Чисельник"
-        if week_type == "чисельник"
-        else "Знаменник" if week_type == "знаменник" else week_type
-    )
+    except sqlite3.Error as e:
 
-    response = f"👨‍🏫 Розклад *{teacher_full_name}* на *{week_type_display}*:\n\n"
+        logger.error(f"Розсилки: Помилка читання отримувачів завдання #{job_id}: {e}")
 
-    days_order = ["понеділок", "вівторок", "середа", "четвер", "п'ятниця", "субота", "неділя"]
+        return []
 
-    for day in days_order:
 
-        if day not in schedule_by_day:
+def persist_broadcast_outcomes(job: dict, outcomes: list[tuple[int, Exception | None]]) -> None:
+    """
+    Фіксує результати доставки [(user_id, None або помилка)] однією транзакцією.
 
-            continue
+    Статуси отримувачів і лічильники завдання, статус доставки користувачів і записи DLQ -
+    по одному executemany на вид запису замість окремого з'єднання на кожного отримувача.
 
-        day_lessons = schedule_by_day[day]
+    """
 
-        if not day_lessons:
+    if not outcomes:
 
-            continue
+        return
 
-        response += f"*{day.capitalize()}*:\n"
+    job_id = job["id"]
 
-        # Групуємо пари за часом
+    processed_at = datetime.now(KYIV_TZ).isoformat()
 
-        lessons_by_time = {}
+    sent_user_ids = [user_id for user_id, error in outcomes if error is None]
 
-        for lesson in day_lessons:
+    failures = [(user_id, error) for user_id, error in outcomes if error is not None]
 
-            time = lesson.get("час", "")
+    dlq_rows = []
 
-            if time not in lessons_by_time:
+    for user_id, error in failures:
 
-                lessons_by_time[time] = []
+        if job["broadcast_id"]:
 
-            lessons_by_time[time].append(lesson)
+            dlq_text = None
 
-        # Сортуємо по часу
+        elif job["kind"] == "media":
 
-        sorted_times = sorted(lessons_by_time.keys())
+            # Завдання, створене до таблиці broadcasts: медіа в DLQ не зберегти
 
-        for time in sorted_times:
+            dlq_text = f"{DLQ_MEDIA_PREFIX} {job['message_text']}"
 
-            time_lessons = lessons_by_time[time]
+        else:
 
-            # Перевіряємо, чи є реальні пари (не "Немає пари")
+            dlq_text = job["message_text"]
 
-            real_lessons = [
-                lesson
-                for lesson in time_lessons
-                if lesson.get("назва", "").strip().lower()
-                not in ["немає пари", "немає", "відсутня"]
-            ]
+        dlq_rows.append(
+            dlq_insert_params(
+                user_id, dlq_text, str(error), classify_delivery_error(error), job["broadcast_id"]
+            )
+        )
 
-            if real_lessons:
+    try:
 
-                # Показуємо реальні пари
+        with connect_db() as conn:
 
-                for lesson in real_lessons:
+            cursor = conn.cursor()
 
-                    subject = lesson.get("назва", "")
+            for counter_column, rows in (
+                (
+                    "sent",
+                    [("sent", None, processed_at, job_id, user_id) for user_id in sent_user_ids],
+                ),
+                (
+                    "failed",
+                    [
+                        ("failed", str(error), processed_at, job_id, user_id)
+                        for user_id, error in failures
+                    ],
+                ),
+            ):
 
-                    group = lesson.get("група", "")
+                if not rows:
 
-                    room = lesson.get("аудиторія", "")
+                    continue
 
-                    response += f"  • {time} - {subject} | {group} | Ауд. {room}\n"
+                cursor.executemany(
+                    """
 
-            else:
+                    UPDATE broadcast_job_recipients SET status = ?, error = ?, processed_at = ?
 
-                # Якщо тільки "Немає пари", показуємо один раз
+                    WHERE job_id = ? AND user_id = ? AND status = 'pending'
 
-                response += f"  • {time} - Немає пари\n"
+                """,
+                    rows,
+                )
 
-        response += "\n"
+                # rowcount після executemany - сума змінених рядків; вже оброблені не рахуються
 
-    return response.strip()
+                if cursor.rowcount > 0:
 
+                    cursor.execute(
+                        f"UPDATE broadcast_jobs SET {counter_column} = {counter_column} + ?, updated_at = ? WHERE id = ?",
+                        (cursor.rowcount, processed_at, job_id),
+                    )
 
-# --- КЛАВІАТУРИ ДЛЯ РОЗКЛАДУ ВИКЛАДАЧА ---
+            # Сегменти перераховуємо лише для тих, чий статус доставки справді зміниться
 
+            placeholders = ",".join("?" * len(sent_user_ids))
 
-def get_teacher_schedule_menu_keyboard(teacher_id: int) -> InlineKeyboardMarkup:
-    """Створює клавіатуру меню розкладу викладача."""
+            recovered_user_ids = (
+                [
+                    row[0]
+                    for row in cursor.execute(
+                        f"""
 
-    keyboard = [
-        [InlineKeyboardButton("📅 Розклад на сьогодні", callback_data=f"t_today_{teacher_id}")],
-        [
-            InlineKeyboardButton(
-                "📋 Повний розклад на тиждень", callback_data=f"t_full_{teacher_id}"
-            )
-        ],
-        [
-            InlineKeyboardButton(
-                "🔍 Розклад на конкретний день", callback_data=f"t_day_schedule_{teacher_id}"
-            )
-        ],
-        [InlineKeyboardButton("⬅️ Назад до меню викладача", callback_data="back_to_main_menu")],
-    ]
+                        SELECT user_id FROM users WHERE user_id IN ({placeholders})
 
-    return InlineKeyboardMarkup(keyboard)
+                          AND (COALESCE(last_delivery_status, 'ok') != 'ok'
 
+                               OR COALESCE(consecutive_failures, 0) != 0)
 
-# ДОДАНО: вибір курсу для викладача (перед вибором групи)
+                    """,
+                        sent_user_ids,
+                    )
+                ]
+                if sent_user_ids
+                else []
+            )
 
+            cursor.executemany(USER_DELIVERY_OK_SQL, ((user_id,) for user_id in recovered_user_ids))
 
-def get_teacher_course_selection_keyboard() -> InlineKeyboardMarkup:
+            cursor.executemany(
+                USER_DELIVERY_FAILED_SQL,
+                (
+                    ("blocked" if is_recipient_gone_error(error) else "failed", user_id)
+                    for user_id, error in failures
+                ),
+            )
 
-    keyboard = [
-        [InlineKeyboardButton("Курс 1", callback_data="teacher_select_course_1")],
-        [InlineKeyboardButton("Курс 2", callback_data="teacher_select_course_2")],
-        [InlineKeyboardButton("Курс 3", callback_data="teacher_select_course_3")],
-        [InlineKeyboardButton("Курс 4", callback_data="teacher_select_course_4")],
-        [InlineKeyboardButton("⬅️ Назад до меню викладача", callback_data="back_to_main_menu")],
-    ]
+            cursor.executemany(DLQ_INSERT_SQL, dlq_rows)
 
-    return InlineKeyboardMarkup(keyboard)
+            conn.commit()
 
+    except sqlite3.Error as e:
 
-# ДОДАНО: вибір груп для викладача з фільтрацією за курсом
+        logger.error(
+            f"Розсилки: Помилка запису результатів {len(outcomes)} отримувачів "
+            f"у завданні #{job_id}: {e}"
+        )
 
+        return
 
-def get_teacher_group_selection_keyboard_by_course(selected_course: int) -> InlineKeyboardMarkup:
+    audience_dirty_user_ids.update(recovered_user_ids)
 
-    all_groups = get_all_group_names_from_cache()
+    audience_dirty_user_ids.update(user_id for user_id, _ in failures)
 
-    if not all_groups:
+    if dlq_rows:
 
-        return InlineKeyboardMarkup(
-            [
-                [InlineKeyboardButton("Немає доступних груп", callback_data="no_groups_available")],
-                [
-                    InlineKeyboardButton(
-                        "⬅️ Назад до вибору курсу", callback_data="teacher_any_group_schedule"
-                    )
-                ],
-            ]
-        )
+        logger.info(f"DLQ: Розсилка #{job_id} - додано {len(dlq_rows)} записів.")
 
-    course_year_map = {1: "25", 2: "24", 3: "23", 4: "22"}
 
-    target_year = course_year_map.get(selected_course, "25")
+def set_broadcast_job_status(job_id: int, status: str, expected_status: str | None = None) -> bool:
+    """
+    Змінює статус завдання. З expected_status - лише якщо поточний статус саме такий
+    (щоб воркер не перезаписав паузу/скасування адміна); False, якщо рядок не змінено.
 
-    filtered_groups = [
-        group
-        for group in all_groups
-        if group.endswith(f"-{target_year}") or f"-{target_year} (" in group
-    ]
+    """
 
-    if not filtered_groups:
+    try:
 
-        return InlineKeyboardMarkup(
-            [
-                [
-                    InlineKeyboardButton(
-                        f"Немає груп для {selected_course} курсу",
-                        callback_data="no_groups_available",
-                    )
-                ],
-                [
-                    InlineKeyboardButton(
-                        "⬅️ Назад до вибору курсу", callback_data="teacher_any_group_schedule"
-                    )
-                ],
-            ]
-        )
+        with connect_db() as conn:
 
-    keyboard = []
+            if expected_status is None:
 
-    row = []
+                cursor = conn.execute(
+                    "UPDATE broadcast_jobs SET status = ?, updated_at = ? WHERE id = ?",
+                    (status, datetime.now(KYIV_TZ).isoformat(), job_id),
+                )
 
-    for group_name in filtered_groups:
+            else:
 
-        row.append(
-            InlineKeyboardButton(group_name, callback_data=f"teacher_view_group_{group_name}")
-        )
+                cursor = conn.execute(
+                    "UPDATE broadcast_jobs SET status = ?, updated_at = ? WHERE id = ? AND status = ?",
+                    (status, datetime.now(KYIV_TZ).isoformat(), job_id, expected_status),
+                )
 
-        if len(row) == 3:
+            conn.commit()
 
-            keyboard.append(row)
+        return cursor.rowcount > 0
 
-            row = []
+    except sqlite3.Error as e:
 
-    if row:
+        logger.error(f"Розсилки: Помилка зміни статусу завдання #{job_id} на '{status}': {e}")
 
-        keyboard.append(row)
+        return False
 
-    keyboard.append(
-        [
-            InlineKeyboardButton(
-                "⬅️ Назад до вибору курсу", callback_data="teacher_any_group_schedule"
-            )
-        ]
-    )
 
-    return InlineKeyboardMarkup(keyboard)
+def create_scheduled_announcement(
+    created_by: int,
+    kind: str,
+    message_text: str,
+    media_file_ids: list[str] | None,
+    group_name: str | None,
+    include_unreachable: bool,
+    target_description: str,
+    send_at: datetime,
+    segment_expression: str | None = None,
+) -> int | None:
+    """Зберігає відкладене оголошення; аудиторія визначається в момент відправки."""
 
+    try:
 
-def get_teacher_day_selection_keyboard(teacher_id: int) -> InlineKeyboardMarkup:
-    """Створює клавіатуру вибору дня тижня для розкладу викладача."""
+        with connect_db() as conn:
 
-    days = ["понеділок", "вівторок", "середа", "четвер", "п'ятниця"]
+            cursor = conn.cursor()
 
-    keyboard = []
+            cursor.execute(
+                """
 
-    for day in days:
+                INSERT INTO scheduled_announcements (created_by, kind, message_text, media_json, group_name,
+                                                     include_unreachable, segment_expression,
+                                                     target_description, send_at, created_at, updated_at)
 
-        # Використовуємо коротші назви днів
+                VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
 
-        day_short = {
-            "понеділок": "mon",
-            "вівторок": "tue",
-            "середа": "wed",
-            "четвер": "thu",
-            "п'ятниця": "fri",
-        }.get(day, day)
+            """,
+                (
+                    created_by,
+                    kind,
+                    message_text,
+                    json.dumps(media_file_ids) if media_file_ids else None,
+                    group_name,
+                    int(include_unreachable),
+                    segment_expression,
+                    target_description,
+                    send_at.isoformat(),
+                    datetime.now(KYIV_TZ).isoformat(),
+                    datetime.now(KYIV_TZ).isoformat(),
+                ),
+            )
 
-        keyboard.append(
-            [
-                InlineKeyboardButton(
-                    day.capitalize(), callback_data=f"t_day_{day_short}_{teacher_id}"
-                )
-            ]
-        )
+            conn.commit()
 
-    keyboard.append([InlineKeyboardButton("⬅️ Назад", callback_data=f"t_menu_{teacher_id}")])
+            logger.info(
+                f"Відкладені оголошення: Створено #{cursor.lastrowid} на {send_at.isoformat()}."
+            )
 
-    return InlineKeyboardMarkup(keyboard)
+            return cursor.lastrowid
 
+    except sqlite3.Error as e:
 
-def get_teacher_week_type_selection_keyboard(
-    day_short: str, teacher_id: int
-) -> InlineKeyboardMarkup:
-    """Створює клавіатуру вибору типу тижня для розкладу викладача."""
+        logger.error(f"Відкладені оголошення: Помилка створення: {e}")
 
-    keyboard = [
-        [InlineKeyboardButton("Чисельник", callback_data=f"t_week_num_{day_short}_{teacher_id}")],
-        [InlineKeyboardButton("Знаменник", callback_data=f"t_week_den_{day_short}_{teacher_id}")],
-        [InlineKeyboardButton("⬅️ Назад", callback_data=f"t_day_schedule_{teacher_id}")],
-    ]
+        return None
 
-    return InlineKeyboardMarkup(keyboard)
 
+def get_scheduled_announcement(announcement_id: int) -> dict | None:
 
-# --- ОБРОБНИКИ ДЛЯ РОЗКЛАДУ ВИКЛАДАЧА ---
+    try:
 
+        with connect_db() as conn:
 
-async def teacher_my_schedule_handler(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
-    """Показує меню розкладу викладача."""
+            conn.row_factory = sqlite3.Row
 
-    query = update.callback_query
+            row = conn.execute(
+                "SELECT * FROM scheduled_announcements WHERE id = ?", (announcement_id,)
+            ).fetchone()
 
-    if not query or not query.from_user:
+            return dict(row) if row else None
 
-        logger.warning("teacher_my_schedule_handler викликано без query або from_user")
+    except sqlite3.Error as e:
 
-        return
+        logger.error(f"Відкладені оголошення: Помилка читання #{announcement_id}: {e}")
 
-    # Отримуємо teacher_id з callback_data або з user.id
+        return None
 
-    callback_data = query.data
 
-    if callback_data and callback_data.startswith("t_menu_"):
+def get_scheduled_announcements(only_pending: bool = False, limit: int = 10) -> list[dict]:
+    """Останні відкладені оголошення (або лише ті, що ще чекають на відправку)."""
 
-        teacher_id = int(callback_data.replace("t_menu_", ""))
+    where_sql = "WHERE status = 'scheduled'" if only_pending else ""
 
-    else:
+    order_sql = "ORDER BY send_at" if only_pending else "ORDER BY id DESC"
 
-        teacher_id = query.from_user.id
+    try:
 
-    teacher_data = get_teacher_data_from_db(teacher_id)
+        with connect_db() as conn:
 
-    if not teacher_data:
+            conn.row_factory = sqlite3.Row
 
-        await query.answer("Ви не зареєстровані як викладач.", show_alert=True)
+            rows = conn.execute(
+                f"SELECT * FROM scheduled_announcements {where_sql} {order_sql} LIMIT ?", (limit,)
+            ).fetchall()
 
-        return
+            return [dict(row) for row in rows]
 
-    teacher_name = teacher_data.get("full_name", "")
+    except sqlite3.Error as e:
 
-    if not teacher_name:
+        logger.error(f"Відкладені оголошення: Помилка читання списку: {e}")
 
-        await query.answer("У вас не вказано повне ім'я.", show_alert=True)
+        return []
 
-        return
 
-    text = f"👨‍🏫 Меню розкладу для *{teacher_name}*\n\nОберіть тип розкладу:"
+def update_scheduled_announcement(announcement_id: int, **fields) -> bool:
+    """Оновлює message_text / send_at / status / broadcast_job_id відкладеного оголошення."""
 
-    reply_markup = get_teacher_schedule_menu_keyboard(teacher_id)
+    allowed_fields = {"message_text", "send_at", "status", "broadcast_job_id"}
 
-    await query.edit_message_text(text, reply_markup=reply_markup, parse_mode="Markdown")
+    fields = {key: value for key, value in fields.items() if key in allowed_fields}
 
+    if not fields:
 
-# ДОДАНО: обробник вибору курсу викладачем для перегляду будь-якої групи
+        return False
 
+    if isinstance(fields.get("send_at"), datetime):
 
-async def teacher_select_course_for_any_group_handler(
-    update: Update, context: ContextTypes.DEFAULT_TYPE
-) -> None:
+        fields["send_at"] = fields["send_at"].isoformat()
 
-    query = update.callback_query
+    fields["updated_at"] = datetime.now(KYIV_TZ).isoformat()
 
-    if not query or not query.data.startswith("teacher_select_course_"):
+    set_sql = ", ".join(f"{key} = ?" for key in fields)
 
-        return
+    try:
 
-    await query.answer()
+        with connect_db() as conn:
 
-    try:
+            conn.execute(
+                f"UPDATE scheduled_announcements SET {set_sql} WHERE id = ?",
+                tuple(fields.values()) + (announcement_id,),
+            )
 
-        course_number = int(query.data.replace("teacher_select_course_", ""))
+            conn.commit()
 
-    except ValueError:
+        return True
 
-        await query.answer("Невірний курс.", show_alert=True)
+    except sqlite3.Error as e:
 
-        return
+        logger.error(f"Відкладені оголошення: Помилка оновлення #{announcement_id}: {e}")
 
-    text = f"🔍 Оберіть групу для перегляду (курс {course_number}):"
+        return False
 
-    reply_markup = get_teacher_group_selection_keyboard_by_course(course_number)
 
-    await query.edit_message_text(text, reply_markup=reply_markup, parse_mode="Markdown")
+def get_ics_file_id(content_hash: str) -> str | None:
+    """Повертає Telegram file_id вже завантаженого ICS-файлу за хешем вмісту."""
 
+    try:
 
-async def show_teacher_today_schedule_handler(
-    update: Update, context: ContextTypes.DEFAULT_TYPE
-) -> None:
-    """Показує розклад викладача на сьогодні."""
+        with connect_db() as conn:
 
-    query = update.callback_query
+            cursor = conn.cursor()
 
-    if not query or not query.from_user:
+            cursor.execute("SELECT file_id FROM ics_exports WHERE content_hash = ?", (content_hash,))
 
-        logger.warning("show_teacher_today_schedule_handler викликано без query або from_user")
+            row = cursor.fetchone()
 
-        return
+            return row[0] if row else None
 
-    # Отримуємо teacher_id з callback_data
+    except sqlite3.Error as e:
 
-    callback_data = query.data
+        logger.error(f"ICS: Помилка читання file_id для хешу {content_hash}: {e}")
 
-    if not callback_data or not callback_data.startswith("t_today_"):
+        return None
 
-        logger.warning(f"Неправильний callback_data: {callback_data}")
 
-        return
+def save_ics_file_id(content_hash: str, file_id: str) -> None:
 
-    teacher_id = int(callback_data.replace("t_today_", ""))
+    try:
 
-    teacher_data = get_teacher_data_from_db(teacher_id)
+        with connect_db() as conn:
 
-    if not teacher_data:
+            cursor = conn.cursor()
 
-        await query.answer("Викладач не знайдений.", show_alert=True)
+            cursor.execute(
+                "INSERT OR REPLACE INTO ics_exports (content_hash, file_id) VALUES (?, ?)",
+                (content_hash, file_id),
+            )
 
-        return
+            conn.commit()
 
-    teacher_name = teacher_data.get("full_name", "")
+    except sqlite3.Error as e:
 
-    if not teacher_name:
+        logger.error(f"ICS: Помилка збереження file_id для хешу {content_hash}: {e}")
 
-        await query.answer("У викладача не вказано повне ім'я.", show_alert=True)
 
-        return
+def get_cached_schedule():
 
-    # Визначаємо поточний день та тип тижня
+    global schedule_cache, sql_manager
 
-    current_date = datetime.now()
+    if sql_manager is None:
 
-    current_weekday = current_date.weekday()  # 0 = понеділок, 6 = неділя
+        logger.error("SQLManager не ініціалізовано. Неможливо завантажити розклад.")
 
-    days = ["понеділок", "вівторок", "середа", "четвер", "п'ятниця", "субота", "неділя"]
+        return {"розклади_груп": {}, "дзвінки": []}
 
-    current_day = days[current_weekday]
+    if schedule_cache is None:
 
-    current_week_type = get_current_week_type_for_schedule(current_date)
+        logger.info("Кеш розкладу порожній. Завантаження з бази даних через SQLManager...")
 
-    # Генеруємо розклад на сьогодні
+        try:
 
-    schedule_text = get_teacher_schedule_for_day(teacher_name, current_day, current_week_type)
+            with span("sql_manager.get_info", "schedule_db"):
 
-    reply_markup = InlineKeyboardMarkup(
-        [[InlineKeyboardButton("⬅️ Назад до меню розкладу", callback_data=f"t_menu_{teacher_id}")]]
-    )
+                schedule_cache = sql_manager.get_info()
 
-    await query.edit_message_text(schedule_text, reply_markup=reply_markup, parse_mode="Markdown")
+            if (
+                not schedule_cache
+                or "розклади_груп" not in schedule_cache
+                or "дзвінки" not in schedule_cache
+            ):
 
+                logger.error("SQLManager.get_info() повернув некоректні або неповні дані.")
 
-async def show_teacher_full_schedule_handler(
-    update: Update, context: ContextTypes.DEFAULT_TYPE
-) -> None:
-    """Показує повний розклад викладача на тиждень."""
+                schedule_cache = {"розклади_груп": {}, "дзвінки": []}
 
-    query = update.callback_query
+            else:
 
-    if not query or not query.from_user:
+                logger.info("Розклад успішно завантажено з БД та кешовано.")
 
-        logger.warning("show_teacher_full_schedule_handler викликано без query або from_user")
+        except Exception as e:
 
-        return
+            logger.error(f"Помилка завантаження розкладу з БД через SQLManager: {e}", exc_info=True)
 
-    # Отримуємо teacher_id з callback_data
+            schedule_cache = {"розклади_груп": {}, "дзвінки": []}
 
-    callback_data = query.data
+        _rebuild_schedule_indexes()
 
-    if not callback_data or not callback_data.startswith("t_full_"):
+    return schedule_cache
 
-        logger.warning(f"Неправильний callback_data: {callback_data}")
 
-        return
+def clear_schedule_cache_data():
 
-    teacher_id = int(callback_data.replace("t_full_", ""))
+    global schedule_cache
 
-    teacher_data = get_teacher_data_from_db(teacher_id)
+    schedule_cache = None
 
-    if not teacher_data:
+    _invalidate_schedule_derived_caches()
 
-        await query.answer("Викладач не знайдений.", show_alert=True)
+    logger.info("Кеш розкладу очищено. Наступний запит оновить його з БД.")
 
-        return
 
-    teacher_name = teacher_data.get("full_name", "")
+# --- Похідні кеші розкладу (рендери та індекси) ---
 
-    if not teacher_name:
 
-        await query.answer("У викладача не вказано повне ім'я.", show_alert=True)
+def _invalidate_schedule_derived_caches() -> None:
+    """Скидає всі кеші, побудовані поверх знімку розкладу."""
 
-        return
+    global schedule_cache_version, schedule_prefix_index, bell_timeline, bell_slots
 
-    # Генеруємо повний розклад
+    schedule_cache_version += 1
 
-    schedule_text = get_full_teacher_schedule(teacher_name)
+    schedule_render_cache.clear()
 
-    reply_markup = InlineKeyboardMarkup(
-        [[InlineKeyboardButton("⬅️ Назад до меню розкладу", callback_data=f"t_menu_{teacher_id}")]]
-    )
+    schedule_prefix_index = []
 
-    await query.edit_message_text(schedule_text, reply_markup=reply_markup, parse_mode="Markdown")
+    bell_timeline = []
 
+    bell_slots = []
 
-async def show_teacher_day_schedule_handler(
-    update: Update, context: ContextTypes.DEFAULT_TYPE
-) -> None:
-    """Показує меню вибору дня тижня для розкладу викладача."""
+    now_slot_renders.clear()
 
-    query = update.callback_query
+    teacher_index_entries.clear()
 
-    if not query or not query.from_user:
+    teacher_trigram_index.clear()
 
-        logger.warning("show_teacher_day_schedule_handler викликано без query або from_user")
+    teacher_lessons_by_schedule_name.clear()
 
-        return
+    schedule_conflicts.clear()
 
-    # Отримуємо teacher_id з callback_data
 
-    callback_data = query.data
+def _rebuild_schedule_indexes() -> None:
+    """Перебудовує індекси після завантаження нового знімку розкладу."""
 
-    if not callback_data or not callback_data.startswith("t_day_schedule_"):
+    global schedule_prefix_index
 
-        logger.warning(f"Неправильний callback_data: {callback_data}")
+    _invalidate_schedule_derived_caches()
 
-        return
+    schedule_prefix_index = build_schedule_prefix_index(schedule_cache or {})
 
-    teacher_id = int(callback_data.replace("t_day_schedule_", ""))
+    build_bell_timeline(schedule_cache or {})
 
-    teacher_data = get_teacher_data_from_db(teacher_id)
+    build_teacher_name_index(schedule_cache or {})
 
-    if not teacher_data:
+    schedule_conflicts.extend(find_schedule_conflicts(schedule_cache or {}))
 
-        await query.answer("Викладач не знайдений.", show_alert=True)
+    if schedule_conflicts:
 
-        return
+        logger.warning(
+            f"Розклад: виявлено {len(schedule_conflicts)} конфліктів (викладач/аудиторія зайняті "
+            f"одночасно в кількох групах). Деталі: /schedule_conflicts"
+        )
 
-    teacher_name = teacher_data.get("full_name", "")
+    logger.info(
+        f"Індекси розкладу перебудовано (версія {schedule_cache_version}, "
+        f"{len(schedule_prefix_index)} ключів пошуку)."
+    )
 
-    if not teacher_name:
 
-        await query.answer("У викладача не вказано повне ім'я.", show_alert=True)
+def get_cached_render(view: str, key: tuple, builder) -> str:
+    """Повертає готовий текст з кешу рендерів або будує його через builder()."""
 
-        return
+    get_cached_schedule()
 
-    text = f"👨‍🏫 Оберіть день тижня для розкладу *{teacher_name}*:"
+    cache_key = (view,) + tuple(key)
 
-    reply_markup = get_teacher_day_selection_keyboard(teacher_id)
+    rendered = schedule_render_cache.get(cache_key)
 
-    await query.edit_message_text(text, reply_markup=reply_markup, parse_mode="Markdown")
+    view_stats = schedule_render_stats.setdefault(view, {"hits": 0, "misses": 0})
 
+    if rendered is None:
 
-async def show_teacher_specific_day_schedule_handler(
-    update: Update, context: ContextTypes.DEFAULT_TYPE
-) -> None:
-    """Показує меню вибору типу тижня для конкретного дня."""
+        view_stats["misses"] += 1
 
-    query = update.callback_query
+        with span(f"render:{view}", "render"):
 
-    if not query or not query.from_user:
+            rendered = builder()
 
-        logger.warning(
-            "show_teacher_specific_day_schedule_handler викликано без query або from_user"
-        )
+        schedule_render_cache[cache_key] = rendered
 
-        return
+    else:
 
-    user = query.from_user
+        view_stats["hits"] += 1
 
-    teacher_data = get_teacher_data_from_db(user.id)
+    return rendered
 
-    if not teacher_data:
 
-        await query.answer("Ви не зареєстровані як викладач.", show_alert=True)
+def normalize_search_key(text: str) -> str:
+    """Нормалізує рядок для пошуку: нижній регістр, без зайвих пробілів та апострофів."""
 
-        return
+    if not text:
 
-    teacher_name = teacher_data.get("full_name", "")
+        return ""
 
-    if not teacher_name:
+    text = text.lower().replace("’", "'").replace("ʼ", "'").replace("`", "'")
 
-        await query.answer("У вас не вказано повне ім'я.", show_alert=True)
+    return " ".join(text.split())
 
-        return
 
-    # Отримуємо дані з callback_data
+def build_schedule_prefix_index(schedule_data: dict) -> list[tuple[str, str, str]]:
+    """Будує відсортований індекс груп і викладачів для пошуку за префіксом."""
 
-    callback_data = query.data
+    entries = set()
 
-    if not callback_data or not callback_data.startswith("t_day_"):
+    for group_name, group_data in schedule_data.get("розклади_груп", {}).items():
 
-        logger.warning(f"Неправильний callback_data: {callback_data}")
+        entries.add((normalize_search_key(group_name), "group", group_name))
 
-        return
+        # Група також шукається без дефісів: "кн2124" -> "КН-21-24"
 
-    # Формат: t_day_{day_short}_{teacher_id}
+        entries.add((normalize_search_key(group_name).replace("-", ""), "group", group_name))
 
-    parts = callback_data.split("_")
+        for day_lessons in (group_data or {}).get("тиждень", {}).values():
 
-    if len(parts) < 4:
+            if not isinstance(day_lessons, list):
 
-        logger.warning(f"Неправильний формат callback_data: {callback_data}")
+                continue
 
-        return
+            for lesson in day_lessons:
 
-    day_short = parts[2]  # Коротка назва дня
+                teacher = (lesson.get("викладач") or "").strip() if isinstance(lesson, dict) else ""
 
-    teacher_id = int(parts[3])  # ID викладача
+                if teacher and teacher != "-":
 
-    # Переводимо коротку назву в повну
+                    entries.add((normalize_search_key(teacher), "teacher", teacher))
 
-    day_names = {
-        "mon": "понеділок",
-        "tue": "вівторок",
-        "wed": "середа",
-        "thu": "четвер",
-        "fri": "п'ятниця",
-        "sat": "субота",
-        "sun": "неділя",
-    }
+    return sorted(entries)
 
-    day_name = day_names.get(day_short, day_short)
 
-    text = f"👨‍🏫 Оберіть тип тижня для *{day_name}* (*{teacher_name}*):"
+def build_bell_timeline(schedule_data: dict) -> None:
+    """Будує відсортовану шкалу дзвінків і заздалегідь рендерить пари по слотах."""
 
-    reply_markup = get_teacher_week_type_selection_keyboard(day_short, teacher_id)
+    global bell_timeline, bell_slots
 
-    await query.edit_message_text(text, reply_markup=reply_markup, parse_mode="Markdown")
+    slots = []
 
+    for call in schedule_data.get("дзвінки", []):
 
-async def show_teacher_final_day_schedule_handler(
-    update: Update, context: ContextTypes.DEFAULT_TYPE
-) -> None:
-    """Показує фінальний розклад викладача на конкретний день та тип тижня."""
+        time_range = parse_lesson_time_range(f"{call.get('початок')}-{call.get('кінець')}")
 
-    query = update.callback_query
+        if not time_range:
 
-    if not query or not query.from_user:
+            continue
 
-        logger.warning("show_teacher_final_day_schedule_handler викликано без query або from_user")
+        (h1, m1), (h2, m2) = time_range
 
-        return
+        slots.append((h1 * 60 + m1, h2 * 60 + m2, str(call.get("пара", "?"))))
 
-    user = query.from_user
+    slots.sort()
 
-    teacher_data = get_teacher_data_from_db(user.id)
+    bell_slots = slots
 
-    if not teacher_data:
+    bell_timeline = [minute for start, end, _ in slots for minute in (start, end)]
 
-        await query.answer("Ви не зареєстровані як викладач.", show_alert=True)
+    slot_starts = [start for start, _, _ in slots]
+
+    now_slot_renders.clear()
+
+    if not slots:
 
         return
 
-    teacher_name = teacher_data.get("full_name", "")
+    for group_name, group_data in schedule_data.get("розклади_груп", {}).items():
 
-    if not teacher_name:
+        for day_name, day_lessons in (group_data or {}).get("тиждень", {}).items():
 
-        await query.answer("У вас не вказано повне ім'я.", show_alert=True)
+            if not isinstance(day_lessons, list):
 
-        return
+                continue
 
-    # Отримуємо дані з callback_data
+            for week_type in ("чисельник", "знаменник"):
 
-    callback_data = query.data
+                lines = [None] * len(slots)
 
-    if not callback_data or not callback_data.startswith("t_week_"):
+                for lesson in day_lessons:
 
-        logger.warning(f"Неправильний callback_data: {callback_data}")
+                    if not isinstance(lesson, dict):
 
-        return
+                        continue
 
-    # Формат: t_week_{num/den}_{day_short}_{teacher_id}
+                    lesson_type = (lesson.get("тип_тижня") or "завжди").lower()
 
-    parts = callback_data.split("_")
+                    name = (lesson.get("назва") or "").strip()
 
-    if len(parts) < 5:
+                    if lesson_type not in ("завжди", week_type) or not name:
 
-        logger.warning(f"Неправильний формат callback_data: {callback_data}")
+                        continue
 
-        return
+                    if name.lower() == "немає пари":
 
-    week_type_short = parts[2]  # num або den
+                        continue
 
-    day_short = parts[3]  # Коротка назва дня
+                    time_range = parse_lesson_time_range(lesson.get("час"))
 
-    teacher_id = int(parts[4])  # ID викладача
+                    if not time_range:
 
-    # Переводимо короткі назви в повні
+                        continue
 
-    week_type = "чисельник" if week_type_short == "num" else "знаменник"
+                    (h1, m1), _ = time_range
 
-    day_names = {
-        "mon": "понеділок",
-        "tue": "вівторок",
-        "wed": "середа",
-        "thu": "четвер",
-        "fri": "п'ятниця",
-        "sat": "субота",
-        "sun": "неділя",
-    }
+                    slot_idx = bisect.bisect_right(slot_starts, h1 * 60 + m1) - 1
 
-    day_name = day_names.get(day_short, day_short)
+                    if 0 <= slot_idx < len(slots):
 
-    # Генеруємо розклад
+                        # Підгрупи/паралельні пари в одному слоті показуємо всі
 
-    schedule_text = get_teacher_schedule_for_day(teacher_name, day_name, week_type)
+                        details = format_lesson_details(lesson)
 
-    reply_markup = InlineKeyboardMarkup(
-        [[InlineKeyboardButton("⬅️ Назад до меню розкладу", callback_data=f"t_menu_{teacher_id}")]]
-    )
+                        lines[slot_idx] = (
+                            f"{lines[slot_idx]} / {details}" if lines[slot_idx] else details
+                        )
 
-    await query.edit_message_text(schedule_text, reply_markup=reply_markup, parse_mode="Markdown")
+                # Для кожного слота - індекс найближчої пари, що ще не почалася (або None)
 
+                next_idx = [None] * (len(slots) + 1)
 
-async def teacher_view_group_schedule_handler(
-    update: Update, context: ContextTypes.DEFAULT_TYPE
-) -> None:
+                for idx in range(len(slots) - 1, -1, -1):
 
-    query = update.callback_query
+                    next_idx[idx] = idx if lines[idx] else next_idx[idx + 1]
 
-    if not query or not query.from_user:
+                now_slot_renders[(group_name, day_name, week_type)] = (lines, next_idx)
 
-        logger.warning("teacher_view_group_schedule_handler викликано без query або from_user")
 
-        return
+def teacher_match_key(name: str) -> str:
+    """Канонічний ключ викладача: прізвище + ініціали ("Коваль Іван Петрович" і "Коваль І.П." -> "коваль іп")."""
 
-    # Отримуємо назву групи з callback_data
+    tokens = normalize_search_key(str(name or "").replace(".", " ")).split()
 
-    callback_data = query.data
+    if not tokens:
 
-    if not callback_data or not callback_data.startswith("teacher_view_group_"):
+        return ""
 
-        logger.warning(f"Неправильний callback_data: {callback_data}")
+    return " ".join([tokens[0], "".join(token[0] for token in tokens[1:])]).strip()
 
-        return
 
-    group_name = callback_data.replace("teacher_view_group_", "")
+def name_trigrams(text: str) -> frozenset:
 
-    group_schedule_data = get_schedule_data_for_group(group_name)
+    padded = f"  {text} "
 
-    if not group_schedule_data:
+    return frozenset(padded[i : i + 3] for i in range(len(padded) - 2))
 
-        await query.answer(f"На жаль, розклад для групи {group_name} не знайдено.", show_alert=True)
 
-        return
+def _load_teacher_names_from_db() -> list[str]:
 
-    # Зберігаємо групу в контексті для подальшого використання
+    try:
 
-    if context.user_data is None:
+        with connect_db() as conn:
 
-        context.user_data = {}
+            return [row[0] for row in conn.execute("SELECT full_name FROM teachers") if row[0]]
 
-    context.user_data["teacher_viewing_group"] = group_name
+    except sqlite3.Error as e:
 
-    context.user_data["teacher_viewing_any_group"] = True
+        logger.error(f"Індекс викладачів: Помилка читання таблиці teachers: {e}")
 
-    text = f"📅 Меню розкладу для групи: *{group_name}*.\nОберіть пункт:"
+        return []
 
-    reply_markup = get_schedule_menu_keyboard(group_name)
 
-    await query.edit_message_text(text, reply_markup=reply_markup, parse_mode="Markdown")
+def build_teacher_name_index(schedule_data: dict) -> None:
+    """
+    Будує триграмний індекс викладачів та групує їхні пари за іменем з розкладу.
 
+    Індексуються лише імена з розкладу; ПІБ з таблиці teachers приєднується до найсхожішого
+    з них (інакше варіант написання з БД знаходив би сам себе без жодної пари).
 
-def get_schedule_menu_keyboard(user_group: str | None) -> InlineKeyboardMarkup:
+    """
 
-    if not user_group:
+    global teacher_index_version
 
-        return InlineKeyboardMarkup(
-            [
-                [
-                    InlineKeyboardButton(
-                        "Будь ласка, спочатку оберіть групу",
-                        callback_data="change_set_group_prompt",
-                    )
-                ],
-                [
-                    InlineKeyboardButton(
-                        "⬅️ Назад до головного меню", callback_data="back_to_main_menu"
-                    )
-                ],
-            ]
-        )
+    teacher_index_version += 1
 
-    buttons = [
-        [
-            InlineKeyboardButton("Сьогодні", callback_data="get_schedule_today"),
-            InlineKeyboardButton("Завтра", callback_data="get_schedule_tomorrow"),
-        ],
-        [
-            InlineKeyboardButton(
-                "Обрати день (поточний тиждень)", callback_data="show_day_schedule_menu"
-            )
-        ],
-        [
-            InlineKeyboardButton(
-                "Обрати день + тип тижня", callback_data="select_specific_day_and_type"
-            )
-        ],
-        [InlineKeyboardButton("Розклад дзвінків", callback_data="get_call_schedule")],
-        [InlineKeyboardButton("Повний розклад (по групі)", callback_data="get_full_schedule_all")],
-        [InlineKeyboardButton("⬅️ Назад до головного меню", callback_data="back_to_main_menu")],
-    ]
+    teacher_index_entries.clear()
 
-    return InlineKeyboardMarkup(buttons)
+    teacher_trigram_index.clear()
 
+    teacher_lessons_by_schedule_name.clear()
 
-def get_day_schedule_menu_keyboard() -> InlineKeyboardMarkup:
+    entries_by_key = {}
 
-    return InlineKeyboardMarkup(
-        [
-            [
-                InlineKeyboardButton("Пн", callback_data="get_schedule_day_понеділок"),
-                InlineKeyboardButton("Вт", callback_data="get_schedule_day_вівторок"),
-                InlineKeyboardButton("Ср", callback_data="get_schedule_day_середа"),
-            ],
-            [
-                InlineKeyboardButton("Чт", callback_data="get_schedule_day_четвер"),
-                InlineKeyboardButton("Пт", callback_data="get_schedule_day_п'ятниця"),
-            ],
-            [InlineKeyboardButton("⬅️ Назад до меню розкладу", callback_data="show_schedule_menu")],
-        ]
-    )
+    def get_entry(name: str) -> dict | None:
 
+        key = teacher_match_key(name)
 
-def get_specific_day_selection_keyboard() -> InlineKeyboardMarkup:
+        if not key:
 
-    keyboard = [
-        [
-            InlineKeyboardButton("Пн", callback_data="chose_day_понеділок"),
-            InlineKeyboardButton("Вт", callback_data="chose_day_вівторок"),
-            InlineKeyboardButton("Ср", callback_data="chose_day_середа"),
-        ],
-        [
-            InlineKeyboardButton("Чт", callback_data="chose_day_четвер"),
-            InlineKeyboardButton("Пт", callback_data="chose_day_п'ятниця"),
-        ],
-        [InlineKeyboardButton("⬅️ Назад до меню розкладу", callback_data="show_schedule_menu")],
-    ]
+            return None
 
-    return InlineKeyboardMarkup(keyboard)
+        if key not in entries_by_key:
 
+            entries_by_key[key] = {
+                "key": key,
+                "display_name": name,
+                "schedule_names": set(),
+                "db_names": set(),
+                "trigrams": name_trigrams(key),
+                "surname_trigrams": name_trigrams(key.split()[0]),
+            }
 
-def get_week_type_selection_keyboard(day_name: str) -> InlineKeyboardMarkup:
+        return entries_by_key[key]
 
-    keyboard = [
-        [
-            InlineKeyboardButton(
-                "Чисельник", callback_data=f"show_day_explicit_{day_name}_чисельник"
-            )
-        ],
-        [
-            InlineKeyboardButton(
-                "Знаменник", callback_data=f"show_day_explicit_{day_name}_знаменник"
-            )
-        ],
-        [
-            InlineKeyboardButton(
-                "⬅️ Назад до вибору дня", callback_data="select_specific_day_and_type"
-            )
-        ],
-    ]
+    for group_name, group_data in schedule_data.get("розклади_груп", {}).items():
 
-    return InlineKeyboardMarkup(keyboard)
+        for day_name, day_lessons in (group_data or {}).get("тиждень", {}).items():
 
+            if not isinstance(day_lessons, list):
 
-def get_raffle_menu_keyboard(user_id: int) -> InlineKeyboardMarkup:
+                continue
 
-    buttons = []
+            for lesson in day_lessons:
 
-    user_is_participant = get_raffle_participant_status(user_id)
+                if not isinstance(lesson, dict):
 
-    if user_is_participant:
+                    continue
 
-        buttons.append(
-            [
-                InlineKeyboardButton(
-                    "✅ Ви вже берете участь!", callback_data="raffle_already_joined"
-                )
-            ]
-        )
+                lesson_teacher = (lesson.get("викладач") or "").strip()
 
-    else:
+                if not lesson_teacher or lesson_teacher == "-":
 
-        buttons.append(
-            [
-                InlineKeyboardButton(
-                    "🎉 Взяти участь у розіграші", callback_data="raffle_join_prompt"
-                )
-            ]
-        )
+                    continue
 
-    buttons.append(
-        [InlineKeyboardButton("⬅️ Назад до головного меню", callback_data="back_to_main_menu")]
-    )
+                entry = get_entry(lesson_teacher)
 
-    return InlineKeyboardMarkup(buttons)
+                if entry is None:
 
+                    continue
 
-def get_raffle_join_confirmation_keyboard() -> InlineKeyboardMarkup:
+                entry["schedule_names"].add(lesson_teacher)
 
-    return InlineKeyboardMarkup(
-        [
-            [InlineKeyboardButton("Так, підтверджую", callback_data="raffle_confirm_join")],
-            [InlineKeyboardButton("Скасувати", callback_data="back_to_raffle_menu")],
-        ]
-    )
+                subject_name = (lesson.get("назва") or "").strip()
 
+                if subject_name.lower() in ["виховна година", "виховна", ""]:
 
-def get_raffle_referral_success_keyboard() -> InlineKeyboardMarkup:
+                    continue
 
-    return InlineKeyboardMarkup(
-        [
-            [InlineKeyboardButton("🎉 Продовжити", callback_data="raffle_continue_after_referral")],
-            [
-                InlineKeyboardButton(
-                    "⬅️ Назад до меню розіграшу", callback_data="back_to_raffle_menu"
+                lesson_with_group = lesson.copy()
+
+                lesson_with_group["група"] = group_name
+
+                lesson_with_group["день"] = day_name
+
+                teacher_lessons_by_schedule_name.setdefault(lesson_teacher, []).append(
+                    lesson_with_group
                 )
-            ],
-        ]
-    )
 
+    for idx, entry in enumerate(sorted(entries_by_key.values(), key=lambda e: e["key"])):
 
-def get_back_to_raffle_menu_keyboard() -> InlineKeyboardMarkup:
+        teacher_index_entries.append(entry)
 
-    return InlineKeyboardMarkup(
-        [[InlineKeyboardButton("⬅️ Назад до меню розіграшу", callback_data="back_to_raffle_menu")]]
-    )
+        for trigram in entry["trigrams"]:
 
+            teacher_trigram_index.setdefault(trigram, []).append(idx)
 
-def get_admin_panel_keyboard() -> InlineKeyboardMarkup:
+    for full_name in _load_teacher_names_from_db():
 
-    keyboard = [
-        [InlineKeyboardButton("📢 Оголошення", callback_data="admin_announce_start")],
-        [InlineKeyboardButton("🖥️ Статус сервера", callback_data="admin_server_status")],
-        [InlineKeyboardButton("⚙️ Режим обслуговування", callback_data="admin_maintenance_menu")],
-        [InlineKeyboardButton("📬 Переглянути DLQ", callback_data="view_dlq_callback")],
-        [InlineKeyboardButton("🗑️ Очистити DLQ", callback_data="admin_clear_dlq")],
-        [InlineKeyboardButton("📊 Статистика бота", callback_data="admin_show_stats")],
-        # [InlineKeyboardButton("📢 Оголошення", callback_data='admin_announce_start')],  <-- Я ВИДАЛИВ ДУБЛІКАТ
-        [InlineKeyboardButton("👨‍🏫 Керування викладачами", callback_data="admin_manage_teachers")],
-        [
-            InlineKeyboardButton(
-                "🔄 Очистити кеш розкладу (пам'ять)", callback_data="admin_clear_schedule_cache"
-            )
-        ],
-        [
-            InlineKeyboardButton(
-                "🔄 Перезавантажити розклад з JSON", callback_data="admin_reload_schedule_json"
-            )
-        ],
-        [
-            InlineKeyboardButton(
-                "📥 Завантажити локальну БД (користувачі)", callback_data="admin_download_local_db"
-            )
-        ],
-        # [InlineKeyboardButton("🏆 Обрати переможця розіграшу", callback_data='admin_pick_raffle_winner')] <-- І КНОПКУ РОЗІГРАШУ
-    ]
-
-    if ENABLE_FTP_SYNC:
+        entry = entries_by_key.get(teacher_match_key(full_name))
 
-        keyboard.append(
-            [
-                InlineKeyboardButton(
-                    "💾 Завантажити БД користувачів на FTP", callback_data="admin_upload_db_to_ftp"
-                )
-            ]
-        )
+        if entry is None:
 
-    keyboard.append(
-        [InlineKeyboardButton("⬅️ Назад до головного меню", callback_data="back_to_main_menu")]
-    )
+            matches = rank_teacher_entries(full_name, limit=1)
 
-    return InlineKeyboardMarkup(keyboard)
+            if not matches:
 
+                continue  # Викладача немає в розкладі - зв'язувати нема з чим
 
-# ЗАМІНІТЬ СТАРУ ФУНКЦІЮ get_group_selection_keyboard НА ЦЮ
+            entry = teacher_index_entries[matches[0][0]]
 
+        entry["db_names"].add(full_name)
 
-def get_group_selection_keyboard(
-    page: int = 0, page_size: int = 9, registration_flow: bool = False, selected_course: int = None
-) -> InlineKeyboardMarkup:
+        entry["display_name"] = full_name  # Повне ім'я з БД інформативніше
 
-    all_groups = get_all_group_names_from_cache()
 
-    if not all_groups:
+def refresh_teacher_name_index() -> None:
+    """Перебудовує індекс викладачів після змін у таблиці teachers і скидає рендери викладачів."""
 
-        # Кнопка "Назад" тут також має бути динамічною
+    if schedule_cache is None:
 
-        back_button = (
-            InlineKeyboardButton(
-                "⬅️ Назад до вибору курсу", callback_data="back_to_course_selection"
-            )
-            if registration_flow
-            else InlineKeyboardButton("⬅️ Назад", callback_data="back_to_main_menu")
-        )
+        return
 
-        return InlineKeyboardMarkup(
-            [
-                [InlineKeyboardButton("Немає доступних груп", callback_data="no_groups_available")],
-                [back_button],
-            ]
-        )
+    build_teacher_name_index(schedule_cache)
 
-    # Фільтруємо групи за курсом, якщо він вказаний
+    for cache_key in [key for key in schedule_render_cache if key[0] in TEACHER_RENDER_VIEWS]:
 
-    if selected_course is not None:
+        schedule_render_cache.pop(cache_key, None)
 
-        # Визначаємо рік за курсом: 1 курс = 25, 2 курс = 24, 3 курс = 23, 4 курс = 22
 
-        course_year_map = {1: "25", 2: "24", 3: "23", 4: "22"}
+def search_teachers_fuzzy(query: str, limit: int = 5, threshold: float | None = None) -> list[tuple[int, float]]:
+    """Повертає [(індекс запису, оцінка)] за спаданням схожості (коефіцієнт Жаккара по триграмах)."""
 
-        target_year = course_year_map.get(selected_course, "25")
+    get_cached_schedule()
 
-        # Фільтруємо групи, що закінчуються на рік або містять рік з підгрупами
+    return rank_teacher_entries(query, limit, threshold)
 
-        filtered_groups = [
-            group
-            for group in all_groups
-            if group.endswith(f"-{target_year}") or f"-{target_year} (" in group
-        ]
 
-        all_groups = filtered_groups
+def rank_teacher_entries(query: str, limit: int = 5, threshold: float | None = None) -> list[tuple[int, float]]:
+    """Ранжування за поточним індексом без перевірки актуальності розкладу."""
 
-    if not all_groups:
+    if threshold is None:
 
-        back_button = (
-            InlineKeyboardButton(
-                "⬅️ Назад до вибору курсу", callback_data="back_to_course_selection"
-            )
-            if registration_flow
-            else InlineKeyboardButton("⬅️ Назад", callback_data="back_to_main_menu")
-        )
+        threshold = TEACHER_MATCH_THRESHOLD
 
-        return InlineKeyboardMarkup(
-            [
-                [
-                    InlineKeyboardButton(
-                        f"Немає груп для {selected_course} курсу",
-                        callback_data="no_groups_available",
-                    )
-                ],
-                [back_button],
-            ]
-        )
+    query_key = teacher_match_key(query)
 
-    display_page_size = 50
+    if not query_key:
 
-    groups_on_page = all_groups[0:display_page_size]
+        return []
 
-    keyboard = []
+    query_trigrams = name_trigrams(query_key)
 
-    row = []
+    shared_counts = {}
 
-    for group_name in groups_on_page:
+    for trigram in query_trigrams:
 
-        row.append(InlineKeyboardButton(group_name, callback_data=f"set_group_{group_name}"))
+        for idx in teacher_trigram_index.get(trigram, ()):
 
-        if len(row) == 3:
+            shared_counts[idx] = shared_counts.get(idx, 0) + 1
 
-            keyboard.append(row)
+    scored = []
 
-            row = []
+    for idx, shared in shared_counts.items():
 
-    if row:
+        entry = teacher_index_entries[idx]
 
-        keyboard.append(row)
+        score = shared / (len(query_trigrams) + len(entry["trigrams"]) - shared)
 
-    # Ось ключова зміна: ми обираємо кнопку "Назад" залежно від контексту
+        # Запит лише з прізвища порівнюємо також з прізвищем
 
-    # ... всередині get_group_selection_keyboard()
+        if " " not in query_key:
 
-    if registration_flow:
+            surname_shared = len(query_trigrams & entry["surname_trigrams"])
 
-        # Під час реєстрації кнопка повертає до вибору курсу
+            score = max(
+                score,
+                surname_shared
+                / (len(query_trigrams) + len(entry["surname_trigrams"]) - surname_shared),
+            )
 
-        keyboard.append(
-            [
-                InlineKeyboardButton(
-                    "⬅️ Назад до вибору курсу", callback_data="back_to_course_selection"
-                )
-            ]
-        )
+        if score >= threshold:
 
-    else:
+            scored.append((idx, score))
 
-        # Додаємо кнопку для повернення на самий початок
+    scored.sort(key=lambda item: (-item[1], teacher_index_entries[item[0]]["key"]))
 
-        keyboard.append(
-            [
-                InlineKeyboardButton(
-                    "↩️ Почати реєстрацію з початку", callback_data="back_to_role_selection"
-                )
-            ]
-        )
+    return scored[:limit]
 
-        # При зміні групи з головного меню, кнопка повертає в головне меню
 
-        keyboard.append([InlineKeyboardButton("⬅️ Скасувати", callback_data="back_to_main_menu")])
+def resolve_teacher_name(name: str) -> tuple[dict, float] | None:
+    """Найкращий збіг викладача в індексі або None, якщо схожість нижча за поріг."""
 
-    return InlineKeyboardMarkup(keyboard)
+    matches = search_teachers_fuzzy(name, limit=1)
 
+    if not matches:
 
-def get_back_to_schedule_menu_keyboard() -> InlineKeyboardMarkup:
+        return None
 
-    return InlineKeyboardMarkup(
-        [[InlineKeyboardButton("⬅️ Назад до меню розкладу", callback_data="show_schedule_menu")]]
-    )
+    idx, score = matches[0]
 
+    return teacher_index_entries[idx], score
 
-def get_back_to_teacher_menu_keyboard() -> InlineKeyboardMarkup:
 
-    return InlineKeyboardMarkup(
-        [[InlineKeyboardButton("⬅️ Назад до меню викладача", callback_data="back_to_main_menu")]]
-    )
+def format_minutes_range(start: int, end: int) -> str:
+    """(480, 560) -> "08:00-09:20"."""
 
+    return f"{start // 60:02d}:{start % 60:02d}-{end // 60:02d}:{end % 60:02d}"
 
-def get_back_to_main_menu_keyboard() -> InlineKeyboardMarkup:
 
-    return InlineKeyboardMarkup(
-        [[InlineKeyboardButton("⬅️ Назад до головного меню", callback_data="back_to_main_menu")]]
-    )
+def find_schedule_conflicts(schedule_data: dict) -> list[dict]:
+    """
+    Шукає накладки: пари кожного ресурсу (викладач/аудиторія) за день і тиждень сортуються
+    за початком, а інтервали, що перетинаються (навіть частково), об'єднуються в групи.
 
+    Викладач у кількох аудиторіях або аудиторія з кількома викладачами в одній групі
+    перетинів - конфлікт. Спільна пара кількох груп (той самий викладач і аудиторія) - ні.
 
-def get_cancel_profanity_flow_keyboard(flow_type: str) -> InlineKeyboardMarkup:
     """
 
-    Повертає клавіатуру для скасування поточного введення після виявлення нецензурної лексики,
+    occupancy = {}
 
-    та повертає до відповідного головного меню.
+    for group_name, group_data in schedule_data.get("розклади_груп", {}).items():
 
-    'flow_type' має бути 'report', 'suggestion', або 'feedback'.
+        for day_name, day_lessons in (group_data or {}).get("тиждень", {}).items():
 
-    """
+            if not isinstance(day_lessons, list):
 
-    return InlineKeyboardMarkup(
-        [[InlineKeyboardButton("❌ Скасувати", callback_data=f"cancel_{flow_type}_flow")]]
-    )
+                continue
 
+            for lesson in day_lessons:
 
-def get_back_to_admin_panel_keyboard() -> InlineKeyboardMarkup:
+                if not isinstance(lesson, dict):
 
-    return InlineKeyboardMarkup(
-        [[InlineKeyboardButton("⬅️ Назад до адмін-панелі", callback_data="show_admin_panel")]]
-    )
+                    continue
 
+                subject_name = (lesson.get("назва") or "").strip()
 
-def get_maintenance_status_text() -> str:
+                if not subject_name or subject_name.lower() == "немає пари":
 
-    if maintenance_mode_active:
+                    continue
 
-        status = "🟢 *УВІМКНЕНО*"
+                time_range = parse_lesson_time_range(lesson.get("час"))
 
-        msg = maintenance_message
+                if not time_range:
 
-        end_time_str = (
-            maintenance_end_time.strftime("%Y-%m-%d %H:%M:%S %Z")
-            if maintenance_end_time
-            else "не встановлено"
-        )
+                    continue
 
-        time_left_str = ""
+                (h1, m1), (h2, m2) = time_range
 
-        if maintenance_end_time and maintenance_end_time > datetime.now(KYIV_TZ):
+                interval = (h1 * 60 + m1, h2 * 60 + m2)
 
-            remaining_delta = maintenance_end_time - datetime.now(KYIV_TZ)
+                lesson_type = (lesson.get("тип_тижня") or "завжди").lower()
 
-            total_seconds = int(remaining_delta.total_seconds())
+                week_types = ("чисельник", "знаменник") if lesson_type == "завжди" else (lesson_type,)
 
-            days, rem = divmod(total_seconds, 86400)
+                teacher = (lesson.get("викладач") or "").strip()
 
-            hours, rem = divmod(rem, 3600)
+                teacher_key = teacher_match_key(teacher) if teacher not in ("", "-") else ""
 
-            minutes, seconds = divmod(rem, 60)
+                room = str(lesson.get("аудиторія") or "").strip()
 
-            if days > 0:
-                time_left_str = f"{days}д {hours}г {minutes}хв"
+                room_key = room.lower() if room.lower() not in CONFLICT_IGNORED_ROOMS else ""
 
-            elif hours > 0:
-                time_left_str = f"{hours}г {minutes}хв"
+                slot = format_minutes_range(*interval)
 
-            elif minutes > 0:
-                time_left_str = f"{minutes}хв {seconds}с"
+                occurrence = (group_name, teacher, room, subject_name, slot)
 
-            else:
-                time_left_str = f"{seconds}с"
+                for week_type in week_types:
 
-            time_left_str = f" (залишилось: {time_left_str})"
+                    if teacher_key:
 
-        return (
-            f"Статус режиму обслуговування: {status}\n"
-            f'Повідомлення для користувачів: "{msg}"\n'
-            f"Завершується: {end_time_str}{time_left_str}"
-        )
+                        occupancy.setdefault(
+                            ("teacher", teacher_key, day_name, week_type), []
+                        ).append((interval, occurrence))
 
-    else:
+                    if room_key:
 
-        return "Статус режиму обслуговування: 🔴 *ВИМКНЕНО*"
+                        occupancy.setdefault(("room", room_key, day_name, week_type), []).append(
+                            (interval, occurrence)
+                        )
 
+    conflicts = []
 
-def get_server_status_text() -> str:
+    for (kind, _resource_key, day_name, week_type), lessons in occupancy.items():
 
-    try:
+        if len(lessons) < 2:
 
-        cpu_usage = psutil.cpu_percent(interval=0.1)
+            continue
 
-        memory_info = psutil.virtual_memory()
+        lessons.sort(key=lambda lesson: lesson[0])
 
-        memory_usage = memory_info.percent
+        # Групи пар, що перетинаються в часі: наступна починається раніше, ніж закінчилась група
 
-        disk_info = psutil.disk_usage("/")
+        clusters = []
 
-        disk_usage = disk_info.percent
+        for (start, end), occurrence in lessons:
 
-        p = psutil.Process(os.getpid())
+            if clusters and start < clusters[-1]["end"]:
 
-        process_uptime_seconds = time.time() - p.create_time()
+                clusters[-1]["end"] = max(clusters[-1]["end"], end)
 
-        process_uptime_str = str(timedelta(seconds=int(process_uptime_seconds)))
+                clusters[-1]["occurrences"].append(occurrence)
 
-        text = (
-            f"🖥️ *Статус сервера:*\n\n"
-            f"CPU Навантаження: {cpu_usage}%\n"
-            f"Використання RAM: {memory_usage}% (Всього: {memory_info.total // (1024**3)} GB, Використано: {memory_info.used // (1024**2)} MB)\n"
-            f"Використання Диску (/): {disk_usage}% (Всього: {disk_info.total // (1024**3)} GB, Використано: {disk_info.used // (1024**3)} GB)\n"
-            f"Час роботи бота: {process_uptime_str}"
-        )
+            else:
 
-        return text
+                clusters.append({"start": start, "end": end, "occurrences": [occurrence]})
 
-    except Exception as e:
+        for cluster in clusters:
 
-        logger.error(f"Помилка отримання статусу сервера: {e}")
+            occurrences = cluster["occurrences"]
 
-        return "Не вдалося отримати статус сервера."
+            if len(occurrences) < 2:
 
+                continue
 
-def escape_markdown(text: str) -> str:
-    """Escapes common MarkdownV2 special characters."""
+            # Для викладача конфлікт - різні аудиторії, для аудиторії - різні викладачі
 
-    if not text:
+            distinguishing = {
+                (occ[2].lower() if kind == "teacher" else teacher_match_key(occ[1]))
+                for occ in occurrences
+            }
 
-        return ""
+            if len(distinguishing) < 2:
 
-    escape_chars = r"\_*[]()~`>#+-=|{}.!"
+                continue
 
-    return "".join(["\\" + char if char in escape_chars else char for char in text])
+            conflicts.append(
+                {
+                    "kind": kind,
+                    "resource": occurrences[0][1] if kind == "teacher" else occurrences[0][2],
+                    "day": day_name,
+                    "week_type": week_type,
+                    "slot": format_minutes_range(cluster["start"], cluster["end"]),
+                    "occurrences": occurrences,
+                }
+            )
 
+    day_order = {day: idx for idx, day in enumerate(WEEKDAY_NAMES)}
 
-# --- Обробники Команд та Кнопок ---
+    conflicts.sort(
+        key=lambda c: (c["kind"], c["resource"], day_order.get(c["day"], 99), c["slot"], c["week_type"])
+    )
 
+    return conflicts
 
-async def maintenance_menu_page(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
 
-    query = update.callback_query
+def get_schedule_conflicts_formatted(limit: int = 30) -> str:
+    """Звіт про конфлікти розкладу для адміністратора."""
 
-    if query:
-        await query.answer()
+    get_cached_schedule()
 
-    text = get_maintenance_status_text() + "\n\nОберіть дію:"
+    if not schedule_conflicts:
 
-    keyboard_buttons = []
+        return "✅ Конфліктів у розкладі не виявлено."
 
-    if maintenance_mode_active:
+    teacher_count = sum(1 for c in schedule_conflicts if c["kind"] == "teacher")
 
-        keyboard_buttons.append(
-            [InlineKeyboardButton("🔴 Вимкнути зараз", callback_data="maint_disable_now")]
-        )
+    room_count = len(schedule_conflicts) - teacher_count
 
-    else:
+    text = (
+        f"⚠️ *Конфлікти розкладу:* {len(schedule_conflicts)}\n"
+        f"👨‍🏫 Викладачі: {teacher_count} | 🚪 Аудиторії: {room_count}\n\n"
+    )
 
-        keyboard_buttons.append(
-            [InlineKeyboardButton("🟢 Увімкнути режим", callback_data="maint_start_setup")]
-        )
+    shown = 0
 
-    keyboard_buttons.append(
-        [InlineKeyboardButton("⬅️ Назад до адмін-панелі", callback_data="show_admin_panel")]
-    )
+    for conflict in schedule_conflicts[:limit]:
 
-    reply_markup = InlineKeyboardMarkup(keyboard_buttons)
+        icon = "👨‍🏫" if conflict["kind"] == "teacher" else "🚪 Ауд."
 
-    if query:
-        await query.edit_message_text(text=text, reply_markup=reply_markup, parse_mode="Markdown")
+        week_type_display = "чис." if conflict["week_type"] == "чисельник" else "знам."
 
-    elif update.message:
-        await update.message.reply_text(text=text, reply_markup=reply_markup, parse_mode="Markdown")
+        block = (
+            f"{icon} *{conflict['resource']}* — {conflict['day'].capitalize()}, "
+            f"{conflict['slot']} ({week_type_display}):\n"
+        )
 
+        for group_name, teacher, room, subject_name, slot in conflict["occurrences"]:
 
-async def maintenance_start_setup_handler(
-    update: Update, context: ContextTypes.DEFAULT_TYPE
-) -> int:
+            block += (
+                f"   • {group_name}: {subject_name} ({slot}) | "
+                f"{teacher or '-'} | Ауд. {room or '-'}\n"
+            )
 
-    query = update.callback_query
+        # Ліміт Telegram - 4096 символів на повідомлення
 
-    await query.answer()
+        if len(text) + len(block) > 3800:
 
-    context.user_data["maintenance_setter_id"] = query.from_user.id
+            break
 
-    keyboard = [
-        [
-            InlineKeyboardButton("10 хв", callback_data="maint_set_duration_10"),
-            InlineKeyboardButton("30 хв", callback_data="maint_set_duration_30"),
-            InlineKeyboardButton("60 хв", callback_data="maint_set_duration_60"),
-        ],
-        [InlineKeyboardButton("Ввести вручну (хв)", callback_data="maint_manual_duration_prompt")],
-        [InlineKeyboardButton(" скасувати", callback_data="maint_cancel_setup")],
-    ]
+        text += block
 
-    reply_markup = InlineKeyboardMarkup(keyboard)
+        shown += 1
 
-    await query.edit_message_text(
-        "⚙️ Налаштування режиму обслуговування:\n\nОберіть тривалість:", reply_markup=reply_markup
-    )
+    if len(schedule_conflicts) > shown:
 
-    return SELECTING_DURATION
+        text += f"\n_...та ще {len(schedule_conflicts) - shown}._"
 
+    return text
 
-async def maintenance_set_duration_callback(
-    update: Update, context: ContextTypes.DEFAULT_TYPE
-) -> int:
 
-    query = update.callback_query
+def search_schedule_prefix_index(query: str, limit: int = INLINE_QUERY_MAX_RESULTS) -> list[tuple[str, str]]:
+    """Повертає (тип, назва) для всіх ключів, що починаються з query."""
 
-    await query.answer()
+    get_cached_schedule()
 
-    if context.user_data.get("maintenance_setter_id") != query.from_user.id:
+    prefix = normalize_search_key(query)
 
-        await query.edit_message_text(
-            "Помилка: інший адміністратор вже налаштовує.",
-            reply_markup=get_back_to_admin_panel_keyboard(),
-        )
+    if not prefix:
 
-        return ConversationHandler.END
+        return []
 
-    duration_minutes = int(query.data.split("_")[-1])
+    results = []
 
-    context.user_data["maintenance_duration"] = duration_minutes
+    seen = set()
 
-    await query.edit_message_text(
-        f"Тривалість: {duration_minutes} хв.\nНадішліть повідомлення для користувачів:"
-    )
+    start = bisect.bisect_left(schedule_prefix_index, (prefix,))
 
-    return TYPING_MESSAGE
+    for norm_key, kind, name in schedule_prefix_index[start:]:
 
+        if not norm_key.startswith(prefix):
 
-async def maintenance_manual_duration_prompt_callback(
-    update: Update, context: ContextTypes.DEFAULT_TYPE
-) -> int:
+            break
 
-    query = update.callback_query
+        if (kind, name) in seen:
 
-    await query.answer()
+            continue
 
-    if context.user_data.get("maintenance_setter_id") != query.from_user.id:
+        seen.add((kind, name))
 
-        await query.edit_message_text(
-            "Помилка доступу.", reply_markup=get_back_to_admin_panel_keyboard()
-        )
+        results.append((kind, name))
 
-        return ConversationHandler.END
+        if len(results) >= limit:
 
-    await query.edit_message_text("Введіть тривалість в хвилинах (число):")
+            break
 
-    return TYPING_DURATION
+    return results
 
 
-async def maintenance_typed_duration_handler(
-    update: Update, context: ContextTypes.DEFAULT_TYPE
-) -> int:
+def load_specialties_data():
 
-    if context.user_data.get("maintenance_setter_id") != update.effective_user.id:
+    global specialties_cache
 
-        await update.message.reply_text(
-            "Помилка доступу.", reply_markup=get_back_to_admin_panel_keyboard()
+    if specialties_cache is None:
+
+        logger.info(
+            f"Кеш спеціальностей порожній. Завантаження з файлу '{SPECIALTIES_JSON_FILE}'..."
         )
 
-        return ConversationHandler.END
+        if not os.path.exists(SPECIALTIES_JSON_FILE):
 
-    try:
+            logger.error(
+                f"Файл спеціальностей '{SPECIALTIES_JSON_FILE}' не знайдено! Функціонал спеціальностей не працюватиме."
+            )
 
-        duration_minutes = int(update.message.text)
+            specialties_cache = {"specialties": {}}
 
-        if duration_minutes <= 0:
+            return specialties_cache
 
-            await update.message.reply_text("Тривалість має бути позитивною. Введіть ще раз:")
+        try:
 
-            return TYPING_DURATION
+            with open(SPECIALTIES_JSON_FILE, "r", encoding="utf-8") as f:
 
-        context.user_data["maintenance_duration"] = duration_minutes
+                specialties_cache = json.load(f)
 
-        await update.message.reply_text(
-            f"Тривалість: {duration_minutes} хв.\nНадішліть повідомлення для користувачів:"
-        )
+            logger.info(f"Спеціальності успішно завантажено з '{SPECIALTIES_JSON_FILE}'.")
 
-        return TYPING_MESSAGE
+        except json.JSONDecodeError as e:
 
-    except ValueError:
+            logger.error(f"Помилка декодування JSON у файлі '{SPECIALTIES_JSON_FILE}': {e}")
 
-        await update.message.reply_text("Введіть числове значення для тривалості:")
+            specialties_cache = {"specialties": {}}
 
-        return TYPING_DURATION
+        except Exception as e:
 
+            logger.error(f"Невідома помилка при завантаженні спеціальностей: {e}")
 
-async def maintenance_typed_message_handler(
-    update: Update, context: ContextTypes.DEFAULT_TYPE
-) -> int:
+            specialties_cache = {"specialties": {}}
 
-    if context.user_data.get("maintenance_setter_id") != update.effective_user.id:
+    return specialties_cache.get("specialties", {})
 
-        await update.message.reply_text(
-            "Помилка доступу.", reply_markup=get_back_to_admin_panel_keyboard()
-        )
 
-        context.user_data.clear()
+def load_admission_docs_data():
 
-        return ConversationHandler.END
+    global admission_docs_cache
 
-    user_message = update.message.text
+    if admission_docs_cache is None:
 
-    duration_minutes = context.user_data.get("maintenance_duration")
+        logger.info(
+            f"Кеш документів для вступу порожній. Завантаження з файлу '{ADMISSION_DOCS_JSON_FILE}'..."
+        )
 
-    if not user_message or not duration_minutes:
+        if not os.path.exists(ADMISSION_DOCS_JSON_FILE):
 
-        await update.message.reply_text(
-            "Помилка: не вдалося отримати дані.", reply_markup=get_back_to_admin_panel_keyboard()
-        )
+            logger.error(
+                f"Файл документів для вступу '{ADMISSION_DOCS_JSON_FILE}' не знайдено! Функціонал документів не працюватиме."
+            )
 
-        context.user_data.clear()
+            admission_docs_cache = {}
 
-        return ConversationHandler.END
+            return admission_docs_cache
 
-    global maintenance_mode_active, maintenance_message, maintenance_end_time, maintenance_messages_ids
+        try:
 
-    maintenance_mode_active = True
+            with open(ADMISSION_DOCS_JSON_FILE, "r", encoding="utf-8") as f:
 
-    maintenance_message = user_message
+                admission_docs_cache = json.load(f)
 
-    maintenance_end_time = datetime.now(KYIV_TZ) + timedelta(minutes=duration_minutes)
+            logger.info(f"Документи для вступу успішно завантажено з '{ADMISSION_DOCS_JSON_FILE}'.")
 
-    current_jobs = context.job_queue.get_jobs_by_name(MAINTENANCE_JOB_NAME)
+        except json.JSONDecodeError as e:
 
-    for job in current_jobs:
-        job.schedule_removal()
+            logger.error(f"Помилка декодування JSON у файлі '{ADMISSION_DOCS_JSON_FILE}': {e}")
 
-    context.job_queue.run_once(
-        disable_maintenance_job_callback, maintenance_end_time, name=MAINTENANCE_JOB_NAME
-    )
+            admission_docs_cache = {}
 
-    activation_msg = (
-        f"✅ Режим обслуговування УВІМКНЕНО!\n"
-        f'Тривалість: {duration_minutes} хв.\nПовідомлення: "{maintenance_message}"\n'
-        f"Завершиться: {maintenance_end_time.strftime('%Y-%m-%d %H:%M:%S %Z')}"
-    )
+        except Exception as e:
 
-    # Зберігаємо ID повідомлення про активацію для подальшого видалення
+            logger.error(f"Невідома помилка при завантаженні документів для вступу: {e}")
 
-    sent_message = await update.message.reply_text(
-        activation_msg, reply_markup=get_admin_panel_keyboard()
-    )
+            admission_docs_cache = {}
 
-    maintenance_messages_ids[sent_message.chat_id] = sent_message.message_id
+    return admission_docs_cache
 
-    logger.info(
-        f"Адмін {update.effective_user.id} увімкнув режим обслуговування на {duration_minutes} хв. Збережено maintenance_message_id: {sent_message.message_id}"
-    )
 
-    context.user_data.clear()
+def get_admission_docs_by_form(form_type: str) -> dict | None:
 
-    return ConversationHandler.END
+    all_docs = load_admission_docs_data()
 
+    return all_docs.get(
+        f"{form_type}_form"
+    )  # Використовуємо f-рядок для "day_form" або "extramural_form"
 
-async def disable_maintenance_job_callback(context: ContextTypes.DEFAULT_TYPE) -> None:
 
-    global maintenance_mode_active, maintenance_end_time, maintenance_messages_ids
+def get_all_specialties() -> dict:
 
-    if maintenance_mode_active:
+    return load_specialties_data()
 
-        maintenance_mode_active = False
 
-        maintenance_end_time = None
+def get_specialty_by_id(specialty_id: str) -> dict | None:
 
-        logger.info(
-            f"Режим обслуговування автоматично вимкнено (за розкладом о {datetime.now(KYIV_TZ).strftime('%Y-%m-%d %H:%M:%S %Z')})."
-        )
+    all_specialties = get_all_specialties()
 
-        # Видалення старих повідомлень про ТО
+    return all_specialties.get(specialty_id)
 
-        for chat_id, message_id in list(maintenance_messages_ids.items()):
 
-            try:
+def get_all_group_names_from_cache() -> list[str]:
 
-                await context.bot.delete_message(chat_id=chat_id, message_id=message_id)
+    global sql_manager
 
-                logger.info(
-                    f"Автоматично видалено старе повідомлення про ТО (chat_id: {chat_id}, message_id: {message_id})."
-                )
+    if sql_manager is None:
 
-            except telegram.error.BadRequest as e:
+        logger.warning("SQLManager не ініціалізовано при спробі отримати назви груп.")
 
-                if "Message to delete not found" in str(e):
+        cache = get_cached_schedule()
 
-                    logger.warning(
-                        f"Повідомлення про ТО вже видалено або не існує (chat_id: {chat_id}, message_id: {message_id})."
-                    )
+        return sorted(list(cache.get("розклади_груп", {}).keys()))
 
-                else:
+    try:
 
-                    logger.error(
-                        f"Помилка при автоматичному видаленні повідомлення про ТО (chat_id: {chat_id}, message_id: {message_id}): {e}"
-                    )
+        with span("sql_manager.get_static", "schedule_db"):
 
-            except Exception as e:
+            groups_static_data = sql_manager.get_static().get("Groups", {})
 
-                logger.error(
-                    f"Неочікувана помилка при автоматичному видаленні повідомлення про ТО (chat_id: {chat_id}, message_id: {message_id}): {e}"
-                )
+        group_names = [details["Name"] for details in groups_static_data.values()]
 
-            finally:
+        return sorted(group_names)
 
-                del maintenance_messages_ids[chat_id]
+    except Exception as e:
 
-        for admin_id in ADMIN_USER_IDS:
+        logger.error(f"Помилка отримання назв груп з SQLManager: {e}", exc_info=True)
 
-            try:
-                await context.bot.send_message(
-                    chat_id=admin_id,
-                    text="ℹ️ Режим технічного обслуговування автоматично завершено.",
-                )
+        cache_fallback = schedule_cache if schedule_cache else {"розклади_груп": {}}
 
-            except Exception as e:
-                logger.error(f"Не вдалося сповістити адміна {admin_id}: {e}")
+        return sorted(list(cache_fallback.get("розклади_груп", {}).keys()))
 
 
-async def maintenance_disable_now_callback(
-    update: Update, context: ContextTypes.DEFAULT_TYPE
-) -> None:
+def get_schedule_data_for_group(group_name: str) -> dict | None:
 
-    global maintenance_mode_active, maintenance_end_time, maintenance_messages_ids
+    cache = get_cached_schedule()
 
-    user_id = update.effective_user.id
+    return cache.get("розклади_груп", {}).get(group_name)
 
-    if user_id not in ADMIN_USER_IDS:
 
-        if update.message:
-            await update.message.reply_text("Доступ заборонено.")
+def get_current_week_type_for_schedule(current_date: datetime) -> str:
 
-        elif update.callback_query:
-            await update.callback_query.answer("Доступ заборонено.", show_alert=True)
+    # Якщо current_date не має timezone info, додаємо його
 
-        return
+    if current_date.tzinfo is None or current_date.tzinfo.utcoffset(current_date) is None:
 
-    if update.callback_query:
-        await update.callback_query.answer()
+        current_date = current_date.replace(tzinfo=KYIV_TZ)
 
-    maintenance_mode_active = False
+    delta_days = (current_date - BASE_DATE).days
 
-    maintenance_end_time = None
+    weeks_passed = delta_days // 7
 
-    current_jobs = context.job_queue.get_jobs_by_name(MAINTENANCE_JOB_NAME)
+    return "чисельник" if weeks_passed % 2 == 0 else "знаменник"
 
-    for job in current_jobs:
-        job.schedule_removal()
 
-    text = "🔴 Режим обслуговування вимкнено вручну."
+# --- Функції для реферальної системи ---
 
-    reply_markup = get_admin_panel_keyboard()
 
-    # Видалення старих повідомлень про ТО при ручному вимкненні
+def increment_referred_count(user_id: int) -> None:
 
-    for chat_id, message_id in list(maintenance_messages_ids.items()):
+    try:
 
-        try:
+        with connect_db() as conn:
 
-            await context.bot.delete_message(chat_id=chat_id, message_id=message_id)
+            cursor = conn.cursor()
 
-            logger.info(
-                f"Вручну видалено старе повідомлення про ТО (chat_id: {chat_id}, message_id: {message_id})."
+            cursor.execute(
+                "UPDATE users SET referred_count = referred_count + 1 WHERE user_id = ?", (user_id,)
             )
 
-        except telegram.error.BadRequest as e:
+            conn.commit()
 
-            if "Message to delete not found" in str(e):
+        logger.info(f"Лічильник рефералів для користувача {user_id} збільшено.")
 
-                logger.warning(
-                    f"Повідомлення про ТО вже видалено або не існує (chat_id: {chat_id}, message_id: {message_id})."
-                )
+    except sqlite3.Error as e:
 
-            else:
+        logger.error(f"Помилка збільшення лічильника рефералів для {user_id}: {e}")
 
-                logger.error(
-                    f"Помилка при ручному видаленні повідомлення про ТО (chat_id: {chat_id}, message_id: {message_id}): {e}"
-                )
 
-        except Exception as e:
+def get_referred_count(user_id: int) -> int:
 
-            logger.error(
-                f"Неочікувана помилка при ручному видаленні повідомлення про ТО (chat_id: {chat_id}, message_id: {message_id}): {e}"
-            )
+    try:
 
-        finally:
+        with connect_db() as conn:
 
-            del maintenance_messages_ids[chat_id]
+            cursor = conn.cursor()
+
+            cursor.execute("SELECT referred_count FROM users WHERE user_id = ?", (user_id,))
+
+            result = cursor.fetchone()
+
+            return result[0] if result else 0
+
+    except sqlite3.Error as e:
+
+        logger.error(f"Помилка отримання лічильника рефералів для {user_id}: {e}")
+
+        return 0
+
+
+def set_raffle_participant_status(user_id: int, status: bool) -> bool:
+
+    try:
+
+        with connect_db() as conn:
+
+            cursor = conn.cursor()
+
+            current_time = datetime.now(KYIV_TZ).isoformat() if status else None
+
+            cursor.execute(
+                "UPDATE users SET is_raffle_participant = ?, raffle_participation_date = ? WHERE user_id = ?",
+                (status, current_time, user_id),
+            )
+
+            conn.commit()
+
+        audience_dirty_user_ids.add(user_id)
+
+        logger.info(f"Статус учасника розіграшу для {user_id} встановлено на {status}.")
+
+        return True
+
+    except sqlite3.Error as e:
+
+        logger.error(f"Помилка встановлення статусу учасника розіграшу для {user_id}: {e}")
+
+        return False
+
+
+def get_raffle_participant_status(user_id: int) -> bool:
+
+    try:
+
+        with connect_db() as conn:
+
+            cursor = conn.cursor()
+
+            cursor.execute("SELECT is_raffle_participant FROM users WHERE user_id = ?", (user_id,))
+
+            result = cursor.fetchone()
+
+            return bool(result[0]) if result else False
+
+    except sqlite3.Error as e:
+
+        logger.error(f"Помилка отримання статусу учасника розіграшу для {user_id}: {e}")
+
+        return False
+
+
+def user_exists(user_id: int) -> bool:
+
+    try:
+
+        with connect_db() as conn:
+
+            cursor = conn.cursor()
+
+            cursor.execute("SELECT 1 FROM users WHERE user_id = ?", (user_id,))
+
+            return cursor.fetchone() is not None
+
+    except sqlite3.Error as e:
+
+        logger.error(f"Помилка перевірки існування користувача {user_id}: {e}")
+
+        return False
+
+
+# --- Клавіатури ---
+
+# Нові клавіатури для вибору ролі та курсу
+
+
+def get_role_selection_keyboard() -> InlineKeyboardMarkup:
+
+    keyboard = [
+        [InlineKeyboardButton("🎓 Я студент", callback_data="select_role_student")],
+        [InlineKeyboardButton("👨‍🏫 Я викладач", callback_data="select_role_teacher")],
+        [InlineKeyboardButton("🚶‍♂️ Я гість", callback_data="select_role_guest")],
+        [InlineKeyboardButton("👷‍♂️ Я працівник", callback_data="select_role_staff")],
+    ]
+
+    return InlineKeyboardMarkup(keyboard)
+
+
+def get_student_course_selection_keyboard() -> InlineKeyboardMarkup:
+
+    keyboard = [
+        [InlineKeyboardButton("Курс 1", callback_data="select_course_1")],
+        [InlineKeyboardButton("Курс 2", callback_data="select_course_2")],
+        [InlineKeyboardButton("Курс 3", callback_data="select_course_3")],
+        [InlineKeyboardButton("Курс 4", callback_data="select_course_4")],
+        [InlineKeyboardButton("⬅️ Назад до вибору ролі", callback_data="back_to_role_selection")],
+    ]
+
+    return InlineKeyboardMarkup(keyboard)
+
+
+def get_back_to_role_selection_keyboard() -> InlineKeyboardMarkup:
+
+    return InlineKeyboardMarkup(
+        [[InlineKeyboardButton("⬅️ Назад до вибору ролі", callback_data="back_to_role_selection")]]
+    )
+
+
+def get_floor_by_auditorium(auditorium: str) -> str:
+    """Визначає поверх за номером аудиторії"""
+
+    if not auditorium or auditorium.lower() in ["с/з", "спортзал", "спорт", ""]:
+
+        return ""
+
+    # Видаляємо всі нецифрові символи для перевірки
+
+    import re
+
+    clean_aud = re.sub(r"[^\d]", "", str(auditorium))
+
+    if not clean_aud:
+
+        return ""
+
+    aud_num = int(clean_aud)
+
+    # 1 поверх: ауд. 1, 2, 3, 4, 5, 6, 9, 10
+
+    if aud_num in [1, 2, 3, 4, 5, 6, 9, 10]:
+
+        return "1 Поверх"
+
+    # 2 поверх: ауд. 16, 17, 18, 19, 21
+
+    elif aud_num in [16, 17, 18, 19, 21]:
+
+        return "2 Поверх"
+
+    # 3 поверх: ауд. 26, 28, 29, 30, 31, 32, 33, 34, 37, 38, 39, 42, 41
+
+    elif aud_num in [26, 28, 29, 30, 31, 32, 33, 34, 37, 38, 39, 42, 41]:
+
+        return "3 Поверх"
+
+    # 4 поверх: ауд. 43, 44, 45, 46, 47, 48, 49, 50, 52, 63, 53, 54, 55, 56
+
+    elif aud_num in [43, 44, 45, 46, 47, 48, 49, 50, 52, 63, 53, 54, 55, 56]:
+
+        return "4 Поверх"
+
+    # Якщо аудиторія не знайдена в списку, повертаємо порожній рядок
+
+    return ""
+
+
+def get_textbooks_menu_keyboard() -> InlineKeyboardMarkup:
+    """Створює клавіатуру з навчальними книжками"""
+
+    keyboard = [
+        [
+            InlineKeyboardButton(
+                "📖 Українська мова 10 клас Авраменко",
+                url="https://pidruchnyk.com.ua/1168-ukrainska-mova-10-klas-avramenko.html",
+            )
+        ],
+        [
+            InlineKeyboardButton(
+                "📖 Українська мова 11 клас Авраменко",
+                url="https://pidruchnyk.com.ua/1239-ukrainska-mova-11-klas-avramenko.html",
+            )
+        ],
+        [
+            InlineKeyboardButton(
+                "📖 Українська література 10 клас Авраменко",
+                url="https://pidruchnyk.com.ua/392-ukrayinska-lteratura-avramenko-paharenko-10-klas.html",
+            )
+        ],
+        [
+            InlineKeyboardButton(
+                "📖 Українська література 11 клас Авраменко",
+                url="https://pidruchnyk.com.ua/1237-ukrliteratura-avramenko-11klas.html",
+            )
+        ],
+        [
+            InlineKeyboardButton(
+                "📖 Зарубіжна література 10 клас Ніколенко",
+                url="https://pidruchnyk.com.ua/1146-zarubizhna-literatura-10-klas-nikolenko.html",
+            )
+        ],
+        [
+            InlineKeyboardButton(
+                "📖 Зарубіжна література 11 клас Ніколенко",
+                url="https://pidruchnyk.com.ua/1256-zarubizhna-literatura-11-klas-nikolenko.html",
+            )
+        ],
+        [
+            InlineKeyboardButton(
+                "📖 Англійська мова 10 клас Карпюк",
+                url="https://pidruchnyk.com.ua/425-anglyska-mova-karpyuk-10-klas.html",
+            )
+        ],
+        [
+            InlineKeyboardButton(
+                "📖 Англійська мова 11 клас Карпюк",
+                url="https://pidruchnyk.com.ua/454-anglyska-mova-karpyuk-11-klas.html",
+            )
+        ],
+        [
+            InlineKeyboardButton(
+                "📖 Граматика англійської мови Верба",
+                url="https://ifccyc1.pnu.edu.ua/wp-content/uploads/sites/106/2019/12/%D0%93%D1%80%D0%B0%D0%BC%D0%B0%D1%82%D0%B8%D0%BA%D0%B0-%D0%B0%D0%BD%D0%B3%D0%BB.pdf",
+            )
+        ],
+        [
+            InlineKeyboardButton(
+                "📖 Logistics Victoria Evans",
+                url="https://www.expresspublishing.co.uk/files/Logistics.pdf",
+            )
+        ],
+        [
+            InlineKeyboardButton(
+                "📖 Information technology Victoria Evans",
+                url="https://www.expresspublishing.co.uk/files/Informechnew.pdf",
+            )
+        ],
+        [
+            InlineKeyboardButton(
+                "📖 Hotels and Catering Virginia Evans",
+                url="https://language-teachings.com/wp-content/uploads/2021/04/Virginia-Evans.-Hotels-Catering.pdf",
+            )
+        ],
+        [
+            InlineKeyboardButton(
+                "📖 English for logistics Marion Grussendorf",
+                url="https://mzientek.v.prz.edu.pl/fcp/qGBUKOQtTKlQhbx08SlkTVARGUWRuHQwFDBoIVURNWHxSFVZpCFghUHcKVigEQUw/704/englishlogisticsbook-1.pdf",
+            )
+        ],
+        [InlineKeyboardButton("⬅️ Назад до головного меню", callback_data="back_to_main_menu")],
+    ]
+
+    return InlineKeyboardMarkup(keyboard)
+
+
+def get_guest_menu_keyboard() -> InlineKeyboardMarkup:
+
+    return InlineKeyboardMarkup(
+        [
+            [
+                InlineKeyboardButton(
+                    "ℹ️ Інформація про коледж", callback_data="about_college_from_guest"
+                )
+            ],
+            [
+                InlineKeyboardButton(
+                    "⬅️ Назад до вибору, щоб увійти", callback_data="back_to_role_selection"
+                )
+            ],
+        ]
+    )
+
+
+def get_about_college_menu_keyboard(user_role: str | None = None) -> InlineKeyboardMarkup:
+
+    keyboard_buttons = [
+        [InlineKeyboardButton("📚 Спеціальності", callback_data="about_college_specialties")],
+        [InlineKeyboardButton("🌟 Чому ми?", callback_data="about_college_why_us")],
+        [
+            InlineKeyboardButton(
+                "📄 Документи для вступу", callback_data="about_college_admission_docs"
+            )
+        ],
+        [InlineKeyboardButton("📞 Зв'язки з нами", callback_data="about_college_contacts")],
+        [InlineKeyboardButton("🌐 Соцмережі", callback_data="about_college_social_media")],
+        [
+            InlineKeyboardButton(
+                "🗺️ Віртуальна екскурсія",
+                url="https://view.genially.com/66578acef2390b0015a681f8/interactive-image-virtualna-ekskursiya-mistom",
+            )
+        ],
+    ]
+
+    if user_role == "guest":
+
+        keyboard_buttons.append(
+            [
+                InlineKeyboardButton(
+                    "⬅️ Назад до вибору, щоб увійти", callback_data="back_to_role_selection"
+                )
+            ]
+        )
+
+    else:
+
+        keyboard_buttons.append(
+            [InlineKeyboardButton("⬅️ Назад до головного меню", callback_data="back_to_main_menu")]
+        )
+
+    return InlineKeyboardMarkup(keyboard_buttons)
+
+
+def get_specialties_list_keyboard() -> InlineKeyboardMarkup:
+
+    all_specialties = get_all_specialties()
+
+    specialty_keys = sorted(list(all_specialties.keys()))
+
+    emoji_map = {"F2": "💻", "G19": "🏗️", "G16": "🛢️", "D5": "📈", "D7": "🛒", "D2": "💰"}
+
+    if not specialty_keys:
+
+        return InlineKeyboardMarkup(
+            [
+                [
+                    InlineKeyboardButton(
+                        "Немає доступних спеціальностей", callback_data="no_specialties"
+                    )
+                ],
+                [
+                    InlineKeyboardButton(
+                        "⬅️ Назад до меню коледжу", callback_data="back_to_about_college_menu"
+                    )
+                ],
+            ]
+        )
+
+    keyboard = []
+
+    for specialty_id in specialty_keys:
+
+        specialty_info = all_specialties.get(specialty_id)
+
+        if specialty_info:
+
+            emoji = emoji_map.get(specialty_id, "")
+
+            button_text = f"{emoji} {specialty_info.get('name', specialty_id)}"
+
+            keyboard.append(
+                [
+                    InlineKeyboardButton(
+                        button_text.strip(), callback_data=f"show_specialty_details_{specialty_id}"
+                    )
+                ]
+            )
+
+    keyboard.append(
+        [
+            InlineKeyboardButton(
+                "⬅️ Назад до меню коледжу", callback_data="back_to_about_college_menu"
+            )
+        ]
+    )
+
+    return InlineKeyboardMarkup(keyboard)
+
+
+def get_back_to_specialties_list_keyboard(user_role: str | None = None) -> InlineKeyboardMarkup:
+
+    # Оновлюємо callback_data для "Назад до меню коледжу" в залежності від ролі
+
+    back_to_college_callback = (
+        "about_college_from_guest" if user_role == "guest" else "back_to_about_college_menu"
+    )
+
+    return InlineKeyboardMarkup(
+        [
+            [
+                InlineKeyboardButton(
+                    "⬅️ Назад до списку спеціальностей", callback_data="about_college_specialties"
+                )
+            ],
+            [
+                InlineKeyboardButton(
+                    "🏠 Назад до меню коледжу", callback_data=back_to_college_callback
+                )
+            ],
+        ]
+    )
+
+
+def get_back_to_about_college_menu_keyboard(
+    user_role: str | None = None,
+) -> InlineKeyboardMarkup:  # ДОДАНО user_role
+
+    callback_data = "about_college_from_guest" if user_role == "guest" else "about_college"
+
+    return InlineKeyboardMarkup(
+        [[InlineKeyboardButton("⬅️ Назад до меню коледжу", callback_data=callback_data)]]
+    )
+
+
+def get_admission_form_selection_keyboard(user_role: str | None = None) -> InlineKeyboardMarkup:
+
+    # Оновлюємо callback_data для "Назад до меню коледжу" в залежності від ролі
+
+    back_to_college_callback = (
+        "about_college_from_guest" if user_role == "guest" else "back_to_about_college_menu"
+    )
+
+    keyboard = [
+        [InlineKeyboardButton("📚 Денна форма навчання", callback_data="show_admission_docs_day")],
+        [
+            InlineKeyboardButton(
+                "📖 Заочна форма навчання", callback_data="show_admission_docs_extramural"
+            )
+        ],
+        # --- НОВЕ: Додаємо кнопку "Абітурієнту" тут, над кнопкою "Назад" ---
+        [InlineKeyboardButton("🙋 Абітурієнту", url="https://dvnzchgek.edu.ua/abituriyentu")],
+        # ------------------------------------------------------------------
+        [InlineKeyboardButton("⬅️ Назад до меню коледжу", callback_data=back_to_college_callback)],
+    ]
+
+    return InlineKeyboardMarkup(keyboard)
+
+
+def get_back_to_admission_form_selection_keyboard(
+    user_role: str | None = None,
+) -> InlineKeyboardMarkup:
+
+    # Оновлюємо callback_data для "Назад до меню коледжу" в залежності від ролі
+
+    back_to_college_callback = (
+        "about_college_from_guest" if user_role == "guest" else "back_to_about_college_menu"
+    )
+
+    return InlineKeyboardMarkup(
+        [
+            [
+                InlineKeyboardButton(
+                    "⬅️ Назад до вибору форми", callback_data="about_college_admission_docs"
+                )
+            ],  # Повертає до вибору денна/заочна
+            [
+                InlineKeyboardButton(
+                    "🏠 Назад до меню коледжу", callback_data=back_to_college_callback
+                )
+            ],
+        ]
+    )
+
+
+# -------------------------------------
+
+
+# --- Обробники для меню "Про коледж" ---
+
+
+async def about_college_handler(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+
+    query = update.callback_query
+
+    if query and query.from_user:
+
+        user_id = query.from_user.id
+
+    else:
+
+        user_id = update.effective_user.id if update.effective_user else None
+
+    user_role = get_user_role_from_db(user_id) if user_id is not None else None  # Отримуємо роль
+
+    if query:
+
+        await query.answer()
+
+    text = "ℹ️ *Про коледж: Що вас цікавить?*"
+
+    reply_markup = get_about_college_menu_keyboard(user_role=user_role)  # Передаємо роль
+
+    if query and query.message:
+
+        try:
+
+            await query.message.edit_text(text, reply_markup=reply_markup, parse_mode="Markdown")  # type: ignore
+
+        except telegram.error.BadRequest as e:
+
+            if "Message is not modified" in str(e):
+
+                logger.debug(
+                    f"Повідомлення не модифіковано (кнопка back_to_about_college_menu): {e}"
+                )
+
+            else:
+
+                logger.error(
+                    f"Помилка при редагуванні повідомлення в about_college_handler: {e}",
+                    exc_info=True,
+                )
+
+    elif update.message:
+
+        await update.message.reply_text(text, reply_markup=reply_markup, parse_mode="Markdown")  # type: ignore
+
+    else:
+
+        logger.warning("about_college_handler викликано без відповідного об'єкта Update.")
+
+
+async def show_specialties_list_handler(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+
+    query = update.callback_query
+
+    user_id = None
+
+    if query and query.from_user:
+
+        user_id = query.from_user.id
+
+    elif update.effective_user:
+
+        user_id = update.effective_user.id
+
+    if user_id is None:
+
+        logger.warning("show_specialties_list_handler: не вдалося отримати user_id")
+
+        return
+
+    user_role = get_user_role_from_db(user_id)  # Отримуємо роль
+
+    text = "📚 *Оберіть спеціальність:*"
+
+    reply_markup = get_specialties_list_keyboard()
+
+    # Модифікуємо кнопку "Назад до меню коледжу", якщо користувач гість
+
+    if user_role == "guest":
+
+        modified_keyboard_buttons = []
+
+        for row in reply_markup.inline_keyboard:
+
+            new_row = []
+
+            for button in row:
+
+                if button.callback_data == "back_to_about_college_menu":
+
+                    new_row.append(
+                        InlineKeyboardButton(
+                            "⬅️ Назад до меню коледжу", callback_data="about_college_from_guest"
+                        )
+                    )
+
+                else:
+
+                    new_row.append(button)
+
+            modified_keyboard_buttons.append(new_row)
+
+        reply_markup = InlineKeyboardMarkup(modified_keyboard_buttons)
+
+    if query:
+
+        await query.edit_message_text(text, reply_markup=reply_markup, parse_mode="Markdown")  # type: ignore
+
+    elif update.message:
+
+        await update.message.reply_text(text, reply_markup=reply_markup, parse_mode="Markdown")  # type: ignore
+
+
+async def show_specialty_details_handler(
+    update: Update, context: ContextTypes.DEFAULT_TYPE
+) -> None:
+
+    query = update.callback_query
+
+    if not query or not query.from_user:
+
+        logger.warning(
+            "show_specialty_details_handler викликано без відповідного query або from_user"
+        )
+
+        return
+
+    user_id = query.from_user.id  # Отримуємо user_id з query
+
+    user_role = get_user_role_from_db(user_id)  # Отримуємо роль
+
+    if not query.data:
+
+        logger.warning("show_specialty_details_handler викликано без query.data")
+
+        return
+
+    specialty_id = query.data.replace("show_specialty_details_", "")
+
+    specialty_info = get_specialty_by_id(specialty_id)
+
+    if not specialty_info:
+
+        await query.edit_message_text(
+            "❌ Інформацію про спеціальність не знайдено.",
+            reply_markup=get_back_to_specialties_list_keyboard(user_role=user_role),
+        )  # Передаємо роль
+
+        return
+
+    text = f"📚 *{specialty_info.get('name', 'Невідома спеціальність').upper()}*\n\n"
+
+    for detail_block in specialty_info.get("details", []):
+
+        text += f"*{detail_block.get('title', '')}:*\n"
+
+        for point in detail_block.get("points", []):
+
+            text += f"  • {point}\n"
+
+        text += "\n"
+
+    if specialty_info.get("duration"):
+
+        text += f"*Термін навчання:* {specialty_info.get('duration')}\n\n"
+
+    reply_markup = get_back_to_specialties_list_keyboard(user_role=user_role)  # Передаємо роль
+
+    await query.edit_message_text(text, reply_markup=reply_markup, parse_mode="Markdown")  # type: ignore
+
+
+def get_why_us_text() -> str:
+
+    return (
+        "🌟 *Чому саме наш коледж?*\n\n"
+        "• *ПРОФЕСІЙНИЙ ПЕДАГОГІЧНИЙ КОЛЕКТИВ:*\n"
+        "  наш висококваліфікований та досвідчений педагогічний колектив гарантує якісну освіту та індивідуальний підхід до кожного студента.\n\n"
+        "• *СУЧАСНА МАТЕРІАЛЬНО-ТЕХНІЧНА БАЗА:*\n"
+        "  завдяки сучасній матеріально-технічній базі наші студенти мають можливість вчитися та досліджувати в новітніх умовах, що сприяє їхньому академічному розвитку.\n\n"
+        "• *ПРАКТИКА:*\n"
+        "  наша програма включає практичний підхід до навчання, що дозволяє студентам отримати реальний досвід у своїй галузі та готує їх до успішного впровадження у професійну діяльність.\n\n"
+        "• *ВЛАСНІ УКРИТТЯ:*\n"
+        "  коледж забезпечує безпекові умови для студентів, маючи власні укриття, де кожен може знаходитися під час повітряних тривог, гарантуючи їхню захищеність та спокій у таких ситуаціях.\n\n"
+        "• *ВЛАСНА ЇДАЛЬНЯ:*\n"
+        "  наша власна комфортна їдальня гарантує смачне та збалансоване харчування для студентів.\n\n"
+        "• *ГУРТОЖИТОК:*\n"
+        "  надаючи комфортні умови проживання, наш гуртожиток з сучасним ремонтом забезпечує студентам затишок та безпеку. Гуртожиток знаходиться поруч з коледжем та має 175 місць для проживання."
+    )
+
+
+async def about_college_why_us_handler(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+
+    query = update.callback_query
+
+    user_id = None
+
+    if query and query.from_user:
+
+        user_id = query.from_user.id
+
+    elif update.effective_user:
+
+        user_id = update.effective_user.id
+
+    if user_id is None:
+
+        logger.warning("about_college_why_us_handler: не вдалося отримати user_id")
+
+        return
+
+    user_role = get_user_role_from_db(user_id)  # Отримуємо роль
+
+    if query:
+
+        await query.answer()
+
+    text = get_why_us_text()
+
+    reply_markup = get_back_to_about_college_menu_keyboard(user_role=user_role)  # Передаємо роль
+
+    if query and query.message:
+
+        await query.message.edit_text(text, reply_markup=reply_markup, parse_mode="Markdown")  # type: ignore
+
+    else:
+
+        logger.warning("about_college_why_us_handler викликано без відповідного об'єкта Update.")
+
+
+def get_contacts_info_text() -> str:
+
+    return (
+        "📞 *Зв'язки з нами:*\n\n"
+        "🏢 *Адреса:*\n"
+        "  м. Шептицький\n"
+        "  вул. Василя Стуса, 17\n\n"
+        "🗓️ *Графік приймальної комісії:*\n"
+        "  Пн-Пт: 09:00 - 17:00\n"
+        "  Сб: 09:00 - 14:00\n"
+        "  Нд: вихідний\n\n"
+        "☎️ *Телефони:*\n"
+        "  Приймальна: `+38 (032) 493 11 47`\n"
+        "  Гуртожиток: `+38 (032) 493 15 03`\n\n"
+        "📧 *Email:*\n"
+        "  `cher.collage@gmail.com`"
+    )
+
+
+async def about_college_contacts_handler(
+    update: Update, context: ContextTypes.DEFAULT_TYPE
+) -> None:
+
+    query = update.callback_query
+
+    user_id = None
+
+    if query and query.from_user:
+
+        user_id = query.from_user.id
+
+    elif update.effective_user:
+
+        user_id = update.effective_user.id
+
+    if user_id is None:
+
+        logger.warning("about_college_contacts_handler: не вдалося отримати user_id")
+
+        return
+
+    user_role = get_user_role_from_db(user_id)  # Отримуємо роль
+
+    if query:
+
+        await query.answer()
+
+    text = get_contacts_info_text()
+
+    reply_markup = get_back_to_about_college_menu_keyboard(user_role=user_role)  # Передаємо роль
+
+    if query and query.message:
+
+        await query.message.edit_text(text, reply_markup=reply_markup, parse_mode="Markdown")  # type: ignore
+
+    else:
+
+        logger.warning("about_college_contacts_handler викликано без відповідного об'єкта Update.")
+
+
+### НОВЕ: Функція для отримання тексту "Соцмережі"
+
+
+def get_social_media_text() -> str:
+
+    return (
+        "🌐 *Наші соцмережі:*\n\n"
+        "🔗 [Наш сайт](https://dvnzchgek.edu.ua/)\n"
+        "📘 [Facebook](https://www.facebook.com/koledzh.org/)\n"
+        "📸 [Instagram](https://www.instagram.com/gefk_ua/)\n"
+        "✈️ [Telegram](https://t.me/chgek)\n"
+    )
+
+
+### НОВЕ: Обробник для кнопки "Соцмережі"
+
+
+async def about_college_social_media_handler(
+    update: Update, context: ContextTypes.DEFAULT_TYPE
+) -> None:
+
+    query = update.callback_query
+
+    user_id = None
+
+    if query and query.from_user:
+
+        user_id = query.from_user.id
+
+    elif update.effective_user:
+
+        user_id = update.effective_user.id
+
+    if user_id is None:
+
+        logger.warning("about_college_social_media_handler: не вдалося отримати user_id")
+
+        return
+
+    user_role = get_user_role_from_db(user_id)  # Отримуємо роль
+
+    if query:
+
+        await query.answer()
+
+    text = get_social_media_text()
+
+    reply_markup = get_back_to_about_college_menu_keyboard(user_role=user_role)  # Передаємо роль
+
+    if query and query.message:
+
+        await query.message.edit_text(text, reply_markup=reply_markup, parse_mode="Markdown", disable_web_page_preview=False)  # type: ignore
+
+    else:
+
+        logger.warning(
+            "about_college_social_media_handler викликано без відповідного об'єкта Update."
+        )
+
+
+async def show_textbooks_menu_handler(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+    """Обробник для показу меню навчальних книжок"""
+
+    query = update.callback_query
+
+    if not query:
+
+        return
+
+    await query.answer()
+
+    text = """📚 *Навчальні книжки*
+
+
+
+Оберіть підручник, який вас цікавить. При натисканні на назву книжки вона відкриється в браузері.
+
+
+
+*Доступні підручники:*"""
+
+    reply_markup = get_textbooks_menu_keyboard()
+
+    await query.edit_message_text(text, reply_markup=reply_markup, parse_mode="Markdown")
+
+
+# --- НОВІ ОБРОБНИКИ ДЛЯ ДОКУМЕНТІВ ---
+
+
+async def about_college_admission_docs_handler(
+    update: Update, context: ContextTypes.DEFAULT_TYPE
+) -> int:
+
+    query = update.callback_query
+
+    if not query or not query.from_user:
+
+        logger.warning(
+            "about_college_admission_docs_handler: не вдалося отримати query або from_user"
+        )
+
+        return SELECTING_ADMISSION_FORM
+
+    user_id = query.from_user.id
+
+    user_role = get_user_role_from_db(user_id)
+
+    if query:
+
+        await query.answer()
+
+    text = "📄 *Документи для вступу: Оберіть форму навчання:*"
+
+    reply_markup = get_admission_form_selection_keyboard(user_role=user_role)
+
+    if query and query.message:
+
+        await query.message.edit_text(text, reply_markup=reply_markup, parse_mode="Markdown")  # type: ignore
+
+    elif update.message:  # Це на випадок, якщо викликаємо не через callback
+
+        await update.message.reply_text(text, reply_markup=reply_markup, parse_mode="Markdown")  # type: ignore
+
+    return SELECTING_ADMISSION_FORM  # Переходимо в новий стан розмови
+
+
+# Функція для виведення списку документів (поки заглушка)
+
+
+async def show_admission_docs_handler(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
+
+    query = update.callback_query
+
+    if not query or not query.from_user:
+
+        logger.warning("show_admission_docs_handler: не вдалося отримати query або from_user")
+
+        return VIEWING_ADMISSION_DOCS
+
+    user_id = query.from_user.id
+
+    user_role = get_user_role_from_db(user_id)
+
+    if query:
+
+        await query.answer()
+
+    if not query.data:
+
+        logger.warning("show_admission_docs_handler: не вдалося отримати query.data")
+
+        return VIEWING_ADMISSION_DOCS
+
+    form_type = query.data.replace("show_admission_docs_", "")  # 'day' або 'extramural'
+
+    docs_data = get_admission_docs_by_form(form_type)
+
+    if not docs_data:
+
+        text = "❌ Інформацію про документи для цієї форми навчання не знайдено."
+
+    else:
+
+        text = f"📄 *{docs_data.get('title', 'Документи для вступу')}*\n\n"
+
+        # Блок "admission_dates" був видалений з JSON і тому не буде тут відображатися.
+
+        # Якщо знову знадобиться, його треба буде додати назад в JSON і тоді в цей код.
+
+        text += "*ПЕРЕЛІК ДОКУМЕНТІВ:*\n"
+
+        if "required_documents" in docs_data and docs_data["required_documents"]:
+
+            for doc in docs_data["required_documents"]:
+
+                text += f"• {doc}\n"
+
+        else:
+
+            text += "_Список документів відсутній._\n"
+
+        # Додаємо додаткові примітки, якщо вони є
+
+        if docs_data.get("additional_notes"):
+
+            text += f"\n_{docs_data['additional_notes']}_"
+
+    reply_markup = get_back_to_admission_form_selection_keyboard(user_role=user_role)
+
+    if query and query.message:
+
+        try:
+
+            await query.message.edit_text(text, reply_markup=reply_markup, parse_mode="Markdown", disable_web_page_preview=True)  # type: ignore
+
+        except telegram.error.BadRequest as e:
+
+            if "Message is not modified" in str(e):
+
+                logger.debug(f"Повідомлення документів не модифіковано: {e}")
+
+            else:
+
+                logger.error(
+                    f"Помилка при редагуванні повідомлення show_admission_docs_handler: {e}",
+                    exc_info=True,
+                )
+
+                # Якщо не вдалося відредагувати, спробуємо надіслати нове
+
+                await query.message.reply_text(text, reply_markup=reply_markup, parse_mode="Markdown", disable_web_page_preview=True)  # type: ignore
+
+    elif update.message:
+
+        await update.message.reply_text(text, reply_markup=reply_markup, parse_mode="Markdown", disable_web_page_preview=True)  # type: ignore
+
+    return VIEWING_ADMISSION_DOCS
+
+
+# --- Клавіатури ---
+
+# Оновлений код
+
+
+def get_main_menu_keyboard(user_id: int, user_group: str | None) -> InlineKeyboardMarkup:
+
+    group_text = f" ({user_group})" if user_group else " (Група не обрана)"
+
+    keyboard_buttons = [
+        [
+            InlineKeyboardButton(
+                f"📅 Показати розклад{group_text}", callback_data="show_schedule_menu"
+            )
+        ],
+        [
+            InlineKeyboardButton(
+                "🌐 Відкрити веб‑додаток",
+                web_app=telegram.WebAppInfo(url=_build_webapp_url_for_user(user_id)),
+            )
+        ],
+        [InlineKeyboardButton("🔄 Змінити/Вказати групу", callback_data="change_set_group_prompt")],
+        [InlineKeyboardButton("📚 Навчальні книжки", callback_data="show_textbooks_menu")],
+        [InlineKeyboardButton("ℹ️ Про коледж", callback_data="about_college")],
+        [InlineKeyboardButton("💰 Підтримати бота", callback_data="show_donation_info")],
+        [
+            InlineKeyboardButton("📝 Анонімний відгук", callback_data="send_feedback_prompt")
+        ],  # НОВА КНОПКА
+        [
+            InlineKeyboardButton(
+                "💡 Як покращити коледж?", callback_data="suggest_improvement_prompt"
+            )
+        ],
+        [
+            InlineKeyboardButton(
+                "💡 Пропозиція / 🐞 Повідомити про проблему",
+                callback_data="report_bug_button_prompt",
+            )
+        ],
+    ]
+
+    if RAFFLE_ACTIVE and datetime.now(KYIV_TZ) < RAFFLE_END_DATE:
+
+        # Вставка кнопки розіграшу перед "Як покращити коледж?" або "Повідомити про проблему"
+
+        # Щоб вона була на логічному місці. Тепер 'Відгуки' на 4й позиції, тому 5
+
+        insert_index = 5  # ЗМІНЕНО: тепер після "Відгуки"
+
+        keyboard_buttons.insert(
+            insert_index,
+            [
+                InlineKeyboardButton(
+                    f"🎁 Розіграш {RAFFLE_PRIZE.upper()} 🎁", callback_data="show_raffle_info"
+                )
+            ],
+        )
+
+    if user_id in ADMIN_USER_IDS:
+
+        keyboard_buttons.append(
+            [InlineKeyboardButton("🛠️ Панель адміністратора", callback_data="show_admin_panel")]
+        )
+
+    return InlineKeyboardMarkup(keyboard_buttons)
+
+
+# --- ДОДАЙТЕ ЦЮ НОВУ УНІВЕРСАЛЬНУ ФУНКЦІЮ ---
+
+
+def get_correct_main_menu_keyboard(user_id: int) -> InlineKeyboardMarkup:
+    """
+
+    Перевіряє роль користувача і повертає відповідну клавіатуру головного меню.
+
+    """
+
+    user_role = get_user_role_from_db(user_id)
+
+    if user_role == "teacher":
+
+        # Для викладача повертаємо меню викладача
+
+        return get_teacher_menu_keyboard(user_id)
+
+    else:
+
+        # Для всіх інших (студент, гість, тощо) повертаємо стандартне меню
+
+        user_group = get_user_group_from_db(user_id)
+
+        return get_main_menu_keyboard(user_id, user_group)
+
+
+# --- НОВІ ФУНКЦІЇ ДЛЯ МЕНЮ ВИКЛАДАЧА ---
+
+
+def get_teacher_menu_keyboard(user_id: int) -> InlineKeyboardMarkup:
+
+    teacher_data = get_teacher_data_from_db(user_id)
+
+    keyboard = [[InlineKeyboardButton("📅 Мій розклад", callback_data="teacher_my_schedule")]]
+
+    # Додаємо кнопку для куратора, якщо є кураторська група
+
+    if teacher_data and teacher_data.get("curated_group_name"):
+
+        keyboard.append(
+            [
+                InlineKeyboardButton(
+                    f"🎓 Розклад моєї групи ({teacher_data['curated_group_name']})",
+                    callback_data="teacher_curated_group_schedule",
+                )
+            ]
+        )
+
+    elif teacher_data and teacher_data.get("curated_group_name"):
+
+        keyboard.append(
+            [
+                InlineKeyboardButton(
+                    f"🎓 Мій клас: {teacher_data['curated_group_name']} (в розробці)",
+                    callback_data="teacher_curated_group",
+                )
+            ]
+        )
+
+    # Додаємо кнопку для перегляду розкладу будь-якої групи
+
+    keyboard.append(
+        [
+            InlineKeyboardButton(
+                "🔍 Розклад будь-якої групи", callback_data="teacher_any_group_schedule"
+            )
+        ]
+    )
+
+    keyboard.extend(
+        [
+            [
+                InlineKeyboardButton(
+                    "🌐 Відкрити веб‑додаток",
+                    web_app=telegram.WebAppInfo(url=_build_webapp_url_for_user(user_id)),
+                )
+            ],
+            [InlineKeyboardButton("📚 Навчальні книжки", callback_data="show_textbooks_menu")],
+            [InlineKeyboardButton("ℹ️ Про коледж", callback_data="about_college")],
+            [InlineKeyboardButton("💰 Підтримати бота", callback_data="show_donation_info")],
+            [
+                InlineKeyboardButton(
+                    "💡 Пропозиція / 🐞 Повідомити про проблему",
+                    callback_data="report_bug_button_prompt",
+                )
+            ],
+            [
+                InlineKeyboardButton(
+                    "🔄 Змінити роль / Вийти", callback_data="back_to_role_selection"
+                )
+            ],
+        ]
+    )
+
+    if user_id in ADMIN_USER_IDS:
+
+        keyboard.append(
+            [InlineKeyboardButton("🛠️ Панель адміністратора", callback_data="show_admin_panel")]
+        )
+
+    return InlineKeyboardMarkup(keyboard)
+
+
+async def show_teacher_menu_handler(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+
+    user = update.effective_user
+
+    if not user:
+
+        logger.warning("show_teacher_menu_handler викликано без effective_user")
+
+        return
+
+    teacher_data = get_teacher_data_from_db(user.id)
+
+    teacher_name = teacher_data.get("full_name", user.full_name) if teacher_data else user.full_name
+
+    text = f"Вітаю, *{teacher_name}*!\nВи увійшли як викладач. Чим можу допомогти?"
+
+    reply_markup = get_teacher_menu_keyboard(user.id)
+
+    if update.callback_query:
+
+        await update.callback_query.edit_message_text(
+            text, reply_markup=reply_markup, parse_mode="Markdown"
+        )
+
+    elif update.message:
+
+        await update.message.reply_text(text, reply_markup=reply_markup, parse_mode="Markdown")
+
+
+async def teacher_my_schedule_handler(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+
+    query = update.callback_query
+
+    if not query:
+
+        logger.warning("teacher_my_schedule_handler викликано без callback_query")
+
+        return
+
+    await query.answer("Цей функціонал наразі в розробці.", show_alert=True)
+
+
+async def teacher_curated_group_schedule_handler(
+    update: Update, context: ContextTypes.DEFAULT_TYPE
+) -> None:
+
+    query = update.callback_query
+
+    if not query or not query.from_user:
+
+        logger.warning("teacher_curated_group_schedule_handler викликано без query або from_user")
+
+        return
+
+    user = query.from_user
+
+    teacher_data = get_teacher_data_from_db(user.id)
+
+    if not teacher_data or not teacher_data.get("curated_group_name"):
+
+        await query.answer("У вас не вказано кураторську групу.", show_alert=True)
+
+        return
+
+    group_name = teacher_data["curated_group_name"]
+
+    group_schedule_data = get_schedule_data_for_group(group_name)
+
+    if not group_schedule_data:
+
+        await query.edit_message_text(
+            f"На жаль, розклад для групи *{group_name}* не знайдено.",
+            reply_markup=get_teacher_menu_keyboard(user.id),
+            parse_mode="Markdown",
+        )
+
+        return
+
+    # Зберігаємо групу в контексті для подальшого використання
+
+    if context.user_data is None:
+
+        context.user_data = {}
+
+    context.user_data["curated_group_name"] = group_name
+
+    text = f"📅 Меню розкладу для групи: *{group_name}*.\nОберіть пункт:"
+
+    reply_markup = get_schedule_menu_keyboard(group_name)
+
+    await query.edit_message_text(text, reply_markup=reply_markup, parse_mode="Markdown")
+
+
+async def teacher_any_group_schedule_handler(
+    update: Update, context: ContextTypes.DEFAULT_TYPE
+) -> None:
+
+    query = update.callback_query
+
+    if not query or not query.from_user:
+
+        logger.warning("teacher_any_group_schedule_handler викликано без query або from_user")
+
+        return
+
+    # Позначаємо, що викладач переглядає розклад будь-якої групи
+
+    if context.user_data is None:
+
+        context.user_data = {}
+
+    context.user_data["teacher_viewing_any_group"] = True
+
+    # Крок 1: показуємо вибір курсу
+
+    text = "🎓 Оберіть курс, а потім групу:"
+
+    reply_markup = get_teacher_course_selection_keyboard()
+
+    await query.edit_message_text(text, reply_markup=reply_markup, parse_mode="Markdown")
+
+
+def get_teacher_group_selection_keyboard(all_groups):
+
+    keyboard = []
+
+    row = []
+
+    for group_name in all_groups:
+
+        row.append(
+            InlineKeyboardButton(group_name, callback_data=f"teacher_view_group_{group_name}")
+        )
+
+        if len(row) == 2:  # 2 групи в рядку для кращого відображення
+
+            keyboard.append(row)
+
+            row = []
+
+    if row:
+
+        keyboard.append(row)
+
+    keyboard.append(
+        [InlineKeyboardButton("⬅️ Назад до меню викладача", callback_data="back_to_main_menu")]
+    )
+
+    return InlineKeyboardMarkup(keyboard)
+
+
+# --- ФУНКЦІЇ ДЛЯ РОЗКЛАДУ ВИКЛАДАЧІВ ---
+
+
+def get_teacher_name_from_callback_data(callback_data: str, prefix: str) -> str:
+    """Отримує оригінальне ім'я викладача з callback_data, замінюючи підкреслення на пробіли."""
+
+    if not callback_data.startswith(prefix):
+
+        return ""
+
+    # Видаляємо префікс
+
+    name_part = callback_data[len(prefix) :]
+
+    # Замінюємо підкреслення на пробіли
+
+    return name_part.replace("_", " ")
+
+
+def normalize_teacher_name_for_matching(full_name: str) -> str:
+    """Нормалізує повне ім'я викладача для зіставлення зі скороченим."""
+
+    if not full_name:
+
+        return ""
+
+    # Розбиваємо на частини
+
+    parts = full_name.strip().split()
+
+    if len(parts) < 2:
+
+        return full_name.strip()
+
+    # Беремо прізвище та ініціали
+
+    surname = parts[0]
+
+    initials = ""
+
+    for part in parts[1:]:
+
+        if part and len(part) > 0:
+
+            initials += part[0].upper() + "."
+
+    return f"{surname} {initials}".strip()
+
+
+def find_teacher_lessons_in_schedule(teacher_full_name: str) -> list:
+    """Знаходить всі пари викладача в розкладі всіх груп (через нечіткий індекс імен)."""
+
+    schedule_data = get_cached_schedule()
+
+    if not schedule_data or "розклади_груп" not in schedule_data:
+
+        return []
+
+    resolved = resolve_teacher_name(teacher_full_name)
+
+    if not resolved:
+
+        return []
+
+    entry, _score = resolved
+
+    teacher_lessons = []
+
+    for schedule_name in sorted(entry["schedule_names"]):
+
+        teacher_lessons.extend(
+            lesson.copy() for lesson in teacher_lessons_by_schedule_name.get(schedule_name, [])
+        )
+
+    return teacher_lessons
+
+
+def _render_teacher_schedule_for_day(
+    teacher_full_name: str, day_name: str, week_type: str = "завжди"
+) -> str:
+    """Генерує розклад викладача на конкретний день та тип тижня.
+
+
+
+    Показує ВСІ пари по фіксованих слотах часу у правильному порядку.
+
+    Якщо в слоті немає пари, виводить "Немає пари". Без зайвих порожніх рядків.
+
+    """
+
+    lessons = find_teacher_lessons_in_schedule(teacher_full_name)
+
+    # Фільтруємо по дню та типу тижня
+
+    day_lessons = []
+
+    for lesson in lessons:
+
+        if lesson.get("день") == day_name:
+
+            lesson_week_type = lesson.get("тип_тижня", "завжди")
+
+            if lesson_week_type == "завжди" or lesson_week_type == week_type:
+
+                day_lessons.append(lesson)
+
+    response_header = f"👨‍🏫 Розклад *{teacher_full_name}* на *{day_name}* ({week_type}):\n\n"
+
+    # Якщо взагалі немає жодного запису на цей день і тип тижня
+
+    if not day_lessons:
+
+        return (
+            response_header
+            + "• 08:00-09:20 - Немає пари\n"
+            + "• 09:30-10:50 - Немає пари\n"
+            + "• 11:40-13:00 - Немає пари\n"
+            + "• 13:10-14:30 - Немає пари"
+        )
+
+    # Групуємо пари за часом
+
+    lessons_by_time: dict[str, list] = {}
+
+    for lesson in day_lessons:
+
+        time = lesson.get("час", "")
+
+        if time not in lessons_by_time:
+
+            lessons_by_time[time] = []
+
+        lessons_by_time[time].append(lesson)
+
+    # Фіксований порядок слотів часу
+
+    canonical_times = [
+        "08:00-09:20",
+        "09:30-10:50",
+        "11:40-13:00",
+        "13:10-14:30",
+    ]
+
+    lines: list[str] = []
+
+    for time in canonical_times:
+
+        time_lessons = lessons_by_time.get(time, [])
+
+        # Відкидаємо псевдо-записи типу "Немає пари"
+
+        real_lessons = [
+            lesson
+            for lesson in time_lessons
+            if lesson.get("назва", "").strip().lower() not in ["немає пари", "немає", "відсутня"]
+        ]
+
+        if real_lessons:
+
+            # Може бути кілька груп у той самий час – виводимо кожну окремо
+
+            for lesson in real_lessons:
+
+                subject = lesson.get("назва", "")
+
+                group = lesson.get("група", "")
+
+                room = lesson.get("аудиторія", "")
+
+                lines.append(f"• {time} - {subject}")
+
+                # Формуємо інформацію про аудиторію з поверхом
+
+                room_info = ""
+
+                if room:
+
+                    floor = get_floor_by_auditorium(room)
+
+                    if floor:
+
+                        room_info = f"🏢 Ауд. {room} ({floor})"
+
+                    else:
+
+                        room_info = f"🏢 Ауд. {room}"
+
+                else:
+
+                    room_info = "🏢 Ауд. -"
+
+                lines.append(f"  📚 Група: {group} | {room_info}")
+
+        else:
+
+            lines.append(f"• {time} - Немає пари")
+
+    return (response_header + "\n".join(lines)).strip()
+
+
+def _render_full_teacher_schedule(teacher_full_name: str) -> str:
+    """Генерує повний розклад викладача на тиждень."""
+
+    lessons = find_teacher_lessons_in_schedule(teacher_full_name)
+
+    if not lessons:
+
+        return f"👨‍🏫 У *{teacher_full_name}* немає пар в розкладі."
+
+    # Групуємо по днях та типах тижня
+
+    schedule_by_day = {}
+
+    for lesson in lessons:
+
+        day = lesson.get("день", "")
+
+        week_type = lesson.get("тип_тижня", "завжди")
+
+        if day not in schedule_by_day:
+
+            schedule_by_day[day] = {"завжди": [], "чисельник": [], "знаменник": []}
+
+        if week_type in schedule_by_day[day]:
+
+            schedule_by_day[day][week_type].append(lesson)
+
+    # Сортуємо пари по часу в кожному дні
+
+    for day_data in schedule_by_day.values():
+
+        for week_type_lessons in day_data.values():
+
+            week_type_lessons.sort(key=lambda x: x.get("час", ""))
+
+    # Формуємо відповідь
+
+    response = f"👨‍🏫 Повний розклад *{teacher_full_name}* на тиждень:\n\n"
+
+    days_order = ["понеділок", "вівторок", "середа", "четвер", "п'ятниця", "субота", "неділя"]
+
+    for day in days_order:
+
+        if day not in schedule_by_day:
+
+            continue
+
+        day_data = schedule_by_day[day]
+
+        has_lessons = any(day_data[wt] for wt in ["завжди", "чисельник", "знаменник"])
+
+        if not has_lessons:
+
+            continue
+
+        response += f"*{day.capitalize()}*:\n"
+
+        # Показуємо пари для кожного типу тижня
+
+        for week_type in ["завжди", "чисельник", "знаменник"]:
+
+            week_lessons = day_data.get(week_type, [])
+
+            if week_lessons:
+
+                week_type_display = (
+                    "Чисельник"
+                    if week_type == "чисельник"
+                    else "Знаменник" if week_type == "знаменник" else "Завжди"
+                )
+
+                response += f"  {week_type_display}:\n"
+
+                # Групуємо пари за часом
+
+                lessons_by_time = {}
+
+                for lesson in week_lessons:
+
+                    time = lesson.get("час", "")
+
+                    if time not in lessons_by_time:
+
+                        lessons_by_time[time] = []
+
+                    lessons_by_time[time].append(lesson)
+
+                # Сортуємо по часу
+
+                sorted_times = sorted(lessons_by_time.keys())
+
+                for time in sorted_times:
+
+                    time_lessons = lessons_by_time[time]
+
+                    # Перевіряємо, чи є реальні пари (не "Немає пари")
+
+                    real_lessons = [
+                        lesson
+                        for lesson in time_lessons
+                        if lesson.get("назва", "").strip().lower()
+                        not in ["немає пари", "немає", "відсутня"]
+                    ]
+
+                    if real_lessons:
+
+                        # Показуємо реальні пари
+
+                        for lesson in real_lessons:
+
+                            subject = lesson.get("назва", "")
+
+                            group = lesson.get("група", "")
+
+                            room = lesson.get("аудиторія", "")
+
+                            response += f"    • {time} - {subject} | {group} | Ауд. {room}\n"
+
+                    else:
+
+                        # Якщо тільки "Немає пари", показуємо один раз
+
+                        response += f"    • {time} - Немає пари\n"
+
+        response += "\n"
+
+    return response.strip()
+
+
+def _render_teacher_schedule_by_week_type(teacher_full_name: str, week_type: str) -> str:
+    """Генерує розклад викладача на конкретний тип тижня."""
+
+    lessons = find_teacher_lessons_in_schedule(teacher_full_name)
+
+    # Фільтруємо по типу тижня
+
+    filtered_lessons = []
+
+    for lesson in lessons:
+
+        lesson_week_type = lesson.get("тип_тижня", "завжди")
+
+        if lesson_week_type == "завжди" or lesson_week_type == week_type:
+
+            filtered_lessons.append(lesson)
+
+    if not filtered_lessons:
+
+        week_type_display = (
+            "Чисельник"
+            if week_type == "чисельник"
+            else "Знаменник" if week_type == "знаменник" else week_type
+        )
+
+        return f"👨‍🏫 У *{teacher_full_name}* немає пар на *{week_type_display}*."
+
+    # Групуємо по днях
+
+    schedule_by_day = {}
+
+    for lesson in filtered_lessons:
+
+        day = lesson.get("день", "")
+
+        if day not in schedule_by_day:
+
+            schedule_by_day[day] = []
+
+        schedule_by_day[day].append(lesson)
+
+    # Сортуємо пари по часу в кожному дні
+
+    for day_lessons in schedule_by_day.values():
+
+        day_lessons.sort(key=lambda x: x.get("час", ""))
+
+    # Формуємо відповідь
+
+    week_type_display = (
+        "Чисельник"
+        if week_type == "чисельник"
+        else "Знаменник" if week_type == "знаменник" else week_type
+    )
+
+    response = f"👨‍🏫 Розклад *{teacher_full_name}* на *{week_type_display}*:\n\n"
+
+    days_order = ["понеділок", "вівторок", "середа", "четвер", "п'ятниця", "субота", "неділя"]
+
+    for day in days_order:
+
+        if day not in schedule_by_day:
+
+            continue
+
+        day_lessons = schedule_by_day[day]
+
+        if not day_lessons:
+
+            continue
+
+        response += f"*{day.capitalize()}*:\n"
+
+        # Групуємо пари за часом
+
+        lessons_by_time = {}
+
+        for lesson in day_lessons:
+
+            time = lesson.get("час", "")
+
+            if time not in lessons_by_time:
+
+                lessons_by_time[time] = []
+
+            lessons_by_time[time].append(lesson)
+
+        # Сортуємо по часу
+
+        sorted_times = sorted(lessons_by_time.keys())
+
+        for time in sorted_times:
+
+            time_lessons = lessons_by_time[time]
+
+            # Перевіряємо, чи є реальні пари (не "Немає пари")
+
+            real_lessons = [
+                lesson
+                for lesson in time_lessons
+                if lesson.get("назва", "").strip().lower()
+                not in ["немає пари", "немає", "відсутня"]
+            ]
+
+            if real_lessons:
+
+                # Показуємо реальні пари
+
+                for lesson in real_lessons:
+
+                    subject = lesson.get("назва", "")
+
+                    group = lesson.get("група", "")
+
+                    room = lesson.get("аудиторія", "")
+
+                    response += f"  • {time} - {subject} | {group} | Ауд. {room}\n"
+
+            else:
+
+                # Якщо тільки "Немає пари", показуємо один раз
+
+                response += f"  • {time} - Немає пари\n"
+
+        response += "\n"
+
+    return response.strip()
+
+
+# --- КЛАВІАТУРИ ДЛЯ РОЗКЛАДУ ВИКЛАДАЧА ---
+
+
+# --- Кешовані версії розкладу викладача (скидаються при перезавантаженні розкладу) ---
+
+
+def get_teacher_schedule_for_day(
+    teacher_full_name: str, day_name: str, week_type: str = "завжди"
+) -> str:
+
+    return get_cached_render(
+        "teacher_day",
+        (teacher_full_name, day_name, week_type),
+        lambda: _render_teacher_schedule_for_day(teacher_full_name, day_name, week_type),
+    )
+
+
+def get_full_teacher_schedule(teacher_full_name: str) -> str:
+
+    return get_cached_render(
+        "teacher_full",
+        (teacher_full_name,),
+        lambda: _render_full_teacher_schedule(teacher_full_name),
+    )
+
+
+def get_teacher_schedule_by_week_type(teacher_full_name: str, week_type: str) -> str:
+
+    return get_cached_render(
+        "teacher_week",
+        (teacher_full_name, week_type),
+        lambda: _render_teacher_schedule_by_week_type(teacher_full_name, week_type),
+    )
+
+
+def get_teacher_schedule_menu_keyboard(teacher_id: int) -> InlineKeyboardMarkup:
+    """Створює клавіатуру меню розкладу викладача."""
+
+    keyboard = [
+        [InlineKeyboardButton("📅 Розклад на сьогодні", callback_data=f"t_today_{teacher_id}")],
+        [
+            InlineKeyboardButton(
+                "📋 Повний розклад на тиждень", callback_data=f"t_full_{teacher_id}"
+            )
+        ],
+        [
+            InlineKeyboardButton(
+                "🔍 Розклад на конкретний день", callback_data=f"t_day_schedule_{teacher_id}"
+            )
+        ],
+        [
+            InlineKeyboardButton(
+                "📆 Експорт у календар (.ics)", callback_data=f"export_ics_teacher_{teacher_id}"
+            )
+        ],
+        [InlineKeyboardButton("⬅️ Назад до меню викладача", callback_data="back_to_main_menu")],
+    ]
+
+    return InlineKeyboardMarkup(keyboard)
+
+
+# ДОДАНО: вибір курсу для викладача (перед вибором групи)
+
+
+def get_teacher_course_selection_keyboard() -> InlineKeyboardMarkup:
+
+    keyboard = [
+        [InlineKeyboardButton("Курс 1", callback_data="teacher_select_course_1")],
+        [InlineKeyboardButton("Курс 2", callback_data="teacher_select_course_2")],
+        [InlineKeyboardButton("Курс 3", callback_data="teacher_select_course_3")],
+        [InlineKeyboardButton("Курс 4", callback_data="teacher_select_course_4")],
+        [InlineKeyboardButton("⬅️ Назад до меню викладача", callback_data="back_to_main_menu")],
+    ]
+
+    return InlineKeyboardMarkup(keyboard)
+
+
+# ДОДАНО: вибір груп для викладача з фільтрацією за курсом
+
+
+def get_teacher_group_selection_keyboard_by_course(selected_course: int) -> InlineKeyboardMarkup:
+
+    all_groups = get_all_group_names_from_cache()
+
+    if not all_groups:
+
+        return InlineKeyboardMarkup(
+            [
+                [InlineKeyboardButton("Немає доступних груп", callback_data="no_groups_available")],
+                [
+                    InlineKeyboardButton(
+                        "⬅️ Назад до вибору курсу", callback_data="teacher_any_group_schedule"
+                    )
+                ],
+            ]
+        )
+
+    course_year_map = get_course_year_suffixes()
+
+    target_year = course_year_map.get(selected_course, course_year_map[1])
+
+    filtered_groups = [
+        group
+        for group in all_groups
+        if group.endswith(f"-{target_year}") or f"-{target_year} (" in group
+    ]
+
+    if not filtered_groups:
+
+        return InlineKeyboardMarkup(
+            [
+                [
+                    InlineKeyboardButton(
+                        f"Немає груп для {selected_course} курсу",
+                        callback_data="no_groups_available",
+                    )
+                ],
+                [
+                    InlineKeyboardButton(
+                        "⬅️ Назад до вибору курсу", callback_data="teacher_any_group_schedule"
+                    )
+                ],
+            ]
+        )
+
+    keyboard = []
+
+    row = []
+
+    for group_name in filtered_groups:
+
+        row.append(
+            InlineKeyboardButton(group_name, callback_data=f"teacher_view_group_{group_name}")
+        )
+
+        if len(row) == 3:
+
+            keyboard.append(row)
+
+            row = []
+
+    if row:
+
+        keyboard.append(row)
+
+    keyboard.append(
+        [
+            InlineKeyboardButton(
+                "⬅️ Назад до вибору курсу", callback_data="teacher_any_group_schedule"
+            )
+        ]
+    )
+
+    return InlineKeyboardMarkup(keyboard)
+
+
+def get_teacher_day_selection_keyboard(teacher_id: int) -> InlineKeyboardMarkup:
+    """Створює клавіатуру вибору дня тижня для розкладу викладача."""
+
+    days = ["понеділок", "вівторок", "середа", "четвер", "п'ятниця"]
+
+    keyboard = []
+
+    for day in days:
+
+        # Використовуємо коротші назви днів
+
+        day_short = {
+            "понеділок": "mon",
+            "вівторок": "tue",
+            "середа": "wed",
+            "четвер": "thu",
+            "п'ятниця": "fri",
+        }.get(day, day)
+
+        keyboard.append(
+            [
+                InlineKeyboardButton(
+                    day.capitalize(), callback_data=f"t_day_{day_short}_{teacher_id}"
+                )
+            ]
+        )
+
+    keyboard.append([InlineKeyboardButton("⬅️ Назад", callback_data=f"t_menu_{teacher_id}")])
+
+    return InlineKeyboardMarkup(keyboard)
+
+
+def get_teacher_week_type_selection_keyboard(
+    day_short: str, teacher_id: int
+) -> InlineKeyboardMarkup:
+    """Створює клавіатуру вибору типу тижня для розкладу викладача."""
+
+    keyboard = [
+        [InlineKeyboardButton("Чисельник", callback_data=f"t_week_num_{day_short}_{teacher_id}")],
+        [InlineKeyboardButton("Знаменник", callback_data=f"t_week_den_{day_short}_{teacher_id}")],
+        [InlineKeyboardButton("⬅️ Назад", callback_data=f"t_day_schedule_{teacher_id}")],
+    ]
+
+    return InlineKeyboardMarkup(keyboard)
+
+
+# --- ОБРОБНИКИ ДЛЯ РОЗКЛАДУ ВИКЛАДАЧА ---
+
+
+async def teacher_my_schedule_handler(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+    """Показує меню розкладу викладача."""
+
+    query = update.callback_query
+
+    if not query or not query.from_user:
+
+        logger.warning("teacher_my_schedule_handler викликано без query або from_user")
+
+        return
+
+    # Отримуємо teacher_id з callback_data або з user.id
+
+    callback_data = query.data
+
+    if callback_data and callback_data.startswith("t_menu_"):
+
+        teacher_id = int(callback_data.replace("t_menu_", ""))
+
+    else:
+
+        teacher_id = query.from_user.id
+
+    teacher_data = get_teacher_data_from_db(teacher_id)
+
+    if not teacher_data:
+
+        await query.answer("Ви не зареєстровані як викладач.", show_alert=True)
+
+        return
+
+    teacher_name = teacher_data.get("full_name", "")
+
+    if not teacher_name:
+
+        await query.answer("У вас не вказано повне ім'я.", show_alert=True)
+
+        return
+
+    text = f"👨‍🏫 Меню розкладу для *{teacher_name}*\n\nОберіть тип розкладу:"
+
+    reply_markup = get_teacher_schedule_menu_keyboard(teacher_id)
+
+    await query.edit_message_text(text, reply_markup=reply_markup, parse_mode="Markdown")
+
+
+# ДОДАНО: обробник вибору курсу викладачем для перегляду будь-якої групи
+
+
+async def teacher_select_course_for_any_group_handler(
+    update: Update, context: ContextTypes.DEFAULT_TYPE
+) -> None:
+
+    query = update.callback_query
+
+    if not query or not query.data.startswith("teacher_select_course_"):
+
+        return
+
+    await query.answer()
+
+    try:
+
+        course_number = int(query.data.replace("teacher_select_course_", ""))
+
+    except ValueError:
+
+        await query.answer("Невірний курс.", show_alert=True)
+
+        return
+
+    text = f"🔍 Оберіть групу для перегляду (курс {course_number}):"
+
+    reply_markup = get_teacher_group_selection_keyboard_by_course(course_number)
+
+    await query.edit_message_text(text, reply_markup=reply_markup, parse_mode="Markdown")
+
+
+async def show_teacher_today_schedule_handler(
+    update: Update, context: ContextTypes.DEFAULT_TYPE
+) -> None:
+    """Показує розклад викладача на сьогодні."""
+
+    query = update.callback_query
+
+    if not query or not query.from_user:
+
+        logger.warning("show_teacher_today_schedule_handler викликано без query або from_user")
+
+        return
+
+    # Отримуємо teacher_id з callback_data
+
+    callback_data = query.data
+
+    if not callback_data or not callback_data.startswith("t_today_"):
+
+        logger.warning(f"Неправильний callback_data: {callback_data}")
+
+        return
+
+    teacher_id = int(callback_data.replace("t_today_", ""))
+
+    teacher_data = get_teacher_data_from_db(teacher_id)
+
+    if not teacher_data:
+
+        await query.answer("Викладач не знайдений.", show_alert=True)
+
+        return
+
+    teacher_name = teacher_data.get("full_name", "")
+
+    if not teacher_name:
+
+        await query.answer("У викладача не вказано повне ім'я.", show_alert=True)
+
+        return
+
+    # Визначаємо поточний день та тип тижня
+
+    current_date = datetime.now()
+
+    current_weekday = current_date.weekday()  # 0 = понеділок, 6 = неділя
+
+    days = ["понеділок", "вівторок", "середа", "четвер", "п'ятниця", "субота", "неділя"]
+
+    current_day = days[current_weekday]
+
+    current_week_type = get_current_week_type_for_schedule(current_date)
+
+    # Генеруємо розклад на сьогодні
+
+    schedule_text = get_teacher_schedule_for_day(teacher_name, current_day, current_week_type)
+
+    reply_markup = InlineKeyboardMarkup(
+        [[InlineKeyboardButton("⬅️ Назад до меню розкладу", callback_data=f"t_menu_{teacher_id}")]]
+    )
+
+    await query.edit_message_text(schedule_text, reply_markup=reply_markup, parse_mode="Markdown")
+
+
+async def show_teacher_full_schedule_handler(
+    update: Update, context: ContextTypes.DEFAULT_TYPE
+) -> None:
+    """Показує повний розклад викладача на тиждень."""
+
+    query = update.callback_query
+
+    if not query or not query.from_user:
+
+        logger.warning("show_teacher_full_schedule_handler викликано без query або from_user")
+
+        return
+
+    # Отримуємо teacher_id з callback_data
+
+    callback_data = query.data
+
+    if not callback_data or not callback_data.startswith("t_full_"):
+
+        logger.warning(f"Неправильний callback_data: {callback_data}")
+
+        return
+
+    teacher_id = int(callback_data.replace("t_full_", ""))
+
+    teacher_data = get_teacher_data_from_db(teacher_id)
+
+    if not teacher_data:
+
+        await query.answer("Викладач не знайдений.", show_alert=True)
+
+        return
+
+    teacher_name = teacher_data.get("full_name", "")
+
+    if not teacher_name:
+
+        await query.answer("У викладача не вказано повне ім'я.", show_alert=True)
+
+        return
+
+    # Генеруємо повний розклад
+
+    schedule_text = get_full_teacher_schedule(teacher_name)
+
+    reply_markup = InlineKeyboardMarkup(
+        [[InlineKeyboardButton("⬅️ Назад до меню розкладу", callback_data=f"t_menu_{teacher_id}")]]
+    )
+
+    await query.edit_message_text(schedule_text, reply_markup=reply_markup, parse_mode="Markdown")
+
+
+async def find_teacher_command_handler(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+    """/find_teacher <ПІБ> - нечіткий пошук викладача за іменем."""
+
+    update_command_stats("/find_teacher")
+
+    query_text = " ".join(context.args) if context.args else ""
+
+    if not query_text.strip():
+
+        await update.message.reply_text(
+            "Використання: `/find_teacher Прізвище [Ім'я По батькові]`", parse_mode="Markdown"
+        )
+
+        return
+
+    started_at = time.perf_counter()
+
+    matches = search_teachers_fuzzy(query_text, limit=5)
+
+    logger.debug(
+        f"Пошук викладача '{query_text}': {len(matches)} збігів за "
+        f"{(time.perf_counter() - started_at) * 1000:.3f} мс"
+    )
+
+    if not matches:
+
+        await update.message.reply_text(f"🔍 Викладача «{query_text}» не знайдено.")
+
+        return
+
+    keyboard = []
+
+    for idx, score in matches:
+
+        entry = teacher_index_entries[idx]
+
+        keyboard.append(
+            [
+                InlineKeyboardButton(
+                    f"👨‍🏫 {entry['display_name']} ({score:.0%})",
+                    callback_data=f"ft_{teacher_index_version}_{idx}",
+                )
+            ]
+        )
+
+    await update.message.reply_text(
+        f"🔍 Результати пошуку «{query_text}»:", reply_markup=InlineKeyboardMarkup(keyboard)
+    )
+
+
+async def find_teacher_result_handler(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+    """Показує повний розклад викладача, обраного з результатів /find_teacher."""
+
+    query = update.callback_query
+
+    try:
+
+        _, version_str, idx_str = query.data.split("_")
+
+        version, idx = int(version_str), int(idx_str)
+
+    except ValueError:
+
+        logger.warning(f"Неправильний callback_data: {query.data}")
+
+        return
+
+    if version != teacher_index_version or idx >= len(teacher_index_entries):
+
+        await query.edit_message_text(
+            "Розклад або список викладачів оновлено, результати пошуку застаріли. "
+            "Повторіть /find_teacher."
+        )
+
+        return
+
+    entry = teacher_index_entries[idx]
+
+    schedule_text = get_full_teacher_schedule(entry["display_name"])
+
+    await query.edit_message_text(schedule_text, parse_mode="Markdown")
+
+
+async def show_teacher_day_schedule_handler(
+    update: Update, context: ContextTypes.DEFAULT_TYPE
+) -> None:
+    """Показує меню вибору дня тижня для розкладу викладача."""
+
+    query = update.callback_query
+
+    if not query or not query.from_user:
+
+        logger.warning("show_teacher_day_schedule_handler викликано без query або from_user")
+
+        return
+
+    # Отримуємо teacher_id з callback_data
+
+    callback_data = query.data
+
+    if not callback_data or not callback_data.startswith("t_day_schedule_"):
+
+        logger.warning(f"Неправильний callback_data: {callback_data}")
+
+        return
+
+    teacher_id = int(callback_data.replace("t_day_schedule_", ""))
+
+    teacher_data = get_teacher_data_from_db(teacher_id)
+
+    if not teacher_data:
+
+        await query.answer("Викладач не знайдений.", show_alert=True)
+
+        return
+
+    teacher_name = teacher_data.get("full_name", "")
+
+    if not teacher_name:
+
+        await query.answer("У викладача не вказано повне ім'я.", show_alert=True)
+
+        return
+
+    text = f"👨‍🏫 Оберіть день тижня для розкладу *{teacher_name}*:"
+
+    reply_markup = get_teacher_day_selection_keyboard(teacher_id)
+
+    await query.edit_message_text(text, reply_markup=reply_markup, parse_mode="Markdown")
+
+
+async def show_teacher_specific_day_schedule_handler(
+    update: Update, context: ContextTypes.DEFAULT_TYPE
+) -> None:
+    """Показує меню вибору типу тижня для конкретного дня."""
+
+    query = update.callback_query
+
+    if not query or not query.from_user:
+
+        logger.warning(
+            "show_teacher_specific_day_schedule_handler викликано без query або from_user"
+        )
+
+        return
+
+    user = query.from_user
+
+    teacher_data = get_teacher_data_from_db(user.id)
+
+    if not teacher_data:
+
+        await query.answer("Ви не зареєстровані як викладач.", show_alert=True)
+
+        return
+
+    teacher_name = teacher_data.get("full_name", "")
+
+    if not teacher_name:
+
+        await query.answer("У вас не вказано повне ім'я.", show_alert=True)
+
+        return
+
+    # Отримуємо дані з callback_data
+
+    callback_data = query.data
+
+    if not callback_data or not callback_data.startswith("t_day_"):
+
+        logger.warning(f"Неправильний callback_data: {callback_data}")
+
+        return
+
+    # Формат: t_day_{day_short}_{teacher_id}
+
+    parts = callback_data.split("_")
+
+    if len(parts) < 4:
+
+        logger.warning(f"Неправильний формат callback_data: {callback_data}")
+
+        return
+
+    day_short = parts[2]  # Коротка назва дня
+
+    teacher_id = int(parts[3])  # ID викладача
+
+    # Переводимо коротку назву в повну
+
+    day_names = {
+        "mon": "понеділок",
+        "tue": "вівторок",
+        "wed": "середа",
+        "thu": "четвер",
+        "fri": "п'ятниця",
+        "sat": "субота",
+        "sun": "неділя",
+    }
+
+    day_name = day_names.get(day_short, day_short)
+
+    text = f"👨‍🏫 Оберіть тип тижня для *{day_name}* (*{teacher_name}*):"
+
+    reply_markup = get_teacher_week_type_selection_keyboard(day_short, teacher_id)
+
+    await query.edit_message_text(text, reply_markup=reply_markup, parse_mode="Markdown")
+
+
+async def show_teacher_final_day_schedule_handler(
+    update: Update, context: ContextTypes.DEFAULT_TYPE
+) -> None:
+    """Показує фінальний розклад викладача на конкретний день та тип тижня."""
+
+    query = update.callback_query
+
+    if not query or not query.from_user:
+
+        logger.warning("show_teacher_final_day_schedule_handler викликано без query або from_user")
+
+        return
+
+    user = query.from_user
+
+    teacher_data = get_teacher_data_from_db(user.id)
+
+    if not teacher_data:
+
+        await query.answer("Ви не зареєстровані як викладач.", show_alert=True)
+
+        return
+
+    teacher_name = teacher_data.get("full_name", "")
+
+    if not teacher_name:
+
+        await query.answer("У вас не вказано повне ім'я.", show_alert=True)
+
+        return
+
+    # Отримуємо дані з callback_data
+
+    callback_data = query.data
+
+    if not callback_data or not callback_data.startswith("t_week_"):
+
+        logger.warning(f"Неправильний callback_data: {callback_data}")
+
+        return
+
+    # Формат: t_week_{num/den}_{day_short}_{teacher_id}
+
+    parts = callback_data.split("_")
+
+    if len(parts) < 5:
+
+        logger.warning(f"Неправильний формат callback_data: {callback_data}")
+
+        return
+
+    week_type_short = parts[2]  # num або den
+
+    day_short = parts[3]  # Коротка назва дня
+
+    teacher_id = int(parts[4])  # ID викладача
+
+    # Переводимо короткі назви в повні
+
+    week_type = "чисельник" if week_type_short == "num" else "знаменник"
+
+    day_names = {
+        "mon": "понеділок",
+        "tue": "вівторок",
+        "wed": "середа",
+        "thu": "четвер",
+        "fri": "п'ятниця",
+        "sat": "субота",
+        "sun": "неділя",
+    }
+
+    day_name = day_names.get(day_short, day_short)
+
+    # Генеруємо розклад
+
+    schedule_text = get_teacher_schedule_for_day(teacher_name, day_name, week_type)
+
+    reply_markup = InlineKeyboardMarkup(
+        [[InlineKeyboardButton("⬅️ Назад до меню розкладу", callback_data=f"t_menu_{teacher_id}")]]
+    )
+
+    await query.edit_message_text(schedule_text, reply_markup=reply_markup, parse_mode="Markdown")
+
+
+async def teacher_view_group_schedule_handler(
+    update: Update, context: ContextTypes.DEFAULT_TYPE
+) -> None:
+
+    query = update.callback_query
+
+    if not query or not query.from_user:
+
+        logger.warning("teacher_view_group_schedule_handler викликано без query або from_user")
+
+        return
+
+    # Отримуємо назву групи з callback_data
+
+    callback_data = query.data
+
+    if not callback_data or not callback_data.startswith("teacher_view_group_"):
+
+        logger.warning(f"Неправильний callback_data: {callback_data}")
+
+        return
+
+    group_name = callback_data.replace("teacher_view_group_", "")
+
+    group_schedule_data = get_schedule_data_for_group(group_name)
+
+    if not group_schedule_data:
+
+        await query.answer(f"На жаль, розклад для групи {group_name} не знайдено.", show_alert=True)
+
+        return
+
+    # Зберігаємо групу в контексті для подальшого використання
+
+    if context.user_data is None:
+
+        context.user_data = {}
+
+    context.user_data["teacher_viewing_group"] = group_name
+
+    context.user_data["teacher_viewing_any_group"] = True
+
+    text = f"📅 Меню розкладу для групи: *{group_name}*.\nОберіть пункт:"
+
+    reply_markup = get_schedule_menu_keyboard(group_name)
+
+    await query.edit_message_text(text, reply_markup=reply_markup, parse_mode="Markdown")
+
+
+def get_schedule_menu_keyboard(user_group: str | None) -> InlineKeyboardMarkup:
+
+    if not user_group:
+
+        return InlineKeyboardMarkup(
+            [
+                [
+                    InlineKeyboardButton(
+                        "Будь ласка, спочатку оберіть групу",
+                        callback_data="change_set_group_prompt",
+                    )
+                ],
+                [
+                    InlineKeyboardButton(
+                        "⬅️ Назад до головного меню", callback_data="back_to_main_menu"
+                    )
+                ],
+            ]
+        )
+
+    buttons = [
+        [
+            InlineKeyboardButton("Сьогодні", callback_data="get_schedule_today"),
+            InlineKeyboardButton("Завтра", callback_data="get_schedule_tomorrow"),
+        ],
+        [InlineKeyboardButton("⏱ Що зараз / що далі", callback_data="get_schedule_now")],
+        [
+            InlineKeyboardButton(
+                "Обрати день (поточний тиждень)", callback_data="show_day_schedule_menu"
+            )
+        ],
+        [
+            InlineKeyboardButton(
+                "Обрати день + тип тижня", callback_data="select_specific_day_and_type"
+            )
+        ],
+        [InlineKeyboardButton("Розклад дзвінків", callback_data="get_call_schedule")],
+        [InlineKeyboardButton("Повний розклад (по групі)", callback_data="get_full_schedule_all")],
+        [InlineKeyboardButton("📆 Експорт у календар (.ics)", callback_data="export_ics_group")],
+        [InlineKeyboardButton("⬅️ Назад до головного меню", callback_data="back_to_main_menu")],
+    ]
+
+    return InlineKeyboardMarkup(buttons)
+
+
+def get_day_schedule_menu_keyboard() -> InlineKeyboardMarkup:
+
+    return InlineKeyboardMarkup(
+        [
+            [
+                InlineKeyboardButton("Пн", callback_data="get_schedule_day_понеділок"),
+                InlineKeyboardButton("Вт", callback_data="get_schedule_day_вівторок"),
+                InlineKeyboardButton("Ср", callback_data="get_schedule_day_середа"),
+            ],
+            [
+                InlineKeyboardButton("Чт", callback_data="get_schedule_day_четвер"),
+                InlineKeyboardButton("Пт", callback_data="get_schedule_day_п'ятниця"),
+            ],
+            [InlineKeyboardButton("⬅️ Назад до меню розкладу", callback_data="show_schedule_menu")],
+        ]
+    )
+
+
+def get_specific_day_selection_keyboard() -> InlineKeyboardMarkup:
+
+    keyboard = [
+        [
+            InlineKeyboardButton("Пн", callback_data="chose_day_понеділок"),
+            InlineKeyboardButton("Вт", callback_data="chose_day_вівторок"),
+            InlineKeyboardButton("Ср", callback_data="chose_day_середа"),
+        ],
+        [
+            InlineKeyboardButton("Чт", callback_data="chose_day_четвер"),
+            InlineKeyboardButton("Пт", callback_data="chose_day_п'ятниця"),
+        ],
+        [InlineKeyboardButton("⬅️ Назад до меню розкладу", callback_data="show_schedule_menu")],
+    ]
+
+    return InlineKeyboardMarkup(keyboard)
+
+
+def get_week_type_selection_keyboard(day_name: str) -> InlineKeyboardMarkup:
+
+    keyboard = [
+        [
+            InlineKeyboardButton(
+                "Чисельник", callback_data=f"show_day_explicit_{day_name}_чисельник"
+            )
+        ],
+        [
+            InlineKeyboardButton(
+                "Знаменник", callback_data=f"show_day_explicit_{day_name}_знаменник"
+            )
+        ],
+        [
+            InlineKeyboardButton(
+                "⬅️ Назад до вибору дня", callback_data="select_specific_day_and_type"
+            )
+        ],
+    ]
+
+    return InlineKeyboardMarkup(keyboard)
+
+
+def get_raffle_menu_keyboard(user_id: int) -> InlineKeyboardMarkup:
+
+    buttons = []
+
+    user_is_participant = get_raffle_participant_status(user_id)
+
+    if user_is_participant:
+
+        buttons.append(
+            [
+                InlineKeyboardButton(
+                    "✅ Ви вже берете участь!", callback_data="raffle_already_joined"
+                )
+            ]
+        )
+
+    else:
+
+        buttons.append(
+            [
+                InlineKeyboardButton(
+                    "🎉 Взяти участь у розіграші", callback_data="raffle_join_prompt"
+                )
+            ]
+        )
+
+    buttons.append(
+        [InlineKeyboardButton("⬅️ Назад до головного меню", callback_data="back_to_main_menu")]
+    )
+
+    return InlineKeyboardMarkup(buttons)
+
+
+def get_raffle_join_confirmation_keyboard() -> InlineKeyboardMarkup:
+
+    return InlineKeyboardMarkup(
+        [
+            [InlineKeyboardButton("Так, підтверджую", callback_data="raffle_confirm_join")],
+            [InlineKeyboardButton("Скасувати", callback_data="back_to_raffle_menu")],
+        ]
+    )
+
+
+def get_raffle_referral_success_keyboard() -> InlineKeyboardMarkup:
+
+    return InlineKeyboardMarkup(
+        [
+            [InlineKeyboardButton("🎉 Продовжити", callback_data="raffle_continue_after_referral")],
+            [
+                InlineKeyboardButton(
+                    "⬅️ Назад до меню розіграшу", callback_data="back_to_raffle_menu"
+                )
+            ],
+        ]
+    )
+
+
+def get_back_to_raffle_menu_keyboard() -> InlineKeyboardMarkup:
+
+    return InlineKeyboardMarkup(
+        [[InlineKeyboardButton("⬅️ Назад до меню розіграшу", callback_data="back_to_raffle_menu")]]
+    )
+
+
+def get_admin_panel_keyboard() -> InlineKeyboardMarkup:
+
+    keyboard = [
+        [InlineKeyboardButton("📢 Оголошення", callback_data="admin_announce_start")],
+        [InlineKeyboardButton("📨 Черга розсилок", callback_data="admin_broadcast_jobs")],
+        [
+            InlineKeyboardButton(
+                "🕒 Заплановані оголошення", callback_data="admin_scheduled_announcements"
+            )
+        ],
+        [InlineKeyboardButton("🖥️ Статус сервера", callback_data="admin_server_status")],
+        [InlineKeyboardButton("⚙️ Режим обслуговування", callback_data="admin_maintenance_menu")],
+        [InlineKeyboardButton("📬 Переглянути DLQ", callback_data="view_dlq_callback")],
+        [InlineKeyboardButton("🗑️ Очистити DLQ", callback_data="admin_clear_dlq")],
+        [InlineKeyboardButton("📊 Статистика бота", callback_data="admin_show_stats")],
+        # [InlineKeyboardButton("📢 Оголошення", callback_data='admin_announce_start')],  <-- Я ВИДАЛИВ ДУБЛІКАТ
+        [InlineKeyboardButton("👨‍🏫 Керування викладачами", callback_data="admin_manage_teachers")],
+        [
+            InlineKeyboardButton(
+                "🔄 Очистити кеш розкладу (пам'ять)", callback_data="admin_clear_schedule_cache"
+            )
+        ],
+        [
+            InlineKeyboardButton(
+                "🔄 Перезавантажити розклад з JSON", callback_data="admin_reload_schedule_json"
+            )
+        ],
+        [
+            InlineKeyboardButton(
+                "⚠️ Конфлікти розкладу", callback_data="admin_schedule_conflicts"
+            )
+        ],
+        [
+            InlineKeyboardButton(
+                "📥 Завантажити локальну БД (користувачі)", callback_data="admin_download_local_db"
+            )
+        ],
+        # [InlineKeyboardButton("🏆 Обрати переможця розіграшу", callback_data='admin_pick_raffle_winner')] <-- І КНОПКУ РОЗІГРАШУ
+    ]
+
+    if ENABLE_FTP_SYNC:
+
+        keyboard.append(
+            [
+                InlineKeyboardButton(
+                    "💾 Завантажити БД користувачів на FTP", callback_data="admin_upload_db_to_ftp"
+                )
+            ]
+        )
+
+    keyboard.append(
+        [InlineKeyboardButton("⬅️ Назад до головного меню", callback_data="back_to_main_menu")]
+    )
+
+    return InlineKeyboardMarkup(keyboard)
+
+
+# ЗАМІНІТЬ СТАРУ ФУНКЦІЮ get_group_selection_keyboard НА ЦЮ
+
+
+def get_group_selection_keyboard(
+    page: int = 0, page_size: int = 9, registration_flow: bool = False, selected_course: int = None
+) -> InlineKeyboardMarkup:
+
+    all_groups = get_all_group_names_from_cache()
+
+    if not all_groups:
+
+        # Кнопка "Назад" тут також має бути динамічною
+
+        back_button = (
+            InlineKeyboardButton(
+                "⬅️ Назад до вибору курсу", callback_data="back_to_course_selection"
+            )
+            if registration_flow
+            else InlineKeyboardButton("⬅️ Назад", callback_data="back_to_main_menu")
+        )
+
+        return InlineKeyboardMarkup(
+            [
+                [InlineKeyboardButton("Немає доступних груп", callback_data="no_groups_available")],
+                [back_button],
+            ]
+        )
+
+    # Фільтруємо групи за курсом, якщо він вказаний
+
+    if selected_course is not None:
+
+        # Визначаємо рік набору за курсом (у 2025/26: 1 курс = 25, 2 курс = 24, ...)
+
+        course_year_map = get_course_year_suffixes()
+
+        target_year = course_year_map.get(selected_course, course_year_map[1])
+
+        # Фільтруємо групи, що закінчуються на рік або містять рік з підгрупами
+
+        filtered_groups = [
+            group
+            for group in all_groups
+            if group.endswith(f"-{target_year}") or f"-{target_year} (" in group
+        ]
+
+        all_groups = filtered_groups
+
+    if not all_groups:
+
+        back_button = (
+            InlineKeyboardButton(
+                "⬅️ Назад до вибору курсу", callback_data="back_to_course_selection"
+            )
+            if registration_flow
+            else InlineKeyboardButton("⬅️ Назад", callback_data="back_to_main_menu")
+        )
+
+        return InlineKeyboardMarkup(
+            [
+                [
+                    InlineKeyboardButton(
+                        f"Немає груп для {selected_course} курсу",
+                        callback_data="no_groups_available",
+                    )
+                ],
+                [back_button],
+            ]
+        )
+
+    display_page_size = 50
+
+    groups_on_page = all_groups[0:display_page_size]
+
+    keyboard = []
+
+    row = []
+
+    for group_name in groups_on_page:
+
+        row.append(InlineKeyboardButton(group_name, callback_data=f"set_group_{group_name}"))
+
+        if len(row) == 3:
+
+            keyboard.append(row)
+
+            row = []
+
+    if row:
+
+        keyboard.append(row)
+
+    # Ось ключова зміна: ми обираємо кнопку "Назад" залежно від контексту
+
+    # ... всередині get_group_selection_keyboard()
+
+    if registration_flow:
+
+        # Під час реєстрації кнопка повертає до вибору курсу
+
+        keyboard.append(
+            [
+                InlineKeyboardButton(
+                    "⬅️ Назад до вибору курсу", callback_data="back_to_course_selection"
+                )
+            ]
+        )
+
+    else:
+
+        # Додаємо кнопку для повернення на самий початок
+
+        keyboard.append(
+            [
+                InlineKeyboardButton(
+                    "↩️ Почати реєстрацію з початку", callback_data="back_to_role_selection"
+                )
+            ]
+        )
+
+        # При зміні групи з головного меню, кнопка повертає в головне меню
+
+        keyboard.append([InlineKeyboardButton("⬅️ Скасувати", callback_data="back_to_main_menu")])
+
+    return InlineKeyboardMarkup(keyboard)
+
+
+def get_back_to_schedule_menu_keyboard() -> InlineKeyboardMarkup:
+
+    return InlineKeyboardMarkup(
+        [[InlineKeyboardButton("⬅️ Назад до меню розкладу", callback_data="show_schedule_menu")]]
+    )
+
+
+def get_back_to_teacher_menu_keyboard() -> InlineKeyboardMarkup:
+
+    return InlineKeyboardMarkup(
+        [[InlineKeyboardButton("⬅️ Назад до меню викладача", callback_data="back_to_main_menu")]]
+    )
+
+
+def get_back_to_main_menu_keyboard() -> InlineKeyboardMarkup:
+
+    return InlineKeyboardMarkup(
+        [[InlineKeyboardButton("⬅️ Назад до головного меню", callback_data="back_to_main_menu")]]
+    )
+
+
+def get_cancel_profanity_flow_keyboard(flow_type: str) -> InlineKeyboardMarkup:
+    """
+
+    Повертає клавіатуру для скасування поточного введення після виявлення нецензурної лексики,
+
+    та повертає до відповідного головного меню.
+
+    'flow_type' має бути 'report', 'suggestion', або 'feedback'.
+
+    """
+
+    return InlineKeyboardMarkup(
+        [[InlineKeyboardButton("❌ Скасувати", callback_data=f"cancel_{flow_type}_flow")]]
+    )
+
+
+def get_back_to_admin_panel_keyboard() -> InlineKeyboardMarkup:
+
+    return InlineKeyboardMarkup(
+        [[InlineKeyboardButton("⬅️ Назад до адмін-панелі", callback_data="show_admin_panel")]]
+    )
+
+
+def get_maintenance_status_text() -> str:
+
+    if maintenance_mode_active:
+
+        status = "🟢 *УВІМКНЕНО*"
+
+        msg = maintenance_message
+
+        end_time_str = (
+            maintenance_end_time.strftime("%Y-%m-%d %H:%M:%S %Z")
+            if maintenance_end_time
+            else "не встановлено"
+        )
+
+        time_left_str = ""
+
+        if maintenance_end_time and maintenance_end_time > datetime.now(KYIV_TZ):
+
+            remaining_delta = maintenance_end_time - datetime.now(KYIV_TZ)
+
+            total_seconds = int(remaining_delta.total_seconds())
+
+            days, rem = divmod(total_seconds, 86400)
+
+            hours, rem = divmod(rem, 3600)
+
+            minutes, seconds = divmod(rem, 60)
+
+            if days > 0:
+                time_left_str = f"{days}д {hours}г {minutes}хв"
+
+            elif hours > 0:
+                time_left_str = f"{hours}г {minutes}хв"
+
+            elif minutes > 0:
+                time_left_str = f"{minutes}хв {seconds}с"
+
+            else:
+                time_left_str = f"{seconds}с"
+
+            time_left_str = f" (залишилось: {time_left_str})"
+
+        return (
+            f"Статус режиму обслуговування: {status}\n"
+            f'Повідомлення для користувачів: "{msg}"\n'
+            f"Завершується: {end_time_str}{time_left_str}"
+        )
+
+    else:
+
+        return "Статус режиму обслуговування: 🔴 *ВИМКНЕНО*"
+
+
+def get_server_status_text() -> str:
+
+    try:
+
+        cpu_usage = psutil.cpu_percent(interval=0.1)
+
+        memory_info = psutil.virtual_memory()
+
+        memory_usage = memory_info.percent
+
+        disk_info = psutil.disk_usage("/")
+
+        disk_usage = disk_info.percent
+
+        p = psutil.Process(os.getpid())
+
+        process_uptime_seconds = time.time() - p.create_time()
+
+        process_uptime_str = str(timedelta(seconds=int(process_uptime_seconds)))
+
+        text = (
+            f"🖥️ *Статус сервера:*\n\n"
+            f"CPU Навантаження: {cpu_usage}%\n"
+            f"Використання RAM: {memory_usage}% (Всього: {memory_info.total // (1024**3)} GB, Використано: {memory_info.used // (1024**2)} MB)\n"
+            f"Використання Диску (/): {disk_usage}% (Всього: {disk_info.total // (1024**3)} GB, Використано: {disk_info.used // (1024**3)} GB)\n"
+            f"Час роботи бота: {process_uptime_str}"
+        )
+
+        return text
+
+    except Exception as e:
+
+        logger.error(f"Помилка отримання статусу сервера: {e}")
+
+        return "Не вдалося отримати статус сервера."
+
+
+def escape_markdown(text: str) -> str:
+    """Escapes common MarkdownV2 special characters."""
+
+    if not text:
+
+        return ""
+
+    escape_chars = r"\_*[]()~`>#+-=|{}.!"
+
+    return "".join(["\\" + char if char in escape_chars else char for char in text])
+
+
+# --- Обробники Команд та Кнопок ---
+
+
+async def maintenance_menu_page(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+
+    query = update.callback_query
+
+    if query:
+        await query.answer()
+
+    text = get_maintenance_status_text() + "\n\nОберіть дію:"
+
+    keyboard_buttons = []
+
+    if maintenance_mode_active:
+
+        keyboard_buttons.append(
+            [InlineKeyboardButton("🔴 Вимкнути зараз", callback_data="maint_disable_now")]
+        )
+
+    else:
+
+        keyboard_buttons.append(
+            [InlineKeyboardButton("🟢 Увімкнути режим", callback_data="maint_start_setup")]
+        )
+
+    keyboard_buttons.append(
+        [InlineKeyboardButton("⬅️ Назад до адмін-панелі", callback_data="show_admin_panel")]
+    )
+
+    reply_markup = InlineKeyboardMarkup(keyboard_buttons)
+
+    if query:
+        await query.edit_message_text(text=text, reply_markup=reply_markup, parse_mode="Markdown")
+
+    elif update.message:
+        await update.message.reply_text(text=text, reply_markup=reply_markup, parse_mode="Markdown")
+
+
+async def maintenance_start_setup_handler(
+    update: Update, context: ContextTypes.DEFAULT_TYPE
+) -> int:
+
+    query = update.callback_query
+
+    await query.answer()
+
+    context.user_data["maintenance_setter_id"] = query.from_user.id
+
+    keyboard = [
+        [
+            InlineKeyboardButton("10 хв", callback_data="maint_set_duration_10"),
+            InlineKeyboardButton("30 хв", callback_data="maint_set_duration_30"),
+            InlineKeyboardButton("60 хв", callback_data="maint_set_duration_60"),
+        ],
+        [InlineKeyboardButton("Ввести вручну (хв)", callback_data="maint_manual_duration_prompt")],
+        [InlineKeyboardButton(" скасувати", callback_data="maint_cancel_setup")],
+    ]
+
+    reply_markup = InlineKeyboardMarkup(keyboard)
+
+    await query.edit_message_text(
+        "⚙️ Налаштування режиму обслуговування:\n\nОберіть тривалість:", reply_markup=reply_markup
+    )
+
+    return SELECTING_DURATION
+
+
+async def maintenance_set_duration_callback(
+    update: Update, context: ContextTypes.DEFAULT_TYPE
+) -> int:
+
+    query = update.callback_query
+
+    await query.answer()
+
+    if context.user_data.get("maintenance_setter_id") != query.from_user.id:
+
+        await query.edit_message_text(
+            "Помилка: інший адміністратор вже налаштовує.",
+            reply_markup=get_back_to_admin_panel_keyboard(),
+        )
+
+        return ConversationHandler.END
+
+    duration_minutes = int(query.data.split("_")[-1])
+
+    context.user_data["maintenance_duration"] = duration_minutes
+
+    await query.edit_message_text(
+        f"Тривалість: {duration_minutes} хв.\nНадішліть повідомлення для користувачів:"
+    )
+
+    return TYPING_MESSAGE
+
+
+async def maintenance_manual_duration_prompt_callback(
+    update: Update, context: ContextTypes.DEFAULT_TYPE
+) -> int:
+
+    query = update.callback_query
+
+    await query.answer()
+
+    if context.user_data.get("maintenance_setter_id") != query.from_user.id:
+
+        await query.edit_message_text(
+            "Помилка доступу.", reply_markup=get_back_to_admin_panel_keyboard()
+        )
+
+        return ConversationHandler.END
+
+    await query.edit_message_text("Введіть тривалість в хвилинах (число):")
+
+    return TYPING_DURATION
+
+
+async def maintenance_typed_duration_handler(
+    update: Update, context: ContextTypes.DEFAULT_TYPE
+) -> int:
+
+    if context.user_data.get("maintenance_setter_id") != update.effective_user.id:
+
+        await update.message.reply_text(
+            "Помилка доступу.", reply_markup=get_back_to_admin_panel_keyboard()
+        )
+
+        return ConversationHandler.END
+
+    try:
+
+        duration_minutes = int(update.message.text)
+
+        if duration_minutes <= 0:
+
+            await update.message.reply_text("Тривалість має бути позитивною. Введіть ще раз:")
+
+            return TYPING_DURATION
+
+        context.user_data["maintenance_duration"] = duration_minutes
+
+        await update.message.reply_text(
+            f"Тривалість: {duration_minutes} хв.\nНадішліть повідомлення для користувачів:"
+        )
+
+        return TYPING_MESSAGE
+
+    except ValueError:
+
+        await update.message.reply_text("Введіть числове значення для тривалості:")
+
+        return TYPING_DURATION
+
+
+async def maintenance_typed_message_handler(
+    update: Update, context: ContextTypes.DEFAULT_TYPE
+) -> int:
+
+    if context.user_data.get("maintenance_setter_id") != update.effective_user.id:
+
+        await update.message.reply_text(
+            "Помилка доступу.", reply_markup=get_back_to_admin_panel_keyboard()
+        )
+
+        context.user_data.clear()
+
+        return ConversationHandler.END
+
+    user_message = update.message.text
+
+    duration_minutes = context.user_data.get("maintenance_duration")
+
+    if not user_message or not duration_minutes:
+
+        await update.message.reply_text(
+            "Помилка: не вдалося отримати дані.", reply_markup=get_back_to_admin_panel_keyboard()
+        )
+
+        context.user_data.clear()
+
+        return ConversationHandler.END
+
+    global maintenance_mode_active, maintenance_message, maintenance_end_time, maintenance_messages_ids
+
+    maintenance_mode_active = True
+
+    maintenance_message = user_message
+
+    maintenance_end_time = datetime.now(KYIV_TZ) + timedelta(minutes=duration_minutes)
+
+    refresh_maintenance_notice()
+
+    schedule_maintenance_disable_job(context.job_queue)
+
+    activation_msg = (
+        f"✅ Режим обслуговування УВІМКНЕНО!\n"
+        f'Тривалість: {duration_minutes} хв.\nПовідомлення: "{maintenance_message}"\n'
+        f"Завершиться: {maintenance_end_time.strftime('%Y-%m-%d %H:%M:%S %Z')}"
+    )
+
+    # Зберігаємо ID повідомлення про активацію для подальшого видалення
+
+    sent_message = await update.message.reply_text(
+        activation_msg, reply_markup=get_admin_panel_keyboard()
+    )
+
+    record_maintenance_notice(sent_message.chat_id, sent_message.message_id)
+
+    save_maintenance_state()
+
+    logger.info(
+        f"Адмін {update.effective_user.id} увімкнув режим обслуговування на {duration_minutes} хв. Збережено maintenance_message_id: {sent_message.message_id}"
+    )
+
+    context.user_data.clear()
+
+    return ConversationHandler.END
+
+
+async def disable_maintenance_job_callback(context: ContextTypes.DEFAULT_TYPE) -> None:
+
+    global maintenance_mode_active, maintenance_end_time, maintenance_messages_ids
+
+    # Інший екземпляр міг уже вимкнути чи продовжити ТО - спершу звіряємось із БД
+
+    if (
+        load_maintenance_state()
+        and maintenance_mode_active
+        and maintenance_end_time
+        and maintenance_end_time > datetime.now(KYIV_TZ)
+    ):
+
+        schedule_maintenance_disable_job(context.job_queue)
+
+        return
+
+    if maintenance_mode_active:
+
+        maintenance_mode_active = False
+
+        maintenance_end_time = None
+
+        refresh_maintenance_notice()
+
+        logger.info(
+            f"Режим обслуговування автоматично вимкнено (за розкладом о {datetime.now(KYIV_TZ).strftime('%Y-%m-%d %H:%M:%S %Z')})."
+        )
+
+        # Видалення старих повідомлень про ТО (разом зі сповіщеннями інших екземплярів бота)
+
+        maintenance_messages_ids.update(load_maintenance_notices())
+
+        for chat_id, message_id in list(maintenance_messages_ids.items()):
+
+            try:
+
+                await context.bot.delete_message(chat_id=chat_id, message_id=message_id)
+
+                logger.info(
+                    f"Автоматично видалено старе повідомлення про ТО (chat_id: {chat_id}, message_id: {message_id})."
+                )
+
+            except telegram.error.BadRequest as e:
+
+                if "Message to delete not found" in str(e):
+
+                    logger.warning(
+                        f"Повідомлення про ТО вже видалено або не існує (chat_id: {chat_id}, message_id: {message_id})."
+                    )
+
+                else:
+
+                    logger.error(
+                        f"Помилка при автоматичному видаленні повідомлення про ТО (chat_id: {chat_id}, message_id: {message_id}): {e}"
+                    )
+
+            except Exception as e:
+
+                logger.error(
+                    f"Неочікувана помилка при автоматичному видаленні повідомлення про ТО (chat_id: {chat_id}, message_id: {message_id}): {e}"
+                )
+
+            finally:
+
+                del maintenance_messages_ids[chat_id]
+
+        clear_maintenance_notices()
+
+        save_maintenance_state()
+
+        for admin_id in ADMIN_USER_IDS:
+
+            try:
+                await context.bot.send_message(
+                    chat_id=admin_id,
+                    text="ℹ️ Режим технічного обслуговування автоматично завершено.",
+                )
+
+            except Exception as e:
+                logger.error(f"Не вдалося сповістити адміна {admin_id}: {e}")
+
+
+async def maintenance_disable_now_callback(
+    update: Update, context: ContextTypes.DEFAULT_TYPE
+) -> None:
+
+    global maintenance_mode_active, maintenance_end_time, maintenance_messages_ids
+
+    user_id = update.effective_user.id
+
+    if user_id not in ADMIN_USER_IDS:
+
+        if update.message:
+            await update.message.reply_text("Доступ заборонено.")
+
+        elif update.callback_query:
+            await update.callback_query.answer("Доступ заборонено.", show_alert=True)
+
+        return
+
+    if update.callback_query:
+        await update.callback_query.answer()
+
+    maintenance_mode_active = False
+
+    maintenance_end_time = None
+
+    refresh_maintenance_notice()
+
+    schedule_maintenance_disable_job(context.job_queue)
+
+    text = "🔴 Режим обслуговування вимкнено вручну."
+
+    reply_markup = get_admin_panel_keyboard()
+
+    # Видалення старих повідомлень про ТО при ручному вимкненні (з усіх екземплярів бота)
+
+    maintenance_messages_ids.update(load_maintenance_notices())
+
+    for chat_id, message_id in list(maintenance_messages_ids.items()):
+
+        try:
+
+            await context.bot.delete_message(chat_id=chat_id, message_id=message_id)
+
+            logger.info(
+                f"Вручну видалено старе повідомлення про ТО (chat_id: {chat_id}, message_id: {message_id})."
+            )
+
+        except telegram.error.BadRequest as e:
+
+            if "Message to delete not found" in str(e):
+
+                logger.warning(
+                    f"Повідомлення про ТО вже видалено або не існує (chat_id: {chat_id}, message_id: {message_id})."
+                )
+
+            else:
+
+                logger.error(
+                    f"Помилка при ручному видаленні повідомлення про ТО (chat_id: {chat_id}, message_id: {message_id}): {e}"
+                )
+
+        except Exception as e:
+
+            logger.error(
+                f"Неочікувана помилка при ручному видаленні повідомлення про ТО (chat_id: {chat_id}, message_id: {message_id}): {e}"
+            )
+
+        finally:
+
+            del maintenance_messages_ids[chat_id]
+
+    clear_maintenance_notices()
+
+    save_maintenance_state()
+
+    if update.callback_query:
+
+        await update.callback_query.edit_message_text(text, reply_markup=reply_markup)
+
+    elif update.message:
+
+        await update.message.reply_text(text, reply_markup=reply_markup)
+
+    logger.info(f"Адмін {user_id} вимкнув режим обслуговування вручну.")
+
+
+async def maintenance_cancel_setup_callback(
+    update: Update, context: ContextTypes.DEFAULT_TYPE
+) -> int:
+
+    query = update.callback_query
+
+    await query.answer()
+
+    context.user_data.clear()
+
+    await query.edit_message_text(
+        "Налаштування режиму обслуговування скасовано.", reply_markup=get_admin_panel_keyboard()
+    )
+
+    return ConversationHandler.END
+
+
+# --- Стан сесії користувача (user_data): TTL для тимчасових ключів ---
+
+
+def set_transient_state(user_data: dict, key: str, value, ttl_seconds: float) -> None:
+    """Зберігає тимчасове значення, яке зникне через ttl_seconds."""
+
+    transient = user_data.setdefault(SESSION_TRANSIENT_KEY, {})
+
+    if len(transient) >= SESSION_TRANSIENT_PRUNE_THRESHOLD:
+
+        prune_transient_state(user_data)
+
+        transient = user_data.setdefault(SESSION_TRANSIENT_KEY, {})
+
+    transient[key] = (time.time() + ttl_seconds, value)
+
+
+def get_transient_state(user_data: dict, key: str, default=None):
+
+    entry = user_data.get(SESSION_TRANSIENT_KEY, {}).get(key)
+
+    if entry is None or entry[0] <= time.time():
+
+        return default
+
+    return entry[1]
+
+
+def pop_transient_state(user_data: dict, key: str, default=None):
+
+    entry = user_data.get(SESSION_TRANSIENT_KEY, {}).pop(key, None)
+
+    if entry is None or entry[0] <= time.time():
+
+        return default
+
+    return entry[1]
+
+
+def prune_transient_state(user_data: dict) -> int:
+    """Видаляє прострочені тимчасові ключі; повертає кількість видалених."""
+
+    transient = user_data.get(SESSION_TRANSIENT_KEY)
+
+    if not transient:
+
+        user_data.pop(SESSION_TRANSIENT_KEY, None)
+
+        return 0
+
+    now = time.time()
+
+    expired_keys = [key for key, (expires_at, _) in transient.items() if expires_at <= now]
+
+    for key in expired_keys:
+
+        del transient[key]
+
+    if not transient:
+
+        del user_data[SESSION_TRANSIENT_KEY]
+
+    return len(expired_keys)
+
+
+def forget_conversation_state(user_data: dict, conversation_name: str) -> None:
+
+    conversation_states = user_data.get(CONVERSATION_STATES_KEY)
+
+    if conversation_states is not None:
+
+        conversation_states.pop(conversation_name, None)
+
+        if not conversation_states:
+
+            del user_data[CONVERSATION_STATES_KEY]
+
+
+def clear_conversation_state(user_data: dict, conversation_name: str) -> None:
+    """Прибирає проміжні дані лише цього діалогу, не чіпаючи інших діалогів і вибору групи."""
+
+    for key in CONVERSATION_OWNED_USER_DATA_KEYS.get(conversation_name, ()):
+
+        user_data.pop(key, None)
+
+    forget_conversation_state(user_data, conversation_name)
+
+
+def track_conversation_state_callback(callback, conversation_name: str):
+    """Обгортка колбека діалогу: запам'ятовує стан, у який він перевів діалог."""
+
+    @functools.wraps(callback)
+    async def wrapper(update: Update, context: ContextTypes.DEFAULT_TYPE):
+
+        new_state = await callback(update, context)
+
+        if new_state is None or context.user_data is None:
+
+            return new_state
+
+        if new_state == ConversationHandler.END:
+
+            forget_conversation_state(context.user_data, conversation_name)
+
+        else:
+
+            context.user_data.setdefault(CONVERSATION_STATES_KEY, {})[conversation_name] = new_state
+
+        return new_state
+
+    return wrapper
+
+
+def track_conversation_states(conversation_handler: ConversationHandler) -> None:
+    """Відстежує стан діалогу, щоб тайм-аут знав, чи чекав діалог на введення користувача."""
+
+    name = conversation_handler.name
+
+    # Стани з MessageHandler чекають, що користувач щось введе
+
+    CONVERSATION_INPUT_STATES[name] = {
+        state
+        for state, state_handlers in conversation_handler.states.items()
+        if any(isinstance(handler, MessageHandler) for handler in state_handlers)
+    }
+
+    tracked_handlers = list(conversation_handler.entry_points) + list(
+        conversation_handler.fallbacks
+    )
+
+    for state, state_handlers in conversation_handler.states.items():
+
+        if state != ConversationHandler.TIMEOUT:
+
+            tracked_handlers.extend(state_handlers)
+
+    for handler in tracked_handlers:
+
+        if getattr(handler, "callback", None) is not None:
+
+            handler.callback = track_conversation_state_callback(handler.callback, name)
+
+
+def conversation_timeout_handlers(conversation_name: str) -> list[TypeHandler]:
+    """Обробники стану ConversationHandler.TIMEOUT для діалогу conversation_name."""
+
+    async def timeout_callback(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+
+        await conversation_timeout_handler(update, context, conversation_name)
+
+    return [TypeHandler(Update, timeout_callback)]
+
+
+async def conversation_timeout_handler(
+    update: Update, context: ContextTypes.DEFAULT_TYPE, conversation_name: str
+) -> None:
+    """ConversationHandler.TIMEOUT: діалог покинуто - звільняємо його дані."""
+
+    if context.user_data is None:
+
+        return
+
+    timed_out_state = context.user_data.get(CONVERSATION_STATES_KEY, {}).get(conversation_name)
+
+    clear_conversation_state(context.user_data, conversation_name)
+
+    # Сповіщаємо лише якщо діалог чекав на введення (а не, напр., користувач просто вийшов у меню)
+
+    if timed_out_state not in CONVERSATION_INPUT_STATES.get(conversation_name, ()):
+
+        return
+
+    chat = update.effective_chat if isinstance(update, Update) else None
+
+    if chat is None:
+
+        return
+
+    try:
+
+        await context.bot.send_message(
+            chat_id=chat.id,
+            text="⌛ Дію скасовано через неактивність. Почніть знову з меню.",
+        )
+
+    except Exception as e:
+
+        logger.debug(f"Сесії: не вдалося повідомити {chat.id} про тайм-аут діалогу: {e}")
+
+
+def estimate_state_size(value, _depth: int = 0) -> int:
+    """Приблизний розмір вкладеної структури в байтах (sys.getsizeof рекурсивно)."""
+
+    size = sys.getsizeof(value)
+
+    if _depth > 8:
+
+        return size
+
+    if isinstance(value, dict):
+
+        for key, item in value.items():
+
+            size += estimate_state_size(key, _depth + 1) + estimate_state_size(item, _depth + 1)
+
+    elif isinstance(value, (list, tuple, set, frozenset)):
+
+        for item in value:
+
+            size += estimate_state_size(item, _depth + 1)
+
+    return size
+
+
+async def session_state_sweep_job_callback(context: ContextTypes.DEFAULT_TYPE) -> None:
+    """Періодично прибирає прострочені тимчасові ключі та порожні user_data."""
+
+    application = context.application
+
+    expired_total = 0
+
+    empty_user_ids = []
+
+    for user_id, user_data in list(application.user_data.items()):
+
+        expired_total += prune_transient_state(user_data)
+
+        if not user_data:
+
+            empty_user_ids.append(user_id)
+
+    for user_id in empty_user_ids:
+
+        application.drop_user_data(user_id)
+
+    if expired_total or empty_user_ids:
+
+        logger.info(
+            f"Сесії: видалено {expired_total} прострочених ключів, "
+            f"{len(empty_user_ids)} порожніх user_data."
+        )
+
+
+def get_session_state_report_text(application) -> str:
+    """Звіт про обсяг user_data/chat_data: найбільші користувачі та ключі."""
+
+    user_sizes = []
+
+    key_totals: dict[str, list[int]] = {}
+
+    transient_keys = 0
+
+    for user_id, user_data in application.user_data.items():
+
+        user_sizes.append((estimate_state_size(user_data), user_id, len(user_data)))
+
+        transient_keys += len(user_data.get(SESSION_TRANSIENT_KEY, {}))
+
+        for key, value in user_data.items():
+
+            # answered_query_<id> і подібні ключі з ідентифікаторами групуємо за префіксом
+
+            key_name = str(key).rstrip("0123456789")
+
+            totals = key_totals.setdefault(key_name, [0, 0])
+
+            totals[0] += 1
+
+            totals[1] += estimate_state_size(value)
+
+    total_user_bytes = sum(size for size, _, _ in user_sizes)
+
+    chat_bytes = sum(estimate_state_size(chat_data) for chat_data in application.chat_data.values())
+
+    text = (
+        "🧠 *Стан сесій у пам'яті*\n\n"
+        f"👤 user\\_data: {len(user_sizes)} користувачів, ~{total_user_bytes / 1024:.1f} КіБ\n"
+        f"💬 chat\\_data: {len(application.chat_data)} чатів, ~{chat_bytes / 1024:.1f} КіБ\n"
+        f"🤖 bot\\_data: ~{estimate_state_size(application.bot_data) / 1024:.1f} КіБ\n"
+        f"⏳ Тимчасових ключів (TTL): {transient_keys}\n"
+    )
+
+    if user_sizes:
+
+        text += "\n*Найбільші user\\_data:*\n"
+
+        for size, user_id, key_count in sorted(user_sizes, reverse=True)[:SESSION_REPORT_TOP]:
+
+            text += f"  • `{user_id}`: {size / 1024:.1f} КіБ, ключів: {key_count}\n"
+
+    if key_totals:
+
+        text += "\n*Ключі за обсягом:*\n"
+
+        for key_name, (count, size) in sorted(
+            key_totals.items(), key=lambda item: item[1][1], reverse=True
+        )[:SESSION_REPORT_TOP]:
+
+            text += f"  • `{key_name}`: {count}×, {size / 1024:.1f} КіБ\n"
+
+    return text
+
+
+async def admin_session_report_command_handler(
+    update: Update, context: ContextTypes.DEFAULT_TYPE
+) -> None:
+    """/session_report - обсяг стану сесій у пам'яті."""
+
+    update_command_stats("/session_report")
+
+    await update.message.reply_text(
+        get_session_state_report_text(context.application), parse_mode="Markdown"
+    )
+
+
+def refresh_maintenance_notice() -> None:
+    """Перераховує текст сповіщення про ТО та скидає тротлінг (при кожній зміні режиму)."""
+
+    global maintenance_notice_text, maintenance_alert_text
+
+    maintenance_notice_sent_at.clear()
+
+    if not maintenance_mode_active:
+
+        maintenance_notice_text = maintenance_alert_text = ""
+
+        return
+
+    end_time_str = ""
+
+    if maintenance_end_time:
+
+        end_time_str = f" Орієнтовне завершення: {maintenance_end_time.strftime('%d.%m %H:%M')}."
+
+    maintenance_notice_text = f"⚙️ {maintenance_message}{end_time_str}"
+
+    maintenance_alert_text = maintenance_notice_text
+
+    if len(maintenance_alert_text) > CALLBACK_ALERT_MAX_LENGTH:
+
+        # Обрізаємо текст адміна, а не час завершення
+
+        message_room = CALLBACK_ALERT_MAX_LENGTH - len(f"⚙️ …{end_time_str}")
+
+        maintenance_alert_text = f"⚙️ {maintenance_message[:message_room]}…{end_time_str}"
+
+
+def record_maintenance_notice(chat_id: int, message_id: int) -> None:
+    """Запам'ятовує сповіщення про ТО в чаті (щоб прибрати його після завершення ТО)."""
+
+    maintenance_messages_ids[chat_id] = message_id
+
+    try:
+
+        with connect_db() as conn:
+
+            conn.execute(
+                "INSERT INTO maintenance_notices (chat_id, message_id) VALUES (?, ?) "
+                "ON CONFLICT(chat_id) DO UPDATE SET message_id = excluded.message_id",
+                (chat_id, message_id),
+            )
+
+            conn.commit()
+
+    except sqlite3.Error as e:
+
+        logger.error(f"ТО: не вдалося зберегти сповіщення для чату {chat_id}: {e}")
+
+
+def load_maintenance_notices() -> dict[int, int]:
+    """Сповіщення про ТО, надіслані всіма екземплярами бота: {chat_id: message_id}."""
+
+    try:
+
+        with connect_db() as conn:
+
+            return dict(conn.execute("SELECT chat_id, message_id FROM maintenance_notices"))
+
+    except sqlite3.Error as e:
+
+        logger.error(f"ТО: не вдалося прочитати сповіщення про ТО: {e}")
+
+        return {}
+
+
+def clear_maintenance_notices() -> None:
+
+    maintenance_messages_ids.clear()
+
+    try:
+
+        with connect_db() as conn:
+
+            conn.execute("DELETE FROM maintenance_notices")
+
+            conn.commit()
+
+    except sqlite3.Error as e:
+
+        logger.error(f"ТО: не вдалося очистити сповіщення про ТО: {e}")
+
+
+def save_maintenance_state() -> bool:
+    """Зберігає режим ТО в БД: переживає перезапуск і видимий іншим екземплярам бота."""
+
+    global maintenance_state_version
+
+    updated_at = time.time()
+
+    try:
+
+        with connect_db() as conn:
+
+            conn.execute(
+                "INSERT OR REPLACE INTO maintenance_state "
+                "(id, active, message, end_time, updated_at) VALUES (1, ?, ?, ?, ?)",
+                (
+                    int(maintenance_mode_active),
+                    maintenance_message,
+                    maintenance_end_time.isoformat() if maintenance_end_time else None,
+                    updated_at,
+                ),
+            )
+
+            conn.commit()
+
+    except sqlite3.Error as e:
+
+        logger.error(f"ТО: не вдалося зберегти стан режиму обслуговування: {e}")
+
+        return False
+
+    maintenance_state_version = updated_at
+
+    return True
+
+
+def load_maintenance_state() -> bool:
+    """Читає режим ТО з БД у глобальні змінні; True, якщо стан змінився з останнього читання."""
+
+    global maintenance_mode_active, maintenance_message, maintenance_end_time
+    global maintenance_state_version
+
+    try:
+
+        with connect_db() as conn:
+
+            row = conn.execute(
+                "SELECT active, message, end_time, updated_at FROM maintenance_state WHERE id = 1"
+            ).fetchone()
+
+    except sqlite3.Error as e:
+
+        logger.error(f"ТО: не вдалося прочитати стан режиму обслуговування: {e}")
+
+        return False
+
+    if not row or row[3] == maintenance_state_version:
+
+        return False
+
+    active, message, end_time, updated_at = row
+
+    maintenance_mode_active = bool(active)
+
+    if message:
+
+        maintenance_message = message
+
+    maintenance_end_time = datetime.fromisoformat(end_time) if end_time else None
+
+    maintenance_state_version = updated_at
+
+    refresh_maintenance_notice()
+
+    return True
+
+
+def schedule_maintenance_disable_job(job_queue) -> None:
+    """Ставить (або знімає) автоматичне вимкнення ТО відповідно до поточного стану."""
+
+    for job in job_queue.get_jobs_by_name(MAINTENANCE_JOB_NAME):
+
+        job.schedule_removal()
+
+    if not maintenance_mode_active or not maintenance_end_time:
+
+        return
+
+    # Час завершення, що минув за час простою бота, - вимкнення одразу після старту
+
+    job_queue.run_once(
+        disable_maintenance_job_callback,
+        when=max(maintenance_end_time, datetime.now(KYIV_TZ) + timedelta(seconds=5)),
+        name=MAINTENANCE_JOB_NAME,
+    )
+
+
+def restore_maintenance_state(job_queue) -> None:
+    """Відновлює режим ТО та його відкладене вимкнення з БД (при старті бота)."""
+
+    if not load_maintenance_state() or not maintenance_mode_active:
+
+        return
+
+    maintenance_messages_ids.update(load_maintenance_notices())
+
+    schedule_maintenance_disable_job(job_queue)
+
+    logger.info(
+        "ТО: режим обслуговування відновлено з БД"
+        + (
+            f" (завершення {maintenance_end_time.strftime('%Y-%m-%d %H:%M:%S %Z')})."
+            if maintenance_end_time
+            else "."
+        )
+    )
+
+
+async def maintenance_state_sync_job_callback(context: ContextTypes.DEFAULT_TYPE) -> None:
+    """Підхоплює зміни режиму ТО, зроблені іншим екземпляром бота."""
+
+    if load_maintenance_state():
+
+        schedule_maintenance_disable_job(context.job_queue)
+
+        state_text = "увімкнено" if maintenance_mode_active else "вимкнено"
+
+        logger.info(f"ТО: стан синхронізовано з БД (режим {state_text}).")
+
+
+async def maintenance_gate_handler(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+    """Під час ТО зупиняє оновлення не-адмінів раніше за всі інші обробники."""
+
+    if not maintenance_mode_active:
+
+        return
+
+    user = update.effective_user
+
+    if user is not None and user.id in ADMIN_USER_IDS:
+
+        return
+
+    try:
+
+        if update.callback_query:
+
+            # Відповідь на callback обов'язкова (інакше "годинник" на кнопці) - одразу як alert
+
+            try:
+
+                await update.callback_query.answer(maintenance_alert_text, show_alert=True)
+
+            except telegram.error.BadRequest as e:
+
+                logger.warning(f"ТО: alert не надіслано ({e}), сповіщаємо повідомленням у чат.")
+
+                await update.callback_query.answer()
+
+                if update.effective_message and update.effective_chat:
+
+                    await send_throttled_maintenance_notice(update, context)
+
+        elif update.inline_query:
+
+            await update.inline_query.answer([], cache_time=0, is_personal=True)
+
+        elif update.message and update.effective_chat:
+
+            await send_throttled_maintenance_notice(update, context)
+
+    except telegram.error.TelegramError as e:
+
+        logger.debug(f"ТО: не вдалося надіслати сповіщення для оновлення {update.update_id}: {e}")
+
+    raise ApplicationHandlerStop
+
+
+async def send_throttled_maintenance_notice(
+    update: Update, context: ContextTypes.DEFAULT_TYPE
+) -> None:
+    """Не більше одного сповіщення про ТО на чат за MAINTENANCE_NOTICE_THROTTLE_SECONDS."""
+
+    chat_id = update.effective_chat.id
+
+    now = time.monotonic()
+
+    last_sent_at = maintenance_notice_sent_at.get(chat_id)
+
+    if last_sent_at is not None and now - last_sent_at < MAINTENANCE_NOTICE_THROTTLE_SECONDS:
+
+        return
+
+    maintenance_notice_sent_at[chat_id] = now
+
+    # Попереднє сповіщення прибираємо лише раз на вікно тротлінгу, а не на кожне повідомлення
+
+    previous_message_id = maintenance_messages_ids.pop(chat_id, None)
+
+    if previous_message_id is not None:
+
+        try:
+
+            await context.bot.delete_message(chat_id=chat_id, message_id=previous_message_id)
+
+        except telegram.error.BadRequest as e:
+
+            logger.debug(f"ТО: попереднє сповіщення в чаті {chat_id} не видалено: {e}")
+
+    sent_msg = await update.effective_message.reply_text(maintenance_notice_text)
+
+    # Окремий рядок maintenance_notices: стан ТО (і його версія для синхронізації) не змінюється
+
+    record_maintenance_notice(chat_id, sent_msg.message_id)
+
+
+# ЗАМІНІТЬ СТАРУ ФУНКЦІЮ select_role_callback_handler
+
+
+async def select_role_callback_handler(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
+
+    query = update.callback_query
+
+    await query.answer()
+
+    user_id = query.from_user.id
+
+    role = query.data.replace("select_role_", "")
+
+    logger.info(
+        f"select_role_callback_handler: User {user_id} selected role '{role}' (callback_data: {query.data})"
+    )
+
+    logger.info(
+        f"select_role_callback_handler: Function called from {update.effective_chat.type} chat"
+    )
+
+    if role == "student":
+
+        logger.info(
+            f"Setting user {user_id} role to 'student' and transitioning to SELECTING_COURSE"
+        )
+
+        set_user_role_in_db(user_id, role)
+
+        record_registration_funnel_step(context.user_data, "role_student")
+
+        await query.edit_message_text(
+            "🎓 Ви обрали 'Студент'. Будь ласка, оберіть ваш курс:",
+            reply_markup=get_student_course_selection_keyboard(),
+        )
+
+        logger.info(
+            f"User {user_id} role set to 'student', message updated, returning SELECTING_COURSE"
+        )
+
+        return SELECTING_COURSE
+
+    elif role == "guest":
+
+        logger.info(f"Setting user {user_id} role to 'guest' and transitioning to GUEST_MENU")
+
+        set_user_role_in_db(user_id, role)
+
+        await query.edit_message_text(
+            "🚶‍♂️ Ви обрали 'Гість'. Доступні опції:", reply_markup=get_guest_menu_keyboard()
+        )
+
+        logger.info(f"User {user_id} role set to 'guest', message updated, returning GUEST_MENU")
+
+        return GUEST_MENU
+
+    elif role == "staff":
+
+        logger.info(f"Setting user {user_id} role to 'staff' and staying in SELECTING_ROLE")
+
+        set_user_role_in_db(user_id, role)
+
+        await query.edit_message_text(
+            "👷‍♂️ Ви обрали 'Працівник'. Цей функціонал *в розробці*.",
+            reply_markup=get_back_to_role_selection_keyboard(),
+            parse_mode="Markdown",
+        )
+
+        logger.info(
+            f"User {user_id} role set to 'staff', message updated, returning SELECTING_ROLE"
+        )
+
+        return SELECTING_ROLE
+
+    else:
+
+        logger.warning(f"Unknown role '{role}' selected by user {user_id}")
+
+    return ConversationHandler.END
+
+
+async def select_teacher_role_callback_handler(
+    update: Update, context: ContextTypes.DEFAULT_TYPE
+) -> int:
+    """Окремий обробник для кнопки 'Я викладач'"""
+
+    query = update.callback_query
+
+    await query.answer()
+
+    user_id = query.from_user.id
+
+    logger.info(f"select_teacher_role_callback_handler: User {user_id} selected teacher role")
+
+    await query.edit_message_text(
+        "👨‍🏫 Будь ласка, введіть ваш одноразовий пароль (код запрошення), отриманий від адміністратора.",
+        reply_markup=get_back_to_role_selection_keyboard(),
+    )
+
+    return TYPING_ONE_TIME_PASSWORD
+
+
+# ЗАМІНІТЬ СТАРУ ФУНКЦІЮ select_student_course_handler НА ЦЮ
+
+
+async def select_student_course_handler(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
+
+    query = update.callback_query
+
+    await query.answer()
+
+    user_id = query.from_user.id
+
+    course = query.data.replace("select_course_", "")
+
+    logger.info(f"select_student_course_handler: User {user_id} selected course '{course}'")
+
+    try:
+
+        course_number = int(course)
+
+        if course_number in [1, 2, 3, 4]:
+
+            logger.info(
+                f"User {user_id} selected valid course {course_number}, proceeding to group selection"
+            )
+
+            record_registration_funnel_step(context.user_data, "course")
+
+            # Користувач обрав курс. Тепер ми маємо запитати його групу.
+
+            # Ми редагуємо поточне повідомлення, щоб показати клавіатуру вибору групи
+
+            # і переводимо розмову до стану SELECTING_GROUP.
+
+            text = f"Чудово! Тепер, будь ласка, оберіть вашу групу зі списку для {course_number} курсу:"
+
+            # Викликаємо оновлену функцію клавіатури, вказавши, що це процес реєстрації та курс
+
+            reply_markup = get_group_selection_keyboard(
+                registration_flow=True, selected_course=course_number
+            )
+
+            await query.edit_message_text(text, reply_markup=reply_markup, parse_mode="Markdown")
+
+            # Зберігаємо вибраний курс в контексті для подальшого використання
+
+            context.user_data["selected_course"] = course_number
+
+            # Повертаємо наступний стан у нашій розмові. Це найважливіша зміна!
+
+            return SELECTING_GROUP
+
+    except ValueError:
+
+        logger.warning(f"User {user_id} selected invalid course '{course}'")
+
+    # Якщо щось пішло не так, повертаємося до вибору курсу
+
+    logger.info(f"User {user_id} returning to course selection")
+
+    await query.edit_message_text(
+        "Будь ласка, оберіть курс:",
+        reply_markup=get_student_course_selection_keyboard(),
+        parse_mode="Markdown",
+    )
+
+    return SELECTING_COURSE
+
+
+# ЗАМІНІТЬ СТАРУ ФУНКЦІЮ handle_teacher_otp_entry або handle_teacher_initials
+
+
+async def handle_teacher_otp_entry(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
+
+    # 1. Надсилаємо початкове повідомлення і зберігаємо його
+
+    processing_message = await update.message.reply_text(
+        "Перевіряю ваш код... Зачекайте, будь ласка ⏳"
+    )
+
+    user = update.effective_user
+
+    entered_otp = update.message.text.strip()
+
+    # 2. Виконуємо повільну перевірку пароля
+
+    is_successful, message = verify_otp_and_claim_profile(entered_otp, user.id)
+
+    # 3. Редагуємо початкове повідомлення з кінцевим результатом
+
+    if is_successful:
+
+        # Якщо успіх, готуємо і показуємо меню викладача
+
+        if not user_exists(user.id):
+
+            add_or_update_user_in_db(user.id, user.username, user.first_name, user.last_name)
+
+        set_user_role_in_db(user.id, "teacher")
+
+        teacher_data = get_teacher_data_from_db(user.id)
+
+        teacher_name = (
+            teacher_data.get("full_name", user.full_name) if teacher_data else user.full_name
+        )
+
+        success_text = f"Вітаю, *{teacher_name}*!\nВи увійшли як викладач. Чим можу допомогти?"
+
+        resolved = resolve_teacher_name(teacher_name)
+
+        if resolved and resolved[0]["schedule_names"]:
+
+            entry, score = resolved
+
+            success_text += (
+                f"\n\n📅 У розкладі: *{', '.join(sorted(entry['schedule_names']))}* "
+                f"(збіг {score:.0%})"
+            )
+
+        else:
+
+            success_text += "\n\n⚠️ Ваших пар у розкладі не знайдено. Зверніться до адміністратора."
+
+        reply_markup = get_teacher_menu_keyboard(user.id)
+
+        await processing_message.edit_text(
+            text=success_text, reply_markup=reply_markup, parse_mode="Markdown"
+        )
+
+        return ConversationHandler.END
+
+    else:
+
+        # Якщо помилка, показуємо її
+
+        await processing_message.edit_text(
+            text=f"❌ {message}\nСпробуйте ще раз або зверніться до адміністратора.",
+            reply_markup=get_back_to_role_selection_keyboard(),
+        )
+
+        return TYPING_ONE_TIME_PASSWORD
+
+
+async def handle_guest_info_about_college(
+    update: Update, context: ContextTypes.DEFAULT_TYPE
+) -> int:
+
+    query = update.callback_query
+
+    user_id = None
+
+    if query and query.from_user:
+
+        user_id = query.from_user.id
+
+    elif update.effective_user:
+
+        user_id = update.effective_user.id
+
+    if user_id is None:
+
+        logger.warning("handle_guest_info_about_college: не вдалося отримати user_id")
+
+        return GUEST_MENU
+
+    user_role = get_user_role_from_db(user_id)  # Отримуємо роль
+
+    if query:
+
+        await query.answer()
+
+    text = "ℹ️ *Про коледж: Що вас цікавить?*"
+
+    reply_markup = get_about_college_menu_keyboard(user_role=user_role)  # Передаємо роль
+
+    if query and query.message:
+
+        await query.message.edit_text(text, reply_markup=reply_markup, parse_mode="Markdown")  # type: ignore
+
+    elif update.message:
+
+        await update.message.reply_text(text, reply_markup=reply_markup, parse_mode="Markdown")  # type: ignore
+
+    return GUEST_MENU
+
+
+# Правильна версія
+
+
+async def back_to_role_selection_handler(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
+
+    query = update.callback_query
+
+    if query:
+
+        await query.answer()  # Відповідаємо на запит негайно
+
+    user = update.effective_user  # Краще використовувати effective_user
+
+    text = f"Привіт, {user.mention_html()}! Я бот 'ЧГЕФК'.\n" "Будь ласка, оберіть, хто ви:"
+
+    reply_markup = get_role_selection_keyboard()
+
+    # Скидаємо роль користувача в базі даних
+
+    set_user_role_in_db(user.id, "ASK_ROLE")
+
+    # Редагуємо повідомлення, якщо можемо, інакше надсилаємо нове
+
+    if query and query.message:
+
+        await query.edit_message_text(text, reply_markup=reply_markup, parse_mode="HTML")
+
+    else:
+
+        await context.bot.send_message(
+            chat_id=user.id, text=text, reply_markup=reply_markup, parse_mode="HTML"
+        )
+
+    # Завершуємо будь-яку активну розмову. Це ключова зміна.
+
+    return ConversationHandler.END
+
+
+# ДОДАЙТЕ ЦЮ НОВУ ФУНКЦІЮ
+
+
+async def back_to_course_handler(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
+    """Обробник для повернення користувача з етапу вибору групи до вибору курсу."""
+
+    query = update.callback_query
+
+    await query.answer()
+
+    # Показуємо меню вибору курсу знову
+
+    text = "🎓 Будь ласка, оберіть ваш курс:"
+
+    reply_markup = get_student_course_selection_keyboard()
+
+    await query.edit_message_text(text, reply_markup=reply_markup)
+
+    # Повертаємо розмову до стану вибору курсу
+
+    return SELECTING_COURSE
+
+
+async def handle_staff_entry(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
+
+    query = update.callback_query
+
+    await query.answer()
+
+    await query.edit_message_text(
+        "👷‍♂️ Ви обрали 'Працівник'. Цей функціонал *в розробці*.",
+        reply_markup=get_back_to_role_selection_keyboard(),
+        parse_mode="Markdown",
+    )
+
+    return SELECTING_ROLE
+
+
+# ЗНАЙДІТЬ ЦЮ ФУНКЦІЮ І ПЕРЕКОНАЙТЕСЬ, ЩО ВОНА ВИГЛЯДАЄ ТАК
+
+
+async def prompt_set_group_handler(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
+
+    query = update.callback_query
+
+    message_to_edit_or_reply = None
+
+    if query:
+
+        await query.answer()
+
+        message_to_edit_or_reply = query.message
+
+    elif update.message:
+
+        message_to_edit_or_reply = update.message
+
+    if not message_to_edit_or_reply:
+
+        logger.warning("prompt_set_group_handler викликаний без query або message.")
+
+        return ConversationHandler.END
+
+    user_id = update.effective_user.id
+
+    current_group = get_user_group_from_db(user_id)
+
+    action_text = "змінити" if current_group else "вказати"
+
+    message_text = f"Ваша поточна група: *{current_group or 'не обрана'}*.\nБудь ласка, {action_text} вашу групу:"
+
+    # Показуємо вибір курсу спочатку, щоб не було всього списку одразу
+
+    reply_markup = get_student_course_selection_keyboard()
+
+    if query:
+
+        await message_to_edit_or_reply.edit_text(
+            message_text, reply_markup=reply_markup, parse_mode="Markdown"
+        )
+
+    else:
+
+        await message_to_edit_or_reply.reply_text(
+            message_text, reply_markup=reply_markup, parse_mode="Markdown"
+        )
+
+    return SELECTING_GROUP
+
+
+async def select_group_page_callback(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
+
+    query = update.callback_query
+
+    await query.answer()
+
+    page = int(query.data.split("_")[-1])
+
+    user_id = update.effective_user.id
+
+    current_group = get_user_group_from_db(user_id)
+
+    action_text = "змінити" if current_group else "вказати"
+
+    message_text = f"Ваша поточна група: *{current_group or 'не встановлена'}*.\nБудь ласка, {action_text} вашу групу (Сторінка {page + 1}):"
+
+    # Після пагінації більше не використовується, але залишимо для сумісності
+
+    reply_markup = get_student_course_selection_keyboard()
+
+    await query.message.edit_text(
+        text=message_text, reply_markup=reply_markup, parse_mode="Markdown"
+    )
+
+    return SELECTING_GROUP
+
+
+async def set_group_callback_handler(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
+
+    query = update.callback_query
+
+    await query.answer()
+
+    group_name = query.data.replace("set_group_", "")
+
+    user = query.from_user
+
+    if set_user_group_in_db(user.id, group_name):
+
+        record_registration_funnel_step(context.user_data, "group")
+
+        # Ось тут ми замінюємо текст і клавіатуру на головне меню
+
+        await query.message.edit_text(
+            f"✅ Дякую! Вашу групу встановлено: *{group_name}*.",
+            reply_markup=get_main_menu_keyboard(user.id, group_name),
+            parse_mode="Markdown",
+        )
+
+        # Завершуємо ConversationHandler.
+
+        # Якщо користувач потім натисне іншу кнопку, button_callback_handler її обробить.
+
+        return ConversationHandler.END  # <-- ЗАЛИШИМО ЦЕ ТАК
+
+    else:
+
+        await query.message.edit_text(
+            "❌ Сталася помилка при збереженні групи.",
+            reply_markup=get_main_menu_keyboard(user.id, get_user_group_from_db(user.id)),
+        )
+
+    return ConversationHandler.END
+
+
+async def cancel_group_selection_handler(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
+
+    query = update.callback_query
+
+    await query.answer()
+
+    user_id = query.from_user.id
+
+    user = query.from_user
+
+    text = f"Привіт, {user.mention_html()}! Я бот 'ЧГЕФК'.\n" "Будь ласка, оберіть, хто ви:"
+
+    reply_markup = get_role_selection_keyboard()
+
+    await query.message.edit_text(text, reply_markup=reply_markup, parse_mode="HTML")
+
+    set_user_role_in_db(user.id, "ASK_ROLE")  # Скидаємо роль до ASK_ROLE
+
+    return SELECTING_ROLE  # Дуже важливо: повертаємо стан SELECTING_ROLE
+
+    # Повертаємо користувача до вибору ролі
+
+    user = query.from_user
+
+    text = f"Привіт, {user.mention_html()}! Я бот 'ЧГЕФК'.\n" "Будь ласка, оберіть, хто ви:"
+
+    reply_markup = get_role_selection_keyboard()
+
+    await query.message.edit_text(text, reply_markup=reply_markup, parse_mode="HTML")
+
+    set_user_role_in_db(user.id, "ASK_ROLE")  # Скидаємо роль до ASK_ROLE
+
+    return SELECTING_ROLE  # Повертаємо стан SELECTING_ROLE, щоб ConversationHandler знав, що ми повертаємося до цього етапу.
+
+
+async def start_command_handler(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
+
+    user = update.effective_user
+
+    logger.info(
+        f"start_command_handler: Користувач {user.id} ({user.full_name}) розпочав роботу (/start)."
+    )
+
+    is_new_user = not user_exists(user.id)
+
+    referrer_id = None
+
+    if context.args and context.args[0].isdigit():
+
+        potential_referrer_id = int(context.args[0])
+
+        if potential_referrer_id != user.id:
+
+            if user_exists(potential_referrer_id):
+
+                referrer_id = potential_referrer_id
+
+                logger.info(f"Користувач {user.id} прийшов за рефералом від {referrer_id}.")
+
+            else:
+
+                logger.info(
+                    f"Отримано недійсний реферальний ID {context.args[0]}: реферер {potential_referrer_id} не знайдено в БД."
+                )
+
+        else:
+
+            logger.info(f"Користувач {user.id} спробував реферити сам себе.")
+
+    # Отримуємо поточну роль користувача
+
+    current_user_role = get_user_role_from_db(user.id)
+
+    user_group = get_user_group_from_db(user.id)
+
+    logger.info(
+        f"Start: User {user.id}, is_new_user: {is_new_user}, role: {current_user_role}, group: {user_group}."
+    )  # ДОДАНО ЦЕЙ РЯДОК
+
+    is_new_user = not user_exists(user.id)
+
+    referrer_id = None
+
+    if context.args and context.args[0].isdigit():
+
+        potential_referrer_id = int(context.args[0])
+
+        if potential_referrer_id != user.id:
+
+            if user_exists(potential_referrer_id):
+
+                referrer_id = potential_referrer_id
+
+                logger.info(f"Користувач {user.id} прийшов за рефералом від {referrer_id}.")
+
+            else:
+
+                logger.info(
+                    f"Отримано недійсний реферальний ID {context.args[0]}: реферер {potential_referrer_id} не знайдено в БД."
+                )
+
+        else:
+
+            logger.info(f"Користувач {user.id} спробував реферити сам себе.")
+
+    # Отримуємо поточну роль користувача
+
+    current_user_role = get_user_role_from_db(user.id)
+
+    user_group = get_user_group_from_db(user.id)
+
+    # Додаємо або оновлюємо користувача в БД.
+
+    # Якщо це новий користувач або його роль ASK_ROLE, то встановлюємо ASK_ROLE.
+
+    # В іншому випадку, залишаємо існуючу роль і групу.
+
+    if is_new_user or current_user_role is None:
+
+        add_or_update_user_in_db(
+            user.id,
+            user.username,
+            user.first_name,
+            user.last_name,
+            group_name="ASK_LATER",
+            referrer_id=referrer_id,
+        )
+
+        set_user_role_in_db(user.id, "ASK_ROLE")
+
+        current_user_role = "ASK_ROLE"  # Оновлюємо змінну для подальшої логіки
+
+        user_group = "ASK_LATER"  # Оновлюємо змінну для подальшої логіки
+
+    # Якщо користувач вже має роль, відмінну від 'ASK_ROLE', і (якщо студент) має групу,
+
+    # то одразу показуємо головне меню.
+
+    if current_user_role == "teacher" and get_teacher_data_from_db(user.id):
+
+        await show_teacher_menu_handler(update, context)
+
+        return ConversationHandler.END
+
+    if current_user_role != "ASK_ROLE" and (
+        current_user_role != "student" or (user_group is not None and user_group != "ASK_LATER")
+    ):
+
+        text = f"Привіт, {user.full_name}! Твоя роль: *{current_user_role.capitalize()}*.\n"
+
+        if current_user_role == "student":
+
+            text += f"Твоя група: *{user_group or 'не обрана'}*.\n"
+
+        text += "Чим можу допомогти?"
+
+        reply_markup = get_main_menu_keyboard(user.id, user_group)
+
+        if update.message:
+
+            await update.message.reply_text(text, reply_markup=reply_markup, parse_mode="Markdown")
+
+        elif update.callback_query:
+
+            # Якщо це колбек, ми повинні відредагувати існуюче повідомлення
+
+            await update.callback_query.edit_message_text(
+                text, reply_markup=reply_markup, parse_mode="Markdown"
+            )
+
+        return ConversationHandler.END  # Завершуємо ConversationHandler
+
+    # Якщо користувач новий або роль "ASK_ROLE", просимо обрати роль
+
+    if current_user_role == "ASK_ROLE":
+
+        logger.info(
+            f"User {user.id} has ASK_ROLE, showing role selection menu and returning SELECTING_ROLE"
+        )
+
+        record_registration_funnel_step(context.user_data, "start")
+
+        text = f"Привіт, {user.mention_html()}! Я бот 'ЧГЕФК'.\n" "Будь ласка, оберіть, хто ви:"
+
+        reply_markup = get_role_selection_keyboard()
+
+        if update.message:
+
+            await update.message.reply_text(text, reply_markup=reply_markup, parse_mode="HTML")
+
+        elif update.callback_query:
+
+            await update.callback_query.message.edit_text(
+                text, reply_markup=reply_markup, parse_mode="HTML"
+            )
+
+        logger.info(f"User {user.id} role selection menu shown, returning SELECTING_ROLE")
+
+        return SELECTING_ROLE
+
+    # Якщо користувач студент і група не встановлена, просимо обрати групу
+
+    if current_user_role == "student" and (user_group is None or user_group == "ASK_LATER"):
+
+        text = (
+            f"Привіт, {user.mention_html()}! Я бот 'ЧГЕФК'.\n"
+            "Твоя група ще не встановлена.\n"
+            "Будь ласка, обери свою групу, щоб я міг показувати тобі актуальний розклад:"
+        )
+
+        reply_markup = get_group_selection_keyboard(selected_course=None)
+
+        if update.message:
+
+            await update.message.reply_text(text, reply_markup=reply_markup, parse_mode="HTML")
+
+        elif update.callback_query:
+
+            await update.callback_query.message.edit_text(
+                text, reply_markup=reply_markup, parse_mode="HTML"
+            )
+
+        return SELECTING_GROUP
+
+    return ConversationHandler.END
+
+
+async def show_main_menu_handler(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+
+    query = update.callback_query
+
+    user = query.from_user
+
+    user_group = get_user_group_from_db(user.id)
+
+    text = f"Головне меню. Ваша група: *{user_group or 'не обрана'}*.\nЧим можу допомогти?"
+
+    reply_markup = get_main_menu_keyboard(user.id, user_group)
+
+    try:
+
+        await query.edit_message_text(text, reply_markup=reply_markup, parse_mode="Markdown")
+
+    except Exception as e:
+
+        logger.debug(
+            f"Не вдалося відредагувати повідомлення на головне меню (можливо, не змінилось): {e}"
+        )
+
+
+# --- ДОДАЙТЕ ЦЮ НОВУ ФУНКЦІЮ ---
+
+
+async def back_to_main_menu_universal_handler(
+    update: Update, context: ContextTypes.DEFAULT_TYPE
+) -> None:
+    """
+
+    Універсальний обробник для кнопки "Назад до головного меню".
+
+    Перевіряє роль користувача і показує відповідне меню.
+
+    """
+
+    query = update.callback_query
+
+    if query:
+
+        await query.answer()
+
+    user_id = update.effective_user.id
+
+    user_role = get_user_role_from_db(user_id)
+
+    logger.info(
+        f"Universal back to menu: User {user_id} with role '{user_role}' is returning to main menu."
+    )
+
+    if user_role == "teacher":
+
+        # Якщо це викладач, показуємо меню викладача
+
+        await show_teacher_menu_handler(update, context)
+
+    elif user_role == "student":
+
+        # Якщо це студент, показуємо меню студента (стара логіка)
+
+        await show_main_menu_handler(update, context)
+
+    else:
+
+        # Для всіх інших (гості, ті, хто ще не обрав роль) повертаємо на екран вибору ролі
+
+        await back_to_role_selection_handler(update, context)
+
+
+async def schedule_menu_handler(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+
+    user_id = update.effective_user.id
+
+    # Перевіряємо, чи це куратор, який дивиться розклад своєї групи
+
+    curated_group = context.user_data.get("curated_group_name")
+
+    if curated_group:
+
+        user_group = curated_group
+
+        back_keyboard = get_back_to_teacher_menu_keyboard()
+
+    else:
+
+        user_group = get_user_group_from_db(user_id)
+
+        back_keyboard = get_back_to_main_menu_keyboard()
+
+    text = f"📅 Меню розкладу для групи: *{user_group or 'НЕ ОБРАНА'}*.\nОберіть пункт:"
+
+    reply_markup = get_schedule_menu_keyboard(user_group)
 
     if update.callback_query:
 
-        await update.callback_query.edit_message_text(text, reply_markup=reply_markup)
+        await update.callback_query.edit_message_text(
+            text, reply_markup=reply_markup, parse_mode="Markdown"
+        )
+
+    elif update.message:
+
+        update_command_stats(update.message.text.split()[0])
+
+        if not user_group:
+
+            await update.message.reply_text(
+                "Будь ласка, спочатку встановіть вашу групу.",
+                reply_markup=get_main_menu_keyboard(user_id, None),
+            )
+
+            return
+
+        await update.message.reply_text(text, reply_markup=reply_markup, parse_mode="Markdown")
+
+
+async def day_schedule_menu_handler(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+
+    query = update.callback_query
+
+    user_id = query.from_user.id
+
+    # Перевіряємо, чи це куратор, який дивиться розклад своєї групи
+
+    curated_group = context.user_data.get("curated_group_name")
+
+    if curated_group:
+
+        user_group = curated_group
+
+    else:
+
+        user_group = get_user_group_from_db(user_id)
+
+    if not user_group:
+
+        await query.answer("Спочатку оберіть групу!", show_alert=True)
+
+        await query.edit_message_text(
+            "Будь ласка, оберіть групу:",
+            reply_markup=get_group_selection_keyboard(selected_course=None),
+        )
+
+        return
+
+    text = "🗓️ Обери день тижня (для поточного типу тижня):"
+
+    reply_markup = get_day_schedule_menu_keyboard()
+
+    await query.edit_message_text(text, reply_markup=reply_markup, parse_mode="HTML")
+
+
+async def select_specific_day_menu_handler(
+    update: Update, context: ContextTypes.DEFAULT_TYPE
+) -> None:
+
+    query = update.callback_query
+
+    user_id = query.from_user.id
+
+    # Виправлена логіка: якщо викладач дивиться іншу групу, показуємо саме її
+
+    teacher_viewing_group = context.user_data.get("teacher_viewing_group")
+
+    curated_group = context.user_data.get("curated_group_name")
+
+    if teacher_viewing_group:
+
+        user_group = teacher_viewing_group
+
+    elif curated_group:
+
+        user_group = curated_group
+
+    else:
+
+        user_group = get_user_group_from_db(user_id)
+
+    if not user_group:
+
+        await query.edit_message_text(
+            "Будь ласка, спочатку оберіть вашу групу.",
+            reply_markup=get_main_menu_keyboard(user_id, None),
+        )
+
+        return
+
+    text = "🗓️ Оберіть день, для якого бажаєте вказати тип тижня:"
+
+    reply_markup = get_specific_day_selection_keyboard()
+
+    await query.edit_message_text(text, reply_markup=reply_markup)
+
+
+async def select_week_type_for_day_menu_handler(
+    update: Update, context: ContextTypes.DEFAULT_TYPE
+) -> None:
+
+    query = update.callback_query
+
+    day_name = query.data.replace("chose_day_", "")
+
+    text = f"🗓️ Оберіть тип тижня для: *{day_name.capitalize()}*"
+
+    reply_markup = get_week_type_selection_keyboard(day_name)
+
+    await query.edit_message_text(text, reply_markup=reply_markup, parse_mode="Markdown")
+
+
+async def show_schedule_for_day_handler(
+    update: Update, context: ContextTypes.DEFAULT_TYPE, command_or_day_data: str
+) -> None:
+
+    query = update.callback_query
+
+    if not query:
+
+        logger.warning("show_schedule_for_day_handler викликано без callback_query.")
+
+        if update.message:
+            await update.message.reply_text("Сталася помилка. Спробуйте через меню.")
+
+        return
+
+    user_id = query.from_user.id
+
+    # Виправлена логіка: якщо викладач дивиться іншу групу, показуємо саме її
+
+    teacher_viewing_group = context.user_data.get("teacher_viewing_group")
+
+    curated_group = context.user_data.get("curated_group_name")
+
+    if teacher_viewing_group:
+
+        user_group = teacher_viewing_group
+
+    elif curated_group:
+
+        user_group = curated_group
+
+    else:
+
+        user_group = get_user_group_from_db(user_id)
+
+    if not user_group:
+
+        await query.answer("Будь ласка, спочатку оберіть вашу групу.", show_alert=True)
+
+        current_text = "Для перегляду розкладу, будь ласка, спочатку встановіть вашу групу:"
+
+        reply_mk = get_group_selection_keyboard(selected_course=None)
+
+        try:
+            await query.edit_message_text(current_text, reply_markup=reply_mk)
+
+        except Exception:
+            await query.message.reply_text(current_text, reply_markup=reply_mk)
+
+        return
+
+    group_schedule_data = get_schedule_data_for_group(user_group)
+
+    if not group_schedule_data:
+
+        # Використовуємо відповідну клавіатуру повернення залежно від контексту
+
+        if curated_group:
+
+            back_keyboard = get_back_to_teacher_menu_keyboard()
+
+        else:
+
+            back_keyboard = get_back_to_schedule_menu_keyboard()
+
+        await query.edit_message_text(
+            f"На жаль, розклад для групи *{user_group}* не знайдено.",
+            reply_markup=back_keyboard,
+            parse_mode="Markdown",
+        )
+
+        return
+
+    current_day_kyiv = datetime.now(KYIV_TZ)
+
+    target_date_for_week_type_calc = current_day_kyiv
+
+    day_to_display_key = ""
+
+    week_type_to_use = ""
+
+    days_indices_to_text = {
+        0: "понеділок",
+        1: "вівторок",
+        2: "середа",
+        3: "четвер",
+        4: "п'ятниця",
+        5: "субота",
+        6: "неділя",
+    }
+
+    if command_or_day_data == "get_schedule_today":
+
+        target_date_for_week_type_calc = current_day_kyiv
+
+        day_of_week_index = target_date_for_week_type_calc.weekday()
+
+        day_to_display_key = days_indices_to_text.get(day_of_week_index)
+
+        if day_of_week_index >= 5:
+
+            response_text = (
+                f"Сьогодні *{day_to_display_key.capitalize()}*, пар немає. Відпочивай! 🥳"
+            )
+
+            await query.edit_message_text(
+                response_text,
+                reply_markup=get_back_to_schedule_menu_keyboard(),
+                parse_mode="Markdown",
+            )
+
+            return
+
+        week_type_to_use = get_current_week_type_for_schedule(target_date_for_week_type_calc)
+
+    elif command_or_day_data == "get_schedule_tomorrow":
+
+        target_date_for_week_type_calc = current_day_kyiv + timedelta(days=1)
+
+        day_of_week_index = target_date_for_week_type_calc.weekday()
+
+        day_to_display_key = days_indices_to_text.get(day_of_week_index)
+
+        if day_of_week_index >= 5:
+
+            day_name = day_to_display_key.capitalize() if day_to_display_key else "Вихідний"
+
+            response_text = f"Завтра *{day_name}*, пар немає. Плануй відпочинок! 🏖️"
+
+            await query.edit_message_text(
+                response_text,
+                reply_markup=get_back_to_schedule_menu_keyboard(),
+                parse_mode="Markdown",
+            )
+
+            return
+
+        week_type_to_use = get_current_week_type_for_schedule(target_date_for_week_type_calc)
+
+    elif command_or_day_data.startswith("show_day_explicit_"):
+
+        parts = command_or_day_data.replace("show_day_explicit_", "").rsplit("_", 1)
+
+        if len(parts) == 2:
+
+            day_to_display_key = parts[0]
+
+            week_type_to_use = parts[1]
+
+            if week_type_to_use not in ["чисельник", "знаменник"]:
+                week_type_to_use = ""
+
+        else:
+            day_to_display_key = ""
+            week_type_to_use = ""
+
+    elif command_or_day_data.startswith("get_schedule_day_"):
+
+        day_to_display_key = command_or_day_data.replace("get_schedule_day_", "")
+
+        week_type_to_use = get_current_week_type_for_schedule(current_day_kyiv)
+
+    else:
+
+        await query.edit_message_text(
+            "Невідома команда для розкладу.", reply_markup=get_back_to_schedule_menu_keyboard()
+        )
+
+        return
+
+    if not day_to_display_key or not week_type_to_use:
+
+        await query.edit_message_text(
+            "Не вдалося визначити день або тип тижня.",
+            reply_markup=get_back_to_schedule_menu_keyboard(),
+        )
+
+        return
+
+    response_text = get_schedule_for_day(group_schedule_data, day_to_display_key, week_type_to_use)
+
+    # Використовуємо відповідну клавіатуру повернення залежно від контексту
+
+    if curated_group or context.user_data.get("teacher_viewing_any_group"):
+
+        back_button_markup = get_back_to_teacher_menu_keyboard()
 
-    elif update.message:
+        if command_or_day_data.startswith("show_day_explicit_"):
 
-        await update.message.reply_text(text, reply_markup=reply_markup)
+            day_name_for_back_button = day_to_display_key
 
-    logger.info(f"Адмін {user_id} вимкнув режим обслуговування вручну.")
+            back_button_markup = InlineKeyboardMarkup(
+                [
+                    [
+                        InlineKeyboardButton(
+                            "⬅️ Назад до вибору типу тижня",
+                            callback_data=f"chose_day_{day_name_for_back_button}",
+                        )
+                    ],
+                    [InlineKeyboardButton("🏠 Меню викладача", callback_data="back_to_main_menu")],
+                ]
+            )
 
+    else:
 
-async def maintenance_cancel_setup_callback(
-    update: Update, context: ContextTypes.DEFAULT_TYPE
-) -> int:
+        back_button_markup = get_back_to_schedule_menu_keyboard()
 
-    query = update.callback_query
+        if command_or_day_data.startswith("show_day_explicit_"):
 
-    await query.answer()
+            day_name_for_back_button = day_to_display_key
 
-    context.user_data.clear()
+            back_button_markup = InlineKeyboardMarkup(
+                [
+                    [
+                        InlineKeyboardButton(
+                            "⬅️ Назад до вибору типу тижня",
+                            callback_data=f"chose_day_{day_name_for_back_button}",
+                        )
+                    ],
+                    [
+                        InlineKeyboardButton(
+                            "🏠 Головне меню розкладу", callback_data="show_schedule_menu"
+                        )
+                    ],
+                ]
+            )
 
     await query.edit_message_text(
-        "Налаштування режиму обслуговування скасовано.", reply_markup=get_admin_panel_keyboard()
+        response_text, reply_markup=back_button_markup, parse_mode="Markdown"
     )
 
-    return ConversationHandler.END
 
+def format_lesson_details(lesson: dict) -> str:
+    """Назва пари з аудиторією (і поверхом) та викладачем."""
 
-async def check_maintenance_and_reply(update: Update, context: ContextTypes.DEFAULT_TYPE) -> bool:
+    name = lesson.get("назва", "Невідомо")
 
-    global maintenance_messages_ids
+    # Формуємо інформацію про аудиторію з поверхом
 
-    if maintenance_mode_active and update.effective_user.id not in ADMIN_USER_IDS:
+    aud_info = ""
 
-        time_left_str = ""
+    if lesson.get("аудиторія"):
 
-        if maintenance_end_time and maintenance_end_time > datetime.now(KYIV_TZ):
+        auditorium = lesson.get("аудиторія", "-")
 
-            remaining_delta = maintenance_end_time - datetime.now(KYIV_TZ)
+        floor = get_floor_by_auditorium(auditorium)
 
-            total_seconds = int(remaining_delta.total_seconds())
+        if floor:
 
-            days, rem = divmod(total_seconds, 86400)
+            aud_info = f" (Ауд. {auditorium}) ({floor})"
 
-            hours, rem = divmod(rem, 3600)
+        else:
 
-            minutes, _ = divmod(rem, 60)
+            aud_info = f" (Ауд. {auditorium})"
 
-            if days > 0:
-                time_left_str = f" орієнтовно {days}д {hours}г"
+    teacher = f" ({lesson.get('викладач', '-')})" if lesson.get("викладач") else ""
 
-            elif hours > 0:
-                time_left_str = f" орієнтовно {hours}г {minutes}хв"
+    return f"{name}{aud_info}{teacher}"
 
-            elif minutes > 0:
-                time_left_str = f" орієнтовно {minutes}хв"
 
-            else:
-                time_left_str = " менше хвилини"
+def get_schedule_for_day(
+    group_schedule_data: dict | None, day_name_key: str, current_week_type: str
+) -> str:
+
+    if not group_schedule_data:
+
+        return "_Розклад для вашої групи не знайдено._"
+
+    week_data_key = "тиждень"
 
-            time_left_str = f" Залишилось: {time_left_str}."
+    schedule_for_this_type_of_week = group_schedule_data.get(week_data_key, {})
 
-        full_maintenance_msg = f"⚙️ {maintenance_message}{time_left_str}"
+    week_type_name_display = "Чисельник" if current_week_type == "чисельник" else "Знаменник"
 
-        # Видалення старого повідомлення про ТО (якщо воно існує) та надсилання нового
+    day_name_display = day_name_key.capitalize()
 
-        chat_id_to_send = update.effective_chat.id
+    header = f"🗓️ Розклад на *{day_name_display}* ({week_type_name_display}):\n\n"
 
-        if chat_id_to_send in maintenance_messages_ids:
+    if day_name_key in schedule_for_this_type_of_week:
 
-            try:
+        lessons_for_day = schedule_for_this_type_of_week[day_name_key]
 
-                await context.bot.delete_message(
-                    chat_id=chat_id_to_send, message_id=maintenance_messages_ids[chat_id_to_send]
-                )
+        if not lessons_for_day:
 
-                logger.debug(
-                    f"Видалено попереднє повідомлення про ТО для {chat_id_to_send} перед надсиланням нового."
-                )
+            return header + "_Пар немає. Відпочивай!_"
 
-            except telegram.error.BadRequest as e:
+        filtered_lessons = []
 
-                if "Message to delete not found" in str(e):
+        for lesson in lessons_for_day:
 
-                    logger.warning(
-                        f"Повідомлення про ТО для {chat_id_to_send} вже видалено або не існує. ({e})"
-                    )
+            lesson_type = lesson.get("тип_тижня", "завжди").lower()
 
-                else:
+            if lesson_type == "завжди" or lesson_type == current_week_type:
 
-                    logger.error(
-                        f"Помилка при видаленні попереднього повідомлення про ТО для {chat_id_to_send}: {e}"
+                filtered_lessons.append(lesson)
+
+        if not filtered_lessons:
+
+            return header + "_Пар немає для цього типу тижня. Відпочивай!_"
+
+        details = []
+
+        for lesson in filtered_lessons:
+
+            time_val = lesson.get("час", "??:??")
+
+            name = lesson.get("назва", "Невідомо")
+
+            if name.lower() == "немає пари":
+                continue
+
+            details.append(f" • *{time_val}* - {format_lesson_details(lesson)}")
+
+        if not details:
+
+            return header + "_Пар немає для цього типу тижня. Відпочивай!_"
+
+        return header + "\n".join(details)
+
+    return header + f"_Немає даних для {day_name_display} на {week_type_name_display}._"
+
+
+def get_call_schedule_formatted(group_schedule_data: dict | None) -> str:
+
+    cache = get_cached_schedule()
+
+    calls_data = cache.get("дзвінки")
+
+    if not calls_data:
+
+        return "🔔 Розклад дзвінків не знайдено."
+
+    response = "🔔 Розклад дзвінків:\n\n"
+
+    for call in calls_data:
+
+        response += f"• {call.get('пара', '?')} пара: *{call.get('початок', '??:??')}* - *{call.get('кінець', '??:??')}*\n"
+
+    return response
+
+
+def get_full_schedule_formatted(group_schedule_data: dict | None, group_name: str) -> str:
+
+    if not group_schedule_data:
+
+        return f"📋 Повний розклад для групи *{group_name}* не знайдено."
+
+    response = f"📋 Повний розклад для групи *{group_name}*:\n\n"
+
+    days_order = ["понеділок", "вівторок", "середа", "четвер", "п'ятниця"]
+
+    week_data_key = "тиждень"
+
+    week_data = group_schedule_data.get(week_data_key, {})
+
+    response += "*Чисельник*:\n"
+
+    current_week_type_filter = "чисельник"
+
+    week_has_lessons_numerator = False
+
+    for day in days_order:
+
+        if day in week_data and week_data[day]:
+
+            lessons_today = []
+
+            for lesson in week_data[day]:
+
+                lesson_type = lesson.get("тип_тижня", "завжди").lower()
+
+                if (
+                    lesson_type == "завжди" or lesson_type == current_week_type_filter
+                ) and lesson.get("назва", "").lower() != "немає пари":
+
+                    lessons_today.append(lesson)
+
+            if lessons_today:
+
+                week_has_lessons_numerator = True
+
+                response += f"  *{day.capitalize()}*:\n"
+
+                for lesson_val in lessons_today:
+
+                    time_val = lesson_val.get("час", "??:??")
+
+                    # Формуємо інформацію про аудиторію з поверхом
+
+                    aud_info = ""
+
+                    if lesson_val.get("аудиторія"):
+
+                        auditorium = lesson_val.get("аудиторія", "-")
+
+                        floor = get_floor_by_auditorium(auditorium)
+
+                        if floor:
+
+                            aud_info = f" (Ауд. {auditorium}) ({floor})"
+
+                        else:
+
+                            aud_info = f" (Ауд. {auditorium})"
+
+                    teacher = (
+                        f" ({lesson_val.get('викладач', '-')})"
+                        if lesson_val.get("викладач")
+                        else ""
                     )
 
-            finally:
+                    response += f"    • {time_val} - {lesson_val.get('назва', 'Невідомо')}{aud_info}{teacher}\n"
 
-                del maintenance_messages_ids[chat_id_to_send]
+    if not week_has_lessons_numerator:
+        response += "  _На цьому тижні (чисельник) пар немає._\n"
 
-        if update.callback_query:
+    response += "\n*Знаменник*:\n"
 
-            try:
+    current_week_type_filter = "знаменник"
 
-                if not context.user_data.get(f"answered_query_{update.callback_query.id}"):
+    week_has_lessons_denominator = False
 
-                    # Якщо це перший раз, коли бот відповідає на цей запит, надсилаємо сповіщення
+    for day in days_order:
 
-                    await update.callback_query.answer(full_maintenance_msg, show_alert=True)
+        if day in week_data and week_data[day]:
 
-                    context.user_data[f"answered_query_{update.callback_query.id}"] = True
+            lessons_today = []
 
-                else:
+            for lesson_val in week_data[day]:
+
+                lesson_type = lesson_val.get("тип_тижня", "завжди").lower()
+
+                if (
+                    lesson_type == "завжди" or lesson_type == current_week_type_filter
+                ) and lesson_val.get("назва", "").lower() != "немає пари":
+
+                    lessons_today.append(lesson_val)
 
-                    # В іншому випадку, якщо вже було попередження, просто відповідаємо текстом
+            if lessons_today:
+
+                week_has_lessons_denominator = True
+
+                response += f"  *{day.capitalize()}*:\n"
+
+                for lesson_val_inner in lessons_today:
+
+                    time_val = lesson_val_inner.get("час", "??:??")
+
+                    # Формуємо інформацію про аудиторію з поверхом
+
+                    aud_info = ""
+
+                    if lesson_val_inner.get("аудиторія"):
+
+                        auditorium = lesson_val_inner.get("аудиторія", "-")
+
+                        floor = get_floor_by_auditorium(auditorium)
+
+                        if floor:
+
+                            aud_info = f" (Ауд. {auditorium}) ({floor})"
+
+                        else:
+
+                            aud_info = f" (Ауд. {auditorium})"
 
-                    sent_msg = await update.callback_query.message.reply_text(full_maintenance_msg)
+                    teacher = (
+                        f" ({lesson_val_inner.get('викладач', '-')})"
+                        if lesson_val_inner.get("викладач")
+                        else ""
+                    )
 
-                    maintenance_messages_ids[chat_id_to_send] = sent_msg.message_id
+                    response += f"    • {time_val} - {lesson_val_inner.get('назва', 'Невідомо')}{aud_info}{teacher}\n"
 
-            except Exception as e:
+    if not week_has_lessons_denominator:
+        response += "  _На цьому тижні (знаменник) пар немає._\n"
 
-                logger.error(f"Помилка при відповіді на callback з повідомленням про ТО: {e}")
+    response += "\n" + get_call_schedule_formatted(group_schedule_data)
 
-                # Якщо callback.answer не спрацював, надішлемо звичайне повідомлення
+    return response.strip()
 
-                sent_msg = await update.callback_query.message.reply_text(full_maintenance_msg)
 
-                maintenance_messages_ids[chat_id_to_send] = sent_msg.message_id
+async def call_schedule_handler(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
 
-        elif update.message:
+    user_id = update.effective_user.id
 
-            sent_msg = await update.message.reply_text(full_maintenance_msg)
+    # Перевіряємо, чи це викладач, який дивиться розклад
 
-            maintenance_messages_ids[chat_id_to_send] = sent_msg.message_id
+    curated_group = context.user_data.get("curated_group_name")
 
-        return True
+    teacher_viewing_group = context.user_data.get("teacher_viewing_group")
 
-    return False
+    if curated_group:
 
+        user_group = curated_group
 
-# ЗАМІНІТЬ СТАРУ ФУНКЦІЮ select_role_callback_handler
+    elif teacher_viewing_group:
 
+        user_group = teacher_viewing_group
 
-async def select_role_callback_handler(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
+    else:
 
-    query = update.callback_query
+        user_group = get_user_group_from_db(user_id)
 
-    await query.answer()
+    msg_target = update.callback_query.message if update.callback_query else update.message
 
-    user_id = query.from_user.id
+    if not user_group:
 
-    role = query.data.replace("select_role_", "")
+        reply_m = (
+            get_main_menu_keyboard(user_id, None)
+            if update.message
+            else get_group_selection_keyboard(selected_course=None)
+        )
 
-    logger.info(
-        f"select_role_callback_handler: User {user_id} selected role '{role}' (callback_data: {query.data})"
-    )
+        await msg_target.reply_text(
+            "Будь ласка, спочатку встановіть вашу групу (хоча розклад дзвінків зазвичай глобальний).",
+            reply_markup=reply_m,
+        )
 
-    logger.info(
-        f"select_role_callback_handler: Function called from {update.effective_chat.type} chat"
-    )
+        if update.callback_query:
+            await update.callback_query.answer()
 
-    if role == "student":
+        return
 
-        logger.info(
-            f"Setting user {user_id} role to 'student' and transitioning to SELECTING_COURSE"
-        )
+    group_schedule_data = get_schedule_data_for_group(user_group)
 
-        set_user_role_in_db(user_id, role)
+    response_text = get_call_schedule_formatted(group_schedule_data)
 
-        await query.edit_message_text(
-            "🎓 Ви обрали 'Студент'. Будь ласка, оберіть ваш курс:",
-            reply_markup=get_student_course_selection_keyboard(),
-        )
+    # Використовуємо відповідну клавіатуру повернення залежно від контексту
 
-        logger.info(
-            f"User {user_id} role set to 'student', message updated, returning SELECTING_COURSE"
-        )
+    if curated_group or teacher_viewing_group:
 
-        return SELECTING_COURSE
+        reply_markup = get_back_to_teacher_menu_keyboard()
 
-    elif role == "guest":
+    else:
 
-        logger.info(f"Setting user {user_id} role to 'guest' and transitioning to GUEST_MENU")
+        reply_markup = get_back_to_schedule_menu_keyboard()
 
-        set_user_role_in_db(user_id, role)
+    if update.callback_query:
 
-        await query.edit_message_text(
-            "🚶‍♂️ Ви обрали 'Гість'. Доступні опції:", reply_markup=get_guest_menu_keyboard()
+        await update.callback_query.edit_message_text(
+            response_text, reply_markup=reply_markup, parse_mode="Markdown"
         )
 
-        logger.info(f"User {user_id} role set to 'guest', message updated, returning GUEST_MENU")
+    elif update.message:
 
-        return GUEST_MENU
+        update_command_stats("/call_schedule")
 
-    elif role == "staff":
+        await update.message.reply_text(
+            response_text, reply_markup=reply_markup, parse_mode="Markdown"
+        )
 
-        logger.info(f"Setting user {user_id} role to 'staff' and staying in SELECTING_ROLE")
 
-        set_user_role_in_db(user_id, role)
+def get_now_next_formatted(group_name: str, now: datetime) -> str:
+    """Поточна та наступна пара групи: бінарний пошук по шкалі дзвінків."""
 
-        await query.edit_message_text(
-            "👷‍♂️ Ви обрали 'Працівник'. Цей функціонал *в розробці*.",
-            reply_markup=get_back_to_role_selection_keyboard(),
-            parse_mode="Markdown",
-        )
+    get_cached_schedule()
 
-        logger.info(
-            f"User {user_id} role set to 'staff', message updated, returning SELECTING_ROLE"
-        )
+    if not bell_timeline:
 
-        return SELECTING_ROLE
+        return "🔔 Розклад дзвінків не знайдено."
 
-    else:
+    minute_of_day = now.hour * 60 + now.minute
 
-        logger.warning(f"Unknown role '{role}' selected by user {user_id}")
+    day_name = WEEKDAY_NAMES[now.weekday()]
 
-    return ConversationHandler.END
+    week_type = get_current_week_type_for_schedule(now)
 
+    header = f"⏱ Зараз *{now.strftime('%H:%M')}*, група *{group_name}*:\n\n"
 
-async def select_teacher_role_callback_handler(
-    update: Update, context: ContextTypes.DEFAULT_TYPE
-) -> int:
-    """Окремий обробник для кнопки 'Я викладач'"""
+    slot_renders = now_slot_renders.get((group_name, day_name, week_type))
 
-    query = update.callback_query
+    if not slot_renders:
 
-    await query.answer()
+        return header + "_Сьогодні пар немає. Відпочивай!_"
 
-    user_id = query.from_user.id
+    lines, next_idx = slot_renders
 
-    logger.info(f"select_teacher_role_callback_handler: User {user_id} selected teacher role")
+    position = bisect.bisect_right(bell_timeline, minute_of_day)
 
-    await query.edit_message_text(
-        "👨‍🏫 Будь ласка, введіть ваш одноразовий пароль (код запрошення), отриманий від адміністратора.",
-        reply_markup=get_back_to_role_selection_keyboard(),
-    )
+    parts = []
 
-    return TYPING_ONE_TIME_PASSWORD
+    if position % 2 == 1:
 
+        # Всередині слота: непарна позиція в [початок, кінець, ...]
 
-# ЗАМІНІТЬ СТАРУ ФУНКЦІЮ select_student_course_handler НА ЦЮ
+        slot_idx = (position - 1) // 2
 
+        start, end, pair_num = bell_slots[slot_idx]
 
-async def select_student_course_handler(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
+        if lines[slot_idx]:
 
-    query = update.callback_query
+            parts.append(
+                f"▶️ *{pair_num} пара*: {lines[slot_idx]}\n⏳ До кінця: *{end - minute_of_day} хв*"
+            )
 
-    await query.answer()
+        else:
 
-    user_id = query.from_user.id
+            parts.append(f"☕ Зараз ({pair_num} пара) у вас вікно.")
 
-    course = query.data.replace("select_course_", "")
+        search_from = slot_idx + 1
 
-    logger.info(f"select_student_course_handler: User {user_id} selected course '{course}'")
+    else:
 
-    try:
+        is_break = 0 < position < len(bell_timeline)
 
-        course_number = int(course)
+        parts.append("☕ Зараз перерва." if is_break else "☕ Зараз пар немає.")
 
-        if course_number in [1, 2, 3, 4]:
+        search_from = position // 2
 
-            logger.info(
-                f"User {user_id} selected valid course {course_number}, proceeding to group selection"
-            )
+    next_slot_idx = next_idx[search_from] if search_from < len(next_idx) else None
 
-            # Користувач обрав курс. Тепер ми маємо запитати його групу.
+    if next_slot_idx is None:
 
-            # Ми редагуємо поточне повідомлення, щоб показати клавіатуру вибору групи
+        parts.append("🏁 На сьогодні пари закінчились.")
 
-            # і переводимо розмову до стану SELECTING_GROUP.
+    else:
 
-            text = f"Чудово! Тепер, будь ласка, оберіть вашу групу зі списку для {course_number} курсу:"
+        start, end, pair_num = bell_slots[next_slot_idx]
 
-            # Викликаємо оновлену функцію клавіатури, вказавши, що це процес реєстрації та курс
+        parts.append(
+            f"⏭ Далі *{pair_num} пара* о *{start // 60:02d}:{start % 60:02d}* "
+            f"(через *{start - minute_of_day} хв*): {lines[next_slot_idx]}"
+        )
 
-            reply_markup = get_group_selection_keyboard(
-                registration_flow=True, selected_course=course_number
-            )
+    return header + "\n\n".join(parts)
 
-            await query.edit_message_text(text, reply_markup=reply_markup, parse_mode="Markdown")
 
-            # Зберігаємо вибраний курс в контексті для подальшого використання
+async def now_next_lesson_handler(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+    """Кнопка/команда «Що зараз / що далі» для групи користувача."""
 
-            context.user_data["selected_course"] = course_number
+    user_id = update.effective_user.id
 
-            # Повертаємо наступний стан у нашій розмові. Це найважливіша зміна!
+    curated_group = context.user_data.get("curated_group_name")
 
-            return SELECTING_GROUP
+    teacher_viewing_group = context.user_data.get("teacher_viewing_group")
 
-    except ValueError:
+    user_group = curated_group or teacher_viewing_group or get_user_group_from_db(user_id)
 
-        logger.warning(f"User {user_id} selected invalid course '{course}'")
+    msg_target = update.callback_query.message if update.callback_query else update.message
 
-    # Якщо щось пішло не так, повертаємося до вибору курсу
+    if not user_group:
 
-    logger.info(f"User {user_id} returning to course selection")
+        await msg_target.reply_text(
+            "Будь ласка, спочатку встановіть вашу групу.",
+            reply_markup=get_main_menu_keyboard(user_id, None),
+        )
 
-    await query.edit_message_text(
-        "Будь ласка, оберіть курс:",
-        reply_markup=get_student_course_selection_keyboard(),
-        parse_mode="Markdown",
-    )
+        return
 
-    return SELECTING_COURSE
+    response_text = get_now_next_formatted(user_group, datetime.now(KYIV_TZ))
 
+    if curated_group or teacher_viewing_group:
 
-# ЗАМІНІТЬ СТАРУ ФУНКЦІЮ handle_teacher_otp_entry або handle_teacher_initials
+        reply_markup = get_back_to_teacher_menu_keyboard()
 
+    else:
 
-async def handle_teacher_otp_entry(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
+        reply_markup = get_back_to_schedule_menu_keyboard()
 
-    # 1. Надсилаємо початкове повідомлення і зберігаємо його
+    if update.callback_query:
 
-    processing_message = await update.message.reply_text(
-        "Перевіряю ваш код... Зачекайте, будь ласка ⏳"
-    )
+        await update.callback_query.edit_message_text(
+            response_text, reply_markup=reply_markup, parse_mode="Markdown"
+        )
 
-    user = update.effective_user
+    elif update.message:
 
-    entered_otp = update.message.text.strip()
+        update_command_stats("/now")
 
-    # 2. Виконуємо повільну перевірку пароля
+        await update.message.reply_text(
+            response_text, reply_markup=reply_markup, parse_mode="Markdown"
+        )
 
-    is_successful, message = verify_otp_and_claim_profile(entered_otp, user.id)
 
-    # 3. Редагуємо початкове повідомлення з кінцевим результатом
+async def full_schedule_handler(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
 
-    if is_successful:
+    user_id = update.effective_user.id
 
-        # Якщо успіх, готуємо і показуємо меню викладача
+    # Перевіряємо, чи це викладач, який дивиться розклад
 
-        if not user_exists(user.id):
+    curated_group = context.user_data.get("curated_group_name")
 
-            add_or_update_user_in_db(user.id, user.username, user.first_name, user.last_name)
+    teacher_viewing_group = context.user_data.get("teacher_viewing_group")
 
-        set_user_role_in_db(user.id, "teacher")
+    if curated_group:
 
-        teacher_data = get_teacher_data_from_db(user.id)
+        user_group = curated_group
 
-        teacher_name = (
-            teacher_data.get("full_name", user.full_name) if teacher_data else user.full_name
-        )
+    elif teacher_viewing_group:
 
-        success_text = f"Вітаю, *{teacher_name}*!\nВи увійшли як викладач. Чим можу допомогти?"
+        user_group = teacher_viewing_group
 
-        reply_markup = get_teacher_menu_keyboard(user.id)
+    else:
 
-        await processing_message.edit_text(
-            text=success_text, reply_markup=reply_markup, parse_mode="Markdown"
-        )
+        user_group = get_user_group_from_db(user_id)
 
-        return ConversationHandler.END
+    msg_target = update.callback_query.message if update.callback_query else update.message
 
-    else:
+    if not user_group:
 
-        # Якщо помилка, показуємо її
+        reply_m = (
+            get_main_menu_keyboard(user_id, None)
+            if update.message
+            else get_group_selection_keyboard(selected_course=None)
+        )
 
-        await processing_message.edit_text(
-            text=f"❌ {message}\nСпробуйте ще раз або зверніться до адміністратора.",
-            reply_markup=get_back_to_role_selection_keyboard(),
+        await msg_target.reply_text(
+            "Будь ласка, спочатку встановіть вашу групу.", reply_markup=reply_m
         )
 
-        return TYPING_ONE_TIME_PASSWORD
+        if update.callback_query:
+            await update.callback_query.answer()
 
+        return
 
-async def handle_guest_info_about_college(
-    update: Update, context: ContextTypes.DEFAULT_TYPE
-) -> int:
+    group_schedule_data = get_schedule_data_for_group(user_group)
 
-    query = update.callback_query
+    response_text = get_full_schedule_formatted(group_schedule_data, user_group)
 
-    user_id = None
+    # Використовуємо відповідну клавіатуру повернення залежно від контексту
 
-    if query and query.from_user:
+    if curated_group or teacher_viewing_group:
 
-        user_id = query.from_user.id
+        reply_markup = get_back_to_teacher_menu_keyboard()
 
-    elif update.effective_user:
+    else:
 
-        user_id = update.effective_user.id
+        reply_markup = get_back_to_schedule_menu_keyboard()
 
-    if user_id is None:
+    if update.callback_query:
 
-        logger.warning("handle_guest_info_about_college: не вдалося отримати user_id")
+        await update.callback_query.edit_message_text(
+            response_text, reply_markup=reply_markup, parse_mode="Markdown"
+        )
 
-        return GUEST_MENU
+    elif update.message:
 
-    user_role = get_user_role_from_db(user_id)  # Отримуємо роль
+        update_command_stats("/full_schedule")
 
-    if query:
+        await update.message.reply_text(
+            response_text, reply_markup=reply_markup, parse_mode="Markdown"
+        )
 
-        await query.answer()
 
-    text = "ℹ️ *Про коледж: Що вас цікавить?*"
+# --- Inline-режим: @bot КН-21-24 пн [чис|зн] ---
+
+INLINE_DAY_ALIASES = {
+    "пн": "понеділок",
+    "пон": "понеділок",
+    "понеділок": "понеділок",
+    "вт": "вівторок",
+    "вів": "вівторок",
+    "вівторок": "вівторок",
+    "ср": "середа",
+    "сер": "середа",
+    "середа": "середа",
+    "чт": "четвер",
+    "чет": "четвер",
+    "четвер": "четвер",
+    "пт": "п'ятниця",
+    "п'ят": "п'ятниця",
+    "п'ятниця": "п'ятниця",
+    "сб": "субота",
+    "субота": "субота",
+    "нд": "неділя",
+    "неділя": "неділя",
+}
 
-    reply_markup = get_about_college_menu_keyboard(user_role=user_role)  # Передаємо роль
+INLINE_RELATIVE_DAYS = {"сьогодні": 0, "сьогодн": 0, "завтра": 1}
 
-    if query and query.message:
+INLINE_WEEK_ALIASES = {
+    "чис": "чисельник",
+    "чисельник": "чисельник",
+    "зн": "знаменник",
+    "знам": "знаменник",
+    "знаменник": "знаменник",
+}
 
-        await query.message.edit_text(text, reply_markup=reply_markup, parse_mode="Markdown")  # type: ignore
+WEEKDAY_NAMES = ["понеділок", "вівторок", "середа", "четвер", "п'ятниця", "субота", "неділя"]
 
-    elif update.message:
 
-        await update.message.reply_text(text, reply_markup=reply_markup, parse_mode="Markdown")  # type: ignore
+def parse_inline_schedule_query(query: str) -> tuple[str, str, str]:
+    """Розбирає inline-запит на (назва, день, тип тижня)."""
 
-    return GUEST_MENU
+    now = datetime.now(KYIV_TZ)
 
+    day_name = None
 
-# Правильна версія
+    week_type = None
 
+    name_tokens = []
 
-async def back_to_role_selection_handler(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
+    for token in normalize_search_key(query).split():
 
-    query = update.callback_query
+        if token in INLINE_WEEK_ALIASES:
 
-    if query:
+            week_type = INLINE_WEEK_ALIASES[token]
 
-        await query.answer()  # Відповідаємо на запит негайно
+        elif token in INLINE_RELATIVE_DAYS:
 
-    user = update.effective_user  # Краще використовувати effective_user
+            target = now + timedelta(days=INLINE_RELATIVE_DAYS[token])
 
-    text = f"Привіт, {user.mention_html()}! Я бот 'ЧГЕФК'.\n" "Будь ласка, оберіть, хто ви:"
+            day_name = WEEKDAY_NAMES[target.weekday()]
 
-    reply_markup = get_role_selection_keyboard()
+            week_type = week_type or get_current_week_type_for_schedule(target)
 
-    # Скидаємо роль користувача в базі даних
+        elif token in INLINE_DAY_ALIASES:
 
-    set_user_role_in_db(user.id, "ASK_ROLE")
+            day_name = INLINE_DAY_ALIASES[token]
 
-    # Редагуємо повідомлення, якщо можемо, інакше надсилаємо нове
+        else:
 
-    if query and query.message:
+            name_tokens.append(token)
 
-        await query.edit_message_text(text, reply_markup=reply_markup, parse_mode="HTML")
+    if day_name is None:
 
-    else:
+        day_name = WEEKDAY_NAMES[now.weekday()]
 
-        await context.bot.send_message(
-            chat_id=user.id, text=text, reply_markup=reply_markup, parse_mode="HTML"
-        )
+    if week_type is None:
 
-    # Завершуємо будь-яку активну розмову. Це ключова зміна.
+        week_type = get_current_week_type_for_schedule(now)
 
-    return ConversationHandler.END
+    return " ".join(name_tokens), day_name, week_type
 
 
-# ДОДАЙТЕ ЦЮ НОВУ ФУНКЦІЮ
+def render_inline_schedule(kind: str, name: str, day_name: str, week_type: str) -> str:
+    """Текст розкладу для inline-результату (через кеш рендерів)."""
 
+    if kind == "teacher":
 
-async def back_to_course_handler(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
-    """Обробник для повернення користувача з етапу вибору групи до вибору курсу."""
+        return get_teacher_schedule_for_day(name, day_name, week_type)
 
-    query = update.callback_query
+    return get_cached_render(
+        "group_day",
+        (name, day_name, week_type),
+        lambda: f"👥 Група *{name}*\n"
+        + get_schedule_for_day(get_schedule_data_for_group(name), day_name, week_type),
+    )
 
-    await query.answer()
 
-    # Показуємо меню вибору курсу знову
+async def inline_query_handler(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+    """Відповідає на inline-запити готовими розкладами з кешу."""
 
-    text = "🎓 Будь ласка, оберіть ваш курс:"
+    inline_query = update.inline_query
 
-    reply_markup = get_student_course_selection_keyboard()
+    if not inline_query:
 
-    await query.edit_message_text(text, reply_markup=reply_markup)
+        return
 
-    # Повертаємо розмову до стану вибору курсу
+    user_id = inline_query.from_user.id
 
-    return SELECTING_COURSE
+    name_query, day_name, week_type = parse_inline_schedule_query(inline_query.query)
 
+    is_personal = False
 
-async def handle_staff_entry(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
+    if name_query:
 
-    query = update.callback_query
+        matches = search_schedule_prefix_index(name_query)
 
-    await query.answer()
+    else:
 
-    await query.edit_message_text(
-        "👷‍♂️ Ви обрали 'Працівник'. Цей функціонал *в розробці*.",
-        reply_markup=get_back_to_role_selection_keyboard(),
-        parse_mode="Markdown",
-    )
+        # Порожній запит: показуємо розклад групи користувача
 
-    return SELECTING_ROLE
+        user_group = get_user_group_from_db(user_id)
 
+        matches = [("group", user_group)] if user_group else []
 
-# ЗНАЙДІТЬ ЦЮ ФУНКЦІЮ І ПЕРЕКОНАЙТЕСЬ, ЩО ВОНА ВИГЛЯДАЄ ТАК
+        is_personal = True
 
+    week_type_display = "Чисельник" if week_type == "чисельник" else "Знаменник"
 
-async def prompt_set_group_handler(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
+    results = []
 
-    query = update.callback_query
+    for idx, (kind, name) in enumerate(matches):
 
-    message_to_edit_or_reply = None
+        text = render_inline_schedule(kind, name, day_name, week_type)
 
-    if query:
+        icon = "👨‍🏫" if kind == "teacher" else "👥"
 
-        await query.answer()
+        results.append(
+            InlineQueryResultArticle(
+                id=f"{schedule_cache_version}_{idx}",
+                title=f"{icon} {name}",
+                description=f"{day_name.capitalize()} ({week_type_display})",
+                input_message_content=InputTextMessageContent(text, parse_mode="Markdown"),
+            )
+        )
 
-        message_to_edit_or_reply = query.message
+    update_command_stats("inline_query")
 
-    elif update.message:
+    await inline_query.answer(
+        results, cache_time=INLINE_QUERY_CACHE_TIME, is_personal=is_personal
+    )
 
-        message_to_edit_or_reply = update.message
 
-    if not message_to_edit_or_reply:
+# --- Експорт розкладу в iCalendar (ICS) ---
 
-        logger.warning("prompt_set_group_handler викликаний без query або message.")
 
-        return ConversationHandler.END
+def get_ics_export_weeks() -> list[datetime]:
+    """Понеділки тижнів, що входять до експорту (від поточного до кінця семестру)."""
 
-    user_id = update.effective_user.id
+    now = datetime.now(KYIV_TZ)
 
-    current_group = get_user_group_from_db(user_id)
+    week_start = datetime(now.year, now.month, now.day, tzinfo=KYIV_TZ) - timedelta(
+        days=now.weekday()
+    )
 
-    action_text = "змінити" if current_group else "вказати"
+    if SEMESTER_END_DATE and SEMESTER_END_DATE > week_start:
 
-    message_text = f"Ваша поточна група: *{current_group or 'не обрана'}*.\nБудь ласка, {action_text} вашу групу:"
+        export_end = SEMESTER_END_DATE
 
-    # Показуємо вибір курсу спочатку, щоб не було всього списку одразу
+    else:
 
-    reply_markup = get_student_course_selection_keyboard()
+        export_end = week_start + timedelta(weeks=ICS_EXPORT_WEEKS)
 
-    if query:
+    weeks = []
 
-        await message_to_edit_or_reply.edit_text(
-            message_text, reply_markup=reply_markup, parse_mode="Markdown"
-        )
+    monday = week_start
 
-    else:
+    while monday <= export_end:
 
-        await message_to_edit_or_reply.reply_text(
-            message_text, reply_markup=reply_markup, parse_mode="Markdown"
-        )
+        weeks.append(monday)
 
-    return SELECTING_GROUP
+        monday += timedelta(weeks=1)
 
+    return weeks
 
-async def select_group_page_callback(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
 
-    query = update.callback_query
+def parse_lesson_time_range(time_str: str) -> tuple[tuple[int, int], tuple[int, int]] | None:
+    """Розбирає '08:00-09:20' у ((8, 0), (9, 20))."""
 
-    await query.answer()
+    import re
 
-    page = int(query.data.split("_")[-1])
+    match = re.match(r"\s*(\d{1,2}):(\d{2})\s*[-–—]\s*(\d{1,2}):(\d{2})", str(time_str or ""))
 
-    user_id = update.effective_user.id
+    if not match:
 
-    current_group = get_user_group_from_db(user_id)
+        return None
 
-    action_text = "змінити" if current_group else "вказати"
+    h1, m1, h2, m2 = (int(x) for x in match.groups())
 
-    message_text = f"Ваша поточна група: *{current_group or 'не встановлена'}*.\nБудь ласка, {action_text} вашу групу (Сторінка {page + 1}):"
+    return (h1, m1), (h2, m2)
 
-    # Після пагінації більше не використовується, але залишимо для сумісності
 
-    reply_markup = get_student_course_selection_keyboard()
+def _ics_escape(text: str) -> str:
 
-    await query.message.edit_text(
-        text=message_text, reply_markup=reply_markup, parse_mode="Markdown"
+    return (
+        str(text)
+        .replace("\\", "\\\\")
+        .replace(";", "\\;")
+        .replace(",", "\\,")
+        .replace("\n", "\\n")
     )
 
-    return SELECTING_GROUP
 
+def _ics_fold(line: str) -> str:
+    """Переносить рядок ICS по 75 октетів (RFC 5545, 3.1)."""
 
-async def set_group_callback_handler(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
+    encoded = line.encode("utf-8")
 
-    query = update.callback_query
+    if len(encoded) <= 75:
 
-    await query.answer()
+        return line
 
-    group_name = query.data.replace("set_group_", "")
+    parts = []
 
-    user = query.from_user
+    current = ""
 
-    if set_user_group_in_db(user.id, group_name):
+    limit = 75
 
-        # Ось тут ми замінюємо текст і клавіатуру на головне меню
+    for char in line:
 
-        await query.message.edit_text(
-            f"✅ Дякую! Вашу групу встановлено: *{group_name}*.",
-            reply_markup=get_main_menu_keyboard(user.id, group_name),
-            parse_mode="Markdown",
-        )
+        if len((current + char).encode("utf-8")) > limit:
 
-        # Завершуємо ConversationHandler.
+            parts.append(current)
 
-        # Якщо користувач потім натисне іншу кнопку, button_callback_handler її обробить.
+            current = char
 
-        return ConversationHandler.END  # <-- ЗАЛИШИМО ЦЕ ТАК
+            limit = 74  # Продовження починається з пробілу
 
-    else:
+        else:
 
-        await query.message.edit_text(
-            "❌ Сталася помилка при збереженні групи.",
-            reply_markup=get_main_menu_keyboard(user.id, get_user_group_from_db(user.id)),
-        )
+            current += char
 
-    return ConversationHandler.END
+    parts.append(current)
 
+    return "\r\n ".join(parts)
 
-async def cancel_group_selection_handler(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
 
-    query = update.callback_query
+def build_ics_calendar(calendar_name: str, entries: list[dict]) -> bytes:
+    """
+    Будує ICS-файл, розгортаючи чисельник/знаменник у датовані події.
 
-    await query.answer()
+    entries: словники з ключами "день", "час", "тип_тижня", "summary", "location", "description".
 
-    user_id = query.from_user.id
+    """
 
-    user = query.from_user
+    weeks = get_ics_export_weeks()
 
-    text = f"Привіт, {user.mention_html()}! Я бот 'ЧГЕФК'.\n" "Будь ласка, оберіть, хто ви:"
+    # DTSTAMP фіксований (початок експорту), щоб однаковий розклад давав однаковий хеш
 
-    reply_markup = get_role_selection_keyboard()
+    dtstamp = weeks[0].astimezone(ZoneInfo("UTC")).strftime("%Y%m%dT%H%M%SZ")
 
-    await query.message.edit_text(text, reply_markup=reply_markup, parse_mode="HTML")
+    lines = [
+        "BEGIN:VCALENDAR",
+        "VERSION:2.0",
+        "PRODID:-//Abobikkk schedule bot//UA",
+        "CALSCALE:GREGORIAN",
+        "METHOD:PUBLISH",
+        f"X-WR-CALNAME:{_ics_escape(calendar_name)}",
+        "X-WR-TIMEZONE:Europe/Kyiv",
+    ]
 
-    set_user_role_in_db(user.id, "ASK_ROLE")  # Скидаємо роль до ASK_ROLE
+    for monday in weeks:
 
-    return SELECTING_ROLE  # Дуже важливо: повертаємо стан SELECTING_ROLE
+        week_type = get_current_week_type_for_schedule(monday)
 
-    # Повертаємо користувача до вибору ролі
+        for entry in entries:
 
-    user = query.from_user
+            lesson_type = (entry.get("тип_тижня") or "завжди").lower()
 
-    text = f"Привіт, {user.mention_html()}! Я бот 'ЧГЕФК'.\n" "Будь ласка, оберіть, хто ви:"
+            if lesson_type not in ("завжди", week_type):
 
-    reply_markup = get_role_selection_keyboard()
+                continue
 
-    await query.message.edit_text(text, reply_markup=reply_markup, parse_mode="HTML")
+            day_name = entry.get("день")
 
-    set_user_role_in_db(user.id, "ASK_ROLE")  # Скидаємо роль до ASK_ROLE
+            if day_name not in WEEKDAY_NAMES:
 
-    return SELECTING_ROLE  # Повертаємо стан SELECTING_ROLE, щоб ConversationHandler знав, що ми повертаємося до цього етапу.
+                continue
 
+            time_range = parse_lesson_time_range(entry.get("час"))
 
-async def start_command_handler(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
+            if not time_range:
 
-    if await check_maintenance_and_reply(update, context):
+                continue
 
-        return ConversationHandler.END
+            (h1, m1), (h2, m2) = time_range
 
-    user = update.effective_user
+            lesson_date = monday + timedelta(days=WEEKDAY_NAMES.index(day_name))
 
-    logger.info(
-        f"start_command_handler: Користувач {user.id} ({user.full_name}) розпочав роботу (/start)."
-    )
+            start_utc = lesson_date.replace(hour=h1, minute=m1).astimezone(ZoneInfo("UTC"))
 
-    is_new_user = not user_exists(user.id)
+            end_utc = lesson_date.replace(hour=h2, minute=m2).astimezone(ZoneInfo("UTC"))
 
-    referrer_id = None
+            uid_source = f"{calendar_name}|{start_utc.isoformat()}|{entry.get('summary')}"
 
-    if context.args and context.args[0].isdigit():
+            uid = hashlib.sha1(uid_source.encode("utf-8")).hexdigest()
 
-        potential_referrer_id = int(context.args[0])
+            lines.extend(
+                [
+                    "BEGIN:VEVENT",
+                    f"UID:{uid}@abobikkk-bot",
+                    f"DTSTAMP:{dtstamp}",
+                    f"DTSTART:{start_utc.strftime('%Y%m%dT%H%M%SZ')}",
+                    f"DTEND:{end_utc.strftime('%Y%m%dT%H%M%SZ')}",
+                    f"SUMMARY:{_ics_escape(entry.get('summary', ''))}",
+                ]
+            )
 
-        if potential_referrer_id != user.id:
+            if entry.get("location"):
 
-            if user_exists(potential_referrer_id):
+                lines.append(f"LOCATION:{_ics_escape(entry['location'])}")
 
-                referrer_id = potential_referrer_id
+            if entry.get("description"):
 
-                logger.info(f"Користувач {user.id} прийшов за рефералом від {referrer_id}.")
+                lines.append(f"DESCRIPTION:{_ics_escape(entry['description'])}")
 
-            else:
+            lines.append("END:VEVENT")
 
-                logger.info(
-                    f"Отримано недійсний реферальний ID {context.args[0]}: реферер {potential_referrer_id} не знайдено в БД."
-                )
+    lines.append("END:VCALENDAR")
 
-        else:
+    return ("\r\n".join(_ics_fold(line) for line in lines) + "\r\n").encode("utf-8")
 
-            logger.info(f"Користувач {user.id} спробував реферити сам себе.")
 
-    # Отримуємо поточну роль користувача
+def _is_real_lesson(lesson: dict) -> bool:
 
-    current_user_role = get_user_role_from_db(user.id)
+    name = (lesson.get("назва") or "").strip().lower()
 
-    user_group = get_user_group_from_db(user.id)
+    return bool(name) and name != "немає пари"
 
-    logger.info(
-        f"Start: User {user.id}, is_new_user: {is_new_user}, role: {current_user_role}, group: {user_group}."
-    )  # ДОДАНО ЦЕЙ РЯДОК
 
-    is_new_user = not user_exists(user.id)
+def build_ics_for_group(group_name: str) -> bytes | None:
+    """ICS для групи на основі кешованого розкладу. None, якщо пар немає."""
 
-    referrer_id = None
+    group_data = get_schedule_data_for_group(group_name)
 
-    if context.args and context.args[0].isdigit():
+    if not group_data:
 
-        potential_referrer_id = int(context.args[0])
+        return None
 
-        if potential_referrer_id != user.id:
+    entries = []
 
-            if user_exists(potential_referrer_id):
+    for day_name, day_lessons in group_data.get("тиждень", {}).items():
 
-                referrer_id = potential_referrer_id
+        if not isinstance(day_lessons, list):
 
-                logger.info(f"Користувач {user.id} прийшов за рефералом від {referrer_id}.")
+            continue
 
-            else:
+        for lesson in day_lessons:
 
-                logger.info(
-                    f"Отримано недійсний реферальний ID {context.args[0]}: реферер {potential_referrer_id} не знайдено в БД."
-                )
+            if not isinstance(lesson, dict) or not _is_real_lesson(lesson):
 
-        else:
+                continue
 
-            logger.info(f"Користувач {user.id} спробував реферити сам себе.")
+            auditorium = lesson.get("аудиторія")
+
+            entries.append(
+                {
+                    "день": day_name,
+                    "час": lesson.get("час"),
+                    "тип_тижня": lesson.get("тип_тижня"),
+                    "summary": lesson.get("назва"),
+                    "location": f"Ауд. {auditorium}" if auditorium else "",
+                    "description": lesson.get("викладач", ""),
+                }
+            )
 
-    # Отримуємо поточну роль користувача
+    if not entries:
 
-    current_user_role = get_user_role_from_db(user.id)
+        return None
 
-    user_group = get_user_group_from_db(user.id)
+    return build_ics_calendar(f"Розклад {group_name}", entries)
 
-    # Додаємо або оновлюємо користувача в БД.
 
-    # Якщо це новий користувач або його роль ASK_ROLE, то встановлюємо ASK_ROLE.
+def build_ics_for_teacher(teacher_full_name: str) -> bytes | None:
+    """ICS для викладача на основі кешованого розкладу. None, якщо пар немає."""
 
-    # В іншому випадку, залишаємо існуючу роль і групу.
+    entries = []
 
-    if is_new_user or current_user_role is None:
+    for lesson in find_teacher_lessons_in_schedule(teacher_full_name):
 
-        add_or_update_user_in_db(
-            user.id,
-            user.username,
-            user.first_name,
-            user.last_name,
-            group_name="ASK_LATER",
-            referrer_id=referrer_id,
-        )
+        if not _is_real_lesson(lesson):
 
-        set_user_role_in_db(user.id, "ASK_ROLE")
+            continue
 
-        current_user_role = "ASK_ROLE"  # Оновлюємо змінну для подальшої логіки
+        auditorium = lesson.get("аудиторія")
+
+        entries.append(
+            {
+                "день": lesson.get("день"),
+                "час": lesson.get("час"),
+                "тип_тижня": lesson.get("тип_тижня"),
+                "summary": f"{lesson.get('назва')} ({lesson.get('група')})",
+                "location": f"Ауд. {auditorium}" if auditorium else "",
+                "description": f"Група {lesson.get('група')}",
+            }
+        )
 
-        user_group = "ASK_LATER"  # Оновлюємо змінну для подальшої логіки
+    if not entries:
 
-    # Якщо користувач вже має роль, відмінну від 'ASK_ROLE', і (якщо студент) має групу,
+        return None
 
-    # то одразу показуємо головне меню.
+    return build_ics_calendar(f"Розклад {teacher_full_name}", entries)
 
-    if current_user_role == "teacher" and get_teacher_data_from_db(user.id):
 
-        await show_teacher_menu_handler(update, context)
+async def export_ics_handler(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+    """Надсилає ICS-файл розкладу групи або викладача (з кешем file_id за хешем вмісту)."""
 
-        return ConversationHandler.END
+    query = update.callback_query
 
-    if current_user_role != "ASK_ROLE" and (
-        current_user_role != "student" or (user_group is not None and user_group != "ASK_LATER")
-    ):
+    if not query:
 
-        text = f"Привіт, {user.full_name}! Твоя роль: *{current_user_role.capitalize()}*.\n"
+        return
 
-        if current_user_role == "student":
+    data = query.data
 
-            text += f"Твоя група: *{user_group or 'не обрана'}*.\n"
+    user_id = query.from_user.id
 
-        text += "Чим можу допомогти?"
+    if data.startswith("export_ics_teacher_"):
 
-        reply_markup = get_main_menu_keyboard(user.id, user_group)
+        teacher_id = int(data.replace("export_ics_teacher_", ""))
 
-        if update.message:
+        teacher_data = get_teacher_data_from_db(teacher_id)
 
-            await update.message.reply_text(text, reply_markup=reply_markup, parse_mode="Markdown")
+        teacher_name = teacher_data.get("full_name", "") if teacher_data else ""
 
-        elif update.callback_query:
+        if not teacher_name:
 
-            # Якщо це колбек, ми повинні відредагувати існуюче повідомлення
+            await query.message.reply_text("Викладача не знайдено.")
 
-            await update.callback_query.edit_message_text(
-                text, reply_markup=reply_markup, parse_mode="Markdown"
-            )
+            return
 
-        return ConversationHandler.END  # Завершуємо ConversationHandler
+        calendar_title = teacher_name
 
-    # Якщо користувач новий або роль "ASK_ROLE", просимо обрати роль
+        ics_bytes = build_ics_for_teacher(teacher_name)
 
-    if current_user_role == "ASK_ROLE":
+    else:
 
-        logger.info(
-            f"User {user.id} has ASK_ROLE, showing role selection menu and returning SELECTING_ROLE"
+        user_group = (
+            context.user_data.get("curated_group_name")
+            or context.user_data.get("teacher_viewing_group")
+            or get_user_group_from_db(user_id)
         )
 
-        text = f"Привіт, {user.mention_html()}! Я бот 'ЧГЕФК'.\n" "Будь ласка, оберіть, хто ви:"
-
-        reply_markup = get_role_selection_keyboard()
-
-        if update.message:
+        if not user_group:
 
-            await update.message.reply_text(text, reply_markup=reply_markup, parse_mode="HTML")
+            await query.message.reply_text("Будь ласка, спочатку встановіть вашу групу.")
 
-        elif update.callback_query:
+            return
 
-            await update.callback_query.message.edit_text(
-                text, reply_markup=reply_markup, parse_mode="HTML"
-            )
+        calendar_title = user_group
 
-        logger.info(f"User {user.id} role selection menu shown, returning SELECTING_ROLE")
+        ics_bytes = build_ics_for_group(user_group)
 
-        return SELECTING_ROLE
+    if not ics_bytes:
 
-    # Якщо користувач студент і група не встановлена, просимо обрати групу
+        await query.message.reply_text("📆 Немає пар для експорту в календар.")
 
-    if current_user_role == "student" and (user_group is None or user_group == "ASK_LATER"):
+        return
 
-        text = (
-            f"Привіт, {user.mention_html()}! Я бот 'ЧГЕФК'.\n"
-            "Твоя група ще не встановлена.\n"
-            "Будь ласка, обери свою групу, щоб я міг показувати тобі актуальний розклад:"
-        )
+    content_hash = hashlib.sha256(ics_bytes).hexdigest()
 
-        reply_markup = get_group_selection_keyboard(selected_course=None)
+    caption = (
+        f"📆 Розклад *{calendar_title}* у форматі iCalendar.\n"
+        "Відкрийте файл, щоб імпортувати пари у Google/Apple Calendar."
+    )
 
-        if update.message:
+    cached_file_id = get_ics_file_id(content_hash)
 
-            await update.message.reply_text(text, reply_markup=reply_markup, parse_mode="HTML")
+    if cached_file_id:
 
-        elif update.callback_query:
+        try:
 
-            await update.callback_query.message.edit_text(
-                text, reply_markup=reply_markup, parse_mode="HTML"
+            await context.bot.send_document(
+                chat_id=query.message.chat_id,
+                document=cached_file_id,
+                caption=caption,
+                parse_mode="Markdown",
             )
 
-        return SELECTING_GROUP
-
-    return ConversationHandler.END
+            update_command_stats("ics_export_cached")
 
+            return
 
-async def show_main_menu_handler(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+        except telegram.error.BadRequest as e:
 
-    if await check_maintenance_and_reply(update, context):
-        return
+            logger.warning(f"ICS: Збережений file_id недійсний ({e}), завантажуємо файл повторно.")
 
-    query = update.callback_query
+    safe_title = "".join(ch if ch.isalnum() or ch in "-_" else "_" for ch in calendar_title)
 
-    user = query.from_user
+    sent_message = await context.bot.send_document(
+        chat_id=query.message.chat_id,
+        document=ics_bytes,
+        filename=f"schedule_{safe_title}.ics",
+        caption=caption,
+        parse_mode="Markdown",
+    )
 
-    user_group = get_user_group_from_db(user.id)
+    if sent_message and sent_message.document:
 
-    text = f"Головне меню. Ваша група: *{user_group or 'не обрана'}*.\nЧим можу допомогти?"
+        save_ics_file_id(content_hash, sent_message.document.file_id)
 
-    reply_markup = get_main_menu_keyboard(user.id, user_group)
+    update_command_stats("ics_export_uploaded")
 
-    try:
 
-        await query.edit_message_text(text, reply_markup=reply_markup, parse_mode="Markdown")
+async def donation_info_handler(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
 
-    except Exception as e:
+    message = (
+        f"Дякую за бажання підтримати бота! 💖\n\n"
+        f"Можеш кинути копійку на карту:\n`{DONATION_CARD_NUMBER}`\n\nБудь-яка допомога цінується!"
+    )
 
-        logger.debug(
-            f"Не вдалося відредагувати повідомлення на головне меню (можливо, не змінилось): {e}"
-        )
+    reply_markup = get_back_to_main_menu_keyboard()
 
+    if update.callback_query:
 
-# --- ДОДАЙТЕ ЦЮ НОВУ ФУНКЦІЮ ---
+        await update.callback_query.edit_message_text(
+            message, reply_markup=reply_markup, parse_mode="Markdown"
+        )
 
+    elif update.message:
 
-async def back_to_main_menu_universal_handler(
-    update: Update, context: ContextTypes.DEFAULT_TYPE
-) -> None:
-    """
+        update_command_stats("/donate")
 
-    Універсальний обробник для кнопки "Назад до головного меню".
+        await update.message.reply_text(message, reply_markup=reply_markup, parse_mode="Markdown")
 
-    Перевіряє роль користувача і показує відповідне меню.
 
-    """
+async def send_report_prompt_handler(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
 
     query = update.callback_query
 
@@ -5427,828 +10973,870 @@ async def back_to_main_menu_universal_handler(
 
         await query.answer()
 
-    user_id = update.effective_user.id
+        context.user_data["message_to_edit_id"] = query.message.message_id
 
-    user_role = get_user_role_from_db(user_id)
+        context.user_data["chat_id_for_edit"] = query.message.chat_id
 
-    logger.info(
-        f"Universal back to menu: User {user_id} with role '{user_role}' is returning to main menu."
-    )
+    elif update.message:
 
-    if user_role == "teacher":
+        context.user_data["message_to_edit_id"] = update.message.message_id
 
-        # Якщо це викладач, показуємо меню викладача
+        context.user_data["chat_id_for_edit"] = update.message.chat_id
 
-        await show_teacher_menu_handler(update, context)
+    text = "Будь ласка, опишіть проблему, з якою ви зіткнулися. Адміністратори отримають ваше повідомлення."
 
-    elif user_role == "student":
+    keyboard = [[InlineKeyboardButton("Скасувати", callback_data="cancel_report_flow")]]
 
-        # Якщо це студент, показуємо меню студента (стара логіка)
+    reply_markup = InlineKeyboardMarkup(keyboard)
 
-        await show_main_menu_handler(update, context)
+    if query and query.message:
 
-    else:
+        await query.message.edit_text(text, reply_markup=reply_markup, parse_mode="Markdown")
 
-        # Для всіх інших (гості, ті, хто ще не обрав роль) повертаємо на екран вибору ролі
+    elif update.message:
 
-        await back_to_role_selection_handler(update, context)
+        await update.message.reply_text(text, reply_markup=reply_markup, parse_mode="Markdown")
+
+    return TYPING_REPORT
 
 
-async def schedule_menu_handler(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+# --- НОВІ ОБРОБНИКИ ДЛЯ ВІДГУКІВ ---
 
-    if await check_maintenance_and_reply(update, context):
-        return
 
-    user_id = update.effective_user.id
+async def send_feedback_prompt_handler(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
 
-    # Перевіряємо, чи це куратор, який дивиться розклад своєї групи
+    query = update.callback_query
 
-    curated_group = context.user_data.get("curated_group_name")
+    if query:
 
-    if curated_group:
+        await query.answer()
 
-        user_group = curated_group
+        context.user_data["message_to_delete_id"] = query.message.message_id
 
-        back_keyboard = get_back_to_teacher_menu_keyboard()
+        context.user_data["chat_id_for_delete"] = query.message.chat_id
 
-    else:
+    elif update.message:
 
-        user_group = get_user_group_from_db(user_id)
+        context.user_data["message_to_delete_id"] = update.message.message_id
 
-        back_keyboard = get_back_to_main_menu_keyboard()
+        context.user_data["chat_id_for_delete"] = update.message.chat_id
 
-    text = f"📅 Меню розкладу для групи: *{user_group or 'НЕ ОБРАНА'}*.\nОберіть пункт:"
+    text = "Будь ласка, залиште ваш відгук. Він буде відправлений *анонімно*."
 
-    reply_markup = get_schedule_menu_keyboard(user_group)
+    keyboard = [[InlineKeyboardButton("Скасувати", callback_data="cancel_feedback_flow")]]
 
-    if update.callback_query:
+    reply_markup = InlineKeyboardMarkup(keyboard)
 
-        await update.callback_query.edit_message_text(
-            text, reply_markup=reply_markup, parse_mode="Markdown"
-        )
+    if query and query.message:
+
+        await query.message.edit_text(text, reply_markup=reply_markup, parse_mode="Markdown")
 
     elif update.message:
 
-        update_command_stats(update.message.text.split()[0])
+        await update.message.reply_text(text, reply_markup=reply_markup, parse_mode="Markdown")
 
-        if not user_group:
+    return TYPING_FEEDBACK
 
-            await update.message.reply_text(
-                "Будь ласка, спочатку встановіть вашу групу.",
-                reply_markup=get_main_menu_keyboard(user_id, None),
-            )
 
-            return
+async def receive_feedback_message_handler(
+    update: Update, context: ContextTypes.DEFAULT_TYPE
+) -> int:
 
-        await update.message.reply_text(text, reply_markup=reply_markup, parse_mode="Markdown")
+    feedback_text = update.message.text
 
+    user = update.effective_user
 
-async def day_schedule_menu_handler(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+    user_group = get_user_group_from_db(user.id)
 
-    if await check_maintenance_and_reply(update, context):
-        return
+    if contains_profanity(feedback_text):
 
-    query = update.callback_query
+        warn_text = "⚠️ Будь ласка, використовуйте цензурну лексику. Ваше повідомлення не було відправлено. Спробуйте ще раз."
 
-    user_id = query.from_user.id
+        # ЗМІНА ТУТ: Передаємо 'feedback' як flow_type
 
-    # Перевіряємо, чи це куратор, який дивиться розклад своєї групи
+        await update.message.reply_text(
+            warn_text, reply_markup=get_cancel_profanity_flow_keyboard("feedback")
+        )
 
-    curated_group = context.user_data.get("curated_group_name")
+        return TYPING_FEEDBACK
 
-    if curated_group:
+    if not FEEDBACK_CHANNEL_ID:
 
-        user_group = curated_group
+        await update.message.reply_text("Система відгуків не налаштована.")
 
-    else:
+        context.user_data.clear()
 
-        user_group = get_user_group_from_db(user_id)
+        return ConversationHandler.END
 
-    if not user_group:
+    try:
 
-        await query.answer("Спочатку оберіть групу!", show_alert=True)
+        # Для анонімного відгуку user_group не використовується у самому повідомленні для каналу,
 
-        await query.edit_message_text(
-            "Будь ласка, оберіть групу:",
-            reply_markup=get_group_selection_keyboard(selected_course=None),
-        )
+        # але потрібен для get_correct_main_menu_keyboard у confirm_text або у випадку помилки.
 
-        return
+        safe_feedback = escape_markdown(feedback_text)
 
-    text = "🗓️ Обери день тижня (для поточного типу тижня):"
+        feedback_message_text_for_channel = f"📝 **Новий анонімний відгук:**\n\n" f"{safe_feedback}"
 
-    reply_markup = get_day_schedule_menu_keyboard()
+        try:
 
-    await query.edit_message_text(text, reply_markup=reply_markup, parse_mode="HTML")
+            await context.bot.send_message(
+                chat_id=FEEDBACK_CHANNEL_ID,
+                text=feedback_message_text_for_channel,
+                parse_mode="Markdown",
+            )
 
+        except telegram.error.BadRequest as e:
 
-async def select_specific_day_menu_handler(
-    update: Update, context: ContextTypes.DEFAULT_TYPE
-) -> None:
+            if "can't parse entities" in str(e).lower():
 
-    query = update.callback_query
+                # Якщо Markdown не парситься, відправляємо без нього
 
-    user_id = query.from_user.id
+                fallback_text = f"📝 Новий анонімний відгук:\n\n{feedback_text}"
 
-    # Виправлена логіка: якщо викладач дивиться іншу групу, показуємо саме її
+                await context.bot.send_message(chat_id=FEEDBACK_CHANNEL_ID, text=fallback_text)
 
-    teacher_viewing_group = context.user_data.get("teacher_viewing_group")
+            else:
 
-    curated_group = context.user_data.get("curated_group_name")
+                raise e
 
-    if teacher_viewing_group:
+        # 1. Спроба видалити попереднє повідомлення з запитом на відгук
 
-        user_group = teacher_viewing_group
+        if (
+            "message_to_delete_id" in context.user_data
+            and "chat_id_for_delete" in context.user_data
+        ):
 
-    elif curated_group:
+            try:
 
-        user_group = curated_group
+                await context.bot.delete_message(
+                    chat_id=context.user_data["chat_id_for_delete"],
+                    message_id=context.user_data["message_to_delete_id"],
+                )
 
-    else:
+                logger.debug(
+                    f"Видалено повідомлення {context.user_data['message_to_delete_id']} в чаті {context.user_data['chat_id_for_delete']}."
+                )
 
-        user_group = get_user_group_from_db(user_id)
+            except telegram.error.BadRequest as e:
 
-    if not user_group:
+                logger.warning(
+                    f"Не вдалося видалити повідомлення {context.user_data.get('message_to_delete_id')}: {e}"
+                )
 
-        await query.edit_message_text(
-            "Будь ласка, спочатку оберіть вашу групу.",
-            reply_markup=get_main_menu_keyboard(user_id, None),
-        )
+            except Exception as e:
 
-        return
+                logger.error(
+                    f"Неочікувана помилка при видаленні повідомлення {context.user_data.get('message_to_delete_id')}: {e}"
+                )
 
-    text = "🗓️ Оберіть день, для якого бажаєте вказати тип тижня:"
+        # 2. Надсилаємо нове повідомлення-підтвердження користувачу
 
-    reply_markup = get_specific_day_selection_keyboard()
+        confirm_text = "✅ Дякую! Ваш відгук успішно відправлено."
 
-    await query.edit_message_text(text, reply_markup=reply_markup)
+        await update.message.reply_text(
+            confirm_text, reply_markup=get_correct_main_menu_keyboard(user.id)
+        )
 
+        logger.info(
+            f"Відгук: Анонімний відгук від {user.id} до каналу {FEEDBACK_CHANNEL_ID}. Текст: {feedback_text[:50]}..."
+        )
 
-async def select_week_type_for_day_menu_handler(
-    update: Update, context: ContextTypes.DEFAULT_TYPE
-) -> None:
+    except Exception as e:
+
+        logger.error(
+            f"Відгук: Помилка відправлення від {user.id} до {FEEDBACK_CHANNEL_ID}: {e}",
+            exc_info=True,
+        )
 
-    query = update.callback_query
+        user_group_for_menu = get_user_group_from_db(user.id)  # Отримуємо групу для меню
 
-    day_name = query.data.replace("chose_day_", "")
+        await update.message.reply_text(
+            "❌ Виникла помилка під час відправлення відгуку. Спробуйте пізніше.",
+            reply_markup=get_main_menu_keyboard(user.id, user_group_for_menu),
+        )
 
-    text = f"🗓️ Оберіть тип тижня для: *{day_name.capitalize()}*"
+    context.user_data.clear()
 
-    reply_markup = get_week_type_selection_keyboard(day_name)
+    return ConversationHandler.END
 
-    await query.edit_message_text(text, reply_markup=reply_markup, parse_mode="Markdown")
 
+async def cancel_feedback_flow_handler(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
 
-async def show_schedule_for_day_handler(
-    update: Update, context: ContextTypes.DEFAULT_TYPE, command_or_day_data: str
-) -> None:
+    query = update.callback_query
 
-    if await check_maintenance_and_reply(update, context):
-        return
+    if query:
 
-    query = update.callback_query
+        await query.answer()
 
-    if not query:
+        user = query.from_user
 
-        logger.warning("show_schedule_for_day_handler викликано без callback_query.")
+    else:
 
-        if update.message:
-            await update.message.reply_text("Сталася помилка. Спробуйте через меню.")
+        user = update.effective_user
 
-        return
+    user_id = user.id
 
-    user_id = query.from_user.id
+    text = "Надсилання відгуку скасовано."
 
-    # Виправлена логіка: якщо викладач дивиться іншу групу, показуємо саме її
+    # ЗМІНИ ЦЕЙ БЛОК:
 
-    teacher_viewing_group = context.user_data.get("teacher_viewing_group")
+    if "message_to_delete_id" in context.user_data and "chat_id_for_delete" in context.user_data:
 
-    curated_group = context.user_data.get("curated_group_name")
+        try:
 
-    if teacher_viewing_group:
+            await context.bot.delete_message(
+                chat_id=context.user_data["chat_id_for_delete"],
+                message_id=context.user_data["message_to_delete_id"],
+            )
 
-        user_group = teacher_viewing_group
+            logger.debug(
+                f"Видалено повідомлення {context.user_data['message_to_delete_id']} в чаті {context.user_data['chat_id_for_delete']} при скасуванні відгуку."
+            )
 
-    elif curated_group:
+        except telegram.error.BadRequest as e:
 
-        user_group = curated_group
+            if "Message to delete not found" in str(e):
 
-    else:
+                logger.warning(
+                    f"Повідомлення відгуку для видалення вже відсутнє або видалено (ID: {context.user_data.get('message_to_delete_id')})."
+                )
 
-        user_group = get_user_group_from_db(user_id)
+            else:
 
-    if not user_group:
+                logger.error(
+                    f"Помилка при видаленні повідомлення відгуку (ID: {context.user_data.get('message_to_delete_id')}): {e}"
+                )
 
-        await query.answer("Будь ласка, спочатку оберіть вашу групу.", show_alert=True)
+            await (query.message if query else update.message).reply_text(
+                text, reply_markup=get_correct_main_menu_keyboard(user_id)
+            )
 
-        current_text = "Для перегляду розкладу, будь ласка, спочатку встановіть вашу групу:"
+            context.user_data.clear()
 
-        reply_mk = get_group_selection_keyboard(selected_course=None)
+            return ConversationHandler.END
 
-        try:
-            await query.edit_message_text(current_text, reply_markup=reply_mk)
+        except Exception as e:
 
-        except Exception:
-            await query.message.reply_text(current_text, reply_markup=reply_mk)
+            logger.error(
+                f"Неочікувана помилка при видаленні повідомлення відгуку (ID: {context.user_data.get('message_to_delete_id')}): {e}"
+            )
 
-        return
+            await (query.message if query else update.message).reply_text(
+                text, reply_markup=get_correct_main_menu_keyboard(user_id)
+            )
 
-    group_schedule_data = get_schedule_data_for_group(user_group)
+            context.user_data.clear()
 
-    if not group_schedule_data:
+            return ConversationHandler.END
 
-        # Використовуємо відповідну клавіатуру повернення залежно від контексту
+    # Якщо повідомлення було успішно видалене або не існувало,
 
-        if curated_group:
+    # надсилаємо повідомлення про скасування і головне меню.
 
-            back_keyboard = get_back_to_teacher_menu_keyboard()
+    if query and query.message:
 
-        else:
+        try:
 
-            back_keyboard = get_back_to_schedule_menu_keyboard()
+            await query.message.edit_text(
+                text, reply_markup=get_correct_main_menu_keyboard(user_id)
+            )
 
-        await query.edit_message_text(
-            f"На жаль, розклад для групи *{user_group}* не знайдено.",
-            reply_markup=back_keyboard,
-            parse_mode="Markdown",
-        )
+        except telegram.error.BadRequest as e:
 
-        return
+            if "Message is not modified" not in str(e):
 
-    current_day_kyiv = datetime.now(KYIV_TZ)
+                await query.message.reply_text(
+                    text, reply_markup=get_correct_main_menu_keyboard(user_id)
+                )
 
-    target_date_for_week_type_calc = current_day_kyiv
+        except Exception:
 
-    day_to_display_key = ""
+            await query.message.reply_text(
+                text, reply_markup=get_correct_main_menu_keyboard(user_id)
+            )
 
-    week_type_to_use = ""
+    else:
 
-    days_indices_to_text = {
-        0: "понеділок",
-        1: "вівторок",
-        2: "середа",
-        3: "четвер",
-        4: "п'ятниця",
-        5: "субота",
-        6: "неділя",
-    }
+        await update.message.reply_text(text, reply_markup=get_correct_main_menu_keyboard(user_id))
 
-    if command_or_day_data == "get_schedule_today":
+    context.user_data.clear()
 
-        target_date_for_week_type_calc = current_day_kyiv
+    return ConversationHandler.END
 
-        day_of_week_index = target_date_for_week_type_calc.weekday()
 
-        day_to_display_key = days_indices_to_text.get(day_of_week_index)
+async def report_bug_command_handler(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
 
-        if day_of_week_index >= 5:
+    user = update.effective_user
 
-            response_text = (
-                f"Сьогодні *{day_to_display_key.capitalize()}*, пар немає. Відпочивай! 🥳"
-            )
+    report_text = " ".join(context.args)
 
-            await query.edit_message_text(
-                response_text,
-                reply_markup=get_back_to_schedule_menu_keyboard(),
-                parse_mode="Markdown",
-            )
+    update_command_stats("/report")
 
-            return
+    if not report_text:
 
-        week_type_to_use = get_current_week_type_for_schedule(target_date_for_week_type_calc)
+        await update.message.reply_text("Будь ласка, опиши проблему після команди `/report`.")
 
-    elif command_or_day_data == "get_schedule_tomorrow":
+        return
 
-        target_date_for_week_type_calc = current_day_kyiv + timedelta(days=1)
+    # Визначаємо роль користувача
 
-        day_of_week_index = target_date_for_week_type_calc.weekday()
+    user_role = get_user_role_from_db(user.id)
 
-        day_to_display_key = days_indices_to_text.get(day_of_week_index)
+    # Викладачі відправляють репорти тільки в канал розробників
 
-        if day_of_week_index >= 5:
+    if user_role == "teacher":
 
-            day_name = day_to_display_key.capitalize() if day_to_display_key else "Вихідний"
+        target_channel = TEACHER_REPORT_CHANNEL_ID
 
-            response_text = f"Завтра *{day_name}*, пар немає. Плануй відпочинок! 🏖️"
+        if not target_channel:
 
-            await query.edit_message_text(
-                response_text,
-                reply_markup=get_back_to_schedule_menu_keyboard(),
-                parse_mode="Markdown",
-            )
+            await update.message.reply_text("Система репортів для викладачів не налаштована.")
 
             return
 
-        week_type_to_use = get_current_week_type_for_schedule(target_date_for_week_type_calc)
+    else:
 
-    elif command_or_day_data.startswith("show_day_explicit_"):
+        # Студенти та інші відправляють в загальний канал репортів
 
-        parts = command_or_day_data.replace("show_day_explicit_", "").rsplit("_", 1)
+        target_channel = REPORT_CHANNEL_ID
 
-        if len(parts) == 2:
+        if not target_channel:
 
-            day_to_display_key = parts[0]
+            await update.message.reply_text("Система репортів не налаштована.")
 
-            week_type_to_use = parts[1]
+            return
 
-            if week_type_to_use not in ["чисельник", "знаменник"]:
-                week_type_to_use = ""
+    user_group = get_user_group_from_db(user.id)
 
-        else:
-            day_to_display_key = ""
-            week_type_to_use = ""
+    try:
 
-    elif command_or_day_data.startswith("get_schedule_day_"):
+        safe_report = escape_markdown(report_text)
 
-        day_to_display_key = command_or_day_data.replace("get_schedule_day_", "")
+        # Різні формати для викладачів та студентів
 
-        week_type_to_use = get_current_week_type_for_schedule(current_day_kyiv)
+        if user_role == "teacher":
 
-    else:
+            report_message_text = (
+                f"👨‍🏫 **Репорт від викладача:**\nID: `{user.id}`\nUsername: @{user.username or 'N/A'}\n"
+                f"Ім'я: {escape_markdown(user.full_name)}\n\nОпис:\n{safe_report}"
+            )
 
-        await query.edit_message_text(
-            "Невідома команда для розкладу.", reply_markup=get_back_to_schedule_menu_keyboard()
-        )
+        else:
 
-        return
+            report_message_text = (
+                f"🐞 **Новий репорт:**\nID: `{user.id}`\nUsername: @{user.username or 'N/A'}\n"
+                f"Ім'я: {escape_markdown(user.full_name)}\nГрупа: {escape_markdown(user_group or 'Не вказана')}\n\nОпис:\n{safe_report}"
+            )
 
-    if not day_to_display_key or not week_type_to_use:
+        try:
 
-        await query.edit_message_text(
-            "Не вдалося визначити день або тип тижня.",
-            reply_markup=get_back_to_schedule_menu_keyboard(),
-        )
+            await context.bot.send_message(
+                chat_id=target_channel, text=report_message_text, parse_mode="Markdown"
+            )
 
-        return
+        except telegram.error.BadRequest as e:
 
-    response_text = get_schedule_for_day(group_schedule_data, day_to_display_key, week_type_to_use)
+            if "can't parse entities" in str(e).lower():
 
-    # Використовуємо відповідну клавіатуру повернення залежно від контексту
+                # Якщо Markdown не парситься, відправляємо без нього
 
-    if curated_group or context.user_data.get("teacher_viewing_any_group"):
+                if user_role == "teacher":
 
-        back_button_markup = get_back_to_teacher_menu_keyboard()
+                    fallback_text = (
+                        f"👨‍🏫 Репорт від викладача:\nID: {user.id}\nUsername: @{user.username or 'N/A'}\n"
+                        f"Ім'я: {user.full_name}\n\nОпис:\n{report_text}"
+                    )
 
-        if command_or_day_data.startswith("show_day_explicit_"):
+                else:
 
-            day_name_for_back_button = day_to_display_key
+                    fallback_text = (
+                        f"🐞 Новий репорт:\nID: {user.id}\nUsername: @{user.username or 'N/A'}\n"
+                        f"Ім'я: {user.full_name}\nГрупа: {user_group or 'Не вказана'}\n\nОпис:\n{report_text}"
+                    )
 
-            back_button_markup = InlineKeyboardMarkup(
-                [
-                    [
-                        InlineKeyboardButton(
-                            "⬅️ Назад до вибору типу тижня",
-                            callback_data=f"chose_day_{day_name_for_back_button}",
-                        )
-                    ],
-                    [InlineKeyboardButton("🏠 Меню викладача", callback_data="back_to_main_menu")],
-                ]
-            )
+                await context.bot.send_message(chat_id=target_channel, text=fallback_text)
 
-    else:
+            else:
 
-        back_button_markup = get_back_to_schedule_menu_keyboard()
+                raise e
 
-        if command_or_day_data.startswith("show_day_explicit_"):
+        channel_name = "канал розробників" if user_role == "teacher" else "загальний канал репортів"
 
-            day_name_for_back_button = day_to_display_key
+        logger.info(
+            f"Репорт: Відправлено від {user.id} (Роль: {user_role}) в {channel_name}. Текст: {report_text[:50]}..."
+        )
 
-            back_button_markup = InlineKeyboardMarkup(
-                [
-                    [
-                        InlineKeyboardButton(
-                            "⬅️ Назад до вибору типу тижня",
-                            callback_data=f"chose_day_{day_name_for_back_button}",
-                        )
-                    ],
-                    [
-                        InlineKeyboardButton(
-                            "🏠 Головне меню розкладу", callback_data="show_schedule_menu"
-                        )
-                    ],
-                ]
-            )
+        await update.message.reply_text("Дякую! Репорт відправлено.")
 
-    await query.edit_message_text(
-        response_text, reply_markup=back_button_markup, parse_mode="Markdown"
-    )
+    except Exception as e:
 
+        logger.error(f"Репорт: Помилка відправлення від {user.id}: {e}")
 
-def get_schedule_for_day(
-    group_schedule_data: dict | None, day_name_key: str, current_week_type: str
-) -> str:
+        await update.message.reply_text("Помилка відправлення репорту.")
 
-    if not group_schedule_data:
 
-        return "_Розклад для вашої групи не знайдено._"
+async def send_suggestion_prompt_handler(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
 
-    week_data_key = "тиждень"
+    query = update.callback_query
 
-    schedule_for_this_type_of_week = group_schedule_data.get(week_data_key, {})
+    if query:
 
-    week_type_name_display = "Чисельник" if current_week_type == "чисельник" else "Знаменник"
+        await query.answer()
 
-    day_name_display = day_name_key.capitalize()
+        context.user_data["message_to_delete_id"] = query.message.message_id
 
-    header = f"🗓️ Розклад на *{day_name_display}* ({week_type_name_display}):\n\n"
+        context.user_data["chat_id_for_delete"] = query.message.chat_id
 
-    if day_name_key in schedule_for_this_type_of_week:
+    elif update.message:
 
-        lessons_for_day = schedule_for_this_type_of_week[day_name_key]
+        context.user_data["message_to_delete_id"] = update.message.message_id
 
-        if not lessons_for_day:
+        context.user_data["chat_id_for_delete"] = update.message.chat_id
 
-            return header + "_Пар немає. Відпочивай!_"
+    text = "Будь ласка, детально опишіть вашу ідею або пропозицію. Ваше повідомлення буде передано адміністрації."
 
-        filtered_lessons = []
+    keyboard = [[InlineKeyboardButton("Скасувати", callback_data="cancel_suggestion_flow")]]
 
-        for lesson in lessons_for_day:
+    reply_markup = InlineKeyboardMarkup(keyboard)
 
-            lesson_type = lesson.get("тип_тижня", "завжди").lower()
+    if query and query.message:
 
-            if lesson_type == "завжди" or lesson_type == current_week_type:
+        await query.message.edit_text(text, reply_markup=reply_markup, parse_mode="Markdown")
 
-                filtered_lessons.append(lesson)
+    elif update.message:
 
-        if not filtered_lessons:
+        await update.message.reply_text(text, reply_markup=reply_markup, parse_mode="Markdown")
 
-            return header + "_Пар немає для цього типу тижня. Відпочивай!_"
+    return TYPING_SUGGESTION
 
-        details = []
 
-        for lesson in filtered_lessons:
+async def receive_suggestion_message_handler(
+    update: Update, context: ContextTypes.DEFAULT_TYPE
+) -> int:
 
-            time_val = lesson.get("час", "??:??")
+    suggestion_text = update.message.text
 
-            name = lesson.get("назва", "Невідомо")
+    user = update.effective_user
 
-            if name.lower() == "немає пари":
-                continue
+    update_command_stats("suggestion_from_button")
 
-            # Формуємо інформацію про аудиторію з поверхом
+    user_group = get_user_group_from_db(user.id)
 
-            aud_info = ""
+    if contains_profanity(suggestion_text):
 
-            if lesson.get("аудиторія"):
+        warn_text = "⚠️ Будь ласка, використовуйте цензурну лексику. Ваше повідомлення не було відправлено. Спробуйте ще раз."
 
-                auditorium = lesson.get("аудиторія", "-")
+        # ЗМІНА ТУТ: Передаємо 'suggestion' як flow_type
 
-                floor = get_floor_by_auditorium(auditorium)
+        await update.message.reply_text(
+            warn_text, reply_markup=get_cancel_profanity_flow_keyboard("suggestion")
+        )
 
-                if floor:
+        return TYPING_SUGGESTION
 
-                    aud_info = f" (Ауд. {auditorium}) ({floor})"
+    if not SUGGESTION_CHANNEL_ID:
 
-                else:
+        await update.message.reply_text("Система пропозицій не налаштована.")
 
-                    aud_info = f" (Ауд. {auditorium})"
+        context.user_data.clear()
 
-            teacher = f" ({lesson.get('викладач', '-')})" if lesson.get("викладач") else ""
+        return ConversationHandler.END
 
-            details.append(f" • *{time_val}* - {name}{aud_info}{teacher}")
+    try:
 
-        if not details:
+        # Тут user_data_for_log вже має доступ до user_group
 
-            return header + "_Пар немає для цього типу тижня. Відпочивай!_"
+        user_data_for_log = (
+            f"ID: `{user.id}` | Username: @{user.username or 'N/A'}\n"
+            f"Ім'я: {user.full_name} | Група: {user_group or 'Не вказана'}"
+        )  # Цей рядок тепер коректний
 
-        return header + "\n".join(details)
+        safe_suggestion = escape_markdown(suggestion_text)
 
-    return header + f"_Немає даних для {day_name_display} на {week_type_name_display}._"
+        suggestion_message_text_for_channel = (
+            f"💡 **Нова пропозиція:**\n"
+            f"Інформація про відправника:\n{user_data_for_log}\n\n"
+            f"Опис:\n{safe_suggestion}"
+        )
 
+        try:
 
-def get_call_schedule_formatted(group_schedule_data: dict | None) -> str:
+            await context.bot.send_message(
+                chat_id=SUGGESTION_CHANNEL_ID,
+                text=suggestion_message_text_for_channel,
+                parse_mode="Markdown",
+            )
 
-    cache = get_cached_schedule()
+        except telegram.error.BadRequest as e:
 
-    calls_data = cache.get("дзвінки")
+            if "can't parse entities" in str(e).lower():
 
-    if not calls_data:
+                # Якщо Markdown не парситься, відправляємо без нього
 
-        return "🔔 Розклад дзвінків не знайдено."
+                fallback_text = (
+                    f"💡 Нова пропозиція:\n"
+                    f"Інформація про відправника:\n{user_data_for_log}\n\n"
+                    f"Опис:\n{suggestion_text}"
+                )
 
-    response = "🔔 Розклад дзвінків:\n\n"
+                await context.bot.send_message(chat_id=SUGGESTION_CHANNEL_ID, text=fallback_text)
 
-    for call in calls_data:
+            else:
 
-        response += f"• {call.get('пара', '?')} пара: *{call.get('початок', '??:??')}* - *{call.get('кінець', '??:??')}*\n"
+                raise e
 
-    return response
+        # 1. Спроба видалити попереднє повідомлення з запитом на пропозицію
 
+        if (
+            "message_to_delete_id" in context.user_data
+            and "chat_id_for_delete" in context.user_data
+        ):
 
-def get_full_schedule_formatted(group_schedule_data: dict | None, group_name: str) -> str:
+            try:
 
-    if not group_schedule_data:
+                await context.bot.delete_message(
+                    chat_id=context.user_data["chat_id_for_delete"],
+                    message_id=context.user_data["message_to_delete_id"],
+                )
 
-        return f"📋 Повний розклад для групи *{group_name}* не знайдено."
+                logger.debug(
+                    f"Видалено повідомлення {context.user_data['message_to_delete_id']} в чаті {context.user_data['chat_id_for_delete']}."
+                )
 
-    response = f"📋 Повний розклад для групи *{group_name}*:\n\n"
+            except telegram.error.BadRequest as e:
 
-    days_order = ["понеділок", "вівторок", "середа", "четвер", "п'ятниця"]
+                logger.warning(
+                    f"Не вдалося видалити повідомлення {context.user_data.get('message_to_delete_id')}: {e}"
+                )
 
-    week_data_key = "тиждень"
+            except Exception as e:
 
-    week_data = group_schedule_data.get(week_data_key, {})
+                logger.error(
+                    f"Неочікувана помилка при видаленні повідомлення {context.user_data.get('message_to_delete_id')}: {e}"
+                )
 
-    response += "*Чисельник*:\n"
+        # 2. Надсилаємо нове повідомлення-підтвердження користувачу
 
-    current_week_type_filter = "чисельник"
+        confirm_text = "✅ Дякую! Вашу пропозицію успішно відправлено адміністрації."
 
-    week_has_lessons_numerator = False
+        # ЗАМІНІТЬ НА ЦЕ
 
-    for day in days_order:
+        await update.message.reply_text(
+            confirm_text, reply_markup=get_correct_main_menu_keyboard(user.id)
+        )
 
-        if day in week_data and week_data[day]:
+        logger.info(
+            f"Пропозиція: Відправлено від {user.id} (Група: {user_group or 'N/A'}) до каналу {SUGGESTION_CHANNEL_ID}. Текст: {suggestion_text[:50]}..."
+        )
 
-            lessons_today = []
+    except Exception as e:
 
-            for lesson in week_data[day]:
+        logger.error(
+            f"Пропозиція: Помилка відправлення від {user.id} до {SUGGESTION_CHANNEL_ID}: {e}",
+            exc_info=True,
+        )
 
-                lesson_type = lesson.get("тип_тижня", "завжди").lower()
+        await update.message.reply_text(
+            "❌ Виникла помилка під час відправлення пропозиції. Спробуйте пізніше.",
+            reply_markup=get_main_menu_keyboard(user.id, user_group),
+        )
 
-                if (
-                    lesson_type == "завжди" or lesson_type == current_week_type_filter
-                ) and lesson.get("назва", "").lower() != "немає пари":
+    context.user_data.clear()
 
-                    lessons_today.append(lesson)
+    return ConversationHandler.END
 
-            if lessons_today:
 
-                week_has_lessons_numerator = True
+async def cancel_suggestion_flow_handler(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
 
-                response += f"  *{day.capitalize()}*:\n"
+    query = update.callback_query
 
-                for lesson_val in lessons_today:
+    if query:
 
-                    time_val = lesson_val.get("час", "??:??")
+        await query.answer()
 
-                    # Формуємо інформацію про аудиторію з поверхом
+        user = query.from_user
 
-                    aud_info = ""
+    else:
 
-                    if lesson_val.get("аудиторія"):
+        user = update.effective_user
 
-                        auditorium = lesson_val.get("аудиторія", "-")
+    user_id = user.id
 
-                        floor = get_floor_by_auditorium(auditorium)
+    text = "Надсилання пропозиції скасовано."
 
-                        if floor:
+    # ЗМІНИ ЦЕЙ БЛОК:
 
-                            aud_info = f" (Ауд. {auditorium}) ({floor})"
+    if "message_to_delete_id" in context.user_data and "chat_id_for_delete" in context.user_data:
 
-                        else:
+        try:
 
-                            aud_info = f" (Ауд. {auditorium})"
+            await context.bot.delete_message(
+                chat_id=context.user_data["chat_id_for_delete"],
+                message_id=context.user_data["message_to_delete_id"],
+            )
 
-                    teacher = (
-                        f" ({lesson_val.get('викладач', '-')})"
-                        if lesson_val.get("викладач")
-                        else ""
-                    )
+            logger.debug(
+                f"Видалено повідомлення {context.user_data['message_to_delete_id']} в чаті {context.user_data['chat_id_for_delete']} при скасуванні пропозиції."
+            )
 
-                    response += f"    • {time_val} - {lesson_val.get('назва', 'Невідомо')}{aud_info}{teacher}\n"
+        except telegram.error.BadRequest as e:
 
-    if not week_has_lessons_numerator:
-        response += "  _На цьому тижні (чисельник) пар немає._\n"
+            # Якщо повідомлення вже видалене або не знайдено (наприклад, після перезапуску бота або якщо користувач сам видалив)
 
-    response += "\n*Знаменник*:\n"
+            if "Message to delete not found" in str(e):
 
-    current_week_type_filter = "знаменник"
+                logger.warning(
+                    f"Повідомлення пропозиції для видалення вже відсутнє або видалено (ID: {context.user_data.get('message_to_delete_id')})."
+                )
 
-    week_has_lessons_denominator = False
+            else:
 
-    for day in days_order:
+                logger.error(
+                    f"Помилка при видаленні повідомлення пропозиції (ID: {context.user_data.get('message_to_delete_id')}): {e}"
+                )
 
-        if day in week_data and week_data[day]:
+            # Продовжуємо надсилати нове повідомлення, навіть якщо старе не видалилося
 
-            lessons_today = []
+            await (query.message if query else update.message).reply_text(
+                text, reply_markup=get_correct_main_menu_keyboard(user_id)
+            )
 
-            for lesson_val in week_data[day]:
+            context.user_data.clear()
 
-                lesson_type = lesson_val.get("тип_тижня", "завжди").lower()
+            return ConversationHandler.END
 
-                if (
-                    lesson_type == "завжди" or lesson_type == current_week_type_filter
-                ) and lesson_val.get("назва", "").lower() != "немає пари":
+        except Exception as e:
 
-                    lessons_today.append(lesson_val)
+            logger.error(
+                f"Неочікувана помилка при видаленні повідомлення пропозиції (ID: {context.user_data.get('message_to_delete_id')}): {e}"
+            )
 
-            if lessons_today:
+            await (query.message if query else update.message).reply_text(
+                text, reply_markup=get_correct_main_menu_keyboard(user_id)
+            )
 
-                week_has_lessons_denominator = True
+            context.user_data.clear()
 
-                response += f"  *{day.capitalize()}*:\n"
+            return ConversationHandler.END
 
-                for lesson_val_inner in lessons_today:
+    # Якщо повідомлення було успішно видалене або не існувало,
 
-                    time_val = lesson_val_inner.get("час", "??:??")
+    # надсилаємо повідомлення про скасування і головне меню.
 
-                    # Формуємо інформацію про аудиторію з поверхом
+    # Якщо це callback_query, редагуємо його повідомлення, щоб не надсилати нове,
 
-                    aud_info = ""
+    # якщо воно вже було відредаговане або ми не хочемо створювати нове
 
-                    if lesson_val_inner.get("аудиторія"):
+    if query and query.message:
 
-                        auditorium = lesson_val_inner.get("аудиторія", "-")
+        try:
 
-                        floor = get_floor_by_auditorium(auditorium)
+            await query.message.edit_text(
+                text, reply_markup=get_correct_main_menu_keyboard(user_id)
+            )
 
-                        if floor:
+        except telegram.error.BadRequest as e:
 
-                            aud_info = f" (Ауд. {auditorium}) ({floor})"
+            if "Message is not modified" not in str(
+                e
+            ):  # Якщо повідомлення справді змінилося, але не відредагувалося
 
-                        else:
+                await query.message.reply_text(
+                    text, reply_markup=get_correct_main_menu_keyboard(user_id)
+                )
 
-                            aud_info = f" (Ауд. {auditorium})"
+        except Exception:  # Якщо щось пішло не так при редагуванні, відправте нове
 
-                    teacher = (
-                        f" ({lesson_val_inner.get('викладач', '-')})"
-                        if lesson_val_inner.get("викладач")
-                        else ""
-                    )
+            await query.message.reply_text(
+                text, reply_markup=get_correct_main_menu_keyboard(user_id)
+            )
 
-                    response += f"    • {time_val} - {lesson_val_inner.get('назва', 'Невідомо')}{aud_info}{teacher}\n"
+    else:  # Якщо це не callback_query (наприклад, команда /cancel), просто відправте нове
 
-    if not week_has_lessons_denominator:
-        response += "  _На цьому тижні (знаменник) пар немає._\n"
+        await update.message.reply_text(text, reply_markup=get_correct_main_menu_keyboard(user_id))
 
-    response += "\n" + get_call_schedule_formatted(group_schedule_data)
+    context.user_data.clear()
 
-    return response.strip()
+    return ConversationHandler.END
 
 
-async def call_schedule_handler(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+async def receive_report_message_handler(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
 
-    if await check_maintenance_and_reply(update, context):
-        return
+    report_text = update.message.text
 
-    user_id = update.effective_user.id
+    user = update.effective_user
 
-    # Перевіряємо, чи це викладач, який дивиться розклад
+    update_command_stats("report_from_button")
 
-    curated_group = context.user_data.get("curated_group_name")
+    user_group = get_user_group_from_db(user.id)
 
-    teacher_viewing_group = context.user_data.get("teacher_viewing_group")
+    if contains_profanity(report_text):
 
-    if curated_group:
+        warn_text = "⚠️ Будь ласка, використовуйте цензурну лексику. Ваше повідомлення не було відправлено. Спробуйте ще раз."
 
-        user_group = curated_group
+        # ЗМІНА ТУТ: Передаємо 'report' як flow_type
 
-    elif teacher_viewing_group:
+        await update.message.reply_text(
+            warn_text, reply_markup=get_cancel_profanity_flow_keyboard("report")
+        )
 
-        user_group = teacher_viewing_group
+        return TYPING_REPORT
 
-    else:
+    # Визначаємо роль користувача
 
-        user_group = get_user_group_from_db(user_id)
+    user_role = get_user_role_from_db(user.id)
 
-    msg_target = update.callback_query.message if update.callback_query else update.message
+    # Викладачі відправляють репорти тільки в канал розробників
 
-    if not user_group:
+    if user_role == "teacher":
 
-        reply_m = (
-            get_main_menu_keyboard(user_id, None)
-            if update.message
-            else get_group_selection_keyboard(selected_course=None)
-        )
+        target_channel = TEACHER_REPORT_CHANNEL_ID
 
-        await msg_target.reply_text(
-            "Будь ласка, спочатку встановіть вашу групу (хоча розклад дзвінків зазвичай глобальний).",
-            reply_markup=reply_m,
-        )
+        if not target_channel:
 
-        if update.callback_query:
-            await update.callback_query.answer()
+            await update.message.reply_text("Система репортів для викладачів не налаштована.")
 
-        return
+            context.user_data.clear()
 
-    group_schedule_data = get_schedule_data_for_group(user_group)
+            return ConversationHandler.END
 
-    response_text = get_call_schedule_formatted(group_schedule_data)
+    else:
 
-    # Використовуємо відповідну клавіатуру повернення залежно від контексту
+        # Студенти та інші відправляють в загальний канал репортів
 
-    if curated_group or teacher_viewing_group:
+        target_channel = REPORT_CHANNEL_ID
 
-        reply_markup = get_back_to_teacher_menu_keyboard()
+        if not target_channel:
 
-    else:
+            await update.message.reply_text("Система репортів не налаштована.")
 
-        reply_markup = get_back_to_schedule_menu_keyboard()
+            context.user_data.clear()
 
-    if update.callback_query:
+            return ConversationHandler.END
 
-        await update.callback_query.edit_message_text(
-            response_text, reply_markup=reply_markup, parse_mode="Markdown"
-        )
+    try:
 
-    elif update.message:
+        safe_report = escape_markdown(report_text)
 
-        update_command_stats("/call_schedule")
+        safe_name = escape_markdown(user.full_name)
 
-        await update.message.reply_text(
-            response_text, reply_markup=reply_markup, parse_mode="Markdown"
-        )
+        safe_group = escape_markdown(user_group or "Не вказана")
 
+        # Різні формати для викладачів та студентів
 
-async def full_schedule_handler(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+        if user_role == "teacher":
 
-    if await check_maintenance_and_reply(update, context):
-        return
+            report_message_text = (
+                f"👨‍🏫 **Репорт від викладача:**\n"
+                f"ID: `{user.id}`\nUsername: @{user.username or 'N/A'}\n"
+                f"Ім'я: {safe_name}\n\nОпис:\n{safe_report}"
+            )
 
-    user_id = update.effective_user.id
+        else:
 
-    # Перевіряємо, чи це викладач, який дивиться розклад
+            report_message_text = (
+                f"🐞 **Новий репорт:**\n"
+                f"ID: `{user.id}`\nUsername: @{user.username or 'N/A'}\n"
+                f"Ім'я: {safe_name}\nГрупа: {safe_group}\n\nОпис:\n{safe_report}"
+            )
 
-    curated_group = context.user_data.get("curated_group_name")
+        try:
 
-    teacher_viewing_group = context.user_data.get("teacher_viewing_group")
+            await context.bot.send_message(
+                chat_id=target_channel, text=report_message_text, parse_mode="Markdown"
+            )
 
-    if curated_group:
+        except telegram.error.BadRequest as e:
 
-        user_group = curated_group
+            if "can't parse entities" in str(e).lower():
 
-    elif teacher_viewing_group:
+                # Якщо Markdown не парситься, відправляємо без нього
 
-        user_group = teacher_viewing_group
+                if user_role == "teacher":
 
-    else:
+                    fallback_text = (
+                        f"👨‍🏫 Репорт від викладача:\n"
+                        f"ID: {user.id}\nUsername: @{user.username or 'N/A'}\n"
+                        f"Ім'я: {user.full_name}\n\nОпис:\n{report_text}"
+                    )
 
-        user_group = get_user_group_from_db(user_id)
+                else:
 
-    msg_target = update.callback_query.message if update.callback_query else update.message
+                    fallback_text = (
+                        f"🐞 Новий репорт:\n"
+                        f"ID: {user.id}\nUsername: @{user.username or 'N/A'}\n"
+                        f"Ім'я: {user.full_name}\nГрупа: {user_group or 'Не вказана'}\n\nОпис:\n{report_text}"
+                    )
 
-    if not user_group:
+                await context.bot.send_message(chat_id=target_channel, text=fallback_text)
 
-        reply_m = (
-            get_main_menu_keyboard(user_id, None)
-            if update.message
-            else get_group_selection_keyboard(selected_course=None)
-        )
+            else:
 
-        await msg_target.reply_text(
-            "Будь ласка, спочатку встановіть вашу групу.", reply_markup=reply_m
-        )
+                raise e
 
-        if update.callback_query:
-            await update.callback_query.answer()
+        # Редагуємо попереднє повідомлення або надсилаємо нове підтвердження
 
-        return
+        if "message_to_edit_id" in context.user_data and "chat_id_for_edit" in context.user_data:
 
-    group_schedule_data = get_schedule_data_for_group(user_group)
+            try:
 
-    response_text = get_full_schedule_formatted(group_schedule_data, user_group)
+                await context.bot.delete_message(
+                    chat_id=context.user_data["chat_id_for_edit"],
+                    message_id=context.user_data["message_to_edit_id"],
+                )
 
-    # Використовуємо відповідну клавіатуру повернення залежно від контексту
+                logger.debug(
+                    f"Видалено повідомлення {context.user_data['message_to_edit_id']} в чаті {context.user_data['chat_id_for_edit']}."
+                )
 
-    if curated_group or teacher_viewing_group:
+            except telegram.error.BadRequest as e:
 
-        reply_markup = get_back_to_teacher_menu_keyboard()
+                logger.warning(
+                    f"Не вдалося видалити повідомлення {context.user_data.get('message_to_edit_id')}: {e}"
+                )
 
-    else:
+            except Exception as e:
 
-        reply_markup = get_back_to_schedule_menu_keyboard()
+                logger.error(
+                    f"Неочікувана помилка при видаленні повідомлення {context.user_data.get('message_to_edit_id')}: {e}"
+                )
 
-    if update.callback_query:
+        # 2. Надсилаємо нове повідомлення-підтвердження
 
-        await update.callback_query.edit_message_text(
-            response_text, reply_markup=reply_markup, parse_mode="Markdown"
-        )
+        confirm_text = "✅ Дякую! Ваш репорт відправлено адміністраторам."
 
-    elif update.message:
+        # Використовуємо update.message.reply_text, щоб підтвердження було відповіддю на останнє повідомлення користувача
 
-        update_command_stats("/full_schedule")
+        # ЗАМІНІТЬ НА ЦЕ
 
         await update.message.reply_text(
-            response_text, reply_markup=reply_markup, parse_mode="Markdown"
+            confirm_text, reply_markup=get_correct_main_menu_keyboard(user.id)
         )
 
+        channel_name = "канал розробників" if user_role == "teacher" else "загальний канал репортів"
 
-async def donation_info_handler(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
-
-    if await check_maintenance_and_reply(update, context):
-        return
+        logger.info(
+            f"Репорт: Відправлено від {user.id} (Роль: {user_role}, Група: {user_group or 'N/A'}) в {channel_name}. Текст: {report_text[:50]}..."
+        )
 
-    message = (
-        f"Дякую за бажання підтримати бота! 💖\n\n"
-        f"Можеш кинути копійку на карту:\n`{DONATION_CARD_NUMBER}`\n\nБудь-яка допомога цінується!"
-    )
+    except Exception as e:
 
-    reply_markup = get_back_to_main_menu_keyboard()
+        logger.error(f"Репорт: Помилка відправлення від {user.id}: {e}", exc_info=True)
 
-    if update.callback_query:
+        # У випадку помилки, також надсилаємо нове повідомлення
 
-        await update.callback_query.edit_message_text(
-            message, reply_markup=reply_markup, parse_mode="Markdown"
+        await update.message.reply_text(
+            "❌ Виникла помилка під час відправлення репорту. Спробуйте пізніше.",
+            reply_markup=get_main_menu_keyboard(user.id, user_group),
         )
 
-    elif update.message:
-
-        update_command_stats("/donate")
+    context.user_data.clear()
 
-        await update.message.reply_text(message, reply_markup=reply_markup, parse_mode="Markdown")
+    return ConversationHandler.END
 
 
-async def send_report_prompt_handler(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
+async def cancel_report_flow_handler(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
 
     query = update.callback_query
 
@@ -6256,1626 +11844,1725 @@ async def send_report_prompt_handler(update: Update, context: ContextTypes.DEFAU
 
         await query.answer()
 
-        context.user_data["message_to_edit_id"] = query.message.message_id
-
-        context.user_data["chat_id_for_edit"] = query.message.chat_id
+        user = query.from_user
 
-    elif update.message:
+    else:
 
-        context.user_data["message_to_edit_id"] = update.message.message_id
+        user = update.effective_user
 
-        context.user_data["chat_id_for_edit"] = update.message.chat_id
+    user_id = user.id
 
-    text = "Будь ласка, опишіть проблему, з якою ви зіткнулися. Адміністратори отримають ваше повідомлення."
+    text = "Надсилання репорту скасовано."
 
-    keyboard = [[InlineKeyboardButton("Скасувати", callback_data="cancel_report_flow")]]
+    # ЗМІНИ ЦЕЙ БЛОК:
 
-    reply_markup = InlineKeyboardMarkup(keyboard)
+    if "message_to_edit_id" in context.user_data and "chat_id_for_edit" in context.user_data:
 
-    if query and query.message:
+        try:
 
-        await query.message.edit_text(text, reply_markup=reply_markup, parse_mode="Markdown")
+            await context.bot.delete_message(
+                chat_id=context.user_data["chat_id_for_edit"],
+                message_id=context.user_data["message_to_edit_id"],
+            )
 
-    elif update.message:
+            logger.debug(
+                f"Видалено повідомлення {context.user_data['message_to_edit_id']} в чаті {context.user_data['chat_id_for_edit']} при скасуванні репорту."
+            )
 
-        await update.message.reply_text(text, reply_markup=reply_markup, parse_mode="Markdown")
+        except telegram.error.BadRequest as e:
 
-    return TYPING_REPORT
+            if "Message to delete not found" in str(e):
 
+                logger.warning(
+                    f"Повідомлення репорту для видалення вже відсутнє або видалено (ID: {context.user_data.get('message_to_edit_id')})."
+                )
 
-# --- НОВІ ОБРОБНИКИ ДЛЯ ВІДГУКІВ ---
+            else:
 
+                logger.error(
+                    f"Помилка при видаленні повідомлення репорту (ID: {context.user_data.get('message_to_edit_id')}): {e}"
+                )
 
-async def send_feedback_prompt_handler(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
+            await (query.message if query else update.message).reply_text(
+                text, reply_markup=get_correct_main_menu_keyboard(user_id)
+            )
 
-    query = update.callback_query
+            context.user_data.clear()
 
-    if query:
+            return ConversationHandler.END
 
-        await query.answer()
+        except Exception as e:
 
-        context.user_data["message_to_delete_id"] = query.message.message_id
+            logger.error(
+                f"Неочікувана помилка при видаленні повідомлення репорту (ID: {context.user_data.get('message_to_edit_id')}): {e}"
+            )
 
-        context.user_data["chat_id_for_delete"] = query.message.chat_id
+            await (query.message if query else update.message).reply_text(
+                text, reply_markup=get_correct_main_menu_keyboard(user_id)
+            )
 
-    elif update.message:
+            context.user_data.clear()
 
-        context.user_data["message_to_delete_id"] = update.message.message_id
+            return ConversationHandler.END
 
-        context.user_data["chat_id_for_delete"] = update.message.chat_id
+    # Якщо повідомлення було успішно видалене або не існувало,
 
-    text = "Будь ласка, залиште ваш відгук. Він буде відправлений *анонімно*."
+    # надсилаємо повідомлення про скасування і головне меню.
 
-    keyboard = [[InlineKeyboardButton("Скасувати", callback_data="cancel_feedback_flow")]]
+    if query and query.message:
 
-    reply_markup = InlineKeyboardMarkup(keyboard)
+        try:
 
-    if query and query.message:
+            await query.message.edit_text(
+                text, reply_markup=get_correct_main_menu_keyboard(user_id)
+            )
 
-        await query.message.edit_text(text, reply_markup=reply_markup, parse_mode="Markdown")
+        except telegram.error.BadRequest as e:
 
-    elif update.message:
+            if "Message is not modified" not in str(e):
 
-        await update.message.reply_text(text, reply_markup=reply_markup, parse_mode="Markdown")
+                await query.message.reply_text(
+                    text, reply_markup=get_correct_main_menu_keyboard(user_id)
+                )
 
-    return TYPING_FEEDBACK
+        except Exception:
 
+            await query.message.reply_text(
+                text, reply_markup=get_correct_main_menu_keyboard(user.id)
+            )
 
-async def receive_feedback_message_handler(
-    update: Update, context: ContextTypes.DEFAULT_TYPE
-) -> int:
+    else:
 
-    feedback_text = update.message.text
+        await update.message.reply_text(text, reply_markup=get_correct_main_menu_keyboard(user_id))
 
-    user = update.effective_user
+    context.user_data.clear()
 
-    user_group = get_user_group_from_db(user.id)
+    return ConversationHandler.END
 
-    if contains_profanity(feedback_text):
 
-        warn_text = "⚠️ Будь ласка, використовуйте цензурну лексику. Ваше повідомлення не було відправлено. Спробуйте ще раз."
+async def admin_panel_handler(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
 
-        # ЗМІНА ТУТ: Передаємо 'feedback' як flow_type
+    user_id = update.effective_user.id
 
-        await update.message.reply_text(
-            warn_text, reply_markup=get_cancel_profanity_flow_keyboard("feedback")
-        )
+    if user_id not in ADMIN_USER_IDS:
 
-        return TYPING_FEEDBACK
+        text = "Доступ заборонено."
 
-    if not FEEDBACK_CHANNEL_ID:
+        if update.callback_query:
+            await update.callback_query.answer(text, show_alert=True)
 
-        await update.message.reply_text("Система відгуків не налаштована.")
+        elif update.message:
+            await update.message.reply_text(text)
 
-        context.user_data.clear()
+        return
 
-        return ConversationHandler.END
+    text = "🛠️ Панель адміністратора:"
 
-    try:
+    reply_markup = get_admin_panel_keyboard()
 
-        # Для анонімного відгуку user_group не використовується у самому повідомленні для каналу,
+    if update.callback_query:
 
-        # але потрібен для get_correct_main_menu_keyboard у confirm_text або у випадку помилки.
+        await update.callback_query.edit_message_text(
+            text, reply_markup=reply_markup, parse_mode="HTML"
+        )
 
-        safe_feedback = escape_markdown(feedback_text)
+    elif update.message:
 
-        feedback_message_text_for_channel = f"📝 **Новий анонімний відгук:**\n\n" f"{safe_feedback}"
+        update_command_stats(update.message.text.split()[0])
 
-        try:
+        await update.message.reply_text(text, reply_markup=reply_markup, parse_mode="HTML")
 
-            await context.bot.send_message(
-                chat_id=FEEDBACK_CHANNEL_ID,
-                text=feedback_message_text_for_channel,
-                parse_mode="Markdown",
-            )
 
-        except telegram.error.BadRequest as e:
+async def admin_announce_start_handler(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
 
-            if "can't parse entities" in str(e).lower():
+    query = update.callback_query
 
-                # Якщо Markdown не парситься, відправляємо без нього
+    if query:
+        await query.answer()
 
-                fallback_text = f"📝 Новий анонімний відгук:\n\n{feedback_text}"
+    if query and query.data == "admin_announce_start":
 
-                await context.bot.send_message(chat_id=FEEDBACK_CHANNEL_ID, text=fallback_text)
+        context.user_data.pop("announce_send_at", None)
 
-            else:
+        context.user_data.pop("announce_segment_expression", None)
 
-                raise e
+    if query and query.data == "announce_toggle_unreachable":
 
-        # 1. Спроба видалити попереднє повідомлення з запитом на відгук
+        context.user_data["announce_include_unreachable"] = not context.user_data.get(
+            "announce_include_unreachable", False
+        )
 
-        if (
-            "message_to_delete_id" in context.user_data
-            and "chat_id_for_delete" in context.user_data
-        ):
+    include_unreachable = context.user_data.get("announce_include_unreachable", False)
 
-            try:
+    unreachable_label = (
+        "👻 Недоступні користувачі: ✅ включати"
+        if include_unreachable
+        else "👻 Недоступні користувачі: ❌ пропускати"
+    )
 
-                await context.bot.delete_message(
-                    chat_id=context.user_data["chat_id_for_delete"],
-                    message_id=context.user_data["message_to_delete_id"],
-                )
+    send_at = context.user_data.get("announce_send_at")
 
-                logger.debug(
-                    f"Видалено повідомлення {context.user_data['message_to_delete_id']} в чаті {context.user_data['chat_id_for_delete']}."
-                )
+    send_time_label = (
+        f"🕒 Надіслати: {format_announcement_send_time(send_at)}"
+        if send_at
+        else "🕒 Надіслати: зараз"
+    )
 
-            except telegram.error.BadRequest as e:
+    keyboard = [
+        [InlineKeyboardButton("Всім користувачам", callback_data="announce_target_all")],
+        [InlineKeyboardButton("Конкретній групі", callback_data="announce_target_group")],
+        [
+            InlineKeyboardButton(
+                "🧮 Сегменти (AND / OR / NOT)", callback_data="announce_target_segment"
+            )
+        ],
+        [InlineKeyboardButton(unreachable_label, callback_data="announce_toggle_unreachable")],
+        [InlineKeyboardButton(send_time_label, callback_data="announce_choose_time")],
+        [InlineKeyboardButton(" Скасувати", callback_data="announce_cancel")],
+    ]
 
-                logger.warning(
-                    f"Не вдалося видалити повідомлення {context.user_data.get('message_to_delete_id')}: {e}"
-                )
+    reply_markup = InlineKeyboardMarkup(keyboard)
 
-            except Exception as e:
+    text = (
+        "📢 Оголошення: Оберіть цільову аудиторію:\n\n"
+        f"Недоступні (заблокували бота або {USER_UNREACHABLE_FAILURE_THRESHOLD}+ невдач поспіль): "
+        f"{count_unreachable_users()}"
+    )
 
-                logger.error(
-                    f"Неочікувана помилка при видаленні повідомлення {context.user_data.get('message_to_delete_id')}: {e}"
-                )
+    if query:
+        await query.edit_message_text(text, reply_markup=reply_markup)
 
-        # 2. Надсилаємо нове повідомлення-підтвердження користувачу
+    elif update.message:
+        await update.message.reply_text(text, reply_markup=reply_markup)
 
-        confirm_text = "✅ Дякую! Ваш відгук успішно відправлено."
+    return ANNOUNCE_SELECT_TARGET
 
-        await update.message.reply_text(
-            confirm_text, reply_markup=get_correct_main_menu_keyboard(user.id)
-        )
 
-        logger.info(
-            f"Відгук: Анонімний відгук від {user.id} до каналу {FEEDBACK_CHANNEL_ID}. Текст: {feedback_text[:50]}..."
-        )
+async def announce_select_target_callback(
+    update: Update, context: ContextTypes.DEFAULT_TYPE
+) -> int:
 
-    except Exception as e:
+    query = update.callback_query
 
-        logger.error(
-            f"Відгук: Помилка відправлення від {user.id} до {FEEDBACK_CHANNEL_ID}: {e}",
-            exc_info=True,
-        )
+    await query.answer()
 
-        user_group_for_menu = get_user_group_from_db(user.id)  # Отримуємо групу для меню
+    target = query.data
 
-        await update.message.reply_text(
-            "❌ Виникла помилка під час відправлення відгуку. Спробуйте пізніше.",
-            reply_markup=get_main_menu_keyboard(user.id, user_group_for_menu),
-        )
+    context.user_data.pop("announce_segment_expression", None)
 
-    context.user_data.clear()
+    if target == "announce_target_segment":
 
-    return ConversationHandler.END
+        await ensure_audience_segments_async()
 
+        await query.edit_message_text(
+            "🧮 *Сегменти аудиторії*\n\n"
+            f"{get_audience_segments_overview()}\n\n"
+            "Надішліть вираз з AND / OR / NOT та дужками, напр.:\n"
+            "`role_student AND (course_1 OR course_2) AND active_30`\n\n"
+            "Недоступні користувачі відкидаються згідно з перемикачем на попередньому кроці.",
+            reply_markup=InlineKeyboardMarkup(
+                [[InlineKeyboardButton(" Скасувати", callback_data="announce_cancel")]]
+            ),
+            parse_mode="Markdown",
+        )
 
-async def cancel_feedback_flow_handler(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
+        return ANNOUNCE_TYPING_SEGMENT_EXPRESSION
 
-    query = update.callback_query
+    if target == "announce_target_all":
 
-    if query:
+        context.user_data["announce_target_group"] = None
 
-        await query.answer()
+        text = "Оберіть тип оголошення для *ВСІХ* користувачів:"
 
-        user = query.from_user
+    elif target == "announce_target_group":
 
-    else:
+        all_groups = get_all_group_names_from_cache()
 
-        user = update.effective_user
+        if not all_groups:
 
-    user_id = user.id
+            await query.edit_message_text(
+                "Немає груп для вибору.", reply_markup=get_back_to_admin_panel_keyboard()
+            )
 
-    text = "Надсилання відгуку скасовано."
+            context.user_data.clear()
 
-    # ЗМІНИ ЦЕЙ БЛОК:
+            return ConversationHandler.END
 
-    if "message_to_delete_id" in context.user_data and "chat_id_for_delete" in context.user_data:
+        group_buttons = [
+            [InlineKeyboardButton(g, callback_data=f"announce_select_group_for_type_{g}")]
+            for g in all_groups
+        ]
 
-        try:
+        group_buttons.append([InlineKeyboardButton("⬅️ Назад", callback_data="announce_cancel")])
 
-            await context.bot.delete_message(
-                chat_id=context.user_data["chat_id_for_delete"],
-                message_id=context.user_data["message_to_delete_id"],
-            )
+        reply_markup = InlineKeyboardMarkup(group_buttons)
 
-            logger.debug(
-                f"Видалено повідомлення {context.user_data['message_to_delete_id']} в чаті {context.user_data['chat_id_for_delete']} при скасуванні відгуку."
-            )
+        await query.edit_message_text("Оберіть групу для оголошення:", reply_markup=reply_markup)
 
-        except telegram.error.BadRequest as e:
+        return ANNOUNCE_SELECT_GROUP_FOR_ANNOUNCE
 
-            if "Message to delete not found" in str(e):
+    keyboard = [
+        [InlineKeyboardButton("Тільки текст", callback_data="announce_type_text")],
+        [InlineKeyboardButton("Фото / Альбом з текстом", callback_data="announce_type_media")],
+        [InlineKeyboardButton(" Скасувати", callback_data="announce_cancel")],
+    ]
 
-                logger.warning(
-                    f"Повідомлення відгуку для видалення вже відсутнє або видалено (ID: {context.user_data.get('message_to_delete_id')})."
-                )
+    reply_markup = InlineKeyboardMarkup(keyboard)
 
-            else:
+    await query.edit_message_text(text, reply_markup=reply_markup, parse_mode="Markdown")
 
-                logger.error(
-                    f"Помилка при видаленні повідомлення відгуку (ID: {context.user_data.get('message_to_delete_id')}): {e}"
-                )
+    return ANNOUNCE_CHOOSING_MEDIA_TYPE
 
-            await (query.message if query else update.message).reply_text(
-                text, reply_markup=get_correct_main_menu_keyboard(user_id)
-            )
 
-            context.user_data.clear()
+async def announce_segment_expression_handler(
+    update: Update, context: ContextTypes.DEFAULT_TYPE
+) -> int:
+    """Перевіряє вираз сегментів і переходить до вибору типу оголошення."""
 
-            return ConversationHandler.END
+    expression = " ".join(update.message.text.split())
 
-        except Exception as e:
+    try:
 
-            logger.error(
-                f"Неочікувана помилка при видаленні повідомлення відгуку (ID: {context.user_data.get('message_to_delete_id')}): {e}"
-            )
+        audience_bitmap = await resolve_audience_bitmap(
+            include_unreachable=context.user_data.get("announce_include_unreachable", False),
+            segment_expression=expression,
+        )
 
-            await (query.message if query else update.message).reply_text(
-                text, reply_markup=get_correct_main_menu_keyboard(user_id)
-            )
+    except ValueError as e:
 
-            context.user_data.clear()
+        await update.message.reply_text(f"❌ {e}\nВиправте вираз і надішліть ще раз.")
 
-            return ConversationHandler.END
+        return ANNOUNCE_TYPING_SEGMENT_EXPRESSION
 
-    # Якщо повідомлення було успішно видалене або не існувало,
+    context.user_data["announce_target_group"] = None
 
-    # надсилаємо повідомлення про скасування і головне меню.
+    context.user_data["announce_segment_expression"] = expression
 
-    if query and query.message:
+    keyboard = [
+        [InlineKeyboardButton("Тільки текст", callback_data="announce_type_text")],
+        [InlineKeyboardButton("Фото / Альбом з текстом", callback_data="announce_type_media")],
+        [InlineKeyboardButton(" Скасувати", callback_data="announce_cancel")],
+    ]
 
-        try:
+    await update.message.reply_text(
+        f"Сегмент `{expression}`: {audience_bitmap.bit_count()} отримувачів.\n"
+        "Оберіть тип оголошення:",
+        reply_markup=InlineKeyboardMarkup(keyboard),
+        parse_mode="Markdown",
+    )
 
-            await query.message.edit_text(
-                text, reply_markup=get_correct_main_menu_keyboard(user_id)
-            )
+    return ANNOUNCE_CHOOSING_MEDIA_TYPE
 
-        except telegram.error.BadRequest as e:
 
-            if "Message is not modified" not in str(e):
+async def announce_select_group_for_announce_callback(
+    update: Update, context: ContextTypes.DEFAULT_TYPE
+) -> int:
 
-                await query.message.reply_text(
-                    text, reply_markup=get_correct_main_menu_keyboard(user_id)
-                )
+    query = update.callback_query
 
-        except Exception:
+    await query.answer()
 
-            await query.message.reply_text(
-                text, reply_markup=get_correct_main_menu_keyboard(user_id)
-            )
+    group_name = query.data.replace("announce_select_group_for_type_", "")
 
-    else:
+    context.user_data["announce_target_group"] = group_name
 
-        await update.message.reply_text(text, reply_markup=get_correct_main_menu_keyboard(user_id))
+    text = f"Оберіть тип оголошення для групи *{group_name}*:"
 
-    context.user_data.clear()
+    keyboard = [
+        [InlineKeyboardButton("Тільки текст", callback_data="announce_type_text")],
+        [InlineKeyboardButton("Фото / Альбом з текстом", callback_data="announce_type_media")],
+        [InlineKeyboardButton(" Скасувати", callback_data="announce_cancel")],
+    ]
 
-    return ConversationHandler.END
+    reply_markup = InlineKeyboardMarkup(keyboard)
 
+    await query.edit_message_text(text, reply_markup=reply_markup, parse_mode="Markdown")
 
-async def report_bug_command_handler(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+    return ANNOUNCE_CHOOSING_MEDIA_TYPE
 
-    user = update.effective_user
 
-    report_text = " ".join(context.args)
+async def announce_choose_media_type_callback(
+    update: Update, context: ContextTypes.DEFAULT_TYPE
+) -> int:
 
-    update_command_stats("/report")
+    query = update.callback_query
 
-    if not report_text:
+    await query.answer()
 
-        await update.message.reply_text("Будь ласка, опиши проблему після команди `/report`.")
+    media_type = query.data.replace("announce_type_", "")
 
-        return
+    context.user_data["announce_media_type"] = media_type
 
-    # Визначаємо роль користувача
+    if media_type == "text":
 
-    user_role = get_user_role_from_db(user.id)
+        if context.user_data.get("announce_segment_expression"):
 
-    # Викладачі відправляють репорти тільки в канал розробників
+            target_description = f"сегмента `{context.user_data['announce_segment_expression']}`"
 
-    if user_role == "teacher":
+        elif context.user_data.get("announce_target_group"):
 
-        target_channel = TEACHER_REPORT_CHANNEL_ID
+            target_description = f"групи *{context.user_data['announce_target_group']}*"
 
-        if not target_channel:
+        else:
 
-            await update.message.reply_text("Система репортів для викладачів не налаштована.")
+            target_description = "*ВСІХ* користувачів"
 
-            return
+        await query.edit_message_text(
+            f"Введіть текст оголошення для {target_description}:", parse_mode="Markdown"
+        )
 
-    else:
+        return ANNOUNCE_TYPING_MESSAGE_FOR_ANNOUNCE
 
-        # Студенти та інші відправляють в загальний канал репортів
+    elif media_type == "media":
 
-        target_channel = REPORT_CHANNEL_ID
+        await query.edit_message_text(
+            f"Надішліть фото для оголошення.\nВи можете відправити до {MAX_ALBUM_PHOTOS} фотографій як альбом.",
+            reply_markup=InlineKeyboardMarkup(
+                [[InlineKeyboardButton("Скасувати", callback_data="announce_cancel_media")]]
+            ),
+        )
 
-        if not target_channel:
+        context.user_data["media_group_photos"] = []
 
-            await update.message.reply_text("Система репортів не налаштована.")
+        return ANNOUNCE_WAITING_FOR_PHOTOS
 
-            return
 
-    user_group = get_user_group_from_db(user.id)
+async def announce_waiting_for_photos_handler(
+    update: Update, context: ContextTypes.DEFAULT_TYPE
+) -> int:
 
-    try:
+    if update.message.photo:
 
-        safe_report = escape_markdown(report_text)
+        photo_file_id = update.message.photo[-1].file_id
 
-        # Різні формати для викладачів та студентів
+        context.user_data["media_group_photos"].append(photo_file_id)
 
-        if user_role == "teacher":
+        current_photo_count = len(context.user_data["media_group_photos"])
 
-            report_message_text = (
-                f"👨‍🏫 **Репорт від викладача:**\nID: `{user.id}`\nUsername: @{user.username or 'N/A'}\n"
-                f"Ім'я: {escape_markdown(user.full_name)}\n\nОпис:\n{safe_report}"
+        if current_photo_count >= MAX_ALBUM_PHOTOS:
+
+            await update.message.reply_text(
+                f"Ви завантажили максимальну кількість фото ({MAX_ALBUM_PHOTOS}).\nТепер введіть підпис для фото:",
+                reply_markup=InlineKeyboardMarkup(
+                    [[InlineKeyboardButton("Скасувати", callback_data="announce_cancel_media")]]
+                ),
             )
 
+            return ANNOUNCE_TYPING_CAPTION_FOR_MEDIA
+
         else:
 
-            report_message_text = (
-                f"🐞 **Новий репорт:**\nID: `{user.id}`\nUsername: @{user.username or 'N/A'}\n"
-                f"Ім'я: {escape_markdown(user.full_name)}\nГрупа: {escape_markdown(user_group or 'Не вказана')}\n\nОпис:\n{safe_report}"
+            await update.message.reply_text(
+                f"Фото додано до альбому ({current_photo_count}/{MAX_ALBUM_PHOTOS}).\n"
+                "Відправте ще фото або введіть підпис для оголошення, якщо це всі фото:",
+                reply_markup=InlineKeyboardMarkup(
+                    [[InlineKeyboardButton("Скасувати", callback_data="announce_cancel_media")]]
+                ),
             )
 
-        try:
+            return ANNOUNCE_WAITING_FOR_PHOTOS
 
-            await context.bot.send_message(
-                chat_id=target_channel, text=report_message_text, parse_mode="Markdown"
-            )
+    elif update.message.text:
 
-        except telegram.error.BadRequest as e:
+        if not context.user_data["media_group_photos"]:
 
-            if "can't parse entities" in str(e).lower():
+            await update.message.reply_text(
+                "Будь ласка, спочатку надішліть хоча б одне фото, або скасуйте.",
+                reply_markup=InlineKeyboardMarkup(
+                    [[InlineKeyboardButton("Скасувати", callback_data="announce_cancel_media")]]
+                ),
+            )
 
-                # Якщо Markdown не парситься, відправляємо без нього
+            return ANNOUNCE_WAITING_FOR_PHOTOS
 
-                if user_role == "teacher":
+        context.user_data["announcement_caption"] = update.message.text
 
-                    fallback_text = (
-                        f"👨‍🏫 Репорт від викладача:\nID: {user.id}\nUsername: @{user.username or 'N/A'}\n"
-                        f"Ім'я: {user.full_name}\n\nОпис:\n{report_text}"
-                    )
+        return await finalize_media_announcement_send(update, context)
 
-                else:
+    else:
 
-                    fallback_text = (
-                        f"🐞 Новий репорт:\nID: {user.id}\nUsername: @{user.username or 'N/A'}\n"
-                        f"Ім'я: {user.full_name}\nГрупа: {user_group or 'Не вказана'}\n\nОпис:\n{report_text}"
-                    )
+        await update.message.reply_text(
+            "Будь ласка, надішліть фото або введіть текст для підпису.",
+            reply_markup=InlineKeyboardMarkup(
+                [[InlineKeyboardButton("Скасувати", callback_data="announce_cancel_media")]]
+            ),
+        )
 
-                await context.bot.send_message(chat_id=target_channel, text=fallback_text)
+        return ANNOUNCE_WAITING_FOR_PHOTOS
 
-            else:
 
-                raise e
+async def announce_typing_caption_for_media_handler(
+    update: Update, context: ContextTypes.DEFAULT_TYPE
+) -> int:
 
-        channel_name = "канал розробників" if user_role == "teacher" else "загальний канал репортів"
+    if update.message.text:
 
-        logger.info(
-            f"Репорт: Відправлено від {user.id} (Роль: {user_role}) в {channel_name}. Текст: {report_text[:50]}..."
-        )
+        context.user_data["announcement_caption"] = update.message.text
 
-        await update.message.reply_text("Дякую! Репорт відправлено.")
+        return await finalize_media_announcement_send(update, context)
 
-    except Exception as e:
+    else:
 
-        logger.error(f"Репорт: Помилка відправлення від {user.id}: {e}")
+        await update.message.reply_text(
+            "Будь ласка, введіть текст підпису.",
+            reply_markup=InlineKeyboardMarkup(
+                [[InlineKeyboardButton("Скасувати", callback_data="announce_cancel_media")]]
+            ),
+        )
 
-        await update.message.reply_text("Помилка відправлення репорту.")
+        return ANNOUNCE_TYPING_CAPTION_FOR_MEDIA
 
 
-async def send_suggestion_prompt_handler(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
+async def enqueue_announcement(
+    update: Update,
+    kind: str,
+    message_text: str,
+    media_file_ids: list[str] | None,
+    target_description: str,
+    user_ids: Iterable[int],
+) -> int | None:
+    """Створює збережене завдання розсилки; саму відправку виконує broadcast_worker_callback."""
 
-    query = update.callback_query
+    progress_message = await update.message.reply_text(
+        f"Створюю розсилку ({target_description})..."
+    )
 
-    if query:
+    job_id = create_broadcast_job(
+        created_by=update.effective_user.id,
+        kind=kind,
+        message_text=message_text,
+        media_file_ids=media_file_ids,
+        target_description=target_description,
+        user_ids=user_ids,
+        progress_chat_id=progress_message.chat_id,
+        progress_message_id=progress_message.message_id,
+    )
 
-        await query.answer()
+    if job_id is None:
 
-        context.user_data["message_to_delete_id"] = query.message.message_id
+        await progress_message.edit_text(
+            "❌ Не вдалося створити завдання розсилки (помилка БД).",
+            reply_markup=get_admin_panel_keyboard(),
+        )
 
-        context.user_data["chat_id_for_delete"] = query.message.chat_id
+        return None
 
-    elif update.message:
+    job = get_broadcast_job(job_id)
 
-        context.user_data["message_to_delete_id"] = update.message.message_id
+    total_users = job["total"] if job else 0
 
-        context.user_data["chat_id_for_delete"] = update.message.chat_id
+    await progress_message.edit_text(
+        f"📨 Розсилку #{job_id} для {total_users} ({target_description}) поставлено в чергу. "
+        f"0/{total_users} надіслано.\n"
+        "Керування: Адмін-панель → Черга розсилок."
+    )
 
-    text = "Будь ласка, детально опишіть вашу ідею або пропозицію. Ваше повідомлення буде передано адміністрації."
+    logger.info(
+        f"Адмін {update.effective_user.id} створив розсилку #{job_id} ({kind}) для {total_users} отримувачів."
+    )
 
-    keyboard = [[InlineKeyboardButton("Скасувати", callback_data="cancel_suggestion_flow")]]
+    return job_id
 
-    reply_markup = InlineKeyboardMarkup(keyboard)
 
-    if query and query.message:
+def get_announce_audience_filter(user_data: dict) -> tuple[dict, str]:
+    """Параметри аудиторії з розмови /announce (для resolve_audience_bitmap) та її опис."""
 
-        await query.message.edit_text(text, reply_markup=reply_markup, parse_mode="Markdown")
+    target_group = user_data.get("announce_target_group")
 
-    elif update.message:
+    segment_expression = user_data.get("announce_segment_expression")
 
-        await update.message.reply_text(text, reply_markup=reply_markup, parse_mode="Markdown")
+    if segment_expression:
 
-    return TYPING_SUGGESTION
+        target_description = f"сегмента {segment_expression}"
 
+    else:
 
-async def receive_suggestion_message_handler(
-    update: Update, context: ContextTypes.DEFAULT_TYPE
-) -> int:
+        target_description = f"групи {target_group}" if target_group else "всіх користувачів"
+
+    audience_filter = {
+        "group_name": target_group if target_group else None,
+        "include_unreachable": user_data.get("announce_include_unreachable", False),
+        "segment_expression": segment_expression,
+    }
 
-    suggestion_text = update.message.text
+    return audience_filter, target_description
 
-    user = update.effective_user
 
-    update_command_stats("suggestion_from_button")
+async def finalize_media_announcement_send(
+    update: Update, context: ContextTypes.DEFAULT_TYPE
+) -> int:
 
-    user_group = get_user_group_from_db(user.id)
+    announcement_caption = context.user_data.get("announcement_caption", "")
 
-    if contains_profanity(suggestion_text):
+    media_file_ids = context.user_data.get("media_group_photos", [])
 
-        warn_text = "⚠️ Будь ласка, використовуйте цензурну лексику. Ваше повідомлення не було відправлено. Спробуйте ще раз."
+    audience_filter, target_description = get_announce_audience_filter(context.user_data)
 
-        # ЗМІНА ТУТ: Передаємо 'suggestion' як flow_type
+    if not media_file_ids:
 
         await update.message.reply_text(
-            warn_text, reply_markup=get_cancel_profanity_flow_keyboard("suggestion")
+            "Немає фото для відправки оголошення.", reply_markup=get_admin_panel_keyboard()
         )
 
-        return TYPING_SUGGESTION
+        context.user_data.clear()
 
-    if not SUGGESTION_CHANNEL_ID:
+        return ConversationHandler.END
 
-        await update.message.reply_text("Система пропозицій не налаштована.")
+    if context.user_data.get("announce_send_at"):
+
+        await schedule_announcement_from_conversation(
+            update,
+            context,
+            "media",
+            announcement_caption,
+            media_file_ids,
+            audience_filter,
+            target_description,
+        )
 
         context.user_data.clear()
 
         return ConversationHandler.END
 
-    try:
-
-        # Тут user_data_for_log вже має доступ до user_group
-
-        user_data_for_log = (
-            f"ID: `{user.id}` | Username: @{user.username or 'N/A'}\n"
-            f"Ім'я: {user.full_name} | Група: {user_group or 'Не вказана'}"
-        )  # Цей рядок тепер коректний
+    audience_bitmap = await resolve_audience_bitmap(**audience_filter)
 
-        safe_suggestion = escape_markdown(suggestion_text)
+    if not audience_bitmap:
 
-        suggestion_message_text_for_channel = (
-            f"💡 **Нова пропозиція:**\n"
-            f"Інформація про відправника:\n{user_data_for_log}\n\n"
-            f"Опис:\n{safe_suggestion}"
+        await update.message.reply_text(
+            f"Немає користувачів для розсилки ({target_description}).",
+            reply_markup=get_admin_panel_keyboard(),
         )
 
-        try:
+        context.user_data.clear()
 
-            await context.bot.send_message(
-                chat_id=SUGGESTION_CHANNEL_ID,
-                text=suggestion_message_text_for_channel,
-                parse_mode="Markdown",
-            )
+        return ConversationHandler.END
 
-        except telegram.error.BadRequest as e:
+    await enqueue_announcement(
+        update,
+        "media",
+        announcement_caption,
+        media_file_ids,
+        target_description,
+        iter_bitmap_user_ids(audience_bitmap),
+    )
 
-            if "can't parse entities" in str(e).lower():
+    context.user_data.clear()
 
-                # Якщо Markdown не парситься, відправляємо без нього
+    return ConversationHandler.END
 
-                fallback_text = (
-                    f"💡 Нова пропозиція:\n"
-                    f"Інформація про відправника:\n{user_data_for_log}\n\n"
-                    f"Опис:\n{suggestion_text}"
-                )
 
-                await context.bot.send_message(chat_id=SUGGESTION_CHANNEL_ID, text=fallback_text)
+async def announce_cancel_media_callback(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
 
-            else:
+    query = update.callback_query
 
-                raise e
+    await query.answer()
 
-        # 1. Спроба видалити попереднє повідомлення з запитом на пропозицію
+    context.user_data.clear()
 
-        if (
-            "message_to_delete_id" in context.user_data
-            and "chat_id_for_delete" in context.user_data
-        ):
+    await query.edit_message_text(
+        "Створення медіа-оголошення скасовано.", reply_markup=get_admin_panel_keyboard()
+    )
 
-            try:
+    return ConversationHandler.END
 
-                await context.bot.delete_message(
-                    chat_id=context.user_data["chat_id_for_delete"],
-                    message_id=context.user_data["message_to_delete_id"],
-                )
 
-                logger.debug(
-                    f"Видалено повідомлення {context.user_data['message_to_delete_id']} в чаті {context.user_data['chat_id_for_delete']}."
-                )
+async def announce_typed_message_handler(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
 
-            except telegram.error.BadRequest as e:
+    announcement_text = update.message.text
 
-                logger.warning(
-                    f"Не вдалося видалити повідомлення {context.user_data.get('message_to_delete_id')}: {e}"
-                )
+    audience_filter, target_description = get_announce_audience_filter(context.user_data)
 
-            except Exception as e:
+    if context.user_data.get("announce_send_at"):
 
-                logger.error(
-                    f"Неочікувана помилка при видаленні повідомлення {context.user_data.get('message_to_delete_id')}: {e}"
-                )
+        await schedule_announcement_from_conversation(
+            update, context, "text", announcement_text, None, audience_filter, target_description
+        )
 
-        # 2. Надсилаємо нове повідомлення-підтвердження користувачу
+        context.user_data.clear()
 
-        confirm_text = "✅ Дякую! Вашу пропозицію успішно відправлено адміністрації."
+        return ConversationHandler.END
 
-        # ЗАМІНІТЬ НА ЦЕ
+    audience_bitmap = await resolve_audience_bitmap(**audience_filter)
 
-        await update.message.reply_text(
-            confirm_text, reply_markup=get_correct_main_menu_keyboard(user.id)
-        )
+    if not audience_bitmap:
 
-        logger.info(
-            f"Пропозиція: Відправлено від {user.id} (Група: {user_group or 'N/A'}) до каналу {SUGGESTION_CHANNEL_ID}. Текст: {suggestion_text[:50]}..."
+        await update.message.reply_text(
+            f"Немає користувачів для розсилки ({target_description}).",
+            reply_markup=get_admin_panel_keyboard(),
         )
 
-    except Exception as e:
+        context.user_data.clear()
 
-        logger.error(
-            f"Пропозиція: Помилка відправлення від {user.id} до {SUGGESTION_CHANNEL_ID}: {e}",
-            exc_info=True,
-        )
+        return ConversationHandler.END
 
-        await update.message.reply_text(
-            "❌ Виникла помилка під час відправлення пропозиції. Спробуйте пізніше.",
-            reply_markup=get_main_menu_keyboard(user.id, user_group),
-        )
+    await enqueue_announcement(
+        update,
+        "text",
+        announcement_text,
+        None,
+        target_description,
+        iter_bitmap_user_ids(audience_bitmap),
+    )
 
     context.user_data.clear()
 
     return ConversationHandler.END
 
 
-async def cancel_suggestion_flow_handler(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
+async def announce_cancel_handler(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
 
     query = update.callback_query
 
-    if query:
-
-        await query.answer()
-
-        user = query.from_user
-
-    else:
-
-        user = update.effective_user
-
-    user_id = user.id
-
-    text = "Надсилання пропозиції скасовано."
+    await query.answer()
 
-    # ЗМІНИ ЦЕЙ БЛОК:
+    context.user_data.clear()
 
-    if "message_to_delete_id" in context.user_data and "chat_id_for_delete" in context.user_data:
+    await query.edit_message_text(
+        "Створення оголошення скасовано.", reply_markup=get_admin_panel_keyboard()
+    )
 
-        try:
+    return ConversationHandler.END
 
-            await context.bot.delete_message(
-                chat_id=context.user_data["chat_id_for_delete"],
-                message_id=context.user_data["message_to_delete_id"],
-            )
 
-            logger.debug(
-                f"Видалено повідомлення {context.user_data['message_to_delete_id']} в чаті {context.user_data['chat_id_for_delete']} при скасуванні пропозиції."
-            )
+async def announce_command_handler(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
 
-        except telegram.error.BadRequest as e:
+    if update.effective_user.id not in ADMIN_USER_IDS:
 
-            # Якщо повідомлення вже видалене або не знайдено (наприклад, після перезапуску бота або якщо користувач сам видалив)
+        await update.message.reply_text("Доступ заборонено.")
 
-            if "Message to delete not found" in str(e):
+        return
 
-                logger.warning(
-                    f"Повідомлення пропозиції для видалення вже відсутнє або видалено (ID: {context.user_data.get('message_to_delete_id')})."
-                )
+    update_command_stats("/announce")
 
-            else:
+    if not context.args:
 
-                logger.error(
-                    f"Помилка при видаленні повідомлення пропозиції (ID: {context.user_data.get('message_to_delete_id')}): {e}"
-                )
+        await update.message.reply_text(
+            "Використовуйте кнопку 'Оголошення' або /announce ТЕКСТ.",
+            reply_markup=get_admin_panel_keyboard(),
+        )
 
-            # Продовжуємо надсилати нове повідомлення, навіть якщо старе не видалилося
+        return
 
-            await (query.message if query else update.message).reply_text(
-                text, reply_markup=get_correct_main_menu_keyboard(user_id)
-            )
+    announcement_text = " ".join(context.args)
 
-            context.user_data.clear()
+    audience_bitmap = await resolve_audience_bitmap()
 
-            return ConversationHandler.END
+    if not audience_bitmap:
 
-        except Exception as e:
+        await update.message.reply_text("Немає користувачів для розсилки.")
 
-            logger.error(
-                f"Неочікувана помилка при видаленні повідомлення пропозиції (ID: {context.user_data.get('message_to_delete_id')}): {e}"
-            )
+        return
 
-            await (query.message if query else update.message).reply_text(
-                text, reply_markup=get_correct_main_menu_keyboard(user_id)
-            )
+    await enqueue_announcement(
+        update,
+        "text",
+        announcement_text,
+        None,
+        "всіх користувачів",
+        iter_bitmap_user_ids(audience_bitmap),
+    )
 
-            context.user_data.clear()
 
-            return ConversationHandler.END
+# --- Фоновий воркер розсилок ---
 
-    # Якщо повідомлення було успішно видалене або не існувало,
 
-    # надсилаємо повідомлення про скасування і головне меню.
+class BroadcastInterrupted(Exception):
+    """Розсилку поставили на паузу або скасували посеред пакета."""
 
-    # Якщо це callback_query, редагуємо його повідомлення, щоб не надсилати нове,
 
-    # якщо воно вже було відредаговане або ми не хочемо створювати нове
+def build_payload_sender(
+    context: ContextTypes.DEFAULT_TYPE, payload: dict, rate_limit_args: dict
+):
+    """Повертає корутину send(user_id), що надсилає вміст розсилки (текст, фото або альбом)."""
 
-    if query and query.message:
+    full_message_to_send = f"📢 ОГОЛОШЕННЯ 📢\n\n{payload['message_text']}"
 
-        try:
+    media_objects = []
 
-            await query.message.edit_text(
-                text, reply_markup=get_correct_main_menu_keyboard(user_id)
-            )
+    if payload["kind"] == "media":
 
-        except telegram.error.BadRequest as e:
+        for i, file_id in enumerate(json.loads(payload["media_json"] or "[]")):
 
-            if "Message is not modified" not in str(
-                e
-            ):  # Якщо повідомлення справді змінилося, але не відредагувалося
+            if i == 0 and payload["message_text"]:
 
-                await query.message.reply_text(
-                    text, reply_markup=get_correct_main_menu_keyboard(user_id)
+                media_objects.append(
+                    InputMediaPhoto(
+                        media=file_id,
+                        caption=full_message_to_send,
+                        parse_mode=payload["parse_mode"],
+                    )
                 )
 
-        except Exception:  # Якщо щось пішло не так при редагуванні, відправте нове
-
-            await query.message.reply_text(
-                text, reply_markup=get_correct_main_menu_keyboard(user_id)
-            )
-
-    else:  # Якщо це не callback_query (наприклад, команда /cancel), просто відправте нове
-
-        await update.message.reply_text(text, reply_markup=get_correct_main_menu_keyboard(user_id))
-
-    context.user_data.clear()
-
-    return ConversationHandler.END
-
+            else:
 
-async def receive_report_message_handler(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
+                media_objects.append(InputMediaPhoto(media=file_id))
 
-    report_text = update.message.text
+    async def send(user_id: int) -> None:
 
-    user = update.effective_user
+        if not media_objects:
 
-    update_command_stats("report_from_button")
+            await context.bot.send_message(
+                chat_id=user_id,
+                text=full_message_to_send,
+                parse_mode=payload["parse_mode"],
+                rate_limit_args=rate_limit_args,
+            )
 
-    user_group = get_user_group_from_db(user.id)
+        elif len(media_objects) > 1:
 
-    if contains_profanity(report_text):
+            await context.bot.send_media_group(
+                chat_id=user_id, media=media_objects, rate_limit_args=rate_limit_args
+            )
 
-        warn_text = "⚠️ Будь ласка, використовуйте цензурну лексику. Ваше повідомлення не було відправлено. Спробуйте ще раз."
+        else:
 
-        # ЗМІНА ТУТ: Передаємо 'report' як flow_type
+            await context.bot.send_photo(
+                chat_id=user_id,
+                photo=media_objects[0].media,
+                caption=media_objects[0].caption,
+                parse_mode=media_objects[0].parse_mode,
+                rate_limit_args=rate_limit_args,
+            )
 
-        await update.message.reply_text(
-            warn_text, reply_markup=get_cancel_profanity_flow_keyboard("report")
-        )
+    return send
 
-        return TYPING_REPORT
 
-    # Визначаємо роль користувача
+def build_broadcast_sender(context: ContextTypes.DEFAULT_TYPE, job: dict):
+    """Повертає корутину send_one(user_id) для завдання розсилки."""
 
-    user_role = get_user_role_from_db(user.id)
+    job_id = job["id"]
 
-    # Викладачі відправляють репорти тільки в канал розробників
+    send_payload = build_payload_sender(context, job, BROADCAST_LANE_ARGS)
 
-    if user_role == "teacher":
+    async def send_one(user_id: int) -> None:
 
-        target_channel = TEACHER_REPORT_CHANNEL_ID
+        if broadcast_job_status_overrides.get(job_id) in ("paused", "cancelled", "failed"):
 
-        if not target_channel:
+            raise BroadcastInterrupted()
 
-            await update.message.reply_text("Система репортів для викладачів не налаштована.")
+        await send_payload(user_id)
 
-            context.user_data.clear()
+    return send_one
 
-            return ConversationHandler.END
 
-    else:
+async def update_broadcast_progress_message(context: ContextTypes.DEFAULT_TYPE, job: dict) -> None:
 
-        # Студенти та інші відправляють в загальний канал репортів
+    if not job.get("progress_chat_id") or not job.get("progress_message_id"):
 
-        target_channel = REPORT_CHANNEL_ID
+        return
 
-        if not target_channel:
+    status_display = BROADCAST_STATUS_DISPLAY.get(job["status"], job["status"])
 
-            await update.message.reply_text("Система репортів не налаштована.")
+    try:
 
-            context.user_data.clear()
+        await context.bot.edit_message_text(
+            chat_id=job["progress_chat_id"],
+            message_id=job["progress_message_id"],
+            text=(
+                f"📨 Розсилка #{job['id']} ({job['target_description']}) - {status_display}\n"
+                f"{job['sent']}/{job['total']} надіслано. Невдачі: {job['failed']}."
+            ),
+        )
 
-            return ConversationHandler.END
+    except telegram.error.BadRequest as e:
 
-    try:
+        if "Message is not modified" in str(e):
 
-        safe_report = escape_markdown(report_text)
+            logger.debug(f"Progress message not modified: {e}")
 
-        safe_name = escape_markdown(user.full_name)
+        else:
 
-        safe_group = escape_markdown(user_group or "Не вказана")
+            logger.warning(f"Failed to edit progress message: {e}")
 
-        # Різні формати для викладачів та студентів
 
-        if user_role == "teacher":
+async def broadcast_worker_callback(context: ContextTypes.DEFAULT_TYPE) -> None:
+    """Обробляє один пакет отримувачів найстарішого активного завдання розсилки."""
 
-            report_message_text = (
-                f"👨‍🏫 **Репорт від викладача:**\n"
-                f"ID: `{user.id}`\nUsername: @{user.username or 'N/A'}\n"
-                f"Ім'я: {safe_name}\n\nОпис:\n{safe_report}"
-            )
+    global broadcast_worker_busy
 
-        else:
+    if broadcast_worker_busy:
 
-            report_message_text = (
-                f"🐞 **Новий репорт:**\n"
-                f"ID: `{user.id}`\nUsername: @{user.username or 'N/A'}\n"
-                f"Ім'я: {safe_name}\nГрупа: {safe_group}\n\nОпис:\n{safe_report}"
-            )
+        return
 
-        try:
+    broadcast_worker_busy = True
 
-            await context.bot.send_message(
-                chat_id=target_channel, text=report_message_text, parse_mode="Markdown"
-            )
+    try:
 
-        except telegram.error.BadRequest as e:
+        job = get_next_active_broadcast_job()
 
-            if "can't parse entities" in str(e).lower():
+        if not job:
 
-                # Якщо Markdown не парситься, відправляємо без нього
+            return
 
-                if user_role == "teacher":
+        job_id = job["id"]
 
-                    fallback_text = (
-                        f"👨‍🏫 Репорт від викладача:\n"
-                        f"ID: {user.id}\nUsername: @{user.username or 'N/A'}\n"
-                        f"Ім'я: {user.full_name}\n\nОпис:\n{report_text}"
-                    )
+        if job["status"] == "pending":
 
-                else:
+            if not set_broadcast_job_status(job_id, "running", expected_status="pending"):
 
-                    fallback_text = (
-                        f"🐞 Новий репорт:\n"
-                        f"ID: {user.id}\nUsername: @{user.username or 'N/A'}\n"
-                        f"Ім'я: {user.full_name}\nГрупа: {user_group or 'Не вказана'}\n\nОпис:\n{report_text}"
-                    )
+                return  # Адмін встиг поставити на паузу або скасувати
 
-                await context.bot.send_message(chat_id=target_channel, text=fallback_text)
+            logger.info(f"Розсилка #{job_id}: старт ({job['total']} отримувачів).")
 
-            else:
+        user_ids = get_pending_broadcast_recipients(job_id, BROADCAST_CHUNK_SIZE)
 
-                raise e
+        if not user_ids:
 
-        # Редагуємо попереднє повідомлення або надсилаємо нове підтвердження
+            if not set_broadcast_job_status(job_id, "completed", expected_status="running"):
 
-        if "message_to_edit_id" in context.user_data and "chat_id_for_edit" in context.user_data:
+                return
 
-            try:
+            job = get_broadcast_job(job_id)
 
-                await context.bot.delete_message(
-                    chat_id=context.user_data["chat_id_for_edit"],
-                    message_id=context.user_data["message_to_edit_id"],
-                )
+            await update_broadcast_progress_message(context, job)
 
-                logger.debug(
-                    f"Видалено повідомлення {context.user_data['message_to_edit_id']} в чаті {context.user_data['chat_id_for_edit']}."
-                )
+            summary_text = (
+                f"Розсилку #{job_id} завершено.\nЦіль: {job['target_description']}\n"
+                f"✅ Відправлено: {job['sent']}\n❌ Невдало: {job['failed']}\n"
+                f"📬 Додано в DLQ: {job['failed']}"
+            )
 
-            except telegram.error.BadRequest as e:
+            try:
 
-                logger.warning(
-                    f"Не вдалося видалити повідомлення {context.user_data.get('message_to_edit_id')}: {e}"
+                await context.bot.send_message(
+                    chat_id=job["created_by"],
+                    text=summary_text,
+                    reply_markup=get_admin_panel_keyboard(),
                 )
 
             except Exception as e:
 
-                logger.error(
-                    f"Неочікувана помилка при видаленні повідомлення {context.user_data.get('message_to_edit_id')}: {e}"
-                )
-
-        # 2. Надсилаємо нове повідомлення-підтвердження
+                logger.warning(f"Розсилка #{job_id}: не вдалося надіслати підсумок адміну: {e}")
 
-        confirm_text = "✅ Дякую! Ваш репорт відправлено адміністраторам."
+            logger.info(f"Розсилка #{job_id} завершена. {summary_text}")
 
-        # Використовуємо update.message.reply_text, щоб підтвердження було відповіддю на останнє повідомлення користувача
+            return
 
-        # ЗАМІНІТЬ НА ЦЕ
+        payload_errors = []
 
-        await update.message.reply_text(
-            confirm_text, reply_markup=get_correct_main_menu_keyboard(user.id)
-        )
+        recipient_outcomes = []  # [(user_id, None або помилка)] - пишуться в БД кожні N отримувачів
 
-        channel_name = "канал розробників" if user_role == "teacher" else "загальний канал репортів"
+        def buffer_outcome(user_id: int, error: Exception | None) -> None:
 
-        logger.info(
-            f"Репорт: Відправлено від {user.id} (Роль: {user_role}, Група: {user_group or 'N/A'}) в {channel_name}. Текст: {report_text[:50]}..."
-        )
+            recipient_outcomes.append((user_id, error))
 
-    except Exception as e:
+            if len(recipient_outcomes) >= BROADCAST_OUTCOME_FLUSH_SIZE:
 
-        logger.error(f"Репорт: Помилка відправлення від {user.id}: {e}", exc_info=True)
+                persist_broadcast_outcomes(job, recipient_outcomes[:])
 
-        # У випадку помилки, також надсилаємо нове повідомлення
+                recipient_outcomes.clear()
 
-        await update.message.reply_text(
-            "❌ Виникла помилка під час відправлення репорту. Спробуйте пізніше.",
-            reply_markup=get_main_menu_keyboard(user.id, user_group),
-        )
+        def on_success(user_id: int) -> None:
 
-    context.user_data.clear()
+            BROADCAST_MESSAGES.inc(lane=LANE_BROADCAST, outcome="sent")
 
-    return ConversationHandler.END
+            buffer_outcome(user_id, None)
 
+        def on_failure(user_id: int, error: Exception) -> None:
 
-async def cancel_report_flow_handler(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
+            if isinstance(error, BroadcastInterrupted):
 
-    query = update.callback_query
+                return  # Отримувач лишається 'pending' і буде оброблений після відновлення
 
-    if query:
+            logger.error(f"Розсилка #{job_id}: Не вдалося {user_id}: {error}")
 
-        await query.answer()
+            error_class = classify_delivery_error(error)
 
-        user = query.from_user
+            BROADCAST_MESSAGES.inc(lane=LANE_BROADCAST, outcome=error_class)
 
-    else:
+            if error_class == DLQ_CLASS_PAYLOAD:
 
-        user = update.effective_user
+                # Вміст не пройде ні до кого: зупиняємо завдання, отримувач лишається 'pending'
 
-    user_id = user.id
+                broadcast_job_status_overrides[job_id] = "failed"
 
-    text = "Надсилання репорту скасовано."
+                payload_errors.append(str(error))
 
-    # ЗМІНИ ЦЕЙ БЛОК:
+                return
 
-    if "message_to_edit_id" in context.user_data and "chat_id_for_edit" in context.user_data:
+            buffer_outcome(user_id, error)
 
         try:
 
-            await context.bot.delete_message(
-                chat_id=context.user_data["chat_id_for_edit"],
-                message_id=context.user_data["message_to_edit_id"],
+            await run_broadcast(
+                user_ids,
+                build_broadcast_sender(context, job),
+                total=len(user_ids),
+                throttle=False,  # Швидкість обмежує LaneRateLimiter (смуга "broadcast")
+                on_success=on_success,
+                on_failure=on_failure,
             )
 
-            logger.debug(
-                f"Видалено повідомлення {context.user_data['message_to_edit_id']} в чаті {context.user_data['chat_id_for_edit']} при скасуванні репорту."
-            )
+        finally:
 
-        except telegram.error.BadRequest as e:
+            persist_broadcast_outcomes(job, recipient_outcomes)
 
-            if "Message to delete not found" in str(e):
+        if payload_errors:
 
-                logger.warning(
-                    f"Повідомлення репорту для видалення вже відсутнє або видалено (ID: {context.user_data.get('message_to_edit_id')})."
-                )
+            set_broadcast_job_status(job_id, "failed")
 
-            else:
+            broadcast_job_status_overrides.pop(job_id, None)
 
-                logger.error(
-                    f"Помилка при видаленні повідомлення репорту (ID: {context.user_data.get('message_to_edit_id')}): {e}"
-                )
+            logger.error(f"Розсилка #{job_id}: зупинено через помилку вмісту: {payload_errors[0]}")
 
-            await (query.message if query else update.message).reply_text(
-                text, reply_markup=get_correct_main_menu_keyboard(user_id)
-            )
+            try:
 
-            context.user_data.clear()
+                await context.bot.send_message(
+                    chat_id=job["created_by"],
+                    text=(
+                        f"❌ Розсилку #{job_id} зупинено: Telegram відхиляє саме повідомлення.\n"
+                        f"Помилка: {payload_errors[0]}\n"
+                        "Виправте текст або вкладення і створіть розсилку знову."
+                    ),
+                    reply_markup=get_admin_panel_keyboard(),
+                )
 
-            return ConversationHandler.END
+            except Exception as e:
 
-        except Exception as e:
+                logger.warning(f"Розсилка #{job_id}: не вдалося повідомити адміна про зупинку: {e}")
 
-            logger.error(
-                f"Неочікувана помилка при видаленні повідомлення репорту (ID: {context.user_data.get('message_to_edit_id')}): {e}"
-            )
+        refreshed_job = get_broadcast_job(job_id)
 
-            await (query.message if query else update.message).reply_text(
-                text, reply_markup=get_correct_main_menu_keyboard(user_id)
-            )
+        if refreshed_job:
 
-            context.user_data.clear()
+            await update_broadcast_progress_message(context, refreshed_job)
 
-            return ConversationHandler.END
+    except Exception as e:
 
-    # Якщо повідомлення було успішно видалене або не існувало,
+        logger.error(f"Воркер розсилок: неочікувана помилка: {e}", exc_info=True)
 
-    # надсилаємо повідомлення про скасування і головне меню.
+    finally:
 
-    if query and query.message:
+        broadcast_worker_busy = False
 
-        try:
 
-            await query.message.edit_text(
-                text, reply_markup=get_correct_main_menu_keyboard(user_id)
-            )
+async def dlq_redelivery_job_callback(context: ContextTypes.DEFAULT_TYPE) -> None:
+    """Повторно доставляє записи DLQ з тимчасовими помилками (пакетами, з експоненційною затримкою)."""
 
-        except telegram.error.BadRequest as e:
+    global dlq_redelivery_busy
 
-            if "Message is not modified" not in str(e):
+    if dlq_redelivery_busy:
 
-                await query.message.reply_text(
-                    text, reply_markup=get_correct_main_menu_keyboard(user_id)
-                )
+        return
 
-        except Exception:
+    dlq_redelivery_busy = True
 
-            await query.message.reply_text(
-                text, reply_markup=get_correct_main_menu_keyboard(user.id)
-            )
+    try:
 
-    else:
+        entries = get_due_dlq_entries(DLQ_REDELIVERY_BATCH_SIZE)
 
-        await update.message.reply_text(text, reply_markup=get_correct_main_menu_keyboard(user_id))
+        if not entries:
 
-    context.user_data.clear()
+            return
 
-    return ConversationHandler.END
+        entries_by_user = {}
 
+        payload_senders = {}  # {broadcast_id: send(user_id)} - вміст кожної розсилки читаємо раз
 
-async def admin_panel_handler(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+        for entry in entries:
 
-    user_id = update.effective_user.id
+            broadcast_id = entry["broadcast_id"]
 
-    if user_id not in ADMIN_USER_IDS:
+            if broadcast_id and broadcast_id not in payload_senders:
 
-        text = "Доступ заборонено."
+                payload = get_broadcast_payload(broadcast_id)
 
-        if update.callback_query:
-            await update.callback_query.answer(text, show_alert=True)
+                payload_senders[broadcast_id] = (
+                    build_payload_sender(context, payload, DLQ_LANE_ARGS) if payload else None
+                )
 
-        elif update.message:
-            await update.message.reply_text(text)
+            if broadcast_id and payload_senders[broadcast_id] is None:
 
-        return
+                reschedule_dlq_entry(
+                    entry["id"],
+                    DLQ_MAX_ATTEMPTS,
+                    f"Вміст розсилки #{broadcast_id} не знайдено",
+                    DLQ_CLASS_PERMANENT,
+                )
 
-    text = "🛠️ Панель адміністратора:"
+                continue
 
-    reply_markup = get_admin_panel_keyboard()
+            if not broadcast_id and entry["message_text"].startswith(DLQ_MEDIA_PREFIX):
 
-    if update.callback_query:
+                # Старі записи (до таблиці broadcasts): фото не збережені - повторити неможливо
 
-        await update.callback_query.edit_message_text(
-            text, reply_markup=reply_markup, parse_mode="HTML"
-        )
+                reschedule_dlq_entry(
+                    entry["id"],
+                    DLQ_MAX_ATTEMPTS,
+                    "Медіа-оголошення не можна доставити повторно",
+                    DLQ_CLASS_PERMANENT,
+                )
 
-    elif update.message:
+                continue
 
-        update_command_stats(update.message.text.split()[0])
+            entries_by_user.setdefault(entry["user_id"], []).append(entry)
 
-        await update.message.reply_text(text, reply_markup=reply_markup, parse_mode="HTML")
+        outcomes = {"processed": 0, "new": 0, "dead": 0}
 
+        processed_ids = set()
 
-async def admin_announce_start_handler(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
+        async def send_one(user_id: int) -> None:
 
-    query = update.callback_query
+            for entry in entries_by_user[user_id]:
 
-    if query:
-        await query.answer()
+                if entry["id"] in processed_ids:
 
-    keyboard = [
-        [InlineKeyboardButton("Всім користувачам", callback_data="announce_target_all")],
-        [InlineKeyboardButton("Конкретній групі", callback_data="announce_target_group")],
-        [InlineKeyboardButton(" Скасувати", callback_data="announce_cancel")],
-    ]
+                    continue
 
-    reply_markup = InlineKeyboardMarkup(keyboard)
+                if entry["broadcast_id"]:
 
-    text = "📢 Оголошення: Оберіть цільову аудиторію:"
+                    await payload_senders[entry["broadcast_id"]](user_id)
 
-    if query:
-        await query.edit_message_text(text, reply_markup=reply_markup)
+                else:
 
-    return ANNOUNCE_SELECT_TARGET
+                    await context.bot.send_message(
+                        chat_id=user_id,
+                        text=f"📢 ОГОЛОШЕННЯ 📢\n\n{entry['message_text']}",
+                        rate_limit_args=DLQ_LANE_ARGS,
+                    )
 
+                mark_dlq_entry_processed(entry["id"])
 
-async def announce_select_target_callback(
-    update: Update, context: ContextTypes.DEFAULT_TYPE
-) -> int:
+                processed_ids.add(entry["id"])
 
-    query = update.callback_query
+                record_user_delivery_outcome(user_id, True)
 
-    await query.answer()
+                outcomes["processed"] += 1
 
-    target = query.data
+                BROADCAST_MESSAGES.inc(lane=LANE_DLQ, outcome="sent")
 
-    if target == "announce_target_all":
+        def on_failure(user_id: int, error: Exception) -> None:
 
-        context.user_data["announce_target_group"] = None
+            error_class = classify_delivery_error(error)
 
-        text = "Оберіть тип оголошення для *ВСІХ* користувачів:"
+            if error_class != DLQ_CLASS_PAYLOAD:
 
-    elif target == "announce_target_group":
+                record_user_delivery_outcome(user_id, False, is_recipient_gone_error(error))
 
-        all_groups = get_all_group_names_from_cache()
+            BROADCAST_MESSAGES.inc(lane=LANE_DLQ, outcome=error_class)
 
-        if not all_groups:
+            for entry in entries_by_user[user_id]:
 
-            await query.edit_message_text(
-                "Немає груп для вибору.", reply_markup=get_back_to_admin_panel_keyboard()
-            )
+                if entry["id"] in processed_ids:
 
-            context.user_data.clear()
+                    continue
 
-            return ConversationHandler.END
+                new_status = reschedule_dlq_entry(
+                    entry["id"], entry["attempts"], str(error), error_class
+                )
 
-        group_buttons = [
-            [InlineKeyboardButton(g, callback_data=f"announce_select_group_for_type_{g}")]
-            for g in all_groups
-        ]
+                outcomes[new_status] += 1
 
-        group_buttons.append([InlineKeyboardButton("⬅️ Назад", callback_data="announce_cancel")])
+        await run_broadcast(
+            list(entries_by_user),
+            send_one,
+            total=len(entries_by_user),
+            throttle=False,  # Швидкість обмежує LaneRateLimiter (смуга "dlq")
+            on_failure=on_failure,
+        )
 
-        reply_markup = InlineKeyboardMarkup(group_buttons)
+        logger.info(
+            f"DLQ: Повторна доставка - доставлено {outcomes['processed']}, "
+            f"відкладено {outcomes['new']}, остаточно невдалих {outcomes['dead']}."
+        )
 
-        await query.edit_message_text("Оберіть групу для оголошення:", reply_markup=reply_markup)
+    except Exception as e:
 
-        return ANNOUNCE_SELECT_GROUP_FOR_ANNOUNCE
+        logger.error(f"DLQ: Неочікувана помилка воркера повторної доставки: {e}", exc_info=True)
 
-    keyboard = [
-        [InlineKeyboardButton("Тільки текст", callback_data="announce_type_text")],
-        [InlineKeyboardButton("Фото / Альбом з текстом", callback_data="announce_type_media")],
-        [InlineKeyboardButton(" Скасувати", callback_data="announce_cancel")],
-    ]
+    finally:
 
-    reply_markup = InlineKeyboardMarkup(keyboard)
+        dlq_redelivery_busy = False
 
-    await query.edit_message_text(text, reply_markup=reply_markup, parse_mode="Markdown")
 
-    return ANNOUNCE_CHOOSING_MEDIA_TYPE
+# --- Адмін: черга розсилок (пауза / відновлення / скасування) ---
 
 
-async def announce_select_group_for_announce_callback(
-    update: Update, context: ContextTypes.DEFAULT_TYPE
-) -> int:
+async def admin_broadcast_jobs_handler(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
 
     query = update.callback_query
 
-    await query.answer()
-
-    group_name = query.data.replace("announce_select_group_for_type_", "")
+    user_id = update.effective_user.id
 
-    context.user_data["announce_target_group"] = group_name
+    if user_id not in ADMIN_USER_IDS:
 
-    text = f"Оберіть тип оголошення для групи *{group_name}*:"
+        if query:
+            await query.answer("Доступ заборонено.", show_alert=True)
 
-    keyboard = [
-        [InlineKeyboardButton("Тільки текст", callback_data="announce_type_text")],
-        [InlineKeyboardButton("Фото / Альбом з текстом", callback_data="announce_type_media")],
-        [InlineKeyboardButton(" Скасувати", callback_data="announce_cancel")],
-    ]
+        return
 
-    reply_markup = InlineKeyboardMarkup(keyboard)
+    data = query.data if query else ""
 
-    await query.edit_message_text(text, reply_markup=reply_markup, parse_mode="Markdown")
+    for action, new_status in (
+        ("bjob_pause_", "paused"),
+        ("bjob_resume_", "running"),
+        ("bjob_cancel_", "cancelled"),
+    ):
 
-    return ANNOUNCE_CHOOSING_MEDIA_TYPE
+        if data.startswith(action):
 
+            job_id = int(data.replace(action, ""))
 
-async def announce_choose_media_type_callback(
-    update: Update, context: ContextTypes.DEFAULT_TYPE
-) -> int:
+            job = get_broadcast_job(job_id)
 
-    query = update.callback_query
+            if job and job["status"] not in ("completed", "cancelled", "failed"):
 
-    await query.answer()
+                set_broadcast_job_status(job_id, new_status)
 
-    media_type = query.data.replace("announce_type_", "")
+                if new_status == "running":
 
-    context.user_data["announce_media_type"] = media_type
+                    broadcast_job_status_overrides.pop(job_id, None)
 
-    if media_type == "text":
+                else:
 
-        target_description = (
-            f"групи *{context.user_data['announce_target_group']}*"
-            if context.user_data.get("announce_target_group")
-            else "*ВСІХ* користувачів"
-        )
+                    broadcast_job_status_overrides[job_id] = new_status
 
-        await query.edit_message_text(
-            f"Введіть текст оголошення для {target_description}:", parse_mode="Markdown"
-        )
+                logger.info(f"Адмін {user_id}: розсилка #{job_id} -> {new_status}.")
 
-        return ANNOUNCE_TYPING_MESSAGE_FOR_ANNOUNCE
+            break
 
-    elif media_type == "media":
+    jobs = get_recent_broadcast_jobs(limit=10)
 
-        await query.edit_message_text(
-            f"Надішліть фото для оголошення.\nВи можете відправити до {MAX_ALBUM_PHOTOS} фотографій як альбом.",
-            reply_markup=InlineKeyboardMarkup(
-                [[InlineKeyboardButton("Скасувати", callback_data="announce_cancel_media")]]
-            ),
-        )
+    text = "*📨 Черга розсилок*\n\n"
 
-        context.user_data["media_group_photos"] = []
+    keyboard = []
 
-        return ANNOUNCE_WAITING_FOR_PHOTOS
+    if not jobs:
 
+        text += "_Розсилок ще не було._"
 
-async def announce_waiting_for_photos_handler(
-    update: Update, context: ContextTypes.DEFAULT_TYPE
-) -> int:
+    for job in jobs:
 
-    if update.message.photo:
+        status_display = BROADCAST_STATUS_DISPLAY.get(job["status"], job["status"])
 
-        photo_file_id = update.message.photo[-1].file_id
+        text += (
+            f"*#{job['id']}* {status_display} - {job['target_description']}\n"
+            f"   {job['sent']}/{job['total']} надіслано, невдач: {job['failed']} ({job['created_at']})\n"
+        )
 
-        context.user_data["media_group_photos"].append(photo_file_id)
+        if job["status"] in ("pending", "running"):
 
-        current_photo_count = len(context.user_data["media_group_photos"])
+            keyboard.append(
+                [
+                    InlineKeyboardButton(
+                        f"⏸ Пауза #{job['id']}", callback_data=f"bjob_pause_{job['id']}"
+                    ),
+                    InlineKeyboardButton(
+                        f"✖️ Скасувати #{job['id']}", callback_data=f"bjob_cancel_{job['id']}"
+                    ),
+                ]
+            )
 
-        if current_photo_count >= MAX_ALBUM_PHOTOS:
+        elif job["status"] == "paused":
 
-            await update.message.reply_text(
-                f"Ви завантажили максимальну кількість фото ({MAX_ALBUM_PHOTOS}).\nТепер введіть підпис для фото:",
-                reply_markup=InlineKeyboardMarkup(
-                    [[InlineKeyboardButton("Скасувати", callback_data="announce_cancel_media")]]
-                ),
+            keyboard.append(
+                [
+                    InlineKeyboardButton(
+                        f"▶️ Продовжити #{job['id']}", callback_data=f"bjob_resume_{job['id']}"
+                    ),
+                    InlineKeyboardButton(
+                        f"✖️ Скасувати #{job['id']}", callback_data=f"bjob_cancel_{job['id']}"
+                    ),
+                ]
             )
 
-            return ANNOUNCE_TYPING_CAPTION_FOR_MEDIA
+    keyboard.append([InlineKeyboardButton("🔄 Оновити", callback_data="admin_broadcast_jobs")])
 
-        else:
+    keyboard.append(
+        [InlineKeyboardButton("⬅️ Назад до адмін-панелі", callback_data="show_admin_panel")]
+    )
 
-            await update.message.reply_text(
-                f"Фото додано до альбому ({current_photo_count}/{MAX_ALBUM_PHOTOS}).\n"
-                "Відправте ще фото або введіть підпис для оголошення, якщо це всі фото:",
-                reply_markup=InlineKeyboardMarkup(
-                    [[InlineKeyboardButton("Скасувати", callback_data="announce_cancel_media")]]
-                ),
-            )
+    try:
 
-            return ANNOUNCE_WAITING_FOR_PHOTOS
+        await query.edit_message_text(
+            text, reply_markup=InlineKeyboardMarkup(keyboard), parse_mode="Markdown"
+        )
 
-    elif update.message.text:
+    except telegram.error.BadRequest as e:
 
-        if not context.user_data["media_group_photos"]:
+        if "Message is not modified" not in str(e):
 
-            await update.message.reply_text(
-                "Будь ласка, спочатку надішліть хоча б одне фото, або скасуйте.",
-                reply_markup=InlineKeyboardMarkup(
-                    [[InlineKeyboardButton("Скасувати", callback_data="announce_cancel_media")]]
-                ),
-            )
+            raise
 
-            return ANNOUNCE_WAITING_FOR_PHOTOS
 
-        context.user_data["announcement_caption"] = update.message.text
+# --- Відкладені оголошення ---
 
-        return await finalize_media_announcement_send(update, context)
 
-    else:
+def get_next_off_peak_slots(
+    count: int = ANNOUNCE_OFF_PEAK_SLOT_CHOICES, now: datetime | None = None
+) -> list[datetime]:
+    """Найближчі непікові слоти (ANNOUNCE_OFF_PEAK_SLOTS) для відкладеного оголошення."""
 
-        await update.message.reply_text(
-            "Будь ласка, надішліть фото або введіть текст для підпису.",
-            reply_markup=InlineKeyboardMarkup(
-                [[InlineKeyboardButton("Скасувати", callback_data="announce_cancel_media")]]
-            ),
-        )
+    now = now or datetime.now(KYIV_TZ)
 
-        return ANNOUNCE_WAITING_FOR_PHOTOS
+    slots = []
 
+    for day_offset in range(8):
 
-async def announce_typing_caption_for_media_handler(
-    update: Update, context: ContextTypes.DEFAULT_TYPE
-) -> int:
+        day = (now + timedelta(days=day_offset)).date()
 
-    if update.message.text:
+        for slot in ANNOUNCE_OFF_PEAK_SLOTS:
 
-        context.user_data["announcement_caption"] = update.message.text
+            try:
 
-        return await finalize_media_announcement_send(update, context)
+                hour, minute = map(int, slot.split(":"))
 
-    else:
+            except ValueError:
 
-        await update.message.reply_text(
-            "Будь ласка, введіть текст підпису.",
-            reply_markup=InlineKeyboardMarkup(
-                [[InlineKeyboardButton("Скасувати", callback_data="announce_cancel_media")]]
-            ),
-        )
+                continue
 
-        return ANNOUNCE_TYPING_CAPTION_FOR_MEDIA
+            slot_dt = datetime(day.year, day.month, day.day, hour, minute, tzinfo=KYIV_TZ)
 
+            if slot_dt > now:
 
-async def finalize_media_announcement_send(
-    update: Update, context: ContextTypes.DEFAULT_TYPE
-) -> int:
+                slots.append(slot_dt)
 
-    announcement_caption = context.user_data.get("announcement_caption", "")
+    return sorted(slots)[:count]
 
-    media_file_ids = context.user_data.get("media_group_photos", [])
 
-    target_group = context.user_data.get("announce_target_group")
+def parse_announcement_send_time(text: str, now: datetime | None = None) -> datetime | None:
+    """Розбирає 'ДД.ММ.РРРР ГГ:ХХ' або 'ДД.ММ ГГ:ХХ' (час за Києвом); None, якщо не в майбутньому."""
 
-    target_description = f"групи {target_group}" if target_group else "всіх користувачів"
+    now = now or datetime.now(KYIV_TZ)
 
-    if not media_file_ids:
+    text = " ".join(text.split())
 
-        await update.message.reply_text(
-            "Немає фото для відправки оголошення.", reply_markup=get_admin_panel_keyboard()
-        )
+    for fmt, with_year in (("%d.%m.%Y %H:%M", True), ("%d.%m %H:%M", False)):
 
-        context.user_data.clear()
+        try:
 
-        return ConversationHandler.END
+            parsed = datetime.strptime(text, fmt)
 
-    user_ids_to_send = list(
-        get_all_user_ids_from_db(group_name=target_group if target_group else None)
-    )
+        except ValueError:
 
-    total_users = len(user_ids_to_send)
+            continue
 
-    if not user_ids_to_send:
+        if not with_year:
 
-        await update.message.reply_text(
-            f"Немає користувачів для розсилки ({target_description}).",
-            reply_markup=get_admin_panel_keyboard(),
-        )
+            parsed = parsed.replace(year=now.year)
 
-        context.user_data.clear()
+        send_at = parsed.replace(tzinfo=KYIV_TZ)
 
-        return ConversationHandler.END
+        if not with_year and send_at.date() < now.date():
 
-    progress_message = await update.message.reply_text(
-        f"Розпочинаю розсилку для {total_users} ({target_description})... 0/{total_users} надіслано."
-    )
+            # "05.01" у грудні - це наступний рік
 
-    sent_count, failed_count, dlq_added_count = 0, 0, 0
+            send_at = send_at.replace(year=now.year + 1)
 
-    media_objects = []
+        return send_at if send_at > now else None
 
-    for i, file_id in enumerate(media_file_ids):
+    return None
 
-        if i == 0 and announcement_caption:
 
-            media_objects.append(
-                InputMediaPhoto(
-                    media=file_id,
-                    caption=f"📢 ОГОЛОШЕННЯ 📢\n\n{announcement_caption}",
-                    parse_mode="Markdown",
-                )
-            )
+def format_announcement_send_time(send_at: datetime | str) -> str:
 
-        else:
+    if isinstance(send_at, str):
 
-            media_objects.append(InputMediaPhoto(media=file_id))
+        send_at = datetime.fromisoformat(send_at)
 
-    for idx, user_id in enumerate(user_ids_to_send):
+    return send_at.astimezone(KYIV_TZ).strftime("%d.%m.%Y %H:%M")
 
-        try:
 
-            if len(media_objects) > 1:
+def schedule_announcement_job(job_queue, announcement: dict) -> None:
+    """Ставить (або переставляє після редагування) відкладене оголошення в job_queue."""
 
-                await context.bot.send_media_group(chat_id=user_id, media=media_objects)
+    job_name = f"{SCHEDULED_ANNOUNCEMENT_JOB_PREFIX}{announcement['id']}"
 
-            else:
+    for existing_job in job_queue.get_jobs_by_name(job_name):
 
-                caption_to_send = (
-                    media_objects[0].caption if hasattr(media_objects[0], "caption") else None
-                )
+        existing_job.schedule_removal()
 
-                parse_mode_to_send = (
-                    media_objects[0].parse_mode if hasattr(media_objects[0], "parse_mode") else None
-                )
+    # Прострочені за час простою бота відправляються одразу після старту
 
-                await context.bot.send_photo(
-                    chat_id=user_id,
-                    photo=media_objects[0].media,
-                    caption=caption_to_send,
-                    parse_mode=parse_mode_to_send,
-                )
+    send_at = max(
+        datetime.fromisoformat(announcement["send_at"]),
+        datetime.now(KYIV_TZ) + timedelta(seconds=5),
+    )
 
-            sent_count += 1
+    job_queue.run_once(
+        scheduled_announcement_callback,
+        when=send_at,
+        name=job_name,
+        data={"announcement_id": announcement["id"]},
+    )
 
-            if (idx + 1) % PROGRESS_UPDATE_INTERVAL == 0 or (idx + 1) == total_users:
 
-                try:
+def unschedule_announcement_job(job_queue, announcement_id: int) -> None:
 
-                    await progress_message.edit_text(
-                        f"Розсилка для {total_users} ({target_description})... {sent_count}/{total_users} надіслано. Невдачі: {failed_count}."
-                    )
+    for existing_job in job_queue.get_jobs_by_name(
+        f"{SCHEDULED_ANNOUNCEMENT_JOB_PREFIX}{announcement_id}"
+    ):
 
-                except telegram.error.BadRequest as e:
+        existing_job.schedule_removal()
 
-                    if "Message is not modified" in str(e):
 
-                        logger.debug(f"Progress message not modified: {e}")
+def load_scheduled_announcements(job_queue) -> int:
+    """Відновлює відкладені оголошення з БД у job_queue (при старті бота)."""
 
-                    else:
+    announcements = get_scheduled_announcements(only_pending=True, limit=1000)
 
-                        logger.warning(f"Failed to edit progress message: {e}")
+    for announcement in announcements:
 
-            time.sleep(0.1)
+        schedule_announcement_job(job_queue, announcement)
 
-        except Exception as e:
+    if announcements:
 
-            logger.error(f"Розсилка медіа: Не вдалося {user_id}: {e}")
+        logger.info(f"Відкладені оголошення: Відновлено {len(announcements)} з БД.")
 
-            failed_count += 1
+    return len(announcements)
 
-            add_to_dlq(user_id, f"[Оголошення з фото] {announcement_caption}", str(e))
 
-            dlq_added_count += 1
+async def scheduled_announcement_callback(context: ContextTypes.DEFAULT_TYPE) -> None:
+    """Настав час відкладеного оголошення: створює завдання розсилки (смуга broadcast)."""
 
-            if (idx + 1) % PROGRESS_UPDATE_INTERVAL == 0 or (idx + 1) == total_users:
+    announcement_id = context.job.data["announcement_id"]
 
-                try:
+    announcement = get_scheduled_announcement(announcement_id)
 
-                    await progress_message.edit_text(
-                        f"Розсилка для {total_users} ({target_description})... {sent_count}/{total_users} надіслано. Невдачі: {failed_count}. Додано в DLQ: {dlq_added_count}."
-                    )
+    if not announcement or announcement["status"] != "scheduled":
 
-                except telegram.error.BadRequest as e:
+        return
 
-                    if "Message is not modified" in str(e):
+    try:
 
-                        logger.debug(f"Progress message not modified on failure: {e}")
+        audience_bitmap = await resolve_audience_bitmap(
+            group_name=announcement["group_name"],
+            include_unreachable=bool(announcement["include_unreachable"]),
+            segment_expression=announcement["segment_expression"],
+        )
 
-                    else:
+    except ValueError as e:
 
-                        logger.warning(f"Failed to edit progress message on failure: {e}")
+        logger.error(f"Відкладені оголошення: Некоректний вираз сегментів #{announcement_id}: {e}")
 
-    summary_text = (
-        f"Розсилку медіа-оголошення завершено.\nЦіль: {target_description}\n✅ Відправлено: {sent_count}\n"
-        f"❌ Невдало: {failed_count}\n📬 Додано в DLQ: {dlq_added_count}"
-    )
+        update_scheduled_announcement(announcement_id, status="failed")
 
-    await update.message.reply_text(summary_text, reply_markup=get_admin_panel_keyboard())
+        return
 
-    logger.info(f"Адмін {update.effective_user.id} розіслав медіа-оголошення. {summary_text}")
+    progress_chat_id = None
 
-    context.user_data.clear()
+    progress_message_id = None
 
-    return ConversationHandler.END
+    try:
 
+        progress_message = await context.bot.send_message(
+            chat_id=announcement["created_by"],
+            text=f"🕒 Запускаю відкладене оголошення #{announcement_id} ({announcement['target_description']})...",
+        )
 
-async def announce_cancel_media_callback(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
+        progress_chat_id = progress_message.chat_id
 
-    query = update.callback_query
+        progress_message_id = progress_message.message_id
 
-    await query.answer()
+    except Exception as e:
 
-    context.user_data.clear()
+        logger.warning(
+            f"Відкладені оголошення: Не вдалося повідомити автора #{announcement_id}: {e}"
+        )
 
-    await query.edit_message_text(
-        "Створення медіа-оголошення скасовано.", reply_markup=get_admin_panel_keyboard()
+    job_id = create_broadcast_job(
+        created_by=announcement["created_by"],
+        kind=announcement["kind"],
+        message_text=announcement["message_text"],
+        media_file_ids=json.loads(announcement["media_json"] or "[]") or None,
+        target_description=announcement["target_description"],
+        user_ids=iter_bitmap_user_ids(audience_bitmap),
+        progress_chat_id=progress_chat_id,
+        progress_message_id=progress_message_id,
+        scheduled_announcement_id=announcement_id,
     )
 
-    return ConversationHandler.END
+    if job_id is None:
 
+        # Не перезаписуємо скасування адміна чи вже надіслане оголошення
 
-async def announce_typed_message_handler(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
+        announcement = get_scheduled_announcement(announcement_id)
 
-    announcement_text = update.message.text
+        if announcement and announcement["status"] == "scheduled":
 
-    target_group = context.user_data.get("announce_target_group")
+            update_scheduled_announcement(announcement_id, status="failed")
 
-    target_description = f"групи {target_group}" if target_group else "всіх користувачів"
+        return
 
-    user_ids_to_send = list(
-        get_all_user_ids_from_db(group_name=target_group if target_group else None)
+    logger.info(f"Відкладені оголошення: #{announcement_id} -> розсилка #{job_id}.")
+
+
+async def schedule_announcement_from_conversation(
+    update: Update,
+    context: ContextTypes.DEFAULT_TYPE,
+    kind: str,
+    message_text: str,
+    media_file_ids: list[str] | None,
+    audience_filter: dict,
+    target_description: str,
+) -> int | None:
+    """Зберігає оголошення з розмови /announce як відкладене (час - announce_send_at)."""
+
+    send_at = datetime.fromisoformat(context.user_data["announce_send_at"])
+
+    announcement_id = create_scheduled_announcement(
+        created_by=update.effective_user.id,
+        kind=kind,
+        message_text=message_text,
+        media_file_ids=media_file_ids,
+        group_name=audience_filter["group_name"],
+        include_unreachable=audience_filter["include_unreachable"],
+        target_description=target_description,
+        send_at=send_at,
+        segment_expression=audience_filter["segment_expression"],
     )
 
-    total_users = len(user_ids_to_send)
-
-    if not user_ids_to_send:
+    if announcement_id is None:
 
         await update.message.reply_text(
-            f"Немає користувачів для розсилки ({target_description}).",
+            "❌ Не вдалося зберегти відкладене оголошення (помилка БД).",
             reply_markup=get_admin_panel_keyboard(),
         )
 
-        context.user_data.clear()
+        return None
 
-        return ConversationHandler.END
+    schedule_announcement_job(context.job_queue, get_scheduled_announcement(announcement_id))
 
-    progress_message = await update.message.reply_text(
-        f"Розпочинаю розсилку для {total_users} ({target_description})... 0/{total_users} надіслано."
+    await update.message.reply_text(
+        f"🕒 Оголошення #{announcement_id} ({target_description}) заплановано на "
+        f"{format_announcement_send_time(send_at)}.\n"
+        "Керування: Адмін-панель → Заплановані оголошення.",
+        reply_markup=get_admin_panel_keyboard(),
     )
 
-    sent_count, failed_count, dlq_added_count = 0, 0, 0
+    return announcement_id
 
-    full_message_to_send = f"📢 ОГОЛОШЕННЯ 📢\n\n{announcement_text}"
 
-    for idx, user_id in enumerate(user_ids_to_send):
+async def announce_choose_time_handler(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
+    """Крок вибору часу відправки: зараз, найближчі непікові слоти або введений вручну час."""
 
-        try:
+    query = update.callback_query
 
-            await context.bot.send_message(chat_id=user_id, text=full_message_to_send)
+    await query.answer()
 
-            sent_count += 1
+    keyboard = [[InlineKeyboardButton("⚡ Зараз", callback_data="announce_time_now")]]
 
-            if (idx + 1) % PROGRESS_UPDATE_INTERVAL == 0 or (idx + 1) == total_users:
+    for slot in get_next_off_peak_slots():
 
-                try:
+        keyboard.append(
+            [
+                InlineKeyboardButton(
+                    f"🕒 {format_announcement_send_time(slot)}",
+                    callback_data=f"announce_time_{int(slot.timestamp())}",
+                )
+            ]
+        )
 
-                    await progress_message.edit_text(
-                        f"Розсилка для {total_users} ({target_description})... {sent_count}/{total_users} надіслано. Невдачі: {failed_count}."
-                    )
+    keyboard.append([InlineKeyboardButton("⬅️ Назад", callback_data="announce_time_back")])
 
-                except telegram.error.BadRequest as e:
+    await query.edit_message_text(
+        "🕒 Коли надіслати оголошення?\n\n"
+        "Оберіть непіковий слот або надішліть дату й час повідомленням: ДД.ММ.РРРР ГГ:ХХ",
+        reply_markup=InlineKeyboardMarkup(keyboard),
+    )
 
-                    if "Message is not modified" in str(e):
+    return ANNOUNCE_SELECT_SEND_TIME
 
-                        logger.debug(f"Progress message not modified: {e}")
 
-                    else:
+async def announce_set_time_callback(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
 
-                        logger.warning(f"Failed to edit progress message: {e}")
+    choice = update.callback_query.data.replace("announce_time_", "")
 
-            time.sleep(0.1)
+    if choice == "now":
 
-        except Exception as e:
+        context.user_data.pop("announce_send_at", None)
 
-            logger.error(f"Розсилка: Не вдалося {user_id}: {e}")
+    elif choice != "back":
 
-            failed_count += 1
+        context.user_data["announce_send_at"] = datetime.fromtimestamp(
+            int(choice), KYIV_TZ
+        ).isoformat()
 
-            add_to_dlq(user_id, announcement_text, str(e))
+    return await admin_announce_start_handler(update, context)
 
-            dlq_added_count += 1
 
-            if (idx + 1) % PROGRESS_UPDATE_INTERVAL == 0 or (idx + 1) == total_users:
+async def announce_typed_time_handler(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
 
-                try:
+    send_at = parse_announcement_send_time(update.message.text)
 
-                    await progress_message.edit_text(
-                        f"Розсилка для {total_users} ({target_description})... {sent_count}/{total_users} надіслано. Невдачі: {failed_count}. Додано в DLQ: {dlq_added_count}."
-                    )
+    if send_at is None:
 
-                except telegram.error.BadRequest as e:
+        await update.message.reply_text(
+            "Не вдалося розпізнати час або він уже минув. Формат: ДД.ММ.РРРР ГГ:ХХ"
+        )
 
-                    if "Message is not modified" in str(e):
+        return ANNOUNCE_SELECT_SEND_TIME
 
-                        logger.debug(f"Progress message not modified on failure: {e}")
+    context.user_data["announce_send_at"] = send_at.isoformat()
 
-                    else:
+    return await admin_announce_start_handler(update, context)
 
-                        logger.warning(f"Failed to edit progress message on failure: {e}")
 
-    summary_text = (
-        f"Розсилку завершено.\nЦіль: {target_description}\n✅ Відправлено: {sent_count}\n"
-        f"❌ Невдало: {failed_count}\n📬 Додано в DLQ: {dlq_added_count}"
-    )
+async def admin_scheduled_announcements_handler(
+    update: Update, context: ContextTypes.DEFAULT_TYPE
+) -> None:
+    """Список відкладених оголошень зі скасуванням (редагування - /edit_announcement)."""
 
-    await update.message.reply_text(summary_text, reply_markup=get_admin_panel_keyboard())
+    query = update.callback_query
 
-    logger.info(f"Адмін {update.effective_user.id} розіслав '{announcement_text}'. {summary_text}")
+    user_id = update.effective_user.id
 
-    context.user_data.clear()
+    if user_id not in ADMIN_USER_IDS:
 
-    return ConversationHandler.END
+        if query:
+            await query.answer("Доступ заборонено.", show_alert=True)
 
+        return
 
-async def announce_cancel_handler(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
+    data = query.data if query else ""
 
-    query = update.callback_query
+    if data.startswith("sann_cancel_"):
 
-    await query.answer()
+        announcement_id = int(data.replace("sann_cancel_", ""))
 
-    context.user_data.clear()
+        announcement = get_scheduled_announcement(announcement_id)
 
-    await query.edit_message_text(
-        "Створення оголошення скасовано.", reply_markup=get_admin_panel_keyboard()
-    )
+        if announcement and announcement["status"] == "scheduled":
 
-    return ConversationHandler.END
+            update_scheduled_announcement(announcement_id, status="cancelled")
 
+            unschedule_announcement_job(context.job_queue, announcement_id)
 
-async def announce_command_handler(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+            logger.info(f"Адмін {user_id}: відкладене оголошення #{announcement_id} скасовано.")
 
-    if update.effective_user.id not in ADMIN_USER_IDS:
+    announcements = get_scheduled_announcements(limit=10)
 
-        await update.message.reply_text("Доступ заборонено.")
+    text = "*🕒 Заплановані оголошення*\n\n"
 
-        return
+    keyboard = []
 
-    update_command_stats("/announce")
+    if not announcements:
 
-    if not context.args:
+        text += "_Відкладених оголошень ще не було._\n"
 
-        await update.message.reply_text(
-            "Використовуйте кнопку 'Оголошення' або /announce ТЕКСТ.",
-            reply_markup=get_admin_panel_keyboard(),
-        )
+    for announcement in announcements:
 
-        return
+        status_display = SCHEDULED_ANNOUNCEMENT_STATUS_DISPLAY.get(
+            announcement["status"], announcement["status"]
+        )
 
-    announcement_text = " ".join(context.args)
+        preview = (announcement["message_text"] or "").replace("\n", " ")[:40]
 
-    all_user_ids = list(get_all_user_ids_from_db())
+        text += (
+            f"*#{announcement['id']}* {status_display} - "
+            f"{format_announcement_send_time(announcement['send_at'])}, "
+            f"{announcement['target_description']}\n"
+            f"   {escape_markdown(preview)}\n"
+        )
 
-    total_users = len(all_user_ids)
+        if announcement["status"] == "scheduled":
 
-    if not all_user_ids:
+            keyboard.append(
+                [
+                    InlineKeyboardButton(
+                        f"✖️ Скасувати #{announcement['id']}",
+                        callback_data=f"sann_cancel_{announcement['id']}",
+                    )
+                ]
+            )
 
-        await update.message.reply_text("Немає користувачів для розсилки.")
+    text += (
+        "\nРедагування: `/edit_announcement ID час ДД.ММ.РРРР ГГ:ХХ` або "
+        "`/edit_announcement ID текст НОВИЙ ТЕКСТ`"
+    )
 
-        return
+    keyboard.append(
+        [InlineKeyboardButton("🔄 Оновити", callback_data="admin_scheduled_announcements")]
+    )
 
-    progress_message = await update.message.reply_text(
-        f"Розпочинаю розсилку (всім) для {total_users} користувачів... 0/{total_users} надіслано."
+    keyboard.append(
+        [InlineKeyboardButton("⬅️ Назад до адмін-панелі", callback_data="show_admin_panel")]
     )
 
-    sent_count, failed_count, dlq_added_count = 0, 0, 0
+    try:
+
+        await query.edit_message_text(
+            text, reply_markup=InlineKeyboardMarkup(keyboard), parse_mode="Markdown"
+        )
 
-    full_message_to_send = f"📢 ОГОЛОШЕННЯ 📢\n\n{announcement_text}"
+    except telegram.error.BadRequest as e:
 
-    for idx, user_id in enumerate(all_user_ids):
+        if "Message is not modified" not in str(e):
 
-        try:
+            raise
 
-            await context.bot.send_message(chat_id=user_id, text=full_message_to_send)
 
-            sent_count += 1
+async def edit_announcement_command_handler(
+    update: Update, context: ContextTypes.DEFAULT_TYPE
+) -> None:
+    """/edit_announcement ID час ДД.ММ.РРРР ГГ:ХХ | /edit_announcement ID текст НОВИЙ ТЕКСТ"""
 
-            if (idx + 1) % PROGRESS_UPDATE_INTERVAL == 0 or (idx + 1) == total_users:
+    update_command_stats("/edit_announcement")
 
-                try:
+    usage_text = (
+        "Використання:\n/edit_announcement ID час ДД.ММ.РРРР ГГ:ХХ\n"
+        "/edit_announcement ID текст НОВИЙ ТЕКСТ"
+    )
 
-                    await progress_message.edit_text(
-                        f"Розсилка (всім) для {total_users} користувачів... {sent_count}/{total_users} надіслано. Невдачі: {failed_count}."
-                    )
+    if len(context.args) < 3 or not context.args[0].isdigit():
 
-                except telegram.error.BadRequest as e:
+        await update.message.reply_text(usage_text)
 
-                    if "Message is not modified" in str(e):
+        return
+
+    announcement_id = int(context.args[0])
+
+    field = context.args[1].lower()
+
+    announcement = get_scheduled_announcement(announcement_id)
+
+    if not announcement or announcement["status"] != "scheduled":
+
+        await update.message.reply_text(
+            f"Відкладене оголошення #{announcement_id} не знайдено або вже відправлено/скасовано."
+        )
 
-                        logger.debug(f"Progress message not modified: {e}")
+        return
 
-                    else:
+    if field == "час":
 
-                        logger.warning(f"Failed to edit progress message: {e}")
+        send_at = parse_announcement_send_time(" ".join(context.args[2:]))
 
-            time.sleep(0.1)
+        if send_at is None:
 
-        except Exception as e:
+            await update.message.reply_text(
+                "Не вдалося розпізнати час або він уже минув. Формат: ДД.ММ.РРРР ГГ:ХХ"
+            )
 
-            logger.error(f"Розсилка (команда): Не вдалося {user_id}: {e}")
+            return
 
-            failed_count += 1
+        update_scheduled_announcement(announcement_id, send_at=send_at)
 
-            add_to_dlq(user_id, announcement_text, str(e))
+        schedule_announcement_job(context.job_queue, get_scheduled_announcement(announcement_id))
 
-            dlq_added_count += 1
+        result_text = f"перенесено на {format_announcement_send_time(send_at)}"
 
-            if (idx + 1) % PROGRESS_UPDATE_INTERVAL == 0 or (idx + 1) == total_users:
+    elif field == "текст":
 
-                try:
+        # Беремо текст повідомлення повністю, щоб зберегти переноси рядків
 
-                    await progress_message.edit_text(
-                        f"Розсилка (всім) для {total_users} користувачів... {sent_count}/{total_users} надіслано. Невдачі: {failed_count}. Додано в DLQ: {dlq_added_count}."
-                    )
+        new_text = update.message.text.split(maxsplit=3)[3]
 
-                except telegram.error.BadRequest as e:
+        update_scheduled_announcement(announcement_id, message_text=new_text)
 
-                    if "Message is not modified" in str(e):
+        result_text = "текст оновлено"
 
-                        logger.debug(f"Progress message not modified on failure: {e}")
+    else:
 
-                    else:
+        await update.message.reply_text(usage_text)
 
-                        logger.warning(f"Failed to edit progress message on failure: {e}")
+        return
 
-    summary_text = (
-        f"Розсилку (команда) завершено.\n✅ Відправлено: {sent_count}\n"
-        f"❌ Невдало: {failed_count}\n📬 Додано в DLQ: {dlq_added_count}"
+    logger.info(
+        f"Адмін {update.effective_user.id}: відкладене оголошення #{announcement_id} - {result_text}."
     )
 
-    await update.message.reply_text(summary_text)
-
-    logger.info(f"Адмін {update.effective_user.id} розіслав '{announcement_text}'. {summary_text}")
+    await update.message.reply_text(f"🕒 Оголошення #{announcement_id}: {result_text}.")
 
 
 async def view_dlq_handler(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
@@ -7896,16 +13583,44 @@ async def view_dlq_handler(update: Update, context: ContextTypes.DEFAULT_TYPE) -
 
     has_records = False
 
+    class_counts = get_dlq_class_counts()
+
+    counts_text = "*📊 DLQ за класами помилок:*\n"
+
+    for error_class, class_label in (
+        (DLQ_CLASS_TRANSIENT, "⏳ Тимчасові"),
+        (DLQ_CLASS_PERMANENT, "🚫 Постійні"),
+        (DLQ_CLASS_PAYLOAD, "📝 Помилки вмісту"),
+    ):
+
+        counts_text += (
+            f"{class_label}: в черзі {class_counts.get((error_class, 'new'), 0)}, "
+            f"доставлено {class_counts.get((error_class, 'processed'), 0)}, "
+            f"dead {class_counts.get((error_class, 'dead'), 0)}\n"
+        )
+
+    counts_text += "\n"
+
     try:
 
-        with sqlite3.connect(DATABASE_NAME) as conn:
+        with connect_db() as conn:
 
             conn.row_factory = sqlite3.Row
 
             cursor = conn.cursor()
 
             cursor.execute(
-                "SELECT id, user_id, SUBSTR(message_text, 1, 25) || '...' AS short_msg, error_message, failed_at, status FROM dead_letter_queue WHERE status = 'new' ORDER BY failed_at DESC LIMIT 10"
+                """
+
+                SELECT d.id, d.user_id, SUBSTR(COALESCE(b.message_text, d.message_text), 1, 25) || '...' AS short_msg,
+
+                       d.error_message, d.failed_at, d.status, d.error_class, d.attempts
+
+                FROM dead_letter_queue d LEFT JOIN broadcasts b ON b.id = d.broadcast_id
+
+                WHERE d.status = 'new' ORDER BY d.failed_at DESC LIMIT 10
+
+            """
             )
 
             for row in cursor.fetchall():
@@ -7934,12 +13649,15 @@ async def view_dlq_handler(update: Update, context: ContextTypes.DEFAULT_TYPE) -
 
                 response_text += (
                     f"`ID: {row['id']}` | `User: {row['user_id']}` | `{failed_at_str}`\n"
-                    f"Msg: `{row['short_msg']}`\nError: `{row['error_message']}` (`{row['status']}`)\n---\n"
+                    f"Msg: `{row['short_msg']}`\nError: `{row['error_message']}` (`{row['status']}`, "
+                    f"`{row['error_class']}`, спроб: {row['attempts']})\n---\n"
                 )
 
         if not has_records:
             response_text = "DLQ порожня або немає нових записів. 👍"
 
+        response_text = counts_text + response_text
+
     except sqlite3.Error as e:
 
         logger.error(f"DLQ: Помилка читання: {e}")
@@ -7985,12 +13703,17 @@ async def admin_clear_dlq_handler(update: Update, context: ContextTypes.DEFAULT_
 
     deleted_processed = clear_dlq(status="processed", older_than_days=0)
 
-    if deleted_new >= 0 and deleted_processed >= 0:
+    # Видаляємо остаточно недоставлені записи старше 30 днів
+
+    deleted_dead = clear_dlq(status="dead", older_than_days=30)
+
+    if deleted_new >= 0 and deleted_processed >= 0 and deleted_dead >= 0:
 
         response_text = (
             f"✅ DLQ очищено!\n"
             f"Видалено нових записів (старше 30 днів): {deleted_new}\n"
-            f"Видалено оброблених записів: {deleted_processed}"
+            f"Видалено оброблених записів: {deleted_processed}\n"
+            f"Видалено недоставлених (dead) записів (старше 30 днів): {deleted_dead}"
         )
 
     else:
@@ -8006,6 +13729,29 @@ async def admin_clear_dlq_handler(update: Update, context: ContextTypes.DEFAULT_
     )
 
 
+def get_render_cache_stats_formatted() -> str:
+    """Статистика влучань у кеш рендерів розкладу (з моменту запуску бота)."""
+
+    text = (
+        f"\n*⚡ Кеш рендерів розкладу* (версія {schedule_cache_version}, "
+        f"{len(schedule_render_cache)} записів):\n"
+    )
+
+    if not schedule_render_stats:
+
+        return text + "_Запитів ще не було._\n"
+
+    for view, stats in sorted(schedule_render_stats.items()):
+
+        total = stats["hits"] + stats["misses"]
+
+        hit_ratio = stats["hits"] / total if total else 0
+
+        text += f"  • `{view}`: {stats['hits']}/{total} з кешу ({hit_ratio:.0%})\n"
+
+    return text
+
+
 async def show_stats_handler(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
 
     user_id_effective = update.effective_user.id
@@ -8022,9 +13768,11 @@ async def show_stats_handler(update: Update, context: ContextTypes.DEFAULT_TYPE)
 
     response_text = "*📊 Статистика використання бота:*\n\n"
 
+    flush_stats_buffers()
+
     try:
 
-        with sqlite3.connect(DATABASE_NAME) as conn:
+        with connect_db() as conn:
 
             cursor = conn.cursor()
 
@@ -8119,75 +13867,399 @@ async def show_stats_handler(update: Update, context: ContextTypes.DEFAULT_TYPE)
 
         response_text = "Помилка завантаження статистики."
 
+    # Розпакування і злиття скетчів за 30 днів - у фоновому потоці, не в циклі подій
+
+    response_text += await asyncio.to_thread(get_active_users_stats_formatted)
+
+    response_text += get_render_cache_stats_formatted()
+
+    reply_markup = get_back_to_admin_panel_keyboard()
+
+    if update.callback_query:
+
+        await update.callback_query.edit_message_text(
+            response_text, reply_markup=reply_markup, parse_mode="Markdown"
+        )
+
+    elif update.message:
+
+        update_command_stats("/stats")
+
+        await update.message.reply_text(
+            response_text, reply_markup=reply_markup, parse_mode="Markdown"
+        )
+
+
+async def admin_schedule_conflicts_handler(
+    update: Update, context: ContextTypes.DEFAULT_TYPE
+) -> None:
+    """Показує накладки викладачів та аудиторій, знайдені при завантаженні розкладу."""
+
+    user_id = update.effective_user.id
+
+    if user_id not in ADMIN_USER_IDS:
+
+        if update.callback_query:
+            await update.callback_query.answer("Доступ заборонено.", show_alert=True)
+
+        elif update.message:
+            await update.message.reply_text("Доступ заборонено.")
+
+        return
+
+    response_text = get_schedule_conflicts_formatted()
+
+    reply_markup = get_back_to_admin_panel_keyboard()
+
+    if update.callback_query:
+
+        await update.callback_query.edit_message_text(
+            response_text, reply_markup=reply_markup, parse_mode="Markdown"
+        )
+
+    elif update.message:
+
+        update_command_stats("/schedule_conflicts")
+
+        await update.message.reply_text(
+            response_text, reply_markup=reply_markup, parse_mode="Markdown"
+        )
+
+
+async def admin_clear_cache_handler(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+
+    query = update.callback_query
+
+    if query.from_user.id not in ADMIN_USER_IDS:
+
+        await query.answer("Недостатньо прав!", show_alert=True)
+
+        return
+
+    clear_schedule_cache_data()
+
+    get_cached_schedule()
+
+    await query.answer(
+        "Кеш розкладу в пам'яті очищено. Наступний запит оновить його з БД.", show_alert=True
+    )
+
+    logger.info(f"Адмін {query.from_user.id} очистив кеш розкладу в пам'яті.")
+
+
+async def server_status_handler(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+
+    user_id_effective = update.effective_user.id
+
+    if user_id_effective not in ADMIN_USER_IDS:
+
+        if update.callback_query:
+            await update.callback_query.answer("Доступ заборонено.", show_alert=True)
+
+        elif update.message:
+            await update.message.reply_text("Доступ заборонено.")
+
+        return
+
+    status_text = get_server_status_text()
+
     reply_markup = get_back_to_admin_panel_keyboard()
 
     if update.callback_query:
 
-        await update.callback_query.edit_message_text(
-            response_text, reply_markup=reply_markup, parse_mode="Markdown"
-        )
+        await update.callback_query.edit_message_text(
+            status_text, reply_markup=reply_markup, parse_mode="Markdown"
+        )
+
+    elif update.message:
+
+        update_command_stats("/server_status")
+
+        await update.message.reply_text(
+            status_text, reply_markup=reply_markup, parse_mode="Markdown"
+        )
+
+
+def estimate_median_from_buckets(bucket_counts: dict[int, int]) -> float | None:
+    """Медіана за гістограмою (лінійна інтерполяція всередині кошика)."""
+
+    total = sum(bucket_counts.values())
+
+    if not total:
+
+        return None
+
+    target = total / 2
+
+    cumulative = 0
+
+    lower_bound = 0
+
+    for bound in sorted(bucket_counts):
+
+        count = bucket_counts[bound]
+
+        if count and cumulative + count >= target:
+
+            return lower_bound + (bound - lower_bound) * (target - cumulative) / count
+
+        cumulative += count
+
+        lower_bound = bound
+
+    return float(lower_bound)
+
+
+def format_duration_short(seconds: float) -> str:
+
+    if seconds < 60:
+
+        return f"{seconds:.0f} с"
+
+    if seconds < 3600:
+
+        return f"{int(seconds // 60)} хв {int(seconds % 60)} с"
+
+    return f"{int(seconds // 3600)} год {int(seconds % 3600 // 60)} хв"
+
+
+def get_registration_funnel_report_text(days: int) -> str:
+    """Звіт воронки реєстрації за когортами останніх days днів."""
+
+    flush_stats_buffers()
+
+    since_day = get_activity_day(time.time() - (days - 1) * 86400)
+
+    try:
+
+        with connect_db() as conn:
+
+            step_rows = conn.execute(
+                "SELECT day, step, count FROM registration_funnel WHERE day >= ?", (since_day,)
+            ).fetchall()
+
+            duration_rows = conn.execute(
+                "SELECT bucket_seconds, SUM(count) FROM registration_funnel_durations "
+                "WHERE day >= ? GROUP BY bucket_seconds",
+                (since_day,),
+            ).fetchall()
+
+    except sqlite3.Error as e:
+
+        logger.error(f"Воронка: Помилка читання: {e}")
+
+        return "Помилка завантаження воронки реєстрації."
+
+    totals = {step: 0 for step in REGISTRATION_FUNNEL_STEPS}
+
+    per_day: dict[str, dict[str, int]] = {}
+
+    for day, step, count in step_rows:
+
+        if step in totals:
+
+            totals[step] += count
+
+            per_day.setdefault(day, {})[step] = count
+
+    text = f"🪜 *Воронка реєстрації* (когорти за {days} дн.)\n\n"
+
+    first_count = totals[REGISTRATION_FUNNEL_STEPS[0]]
+
+    previous_count = None
+
+    for step in REGISTRATION_FUNNEL_STEPS:
+
+        count = totals[step]
+
+        text += f"*{REGISTRATION_FUNNEL_STEP_LABELS[step]}:* {count}"
+
+        if previous_count:
+
+            text += f" ({count / previous_count:.0%} від попереднього"
+
+            text += f", {count / first_count:.0%} від старту)" if first_count else ")"
+
+        text += "\n"
+
+        previous_count = count
+
+    median_seconds = estimate_median_from_buckets(dict(duration_rows))
+
+    text += (
+        f"\n⏱ *Медіана часу до завершення:* {format_duration_short(median_seconds)}\n"
+        if median_seconds is not None
+        else "\n⏱ *Медіана часу до завершення:* немає завершених реєстрацій\n"
+    )
+
+    if per_day:
+
+        first_step, last_step = REGISTRATION_FUNNEL_STEPS[0], REGISTRATION_FUNNEL_STEPS[-1]
+
+        text += "\n*По днях (старт → група):*\n"
+
+        for day in sorted(per_day, reverse=True):
+
+            started = per_day[day].get(first_step, 0)
+
+            completed = per_day[day].get(last_step, 0)
+
+            conversion = f"{completed / started:.0%}" if started else "-"
+
+            text += f"  • {day}: {started} → {completed} ({conversion})\n"
+
+    return text
+
+
+async def admin_funnel_report_command_handler(
+    update: Update, context: ContextTypes.DEFAULT_TYPE
+) -> None:
+    """/funnel [ДНІВ] - конверсія кроків реєстрації роль → курс → група."""
+
+    update_command_stats("/funnel")
+
+    days = int(context.args[0]) if context.args and context.args[0].isdigit() else 7
+
+    days = max(1, min(days, REGISTRATION_FUNNEL_MAX_DAYS))
+
+    await update.message.reply_text(
+        get_registration_funnel_report_text(days), parse_mode="Markdown"
+    )
+
+
+async def admin_traces_command_handler(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+    """/traces [N] - N найповільніших trace'ів оновлень (текст + JSON-файл)."""
+
+    update_command_stats("/traces")
+
+    limit = int(context.args[0]) if context.args and context.args[0].isdigit() else 5
+
+    limit = max(1, min(limit, TRACES_MAX_LIMIT))
+
+    traces = get_slowest_traces(limit)
+
+    if not traces:
+
+        await update.message.reply_text(
+            f"Trace'ів ще немає (вибірка {TRACE_SAMPLE_RATE:.0%} оновлень). Спробуйте пізніше."
+        )
+
+        return
+
+    text = (
+        f"🐢 *Найповільніші оновлення* ({len(traces)} з {len(completed_traces)}, "
+        f"вибірка {TRACE_SAMPLE_RATE:.0%}):\n\n"
+    )
+
+    for trace in traces:
+
+        spans_summary = ", ".join(
+            f"{kind} {count}× {total_ms:.0f} мс"
+            for kind, (count, total_ms) in sorted(
+                summarize_trace_spans(trace).items(), key=lambda item: -item[1][1]
+            )
+        )
+
+        text += (
+            f"• `{trace.name}` - *{trace.duration * 1000:.0f} мс*"
+            f"{' ⚠️ ' + trace.error if trace.error else ''}\n"
+            f"  `{spans_summary or 'без span-ів'}`\n"
+        )
+
+    await update.message.reply_text(text, parse_mode="Markdown")
+
+    await update.message.reply_document(
+        document=export_traces_json(traces).encode("utf-8"),
+        filename=f"traces_{datetime.now(KYIV_TZ).strftime('%Y%m%d_%H%M%S')}.json",
+    )
+
+
+async def admin_profile_command_handler(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+    """/profile СЕКУНДИ [mem] - cProfile (і tracemalloc) живого трафіку, звіт надходить файлом."""
+
+    global active_profiling_session
+
+    update_command_stats("/profile")
+
+    if not context.args or not context.args[0].isdigit():
+
+        await update.message.reply_text(
+            f"Використання: /profile СЕКУНДИ [mem]\n(1-{PROFILE_MAX_SECONDS} с; mem - ще й tracemalloc)"
+        )
+
+        return
+
+    if active_profiling_session is not None:
+
+        await update.message.reply_text("⏳ Профілювання вже триває, дочекайтесь звіту.")
+
+        return
 
-    elif update.message:
+    seconds = max(1, min(int(context.args[0]), PROFILE_MAX_SECONDS))
 
-        update_command_stats("/stats")
+    with_memory = len(context.args) > 1 and context.args[1].lower() in ("mem", "memory", "пам'ять")
 
-        await update.message.reply_text(
-            response_text, reply_markup=reply_markup, parse_mode="Markdown"
-        )
+    session = ProfilingSession(with_memory=with_memory)
 
+    try:
 
-async def admin_clear_cache_handler(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+        session.start()
 
-    query = update.callback_query
+    except ValueError as e:
 
-    if query.from_user.id not in ADMIN_USER_IDS:
+        logger.warning(f"Профілювання: не вдалося запустити cProfile: {e}")
 
-        await query.answer("Недостатньо прав!", show_alert=True)
+        await update.message.reply_text(f"❌ Не вдалося запустити профайлер: {e}")
 
         return
 
-    clear_schedule_cache_data()
+    active_profiling_session = session
 
-    get_cached_schedule()
+    context.job_queue.run_once(
+        profile_finish_job_callback,
+        when=timedelta(seconds=seconds),
+        name=PROFILE_JOB_NAME,
+        data={"chat_id": update.effective_chat.id},
+    )
 
-    await query.answer(
-        "Кеш розкладу в пам'яті очищено. Наступний запит оновить його з БД.", show_alert=True
+    logger.info(
+        f"Профілювання: адмін {update.effective_user.id} запустив на {seconds} с"
+        f"{' з tracemalloc' if with_memory else ''}."
     )
 
-    logger.info(f"Адмін {query.from_user.id} очистив кеш розкладу в пам'яті.")
+    await update.message.reply_text(
+        f"🔬 Профілюю {seconds} с{' (з tracemalloc)' if with_memory else ''}. Звіт надішлю файлом."
+    )
 
 
-async def server_status_handler(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+async def profile_finish_job_callback(context: ContextTypes.DEFAULT_TYPE) -> None:
+    """Зупиняє профілювання, запущене /profile, і надсилає звіт адміну."""
 
-    user_id_effective = update.effective_user.id
+    global active_profiling_session
 
-    if user_id_effective not in ADMIN_USER_IDS:
+    session = active_profiling_session
 
-        if update.callback_query:
-            await update.callback_query.answer("Доступ заборонено.", show_alert=True)
+    active_profiling_session = None
 
-        elif update.message:
-            await update.message.reply_text("Доступ заборонено.")
+    if session is None:
 
         return
 
-    status_text = get_server_status_text()
-
-    reply_markup = get_back_to_admin_panel_keyboard()
+    report = session.stop()
 
-    if update.callback_query:
+    try:
 
-        await update.callback_query.edit_message_text(
-            status_text, reply_markup=reply_markup, parse_mode="Markdown"
+        await context.bot.send_document(
+            chat_id=context.job.data["chat_id"],
+            document=report.encode("utf-8"),
+            filename=f"profile_{datetime.now(KYIV_TZ).strftime('%Y%m%d_%H%M%S')}.txt",
+            caption="🔬 Звіт профілювання: топ функцій за часом"
+            + (" та місця виділення пам'яті." if session.with_memory else "."),
         )
 
-    elif update.message:
-
-        update_command_stats("/server_status")
+    except Exception as e:
 
-        await update.message.reply_text(
-            status_text, reply_markup=reply_markup, parse_mode="Markdown"
-        )
+        logger.error(f"Профілювання: не вдалося надіслати звіт: {e}")
 
 
 async def admin_upload_db_to_ftp_handler(
@@ -8375,10 +14447,16 @@ async def admin_reload_schedule_from_json_handler(
 
         get_cached_schedule()
 
-        await context.bot.send_message(
-            chat_id=user_id_to_send_to,
-            text=f"✅ Розклад успішно перезавантажено з файлу {SCHEDULE_JSON_SOURCE_FILE}.",
-        )
+        reload_report = f"✅ Розклад успішно перезавантажено з файлу {SCHEDULE_JSON_SOURCE_FILE}."
+
+        if schedule_conflicts:
+
+            reload_report += (
+                f"\n\n⚠️ Виявлено конфліктів у розкладі: {len(schedule_conflicts)}. "
+                "Деталі: /schedule_conflicts"
+            )
+
+        await context.bot.send_message(chat_id=user_id_to_send_to, text=reload_report)
 
         logger.info(f"Розклад успішно перезавантажено адміном {user_id_to_send_to}.")
 
@@ -8642,10 +14720,6 @@ def download_db_from_ftp():
 
 async def show_raffle_info_handler(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
 
-    if await check_maintenance_and_reply(update, context):
-
-        return ConversationHandler.END
-
     query = update.callback_query
 
     user_id = query.from_user.id
@@ -8928,23 +15002,20 @@ async def admin_pick_raffle_winner(update: Update, context: ContextTypes.DEFAULT
 
     await message_target.reply_text("Шукаю учасників розіграшу, які відповідають умовам...")
 
-    eligible_participants = []
-
-    try:
-
-        with sqlite3.connect(DATABASE_NAME) as conn:
+    # Резервуарна вибірка: учасників читаємо пакетами, у пам'яті лише поточний переможець
 
-            conn.row_factory = sqlite3.Row
+    eligible_count = 0
 
-            cursor = conn.cursor()
+    winner = None
 
-            cursor.execute(
-                "SELECT user_id, username, first_name, referred_count FROM users WHERE is_raffle_participant = TRUE AND referred_count >= 1"
-            )
+    try:
 
-            for row in cursor.fetchall():
+        for rows in iter_user_rows_chunks(
+            "is_raffle_participant = TRUE AND referred_count >= 1",
+            columns="user_id, username, first_name, referred_count",
+        ):
 
-                user_id = row["user_id"]
+            for user_id, username, first_name, referred_count in rows:
 
                 try:
 
@@ -8954,7 +15025,16 @@ async def admin_pick_raffle_winner(update: Update, context: ContextTypes.DEFAULT
 
                     if chat_member.status in ["member", "administrator", "creator"]:
 
-                        eligible_participants.append(dict(row))
+                        eligible_count += 1
+
+                        if random.randrange(eligible_count) == 0:
+
+                            winner = {
+                                "user_id": user_id,
+                                "username": username,
+                                "first_name": first_name,
+                                "referred_count": referred_count,
+                            }
 
                     else:
 
@@ -8979,7 +15059,7 @@ async def admin_pick_raffle_winner(update: Update, context: ContextTypes.DEFAULT
 
         return
 
-    if not eligible_participants:
+    if winner is None:
 
         await message_target.reply_text(
             "😔 Немає учасників, які відповідають всім умовам розіграшу (підписка на канал та запрошення друга).",
@@ -8988,7 +15068,7 @@ async def admin_pick_raffle_winner(update: Update, context: ContextTypes.DEFAULT
 
         return
 
-    winner = random.choice(eligible_participants)
+    logger.info(f"Розіграш: {eligible_count} учасників відповідають умовам.")
 
     winner_username = f"@{winner['username']}" if winner["username"] else "не вказано"
 
@@ -9042,13 +15122,13 @@ async def button_callback_handler(update: Update, context: ContextTypes.DEFAULT_
 
     answered_key = f"answered_query_{query.id}"
 
-    if not context.user_data.get(answered_key):
+    if not get_transient_state(context.user_data, answered_key):
 
         try:
 
             await query.answer()
 
-            context.user_data[answered_key] = True
+            set_transient_state(context.user_data, answered_key, True, CALLBACK_ANSWERED_TTL_SECONDS)
 
         except Exception as e:
 
@@ -9056,34 +15136,6 @@ async def button_callback_handler(update: Update, context: ContextTypes.DEFAULT_
                 f"Не вдалося відповісти на callback '{data}' (можливо, вже відповіли): {e}"
             )
 
-    admin_callbacks = [
-        "show_admin_panel",
-        "admin_maintenance_menu",
-        "admin_announce_start",
-        "admin_server_status",
-        "view_dlq_callback",
-        "admin_show_stats",
-        "admin_clear_schedule_cache",
-        "admin_upload_db_to_ftp",
-        "admin_download_local_db",
-        "admin_reload_schedule_json",
-        "admin_pick_raffle_winner",
-        "admin_clear_dlq",
-    ]
-
-    is_admin_action_button = data in admin_callbacks and user_id in ADMIN_USER_IDS
-
-    is_maint_disable_action = data == "maint_disable_now" and user_id in ADMIN_USER_IDS
-
-    if not (is_admin_action_button or is_maint_disable_action):
-
-        if await check_maintenance_and_reply(update, context):
-
-            if context.user_data.get(answered_key):
-                del context.user_data[answered_key]
-
-            return
-
     update_command_stats(f"button_{data}")
 
     logger.info(
@@ -9102,6 +15154,9 @@ async def button_callback_handler(update: Update, context: ContextTypes.DEFAULT_
     elif data == "get_call_schedule":
         await call_schedule_handler(update, context)
 
+    elif data == "get_schedule_now":
+        await now_next_lesson_handler(update, context)
+
     elif data == "get_full_schedule_all":
         await full_schedule_handler(update, context)
 
@@ -9124,6 +15179,10 @@ async def button_callback_handler(update: Update, context: ContextTypes.DEFAULT_
 
         await show_schedule_for_day_handler(update, context, data)
 
+    elif data == "export_ics_group" or data.startswith("export_ics_teacher_"):
+
+        await export_ics_handler(update, context)
+
     elif data == "show_donation_info":
         await donation_info_handler(update, context)
 
@@ -9226,6 +15285,9 @@ async def button_callback_handler(update: Update, context: ContextTypes.DEFAULT_
     elif data.startswith("t_menu_"):
         await teacher_my_schedule_handler(update, context)
 
+    elif data.startswith("ft_"):
+        await find_teacher_result_handler(update, context)
+
     elif data == "show_admin_panel" and user_id in ADMIN_USER_IDS:
         await admin_panel_handler(update, context)
 
@@ -9241,6 +15303,17 @@ async def button_callback_handler(update: Update, context: ContextTypes.DEFAULT_
     elif data == "admin_clear_schedule_cache" and user_id in ADMIN_USER_IDS:
         await admin_clear_cache_handler(update, context)
 
+    elif data == "admin_schedule_conflicts" and user_id in ADMIN_USER_IDS:
+        await admin_schedule_conflicts_handler(update, context)
+
+    elif (data == "admin_broadcast_jobs" or data.startswith("bjob_")) and user_id in ADMIN_USER_IDS:
+        await admin_broadcast_jobs_handler(update, context)
+
+    elif (
+        data == "admin_scheduled_announcements" or data.startswith("sann_cancel_")
+    ) and user_id in ADMIN_USER_IDS:
+        await admin_scheduled_announcements_handler(update, context)
+
     elif data == "admin_reload_schedule_json" and user_id in ADMIN_USER_IDS:
         await admin_reload_schedule_from_json_handler(update, context)
 
@@ -9414,7 +15487,7 @@ async def admin_teacher_gen_otp_select_teacher(
 
     keyboard_buttons = []
 
-    with sqlite3.connect(DATABASE_NAME) as conn:
+    with connect_db() as conn:
 
         all_teachers = (
             conn.cursor()
@@ -9478,7 +15551,7 @@ async def admin_teacher_generate_and_show_otp(
 
     teacher_id = context.user_data["otp_teacher_id"]
 
-    with sqlite3.connect(DATABASE_NAME) as conn:
+    with connect_db() as conn:
 
         teacher_name = (
             conn.cursor()
@@ -9513,7 +15586,7 @@ async def admin_teacher_view_list_handler(
 
     text = "📋 *Список зареєстрованих викладачів:*\n\n"
 
-    with sqlite3.connect(DATABASE_NAME) as conn:
+    with connect_db() as conn:
 
         teachers = (
             conn.cursor()
@@ -9552,7 +15625,7 @@ async def admin_teacher_edit_select_handler(
 
     keyboard_buttons = []
 
-    with sqlite3.connect(DATABASE_NAME) as conn:
+    with connect_db() as conn:
 
         teachers = (
             conn.cursor()
@@ -9617,7 +15690,7 @@ async def admin_teacher_edit_menu_handler(
 
     context.user_data["edit_teacher_id"] = teacher_id
 
-    with sqlite3.connect(DATABASE_NAME) as conn:
+    with connect_db() as conn:
 
         row = (
             conn.cursor()
@@ -9797,7 +15870,7 @@ async def admin_teacher_gen_otp_for_all_handler(
 
     try:
 
-        with sqlite3.connect(DATABASE_NAME) as conn:
+        with connect_db() as conn:
 
             # Вибираємо тільки тих викладачів, у яких немає прив'язаного user_id
 
@@ -9867,6 +15940,7 @@ manage_teachers_conv_handler = ConversationHandler(
         CallbackQueryHandler(admin_manage_teachers_handler, pattern="^admin_manage_teachers$")
     ],
     states={
+        ConversationHandler.TIMEOUT: conversation_timeout_handlers("manage_teachers"),
         ADMIN_TEACHER_MENU: [
             CallbackQueryHandler(admin_teacher_add_prompt_name, pattern="^teacher_admin_add$"),
             CallbackQueryHandler(
@@ -9925,6 +15999,9 @@ manage_teachers_conv_handler = ConversationHandler(
     ],
     per_user=True,
     allow_reentry=True,
+    conversation_timeout=CONVERSATION_TIMEOUT_SECONDS,
+    name="manage_teachers",
+    persistent=True,
 )
 
 
@@ -9937,6 +16014,7 @@ teacher_login_conv_handler = ConversationHandler(
         CallbackQueryHandler(select_teacher_role_callback_handler, pattern="^select_role_teacher$")
     ],
     states={
+        ConversationHandler.TIMEOUT: conversation_timeout_handlers("teacher_login"),
         TYPING_ONE_TIME_PASSWORD: [
             MessageHandler(filters.TEXT & ~filters.COMMAND, handle_teacher_otp_entry)
         ],
@@ -9948,13 +16026,186 @@ teacher_login_conv_handler = ConversationHandler(
     ],
     per_user=True,
     allow_reentry=True,
+    conversation_timeout=CONVERSATION_TIMEOUT_SECONDS,
+    name="teacher_login",
+    persistent=True,
+)
+
+
+# --- Метрики Prometheus ---
+
+CACHE_REQUESTS = METRICS.counter(
+    "bot_cache_requests_total", "Звернення до кешів бота за результатом.", ("cache", "result")
 )
 
+CACHE_ENTRIES = METRICS.gauge("bot_cache_entries", "Кількість записів у кешах бота.", ("cache",))
+
+
+def collect_cache_metrics() -> None:
+    """Переносить лічильники кешу рендерів розкладу в метрики (викликається при кожному зборі)."""
+
+    for view, stats in schedule_render_stats.items():
+
+        cache_name = f"schedule_render:{view}"
+
+        CACHE_REQUESTS.set_total(stats["hits"], cache=cache_name, result="hit")
+
+        CACHE_REQUESTS.set_total(stats["misses"], cache=cache_name, result="miss")
+
+    CACHE_ENTRIES.set(len(schedule_render_cache), cache="schedule_render")
+
+
+def instrument_module_handlers() -> int:
+    """Обгортає всі async def *_handler модуля метриками; повертає кількість обгорнутих."""
+
+    module_globals = globals()
+
+    instrumented = 0
+
+    for name, value in list(module_globals.items()):
+
+        if not name.endswith("_handler") or not callable(value):
+
+            continue
+
+        wrapped = instrument_callback(value, name, ignored_exceptions=(ApplicationHandlerStop,))
+
+        if wrapped is not value:
+
+            module_globals[name] = wrapped
+
+            instrumented += 1
+
+    return instrumented
+
+
+def instrument_application_handlers(handlers: Iterable) -> None:
+    """Обгортає колбеки зареєстрованих обробників, не охоплені instrument_module_handlers()."""
+
+    for handler in handlers:
+
+        if isinstance(handler, ConversationHandler):
+
+            instrument_application_handlers(handler.entry_points)
+
+            for state_handlers in handler.states.values():
+
+                instrument_application_handlers(state_handlers)
+
+            instrument_application_handlers(handler.fallbacks)
+
+        elif getattr(handler, "callback", None) is not None:
+
+            handler.callback = instrument_callback(
+                handler.callback, ignored_exceptions=(ApplicationHandlerStop,)
+            )
+
+
+async def metrics_post_init(application: Application) -> None:
+    """Запускає HTTP /metrics і вимірювання затримки циклу подій разом із ботом."""
+
+    global metrics_server, event_loop_lag_task
+
+    METRICS.register_collector(collect_cache_metrics)
+
+    try:
+
+        metrics_server = await start_metrics_server(METRICS_HOST, METRICS_PORT)
+
+    except OSError as e:
+
+        logger.error(f"Метрики: не вдалося відкрити {METRICS_HOST}:{METRICS_PORT}: {e}")
+
+        return
+
+    event_loop_lag_task = asyncio.create_task(
+        monitor_event_loop_lag(EVENT_LOOP_LAG_CHECK_INTERVAL_SECONDS)
+    )
+
+
+async def metrics_post_shutdown(application: Application) -> None:
+    """Зупиняє HTTP /metrics і вимірювання затримки циклу подій."""
+
+    if event_loop_lag_task is not None:
+
+        event_loop_lag_task.cancel()
+
+    if metrics_server is not None:
+
+        metrics_server.close()
+
+        await metrics_server.wait_closed()
+
+
+async def bot_post_shutdown(application: Application) -> None:
+    """Дописує буферизовані лічильники й активність перед зупинкою."""
+
+    flush_stats_buffers()
+
+    flush_user_activity()
+
+    flush_activity_sketches()
+
+    if ENABLE_METRICS:
+
+        await metrics_post_shutdown(application)
+
+
+# --- Трасування оновлень ---
+
+
+def describe_update_for_trace(update: object) -> str:
+    """Коротка назва trace'а: команда, префікс callback_data або тип оновлення."""
+
+    if not isinstance(update, Update):
+
+        return type(update).__name__
+
+    if update.callback_query and update.callback_query.data:
+
+        # Ідентифікатори в кінці callback_data (sann_cancel_12) не повинні дробити назви
+
+        return f"callback:{update.callback_query.data.rstrip('0123456789-_') or 'data'}"
+
+    if update.message and update.message.text and update.message.text.startswith("/"):
+
+        return f"command:{update.message.text.split()[0].split('@')[0]}"
+
+    if update.message:
+
+        return "message:photo" if update.message.photo else "message:text"
+
+    if update.inline_query:
+
+        return "inline_query"
+
+    return "update"
+
+
+class TracedApplication(Application):
+    """Application, що відкриває trace на кожне оновлення (span'и додають БД, Bot API, рендер)."""
+
+    async def process_update(self, update: object) -> None:
+
+        user = update.effective_user if isinstance(update, Update) else None
+
+        with trace_update(
+            describe_update_for_trace(update),
+            update_id=getattr(update, "update_id", None),
+            user_id=user.id if user else None,
+        ):
+
+            await super().process_update(update)
+
 
 def main() -> None:
 
     initialize_database()
 
+    # Латентність і помилки всіх *_handler - до реєстрації, щоб обробники отримали обгортки
+
+    logger.info(f"Метрики: інструментовано {instrument_module_handlers()} обробників.")
+
     initialize_schedule_database()
 
     logger.info("Завантаження початкового кешу розкладу...")
@@ -9971,7 +16222,24 @@ def main() -> None:
 
         logger.warning("Початковий кеш розкладу порожній або не вдалося завантажити дані груп.")
 
-    application = Application.builder().token(BOT_TOKEN).build()
+    # Усі запити до Bot API проходять через спільний планувальник зі смугами пріоритету
+
+    # TracedApplication відкриває trace на кожне оновлення (вибірка TRACE_SAMPLE_RATE)
+
+    application_builder = (
+        Application.builder()
+        .application_class(TracedApplication)
+        .token(BOT_TOKEN)
+        .rate_limiter(LaneRateLimiter())
+        .persistence(SQLitePersistence(connect_db))
+        .post_shutdown(bot_post_shutdown)
+    )
+
+    if ENABLE_METRICS:
+
+        application_builder = application_builder.post_init(metrics_post_init)
+
+    application = application_builder.build()
 
     # --- ВИЗНАЧЕННЯ CONVERSATIONHANDLER'ІВ ---
 
@@ -9986,6 +16254,7 @@ def main() -> None:
     role_selection_conv_handler = ConversationHandler(
         entry_points=[CommandHandler("start", start_command_handler)],
         states={
+            ConversationHandler.TIMEOUT: conversation_timeout_handlers("role_selection"),
             SELECTING_ROLE: [
                 # Обробляємо кнопки вибору ролі (студент, гість, працівник)
                 CallbackQueryHandler(
@@ -10046,6 +16315,9 @@ def main() -> None:
         ],
         per_user=True,
         allow_reentry=True,
+        conversation_timeout=CONVERSATION_TIMEOUT_SECONDS,
+        name="role_selection",
+        persistent=True,
     )
 
     # НОВИЙ ОБРОБНИК ДЛЯ ЗМІНИ ГРУПИ З ГОЛОВНОГО МЕНЮ
@@ -10057,6 +16329,7 @@ def main() -> None:
             CallbackQueryHandler(prompt_set_group_handler, pattern="^change_set_group_prompt$")
         ],
         states={
+            ConversationHandler.TIMEOUT: conversation_timeout_handlers("change_group"),
             SELECTING_GROUP: [
                 CallbackQueryHandler(set_group_callback_handler, pattern="^set_group_"),
                 CallbackQueryHandler(
@@ -10077,6 +16350,9 @@ def main() -> None:
         ],
         per_user=True,
         allow_reentry=True,
+        conversation_timeout=CONVERSATION_TIMEOUT_SECONDS,
+        name="change_group",
+        persistent=True,
     )
 
     # maintenance_conv_handler (МАЄ БУТИ ВИЗНАЧЕНИЙ ТУТ)
@@ -10086,6 +16362,7 @@ def main() -> None:
             CallbackQueryHandler(maintenance_start_setup_handler, pattern="^maint_start_setup$")
         ],
         states={
+            ConversationHandler.TIMEOUT: conversation_timeout_handlers("maintenance"),
             SELECTING_DURATION: [
                 CallbackQueryHandler(
                     maintenance_set_duration_callback, pattern="^maint_set_duration_"
@@ -10108,6 +16385,9 @@ def main() -> None:
         ],
         per_user=True,
         allow_reentry=True,
+        conversation_timeout=CONVERSATION_TIMEOUT_SECONDS,
+        name="maintenance",
+        persistent=True,
     )
 
     # announce_conv_handler (МАЄ БУТИ ВИЗНАЧЕНИЙ ТУТ)
@@ -10117,8 +16397,22 @@ def main() -> None:
             CallbackQueryHandler(admin_announce_start_handler, pattern="^admin_announce_start$")
         ],
         states={
+            ConversationHandler.TIMEOUT: conversation_timeout_handlers("announce"),
             ANNOUNCE_SELECT_TARGET: [
                 CallbackQueryHandler(announce_select_target_callback, pattern="^announce_target_"),
+                CallbackQueryHandler(
+                    admin_announce_start_handler, pattern="^announce_toggle_unreachable$"
+                ),
+                CallbackQueryHandler(announce_choose_time_handler, pattern="^announce_choose_time$"),
+            ],
+            ANNOUNCE_SELECT_SEND_TIME: [
+                CallbackQueryHandler(announce_set_time_callback, pattern="^announce_time_"),
+                MessageHandler(filters.TEXT & ~filters.COMMAND, announce_typed_time_handler),
+            ],
+            ANNOUNCE_TYPING_SEGMENT_EXPRESSION: [
+                MessageHandler(
+                    filters.TEXT & ~filters.COMMAND, announce_segment_expression_handler
+                ),
             ],
             ANNOUNCE_SELECT_GROUP_FOR_ANNOUNCE: [
                 CallbackQueryHandler(
@@ -10159,6 +16453,9 @@ def main() -> None:
         ],
         per_user=True,
         allow_reentry=True,
+        conversation_timeout=CONVERSATION_TIMEOUT_SECONDS,
+        name="announce",
+        persistent=True,
     )
 
     # raffle_conv_handler (МАЄ БУТИ ВИЗНАЧЕНИЙ ТУТ)
@@ -10166,6 +16463,7 @@ def main() -> None:
     raffle_conv_handler = ConversationHandler(
         entry_points=[CallbackQueryHandler(show_raffle_info_handler, pattern="^show_raffle_info$")],
         states={
+            ConversationHandler.TIMEOUT: conversation_timeout_handlers("raffle"),
             RAFFLE_MENU: [
                 CallbackQueryHandler(raffle_join_prompt_handler, pattern="^raffle_join_prompt$"),
                 CallbackQueryHandler(
@@ -10181,6 +16479,9 @@ def main() -> None:
         fallbacks=[CallbackQueryHandler(show_main_menu_handler, pattern="^back_to_main_menu$")],
         per_user=True,
         allow_reentry=True,
+        conversation_timeout=CONVERSATION_TIMEOUT_SECONDS,
+        name="raffle",
+        persistent=True,
     )
 
     # report_conv_handler (МАЄ БУТИ ВИЗНАЧЕНИЙ ТУТ)
@@ -10191,6 +16492,7 @@ def main() -> None:
             CommandHandler("report_button", send_report_prompt_handler),
         ],
         states={
+            ConversationHandler.TIMEOUT: conversation_timeout_handlers("report"),
             TYPING_REPORT: [
                 MessageHandler(filters.TEXT & ~filters.COMMAND, receive_report_message_handler)
             ],
@@ -10201,6 +16503,9 @@ def main() -> None:
         ],
         per_user=True,
         allow_reentry=True,
+        conversation_timeout=CONVERSATION_TIMEOUT_SECONDS,
+        name="report",
+        persistent=True,
     )
 
     # suggestion_conv_handler (МАЄ БУТИ ВИЗНАЧЕНИЙ ТУТ)
@@ -10213,6 +16518,7 @@ def main() -> None:
             CommandHandler("suggest", send_suggestion_prompt_handler),
         ],
         states={
+            ConversationHandler.TIMEOUT: conversation_timeout_handlers("suggestion"),
             TYPING_SUGGESTION: [
                 MessageHandler(filters.TEXT & ~filters.COMMAND, receive_suggestion_message_handler)
             ],
@@ -10225,6 +16531,9 @@ def main() -> None:
         ],
         per_user=True,
         allow_reentry=True,
+        conversation_timeout=CONVERSATION_TIMEOUT_SECONDS,
+        name="suggestion",
+        persistent=True,
     )
 
     # feedback_conv_handler (НОВИЙ)
@@ -10237,6 +16546,7 @@ def main() -> None:
             ),  # Дозволяємо також команду /feedback
         ],
         states={
+            ConversationHandler.TIMEOUT: conversation_timeout_handlers("feedback"),
             TYPING_FEEDBACK: [
                 MessageHandler(filters.TEXT & ~filters.COMMAND, receive_feedback_message_handler)
             ],
@@ -10247,6 +16557,9 @@ def main() -> None:
         ],
         per_user=True,
         allow_reentry=True,
+        conversation_timeout=CONVERSATION_TIMEOUT_SECONDS,
+        name="feedback",
+        persistent=True,
     )
 
     # --- ДОДАВАННЯ CONVERSATIONHANDLER'ІВ ДО APPLICATION ---
@@ -10268,6 +16581,76 @@ def main() -> None:
 
         logger.info(f"FTP синхронізація БД користувачів ('{DATABASE_NAME}') вимкнена.")
 
+    # Воркер розсилок: підхоплює також завдання, перервані попереднім перезапуском
+
+    application.job_queue.run_repeating(
+        broadcast_worker_callback,
+        interval=timedelta(seconds=BROADCAST_WORKER_INTERVAL_SECONDS),
+        first=timedelta(seconds=5),
+        name=BROADCAST_WORKER_JOB_NAME,
+    )
+
+    application.job_queue.run_repeating(
+        dlq_redelivery_job_callback,
+        interval=timedelta(seconds=DLQ_REDELIVERY_INTERVAL_SECONDS),
+        first=timedelta(seconds=30),
+        name=DLQ_REDELIVERY_JOB_NAME,
+    )
+
+    # Відкладені оголошення переживають перезапуск: відновлюємо їх з БД
+
+    load_scheduled_announcements(application.job_queue)
+
+    # Режим ТО і його автоматичне вимкнення переживають перезапуск (таблиця maintenance_state)
+
+    restore_maintenance_state(application.job_queue)
+
+    application.job_queue.run_repeating(
+        maintenance_state_sync_job_callback,
+        interval=timedelta(seconds=MAINTENANCE_STATE_SYNC_INTERVAL_SECONDS),
+        first=timedelta(seconds=MAINTENANCE_STATE_SYNC_INTERVAL_SECONDS),
+        name=MAINTENANCE_STATE_SYNC_JOB_NAME,
+    )
+
+    # Сегменти аудиторії: збережені бітові карти доступні одразу, далі - повний і інкрементальні перерахунки
+
+    load_audience_segments()
+
+    application.job_queue.run_repeating(
+        audience_segment_refresh_job_callback,
+        interval=timedelta(seconds=AUDIENCE_SEGMENT_REFRESH_INTERVAL_SECONDS),
+        first=timedelta(seconds=10),
+        name=AUDIENCE_SEGMENT_REFRESH_JOB_NAME,
+    )
+
+    # Лічильники команд і воронки реєстрації накопичуються в пам'яті та скидаються пакетом
+
+    application.job_queue.run_repeating(
+        stats_flush_job_callback,
+        interval=timedelta(seconds=STATS_FLUSH_INTERVAL_SECONDS),
+        first=timedelta(seconds=STATS_FLUSH_INTERVAL_SECONDS),
+        name=STATS_FLUSH_JOB_NAME,
+    )
+
+    # Прострочені тимчасові ключі user_data (TTL) та порожні сесії
+
+    application.job_queue.run_repeating(
+        session_state_sweep_job_callback,
+        interval=timedelta(seconds=SESSION_STATE_SWEEP_INTERVAL_SECONDS),
+        first=timedelta(seconds=SESSION_STATE_SWEEP_INTERVAL_SECONDS),
+        name=SESSION_STATE_SWEEP_JOB_NAME,
+    )
+
+    # Режим ТО: одна перевірка до всіх обробників замість перевірки в кожному з них
+
+    application.add_handler(
+        TypeHandler(Update, maintenance_gate_handler), group=MAINTENANCE_GATE_GROUP
+    )
+
+    # Час активності користувачів для сегментів active_N (група -1: до всіх інших обробників)
+
+    application.add_handler(TypeHandler(Update, track_user_activity_handler), group=-1)
+
     # ВАЖЛИВА ЗМІНА: Тепер ми знову будемо обробляти всі ролі в одному місці,
 
     # але логін викладача буде винесено в окрему розмову.
@@ -10302,6 +16685,8 @@ def main() -> None:
 
     application.add_handler(CallbackQueryHandler(button_callback_handler))
 
+    application.add_handler(InlineQueryHandler(inline_query_handler))
+
     # --- ІНШІ КОМАНДНІ ХЕНДЛЕРИ ---
 
     # Ці хендлери залишаються, але вони будуть спрацьовувати, тільки якщо ConversationHandler не перехопив команду.
@@ -10312,6 +16697,10 @@ def main() -> None:
 
     application.add_handler(CommandHandler("call_schedule", call_schedule_handler))
 
+    application.add_handler(CommandHandler("now", now_next_lesson_handler))
+
+    application.add_handler(CommandHandler("find_teacher", find_teacher_command_handler))
+
     application.add_handler(CommandHandler("full_schedule", full_schedule_handler))
 
     application.add_handler(CommandHandler("donate", donation_info_handler))
@@ -10342,10 +16731,34 @@ def main() -> None:
 
     application.add_handler(CommandHandler("stats", show_stats_handler, filters=admin_filter))
 
+    application.add_handler(
+        CommandHandler("schedule_conflicts", admin_schedule_conflicts_handler, filters=admin_filter)
+    )
+
+    application.add_handler(
+        CommandHandler("edit_announcement", edit_announcement_command_handler, filters=admin_filter)
+    )
+
     application.add_handler(
         CommandHandler("server_status", server_status_handler, filters=admin_filter)
     )
 
+    application.add_handler(
+        CommandHandler("traces", admin_traces_command_handler, filters=admin_filter)
+    )
+
+    application.add_handler(
+        CommandHandler("profile", admin_profile_command_handler, filters=admin_filter)
+    )
+
+    application.add_handler(
+        CommandHandler("session_report", admin_session_report_command_handler, filters=admin_filter)
+    )
+
+    application.add_handler(
+        CommandHandler("funnel", admin_funnel_report_command_handler, filters=admin_filter)
+    )
+
     application.add_handler(
         CommandHandler(
             "force_disable_maintenance", maintenance_disable_now_callback, filters=admin_filter
@@ -10370,9 +16783,60 @@ def main() -> None:
         CommandHandler("pick_winner", admin_pick_raffle_winner, filters=admin_filter)
     )
 
-    logger.info("Бот запущено. Натисни Ctrl+C для зупинки.")
+    for handlers in application.handlers.values():
+
+        instrument_application_handlers(handlers)
+
+        for handler in handlers:
+
+            if isinstance(handler, ConversationHandler):
+
+                track_conversation_states(handler)
+
+    if BOT_RUN_MODE == "webhook":
+
+        run_webhook_mode(application)
+
+        return
+
+    logger.info("Бот запущено (long polling). Натисни Ctrl+C для зупинки.")
+
+    application.run_polling(allowed_updates=ALLOWED_UPDATES)
+
+
+def run_webhook_mode(application: Application) -> None:
+    """Вбудований webhook-сервер за TLS-проксі (потрібен python-telegram-bot[webhooks])."""
+
+    if not WEBHOOK_URL:
+
+        logger.critical("Webhook: не задано WEBHOOK_URL (публічна https-адреса проксі).")
+
+        sys.exit(1)
+
+    secret_token = WEBHOOK_SECRET_TOKEN
 
-    application.run_polling(allowed_updates=Update.ALL_TYPES)
+    if not secret_token:
+
+        # Telegram надсилає його в X-Telegram-Bot-Api-Secret-Token; без нього запити відхиляються
+
+        secret_token = secrets.token_urlsafe(32)
+
+        logger.warning("Webhook: WEBHOOK_SECRET_TOKEN не задано, згенеровано токен на цей запуск.")
+
+    logger.info(
+        f"Бот запущено (webhook): {WEBHOOK_LISTEN}:{WEBHOOK_PORT}/{WEBHOOK_PATH} "
+        f"<- {WEBHOOK_URL}. Натисни Ctrl+C для зупинки."
+    )
+
+    application.run_webhook(
+        listen=WEBHOOK_LISTEN,
+        port=WEBHOOK_PORT,
+        url_path=WEBHOOK_PATH,
+        webhook_url=f"{WEBHOOK_URL.rstrip('/')}/{WEBHOOK_PATH}",
+        secret_token=secret_token,
+        allowed_updates=ALLOWED_UPDATES,
+        max_connections=WEBHOOK_MAX_CONNECTIONS,
+    )
 
 
 if __name__ == "__main__":
@@ -0,0 +1,136 @@
+"""
+Бенчмарк розсилки: стара послідовна відправка з time.sleep(0.1) проти broadcast_engine.
+
+Запуск з кореня репозиторію:
+
+    python benchmarks/bench_broadcast.py --users 300
+
+Окрім тривалості, вимірюється максимальна затримка event loop: під час старої
+розсилки бот не може обробляти жодних інших оновлень.
+"""
+
+import argparse
+import asyncio
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from fake_bot_api import FakeBotAPI  # noqa: E402
+from broadcast_engine import run_broadcast  # noqa: E402
+
+
+async def measure_loop_lag(stop_event: asyncio.Event, interval: float = 0.01) -> float:
+    """Максимальне запізнення таймера event loop (мс) - імітація "інтерактивного" запиту."""
+
+    max_lag = 0.0
+
+    while not stop_event.is_set():
+
+        expected = time.monotonic() + interval
+
+        await asyncio.sleep(interval)
+
+        max_lag = max(max_lag, time.monotonic() - expected)
+
+    return max_lag * 1000
+
+
+async def legacy_broadcast(api: FakeBotAPI, user_ids: list[int]) -> dict:
+    """Копія старого циклу з announce_*: по одному повідомленню і блокуючий sleep."""
+
+    sent, failed = 0, 0
+
+    for user_id in user_ids:
+
+        try:
+
+            await api.send_message(chat_id=user_id, text="📢 ОГОЛОШЕННЯ 📢")
+
+            sent += 1
+
+            time.sleep(0.1)
+
+        except Exception:
+
+            failed += 1
+
+    return {"sent": sent, "failed": failed}
+
+
+async def engine_broadcast(api: FakeBotAPI, user_ids: list[int], rate: float, concurrency: int) -> dict:
+
+    async def send_one(user_id: int) -> None:
+
+        await api.send_message(chat_id=user_id, text="📢 ОГОЛОШЕННЯ 📢")
+
+    return await run_broadcast(
+        user_ids, send_one, total=len(user_ids), rate_per_second=rate, concurrency=concurrency
+    )
+
+
+async def run_case(name: str, coro_factory, api: FakeBotAPI, users: int) -> None:
+
+    stop_event = asyncio.Event()
+
+    lag_task = asyncio.create_task(measure_loop_lag(stop_event))
+
+    started_at = time.perf_counter()
+
+    stats = await coro_factory()
+
+    duration = time.perf_counter() - started_at
+
+    stop_event.set()
+
+    max_lag_ms = await lag_task
+
+    throughput = users / duration if duration else 0
+
+    projected_10k = 10_000 / throughput / 60 if throughput else float("inf")
+
+    print(
+        f"{name:<8} users={users:<6} sent={stats['sent']:<6} failed={stats['failed']:<5} "
+        f"time={duration:7.2f}s  {throughput:6.1f} msg/s  ~{projected_10k:5.1f} хв на 10k  "
+        f"flood429={api.flood_errors:<4} max_loop_lag={max_lag_ms:8.1f} ms"
+    )
+
+
+async def main() -> None:
+
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+
+    parser.add_argument("--users", type=int, default=300)
+
+    parser.add_argument("--latency-ms", type=float, default=40.0)
+
+    parser.add_argument("--rate", type=float, default=25.0)
+
+    parser.add_argument("--concurrency", type=int, default=10)
+
+    parser.add_argument("--skip-legacy", action="store_true")
+
+    args = parser.parse_args()
+
+    user_ids = list(range(100_000, 100_000 + args.users))
+
+    if not args.skip_legacy:
+
+        api = FakeBotAPI(latency_ms=args.latency_ms)
+
+        await run_case("legacy", lambda: legacy_broadcast(api, user_ids), api, args.users)
+
+    api = FakeBotAPI(latency_ms=args.latency_ms)
+
+    await run_case(
+        "engine",
+        lambda: engine_broadcast(api, user_ids, args.rate, args.concurrency),
+        api,
+        args.users,
+    )
+
+
+if __name__ == "__main__":
+
+    asyncio.run(main())
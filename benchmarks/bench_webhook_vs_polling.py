@@ -0,0 +1,441 @@
+"""
+Синтетична модель транспорту: затримка "оновлення -> відповідь" у long polling проти webhook.
+
+Це НЕ замір цього бота: скрипт не запускає Application з python-telegram-bot, не
+використовує run_webhook_mode/run_polling з Abobikkk.py, обробники, rate limiter чи БД.
+Обидва транспорти змодельовані власними мінімальними HTTP-клієнтом і сервером, тож
+результат показує лише різницю, що її вносить сам спосіб доставки оновлень (зайві
+round trip-и getUpdates проти push), за заданих мережевої затримки та часу обробки.
+
+Запуск з кореня репозиторію:
+
+    python benchmarks/bench_webhook_vs_polling.py --updates 500 --rate 50
+
+Локальний фейковий Bot API (HTTP на 127.0.0.1) генерує оновлення з пуассонівським
+потоком і імітує мережеву затримку в один бік. Бот-клієнт отримує оновлення:
+
+- polling - циклом getUpdates (long polling з offset, як Application.run_polling);
+- webhook - вбудованим HTTP-сервером, на який "Telegram" надсилає POST
+  (не більше --max-connections одночасних запитів, секретний токен у заголовку).
+
+Кожне оновлення модель бота "обробляє" (--handler-ms) і відповідає sendMessage.
+Затримка рахується від появи оновлення до отримання sendMessage фейковим API.
+Залежності - лише стандартна бібліотека. Щоб виміряти справжній бот, спрямуйте його
+Application на фейковий API (ApplicationBuilder.base_url) і запустіть у потрібному режимі.
+"""
+
+import argparse
+import asyncio
+import json
+import random
+import secrets
+import statistics
+import time
+
+HOST = "127.0.0.1"
+
+SECRET_HEADER = "x-telegram-bot-api-secret-token"
+
+
+async def read_http_message(reader: asyncio.StreamReader) -> tuple[str, dict, bytes]:
+    """Перший рядок, заголовки (ключі в нижньому регістрі) і тіло HTTP-повідомлення."""
+
+    first_line = (await reader.readline()).decode("latin-1").strip()
+
+    headers = {}
+
+    while True:
+
+        line = await reader.readline()
+
+        if line in (b"\r\n", b"\n", b""):
+
+            break
+
+        name, _, value = line.decode("latin-1").partition(":")
+
+        headers[name.strip().lower()] = value.strip()
+
+    body = await reader.readexactly(int(headers.get("content-length", "0")))
+
+    return first_line, headers, body
+
+
+def write_http_response(
+    writer: asyncio.StreamWriter, payload: dict, status: str = "200 OK"
+) -> None:
+
+    body = json.dumps(payload).encode("utf-8")
+
+    writer.write(
+        f"HTTP/1.1 {status}\r\nContent-Type: application/json\r\n"
+        f"Content-Length: {len(body)}\r\nConnection: close\r\n\r\n".encode("latin-1") + body
+    )
+
+
+async def http_post(port: int, path: str, payload: dict, headers: dict | None = None) -> dict:
+    """Мінімальний HTTP/1.1 POST з JSON (нове з'єднання на запит)."""
+
+    reader, writer = await asyncio.open_connection(HOST, port)
+
+    body = json.dumps(payload).encode("utf-8")
+
+    extra_headers = "".join(f"{name}: {value}\r\n" for name, value in (headers or {}).items())
+
+    writer.write(
+        f"POST {path} HTTP/1.1\r\nHost: {HOST}\r\nContent-Type: application/json\r\n"
+        f"{extra_headers}Content-Length: {len(body)}\r\nConnection: close\r\n\r\n".encode("latin-1")
+        + body
+    )
+
+    await writer.drain()
+
+    _, _, response_body = await read_http_message(reader)
+
+    writer.close()
+
+    return json.loads(response_body or b"{}")
+
+
+class FakeTelegramAPI:
+    """Фейковий Bot API: getUpdates (long polling), sendMessage і доставка webhook."""
+
+    def __init__(self, latency_ms: float, long_poll_timeout: float = 10.0):
+
+        self.latency = latency_ms / 1000
+
+        self.long_poll_timeout = long_poll_timeout
+
+        self.updates: list[dict] = []
+
+        self.new_update = asyncio.Event()
+
+        self.created_at: dict[int, float] = {}
+
+        self.latencies: list[float] = []
+
+        self.replied = asyncio.Event()
+
+        self.expected_replies = 0
+
+        self.get_updates_calls = 0
+
+        self.webhook_requests = 0
+
+        self.port = 0
+
+        self._requests: set[asyncio.Task] = set()
+
+        self._server: asyncio.base_events.Server | None = None
+
+    async def start(self) -> None:
+
+        self._server = await asyncio.start_server(self._handle, HOST, 0)
+
+        self.port = self._server.sockets[0].getsockname()[1]
+
+    async def stop(self) -> None:
+
+        # Будимо незавершений long poll, щоб запити завершились самі, а не скасовувались
+
+        self.new_update.set()
+
+        await asyncio.gather(*self._requests, return_exceptions=True)
+
+        self._server.close()
+
+        await self._server.wait_closed()
+
+    def emit_update(self, update_id: int) -> dict:
+
+        update = {"update_id": update_id, "message": {"chat": {"id": update_id}, "text": "/start"}}
+
+        self.created_at[update_id] = time.perf_counter()
+
+        self.updates.append(update)
+
+        self.new_update.set()
+
+        return update
+
+    async def _handle(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter) -> None:
+
+        self._requests.add(asyncio.current_task())
+
+        try:
+
+            request_line, _, body = await read_http_message(reader)
+
+            payload = json.loads(body or b"{}")
+
+            # Шлях бот -> сервер Telegram
+
+            await asyncio.sleep(self.latency)
+
+            if request_line.split()[1].endswith("/getUpdates"):
+
+                result = await self._get_updates(payload.get("offset", 0))
+
+                # Шлях сервер Telegram -> бот
+
+                await asyncio.sleep(self.latency)
+
+            else:
+
+                self._record_reply(payload["reply_to"])
+
+                result = True
+
+            write_http_response(writer, {"ok": True, "result": result})
+
+            await writer.drain()
+
+        except (ConnectionError, asyncio.IncompleteReadError):
+
+            pass
+
+        finally:
+
+            writer.close()
+
+            self._requests.discard(asyncio.current_task())
+
+    async def _get_updates(self, offset: int) -> list[dict]:
+
+        self.get_updates_calls += 1
+
+        # Підтверджені (update_id < offset) Telegram більше не віддає
+
+        self.updates = [update for update in self.updates if update["update_id"] >= offset]
+
+        if not self.updates:
+
+            self.new_update.clear()
+
+            try:
+
+                await asyncio.wait_for(self.new_update.wait(), timeout=self.long_poll_timeout)
+
+            except asyncio.TimeoutError:
+
+                return []
+
+        return list(self.updates)
+
+    def _record_reply(self, update_id: int) -> None:
+
+        self.latencies.append(time.perf_counter() - self.created_at[update_id])
+
+        if len(self.latencies) >= self.expected_replies:
+
+            self.replied.set()
+
+    async def deliver_webhook(
+        self, update: dict, bot_port: int, secret_token: str, semaphore: asyncio.Semaphore
+    ) -> None:
+        """Доставка одного оновлення на webhook (з обмеженням max_connections)."""
+
+        async with semaphore:
+
+            self.webhook_requests += 1
+
+            # Шлях сервер Telegram -> бот; відповідь 200 повертається одразу після прийому
+
+            await asyncio.sleep(self.latency)
+
+            await http_post(bot_port, "/telegram", update, {SECRET_HEADER: secret_token})
+
+
+async def handle_update(api: FakeTelegramAPI, update: dict, handler_ms: float) -> None:
+    """Імітація обробника: робота handler_ms, потім sendMessage у відповідь."""
+
+    await asyncio.sleep(handler_ms / 1000)
+
+    await http_post(
+        api.port,
+        "/botTOKEN/sendMessage",
+        {"chat_id": update["message"]["chat"]["id"], "reply_to": update["update_id"]},
+    )
+
+
+async def polling_bot(api: FakeTelegramAPI, handler_ms: float, stop_event: asyncio.Event) -> None:
+
+    offset = 0
+
+    tasks = set()
+
+    while not stop_event.is_set():
+
+        response = await http_post(
+            api.port, "/botTOKEN/getUpdates", {"offset": offset, "timeout": api.long_poll_timeout}
+        )
+
+        for update in response["result"]:
+
+            offset = max(offset, update["update_id"] + 1)
+
+            # Як Application: оновлення обробляються паралельно, наступний getUpdates - одразу
+
+            task = asyncio.create_task(handle_update(api, update, handler_ms))
+
+            tasks.add(task)
+
+            task.add_done_callback(tasks.discard)
+
+
+async def start_webhook_bot(
+    api: FakeTelegramAPI, handler_ms: float, secret_token: str
+) -> asyncio.base_events.Server:
+
+    tasks = set()
+
+    async def handle_request(reader: asyncio.StreamReader, writer: asyncio.StreamWriter) -> None:
+
+        try:
+
+            _, headers, body = await read_http_message(reader)
+
+            if headers.get(SECRET_HEADER) != secret_token:
+
+                write_http_response(writer, {"ok": False}, status="403 Forbidden")
+
+                return
+
+            task = asyncio.create_task(handle_update(api, json.loads(body), handler_ms))
+
+            tasks.add(task)
+
+            task.add_done_callback(tasks.discard)
+
+            write_http_response(writer, {"ok": True})
+
+            await writer.drain()
+
+        finally:
+
+            writer.close()
+
+    return await asyncio.start_server(handle_request, HOST, 0)
+
+
+async def generate_load(api: FakeTelegramAPI, updates: int, rate: float, on_update=None) -> None:
+    """Пуассонівський потік оновлень із середньою інтенсивністю rate на секунду."""
+
+    generator = random.Random(42)
+
+    for update_id in range(1, updates + 1):
+
+        await asyncio.sleep(generator.expovariate(rate))
+
+        update = api.emit_update(update_id)
+
+        if on_update is not None:
+
+            on_update(update)
+
+
+async def run_case(mode: str, args: argparse.Namespace) -> None:
+
+    api = FakeTelegramAPI(args.latency_ms)
+
+    api.expected_replies = args.updates
+
+    await api.start()
+
+    stop_event = asyncio.Event()
+
+    background_tasks = set()
+
+    bot_server = None
+
+    started_at = time.perf_counter()
+
+    if mode == "polling":
+
+        poller = asyncio.create_task(polling_bot(api, args.handler_ms, stop_event))
+
+        await generate_load(api, args.updates, args.rate)
+
+    else:
+
+        secret_token = secrets.token_urlsafe(32)
+
+        bot_server = await start_webhook_bot(api, args.handler_ms, secret_token)
+
+        bot_port = bot_server.sockets[0].getsockname()[1]
+
+        semaphore = asyncio.Semaphore(args.max_connections)
+
+        def on_update(update: dict) -> None:
+
+            task = asyncio.create_task(
+                api.deliver_webhook(update, bot_port, secret_token, semaphore)
+            )
+
+            background_tasks.add(task)
+
+            task.add_done_callback(background_tasks.discard)
+
+        await generate_load(api, args.updates, args.rate, on_update)
+
+    await asyncio.wait_for(api.replied.wait(), timeout=60)
+
+    duration = time.perf_counter() - started_at
+
+    stop_event.set()
+
+    if mode == "polling":
+
+        poller.cancel()
+
+    else:
+
+        bot_server.close()
+
+    await api.stop()
+
+    latencies_ms = sorted(latency * 1000 for latency in api.latencies)
+
+    percentiles = statistics.quantiles(latencies_ms, n=100)
+
+    requests = api.get_updates_calls if mode == "polling" else api.webhook_requests
+
+    print(
+        f"{mode:<8} updates={len(latencies_ms):<5} time={duration:6.2f}s  "
+        f"mean={statistics.fmean(latencies_ms):7.1f}  p50={percentiles[49]:7.1f}  "
+        f"p95={percentiles[94]:7.1f}  p99={percentiles[98]:7.1f}  "
+        f"max={latencies_ms[-1]:7.1f} ms  вхідних HTTP-запитів={requests}"
+    )
+
+
+async def main() -> None:
+
+    parser = argparse.ArgumentParser(
+        description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter
+    )
+
+    parser.add_argument("--updates", type=int, default=500)
+
+    parser.add_argument("--rate", type=float, default=50.0, help="оновлень на секунду")
+
+    parser.add_argument("--latency-ms", type=float, default=30.0, help="затримка в один бік")
+
+    parser.add_argument("--handler-ms", type=float, default=5.0)
+
+    parser.add_argument("--max-connections", type=int, default=40)
+
+    args = parser.parse_args()
+
+    print(
+        f"Затримка мережі {args.latency_ms:.0f} мс в один бік, обробник {args.handler_ms:.0f} мс, "
+        f"{args.rate:.0f} оновлень/с"
+    )
+
+    for mode in ("polling", "webhook"):
+
+        await run_case(mode, args)
+
+
+if __name__ == "__main__":
+
+    asyncio.run(main())
@@ -0,0 +1,91 @@
+"""
+Локальний фейковий Telegram Bot API для бенчмарків розсилок.
+
+Імітує мережеву затримку, серверний ліміт ~30 повідомлень/с (з відповіддю
+RetryAfter при перевищенні) та частку користувачів, що заблокували бота.
+"""
+
+import asyncio
+import collections
+import random
+import time
+
+
+class FakeRetryAfter(Exception):
+    """Аналог telegram.error.RetryAfter (рушій розсилок дивиться лише на retry_after)."""
+
+    def __init__(self, retry_after: float):
+
+        super().__init__(f"Flood control exceeded. Retry in {retry_after} seconds")
+
+        self.retry_after = retry_after
+
+
+class FakeForbidden(Exception):
+    """Аналог telegram.error.Forbidden."""
+
+
+class FakeBotAPI:
+
+    def __init__(
+        self,
+        latency_ms: float = 40.0,
+        jitter_ms: float = 20.0,
+        limit_per_second: int = 30,
+        blocked_ratio: float = 0.02,
+        seed: int = 42,
+    ):
+
+        self.latency_ms = latency_ms
+
+        self.jitter_ms = jitter_ms
+
+        self.limit_per_second = limit_per_second
+
+        self.blocked_ratio = blocked_ratio
+
+        self.random = random.Random(seed)
+
+        self.recent_sends = collections.deque()
+
+        self.calls = 0
+
+        self.delivered = 0
+
+        self.flood_errors = 0
+
+    def _check_flood(self) -> None:
+
+        now = time.monotonic()
+
+        while self.recent_sends and now - self.recent_sends[0] > 1.0:
+
+            self.recent_sends.popleft()
+
+        if len(self.recent_sends) >= self.limit_per_second:
+
+            self.flood_errors += 1
+
+            raise FakeRetryAfter(1)
+
+        self.recent_sends.append(now)
+
+    async def send_message(self, chat_id: int, text: str) -> dict:
+
+        self.calls += 1
+
+        await asyncio.sleep(
+            max(0.0, self.latency_ms + self.random.uniform(-self.jitter_ms, self.jitter_ms)) / 1000
+        )
+
+        self._check_flood()
+
+        # Детерміновано "блокуємо" частину користувачів
+
+        if (chat_id * 2654435761) % 1000 < self.blocked_ratio * 1000:
+
+            raise FakeForbidden("Forbidden: bot was blocked by the user")
+
+        self.delivered += 1
+
+        return {"message_id": self.calls, "chat": {"id": chat_id}}
@@ -0,0 +1,495 @@
+"""
+Вбудовані метрики бота у форматі Prometheus (text exposition 0.0.4).
+
+Модуль не залежить від python-telegram-bot і сторонніх бібліотек:
+
+- Counter / Gauge / Histogram з мітками та реєстр METRICS;
+- start_metrics_server() - локальний HTTP /metrics на asyncio.start_server;
+- instrument_callback() - обгортка для обробників (латентність + помилки);
+- TimedConnection - фабрика sqlite3-з'єднань із записом часу запитів;
+- monitor_event_loop_lag() - фонова задача вимірювання затримки циклу подій.
+"""
+
+import asyncio
+import functools
+import logging
+import math
+import sqlite3
+import time
+from typing import Any, Callable
+
+from bot_tracing import record_span
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+DB_LATENCY_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 1.0)
+
+
+def _escape_label_value(value: Any) -> str:
+
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _format_labels(label_names: tuple, label_values: tuple, extra: str = "") -> str:
+
+    pairs = [
+        f'{name}="{_escape_label_value(value)}"' for name, value in zip(label_names, label_values)
+    ]
+
+    if extra:
+
+        pairs.append(extra)
+
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+def _format_value(value: float) -> str:
+
+    if math.isinf(value):
+
+        return "+Inf" if value > 0 else "-Inf"
+
+    return repr(float(value)) if not float(value).is_integer() else str(int(value))
+
+
+class Metric:
+    """Базова метрика: значення за кортежем міток."""
+
+    metric_type = "untyped"
+
+    def __init__(self, name: str, documentation: str, label_names: tuple = ()):
+
+        self.name = name
+
+        self.documentation = documentation
+
+        self.label_names = tuple(label_names)
+
+        self._values: dict[tuple, Any] = {}
+
+    def _key(self, labels: dict) -> tuple:
+
+        return tuple(labels.get(name, "") for name in self.label_names)
+
+    def render(self) -> list[str]:
+
+        lines = [
+            f"# HELP {self.name} {self.documentation}",
+            f"# TYPE {self.name} {self.metric_type}",
+        ]
+
+        for key, value in sorted(self._values.items()):
+
+            lines.append(
+                f"{self.name}{_format_labels(self.label_names, key)} {_format_value(value)}"
+            )
+
+        return lines
+
+
+class Counter(Metric):
+
+    metric_type = "counter"
+
+    def inc(self, amount: float = 1.0, **labels) -> None:
+
+        key = self._key(labels)
+
+        self._values[key] = self._values.get(key, 0) + amount
+
+    def set_total(self, value: float, **labels) -> None:
+        """Дзеркалить лічильник, який уже ведеться деінде (напр. статистика кешу)."""
+
+        self._values[self._key(labels)] = value
+
+
+class Gauge(Metric):
+
+    metric_type = "gauge"
+
+    def set(self, value: float, **labels) -> None:
+
+        self._values[self._key(labels)] = value
+
+    def inc(self, amount: float = 1.0, **labels) -> None:
+
+        key = self._key(labels)
+
+        self._values[key] = self._values.get(key, 0) + amount
+
+
+class Histogram(Metric):
+
+    metric_type = "histogram"
+
+    def __init__(
+        self,
+        name: str,
+        documentation: str,
+        label_names: tuple = (),
+        buckets: tuple = DEFAULT_LATENCY_BUCKETS,
+    ):
+
+        super().__init__(name, documentation, label_names)
+
+        self.buckets = tuple(sorted(buckets)) + (math.inf,)
+
+    def observe(self, value: float, **labels) -> None:
+
+        key = self._key(labels)
+
+        state = self._values.get(key)
+
+        if state is None:
+
+            state = self._values[key] = {"counts": [0] * len(self.buckets), "sum": 0.0, "count": 0}
+
+        for i, bound in enumerate(self.buckets):
+
+            if value <= bound:
+
+                state["counts"][i] += 1
+
+                break
+
+        state["sum"] += value
+
+        state["count"] += 1
+
+    def render(self) -> list[str]:
+
+        lines = [
+            f"# HELP {self.name} {self.documentation}",
+            f"# TYPE {self.name} {self.metric_type}",
+        ]
+
+        for key, state in sorted(self._values.items()):
+
+            cumulative = 0
+
+            for bound, count in zip(self.buckets, state["counts"]):
+
+                cumulative += count
+
+                le_label = f'le="{_format_value(bound)}"'
+
+                lines.append(
+                    f"{self.name}_bucket{_format_labels(self.label_names, key, le_label)} {cumulative}"
+                )
+
+            labels_text = _format_labels(self.label_names, key)
+
+            lines.append(f"{self.name}_sum{labels_text} {_format_value(state['sum'])}")
+
+            lines.append(f"{self.name}_count{labels_text} {state['count']}")
+
+        return lines
+
+
+class MetricsRegistry:
+
+    def __init__(self):
+
+        self._metrics: dict[str, Metric] = {}
+
+        self._collectors: list[Callable[[], None]] = []
+
+    def counter(self, name: str, documentation: str, label_names: tuple = ()) -> Counter:
+
+        return self._metrics.setdefault(name, Counter(name, documentation, label_names))
+
+    def gauge(self, name: str, documentation: str, label_names: tuple = ()) -> Gauge:
+
+        return self._metrics.setdefault(name, Gauge(name, documentation, label_names))
+
+    def histogram(
+        self,
+        name: str,
+        documentation: str,
+        label_names: tuple = (),
+        buckets: tuple = DEFAULT_LATENCY_BUCKETS,
+    ) -> Histogram:
+
+        return self._metrics.setdefault(name, Histogram(name, documentation, label_names, buckets))
+
+    def register_collector(self, collector: Callable[[], None]) -> None:
+        """collector() викликається перед кожним збором - оновлює значення, що ведуться деінде."""
+
+        self._collectors.append(collector)
+
+    def render(self) -> str:
+
+        for collector in self._collectors:
+
+            try:
+
+                collector()
+
+            except Exception as e:
+
+                logger.warning(f"Метрики: помилка колектора {collector.__name__}: {e}")
+
+        lines = []
+
+        for metric in self._metrics.values():
+
+            lines.extend(metric.render())
+
+        return "\n".join(lines) + "\n"
+
+
+METRICS = MetricsRegistry()
+
+HANDLER_LATENCY = METRICS.histogram(
+    "bot_handler_latency_seconds", "Час виконання обробників оновлень.", ("handler",)
+)
+
+HANDLER_ERRORS = METRICS.counter(
+    "bot_handler_errors_total", "Винятки в обробниках оновлень.", ("handler", "error")
+)
+
+DB_QUERY_LATENCY = METRICS.histogram(
+    "bot_db_query_seconds", "Час SQLite-запитів.", ("operation",), DB_LATENCY_BUCKETS
+)
+
+TELEGRAM_API_LATENCY = METRICS.histogram(
+    "bot_telegram_api_latency_seconds", "Латентність запитів до Bot API.", ("endpoint", "lane")
+)
+
+TELEGRAM_API_ERRORS = METRICS.counter(
+    "bot_telegram_api_errors_total", "Помилки запитів до Bot API.", ("endpoint", "error")
+)
+
+BROADCAST_MESSAGES = METRICS.counter(
+    "bot_broadcast_messages_total", "Повідомлення масових розсилок.", ("lane", "outcome")
+)
+
+EVENT_LOOP_LAG = METRICS.gauge(
+    "bot_event_loop_lag_seconds", "Остання виміряна затримка циклу подій asyncio."
+)
+
+EVENT_LOOP_LAG_HISTOGRAM = METRICS.histogram(
+    "bot_event_loop_lag_distribution_seconds",
+    "Розподіл затримки циклу подій asyncio.",
+    buckets=(0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0),
+)
+
+_KNOWN_SQL_OPERATIONS = {"SELECT", "INSERT", "UPDATE", "DELETE", "REPLACE", "CREATE", "ALTER"}
+
+
+def _sql_operation(sql: str) -> str:
+
+    parts = sql.split(None, 1)
+
+    operation = parts[0].upper() if parts else ""
+
+    return operation if operation in _KNOWN_SQL_OPERATIONS else "OTHER"
+
+
+def _observe_query(sql: str, duration: float) -> None:
+
+    operation = _sql_operation(sql)
+
+    DB_QUERY_LATENCY.observe(duration, operation=operation)
+
+    record_span(operation, "db", duration, sql=" ".join(sql.split())[:120])
+
+
+class TimedCursor(sqlite3.Cursor):
+    """Курсор, що записує час execute/executemany у bot_db_query_seconds і span поточного trace."""
+
+    def execute(self, sql, parameters=(), /):
+
+        started_at = time.perf_counter()
+
+        try:
+
+            return super().execute(sql, parameters)
+
+        finally:
+
+            _observe_query(sql, time.perf_counter() - started_at)
+
+    def executemany(self, sql, seq_of_parameters, /):
+
+        started_at = time.perf_counter()
+
+        try:
+
+            return super().executemany(sql, seq_of_parameters)
+
+        finally:
+
+            _observe_query(sql, time.perf_counter() - started_at)
+
+
+class TimedConnection(sqlite3.Connection):
+    """Фабрика з'єднань: sqlite3.connect(path, factory=TimedConnection)."""
+
+    def cursor(self, factory=TimedCursor):
+
+        return super().cursor(factory)
+
+    # Connection.execute*() у CPython створюють курсор усередині, минаючи cursor(), -
+    # тому перенаправляємо їх на TimedCursor явно
+
+    def execute(self, sql, parameters=(), /):
+
+        return self.cursor().execute(sql, parameters)
+
+    def executemany(self, sql, seq_of_parameters, /):
+
+        return self.cursor().executemany(sql, seq_of_parameters)
+
+    def executescript(self, sql_script, /):
+
+        started_at = time.perf_counter()
+
+        try:
+
+            return super().executescript(sql_script)
+
+        finally:
+
+            _observe_query(sql_script, time.perf_counter() - started_at)
+
+    def commit(self):
+
+        started_at = time.perf_counter()
+
+        try:
+
+            return super().commit()
+
+        finally:
+
+            duration = time.perf_counter() - started_at
+
+            DB_QUERY_LATENCY.observe(duration, operation="COMMIT")
+
+            record_span("COMMIT", "db", duration)
+
+
+def instrument_callback(
+    callback: Callable, name: str | None = None, ignored_exceptions: tuple = ()
+) -> Callable:
+    """Обгортає async-обробник: латентність у bot_handler_latency_seconds, винятки - у лічильник."""
+
+    if getattr(callback, "__metrics_instrumented__", False) or not asyncio.iscoroutinefunction(
+        callback
+    ):
+
+        return callback
+
+    handler_name = name or getattr(callback, "__name__", repr(callback))
+
+    @functools.wraps(callback)
+    async def wrapper(*args, **kwargs):
+
+        started_at = time.perf_counter()
+
+        try:
+
+            return await callback(*args, **kwargs)
+
+        except ignored_exceptions:
+
+            raise
+
+        except Exception as e:
+
+            HANDLER_ERRORS.inc(handler=handler_name, error=type(e).__name__)
+
+            raise
+
+        finally:
+
+            HANDLER_LATENCY.observe(time.perf_counter() - started_at, handler=handler_name)
+
+    wrapper.__metrics_instrumented__ = True
+
+    return wrapper
+
+
+async def monitor_event_loop_lag(interval: float = 1.0) -> None:
+    """Фонова задача: наскільки пізніше запланованого прокидається asyncio.sleep(interval)."""
+
+    loop = asyncio.get_running_loop()
+
+    while True:
+
+        started_at = loop.time()
+
+        await asyncio.sleep(interval)
+
+        lag = max(0.0, loop.time() - started_at - interval)
+
+        EVENT_LOOP_LAG.set(lag)
+
+        EVENT_LOOP_LAG_HISTOGRAM.observe(lag)
+
+
+async def _handle_metrics_request(
+    reader: asyncio.StreamReader, writer: asyncio.StreamWriter
+) -> None:
+
+    try:
+
+        request_line = await asyncio.wait_for(reader.readline(), timeout=5)
+
+        # Заголовки запиту не потрібні - дочитуємо до порожнього рядка
+
+        while True:
+
+            header_line = await asyncio.wait_for(reader.readline(), timeout=5)
+
+            if header_line in (b"\r\n", b"\n", b""):
+
+                break
+
+        parts = request_line.decode("latin-1").split()
+
+        path = parts[1].split("?", 1)[0] if len(parts) >= 2 else ""
+
+        if len(parts) >= 2 and parts[0] == "GET" and path == "/metrics":
+
+            status, content_type, body = (
+                "200 OK",
+                "text/plain; version=0.0.4; charset=utf-8",
+                METRICS.render().encode("utf-8"),
+            )
+
+        else:
+
+            status, content_type, body = (
+                "404 Not Found",
+                "text/plain; charset=utf-8",
+                b"Not Found\n",
+            )
+
+        writer.write(
+            f"HTTP/1.1 {status}\r\nContent-Type: {content_type}\r\n"
+            f"Content-Length: {len(body)}\r\nConnection: close\r\n\r\n".encode("latin-1") + body
+        )
+
+        await writer.drain()
+
+    except (asyncio.TimeoutError, ConnectionError) as e:
+
+        logger.debug(f"Метрики: запит перервано: {e}")
+
+    finally:
+
+        writer.close()
+
+
+async def start_metrics_server(host: str, port: int) -> asyncio.base_events.Server:
+    """Запускає HTTP-сервер /metrics у поточному циклі подій."""
+
+    server = await asyncio.start_server(_handle_metrics_request, host, port)
+
+    logger.info(f"Метрики: /metrics доступний на http://{host}:{port}/metrics")
+
+    return server
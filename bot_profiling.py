@@ -0,0 +1,120 @@
+"""
+Профілювання бота на живому трафіку без перезапуску.
+
+ProfilingSession вмикає cProfile (і, за бажанням, tracemalloc) у потоці циклу
+подій: усі обробники, задачі job_queue і рендер розкладу виконуються саме там,
+тож звіт показує реальні гарячі точки під поточним навантаженням.
+
+Модуль не залежить від python-telegram-bot.
+"""
+
+import cProfile
+import io
+import pstats
+import time
+import tracemalloc
+
+PROFILE_TOP_FUNCTIONS = 40
+
+PROFILE_TOP_ALLOCATIONS = 25
+
+
+class ProfilingSession:
+    """Одна сесія профілювання: start() -> (трафік) -> stop() повертає текстовий звіт."""
+
+    def __init__(self, with_memory: bool = False):
+
+        self.with_memory = with_memory
+
+        self.profiler = cProfile.Profile()
+
+        self.started_at = 0.0
+
+        self._started_tracemalloc = False
+
+        self._memory_before: tracemalloc.Snapshot | None = None
+
+    def start(self) -> None:
+        """Вмикає профайлер; ValueError, якщо в потоці вже працює інший профайлер."""
+
+        if self.with_memory:
+
+            if not tracemalloc.is_tracing():
+
+                tracemalloc.start(10)
+
+                self._started_tracemalloc = True
+
+            self._memory_before = tracemalloc.take_snapshot()
+
+        try:
+
+            self.profiler.enable()
+
+        except ValueError:
+
+            self._stop_tracemalloc()
+
+            raise
+
+        self.started_at = time.monotonic()
+
+    def _stop_tracemalloc(self) -> None:
+
+        if self._started_tracemalloc:
+
+            tracemalloc.stop()
+
+            self._started_tracemalloc = False
+
+    def stop(self) -> str:
+
+        self.profiler.disable()
+
+        elapsed = time.monotonic() - self.started_at
+
+        report = io.StringIO()
+
+        report.write(f"Профілювання: {elapsed:.1f} с живого трафіку\n\n")
+
+        report.write(
+            f"=== Топ-{PROFILE_TOP_FUNCTIONS} функцій за сумарним часом (cumulative) ===\n"
+        )
+
+        stats = pstats.Stats(self.profiler, stream=report)
+
+        stats.strip_dirs().sort_stats(pstats.SortKey.CUMULATIVE).print_stats(PROFILE_TOP_FUNCTIONS)
+
+        report.write(f"\n=== Топ-{PROFILE_TOP_FUNCTIONS} функцій за власним часом (tottime) ===\n")
+
+        stats.sort_stats(pstats.SortKey.TIME).print_stats(PROFILE_TOP_FUNCTIONS)
+
+        if self.with_memory and tracemalloc.is_tracing():
+
+            memory_after = tracemalloc.take_snapshot()
+
+            current, peak = tracemalloc.get_traced_memory()
+
+            report.write(
+                f"\n=== Пам'ять: зараз {current / 1024:.0f} КіБ, пік {peak / 1024:.0f} КіБ ===\n"
+            )
+
+            report.write(f"\n=== Топ-{PROFILE_TOP_ALLOCATIONS} місць виділення (зараз) ===\n")
+
+            for statistic in memory_after.statistics("lineno")[:PROFILE_TOP_ALLOCATIONS]:
+
+                report.write(f"{statistic}\n")
+
+            if self._memory_before is not None:
+
+                report.write(f"\n=== Топ-{PROFILE_TOP_ALLOCATIONS} приростів за вікно ===\n")
+
+                differences = memory_after.compare_to(self._memory_before, "lineno")
+
+                for statistic in differences[:PROFILE_TOP_ALLOCATIONS]:
+
+                    report.write(f"{statistic}\n")
+
+        self._stop_tracemalloc()
+
+        return report.getvalue()
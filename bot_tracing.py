@@ -0,0 +1,285 @@
+"""
+Легке трасування оновлень: trace на кожне оновлення та дочірні span'и.
+
+Поточний trace зберігається в contextvars, тож span'и з будь-якої глибини
+виклику (SQLite, Bot API, рендер розкладу, bcrypt) потрапляють у trace свого
+оновлення, навіть коли оновлення обробляються паралельно.
+
+- trace_update() - корінь trace; рішення про семплінг приймається на старті;
+- span() / traced() - дочірні span'и; без активного trace це майже no-op;
+- record_span() - span за вже виміряним часом (для TimedCursor тощо);
+- завершені trace'и лежать у кільцевому буфері (TRACE_BUFFER_SIZE).
+
+Модуль не залежить від python-telegram-bot.
+"""
+
+import contextlib
+import contextvars
+import functools
+import inspect
+import json
+import os
+import random
+import secrets
+import time
+from collections import deque
+from typing import Callable, Iterator
+
+TRACE_SAMPLE_RATE = float(os.getenv("TRACE_SAMPLE_RATE", "0.1"))
+
+TRACE_BUFFER_SIZE = int(os.getenv("TRACE_BUFFER_SIZE", "500"))
+
+TRACE_MAX_SPANS = 200  # Захист від розростання trace'а (напр. цикл із сотнями запитів)
+
+
+class Trace:
+    """Trace одного оновлення: корінь і плаский список дочірніх span'ів."""
+
+    __slots__ = (
+        "trace_id",
+        "name",
+        "attributes",
+        "started_at",
+        "_started",
+        "duration",
+        "spans",
+        "dropped_spans",
+        "error",
+        "_last_span_id",
+    )
+
+    def __init__(self, name: str, attributes: dict | None = None):
+
+        self.trace_id = secrets.token_hex(8)
+
+        self.name = name
+
+        self.attributes = attributes or {}
+
+        self.started_at = time.time()
+
+        self._started = time.perf_counter()
+
+        self.duration = 0.0
+
+        self.spans: list[dict] = []
+
+        self.dropped_spans = 0
+
+        self.error: str | None = None
+
+        self._last_span_id = 0
+
+    def next_span_id(self) -> int:
+
+        self._last_span_id += 1
+
+        return self._last_span_id
+
+    def add_span(self, span_data: dict) -> None:
+
+        if len(self.spans) >= TRACE_MAX_SPANS:
+
+            self.dropped_spans += 1
+
+            return
+
+        self.spans.append(span_data)
+
+    def offset(self) -> float:
+        """Секунди від початку trace'а."""
+
+        return time.perf_counter() - self._started
+
+    def to_dict(self) -> dict:
+
+        return {
+            "trace_id": self.trace_id,
+            "name": self.name,
+            "attributes": self.attributes,
+            "started_at": self.started_at,
+            "duration_ms": round(self.duration * 1000, 3),
+            "error": self.error,
+            "dropped_spans": self.dropped_spans,
+            "spans": self.spans,
+        }
+
+
+_current_trace: contextvars.ContextVar[Trace | None] = contextvars.ContextVar(
+    "current_trace", default=None
+)
+
+_current_span_id: contextvars.ContextVar[int | None] = contextvars.ContextVar(
+    "current_span_id", default=None
+)
+
+completed_traces: deque[Trace] = deque(maxlen=TRACE_BUFFER_SIZE)
+
+
+def get_current_trace() -> Trace | None:
+
+    return _current_trace.get()
+
+
+@contextlib.contextmanager
+def trace_update(
+    name: str, sample_rate: float | None = None, **attributes
+) -> Iterator[Trace | None]:
+    """Корінь trace'а для одного оновлення. Не потрапивши у вибірку, повертає None."""
+
+    rate = TRACE_SAMPLE_RATE if sample_rate is None else sample_rate
+
+    if rate <= 0 or random.random() >= rate:
+
+        yield None
+
+        return
+
+    trace = Trace(name, attributes)
+
+    trace_token = _current_trace.set(trace)
+
+    span_token = _current_span_id.set(None)
+
+    try:
+
+        yield trace
+
+    except BaseException as e:
+
+        trace.error = type(e).__name__
+
+        raise
+
+    finally:
+
+        trace.duration = time.perf_counter() - trace._started
+
+        _current_span_id.reset(span_token)
+
+        _current_trace.reset(trace_token)
+
+        completed_traces.append(trace)
+
+
+@contextlib.contextmanager
+def span(name: str, kind: str = "internal", **attributes) -> Iterator[dict | None]:
+    """Дочірній span поточного trace'а; атрибути можна доповнити через повернений dict."""
+
+    trace = _current_trace.get()
+
+    if trace is None:
+
+        yield None
+
+        return
+
+    span_data = {
+        "id": trace.next_span_id(),
+        "parent_id": _current_span_id.get(),
+        "name": name,
+        "kind": kind,
+        "start_ms": round(trace.offset() * 1000, 3),
+        "duration_ms": 0.0,
+        "attributes": attributes,
+    }
+
+    parent_token = _current_span_id.set(span_data["id"])
+
+    started = time.perf_counter()
+
+    try:
+
+        yield span_data["attributes"]
+
+    except BaseException as e:
+
+        span_data["error"] = type(e).__name__
+
+        raise
+
+    finally:
+
+        span_data["duration_ms"] = round((time.perf_counter() - started) * 1000, 3)
+
+        _current_span_id.reset(parent_token)
+
+        trace.add_span(span_data)
+
+
+def record_span(name: str, kind: str, duration: float, **attributes) -> None:
+    """Додає span за вже виміряною тривалістю (в секундах), що щойно завершилась."""
+
+    trace = _current_trace.get()
+
+    if trace is None:
+
+        return
+
+    trace.add_span(
+        {
+            "id": trace.next_span_id(),
+            "parent_id": _current_span_id.get(),
+            "name": name,
+            "kind": kind,
+            "start_ms": round((trace.offset() - duration) * 1000, 3),
+            "duration_ms": round(duration * 1000, 3),
+            "attributes": attributes,
+        }
+    )
+
+
+def traced(kind: str = "internal", name: str | None = None) -> Callable:
+    """Декоратор: обгортає функцію (звичайну чи async) у span."""
+
+    def decorator(func: Callable) -> Callable:
+
+        span_name = name or func.__name__
+
+        if inspect.iscoroutinefunction(func):
+
+            @functools.wraps(func)
+            async def async_wrapper(*args, **kwargs):
+
+                with span(span_name, kind):
+
+                    return await func(*args, **kwargs)
+
+            return async_wrapper
+
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+
+            with span(span_name, kind):
+
+                return func(*args, **kwargs)
+
+        return wrapper
+
+    return decorator
+
+
+def get_slowest_traces(limit: int) -> list[Trace]:
+
+    return sorted(completed_traces, key=lambda trace: trace.duration, reverse=True)[:limit]
+
+
+def summarize_trace_spans(trace: Trace) -> dict[str, tuple[int, float]]:
+    """Сумарний час span'ів за видом: kind -> (кількість, мс)."""
+
+    summary: dict[str, tuple[int, float]] = {}
+
+    for span_data in trace.spans:
+
+        count, total_ms = summary.get(span_data["kind"], (0, 0.0))
+
+        summary[span_data["kind"]] = (count + 1, total_ms + span_data["duration_ms"])
+
+    return summary
+
+
+def export_traces_json(traces: list[Trace]) -> str:
+
+    return json.dumps(
+        [trace.to_dict() for trace in traces], ensure_ascii=False, indent=2, default=str
+    )
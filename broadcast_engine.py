@@ -0,0 +1,256 @@
+"""
+Асинхронний рушій масових розсилок.
+
+Замість послідовної відправки з time.sleep() (яка блокує весь event loop)
+розсилка виконується кількома воркерами, що ділять спільне відро токенів
+(token bucket) під ліміти Telegram Bot API. Помилки з полем retry_after
+(telegram.error.RetryAfter) ставлять на паузу все відро і повторюються.
+
+Модуль не залежить від python-telegram-bot, тому його можна бенчмаркати
+з фейковим API (див. benchmarks/).
+"""
+
+import asyncio
+import inspect
+import logging
+import os
+import time
+from typing import Any, Awaitable, Callable, Iterable
+
+logger = logging.getLogger(__name__)
+
+# Telegram дозволяє ~30 повідомлень/с різним чатам; лишаємо запас
+
+BROADCAST_RATE_PER_SECOND = float(os.getenv("BROADCAST_RATE_PER_SECOND", "25"))
+
+BROADCAST_CONCURRENCY = int(os.getenv("BROADCAST_CONCURRENCY", "10"))
+
+BROADCAST_MAX_RETRIES = int(os.getenv("BROADCAST_MAX_RETRIES", "3"))
+
+
+class TokenBucket:
+    """Відро токенів: не більше rate операцій за секунду з піком до capacity."""
+
+    def __init__(self, rate: float, capacity: float | None = None):
+
+        self.rate = rate
+
+        # Невеликий запас на пік, щоб не перевищити ліміт у ковзному вікні 1 с
+
+        self.capacity = capacity if capacity is not None else max(1.0, rate / 10)
+
+        self.tokens = self.capacity
+
+        self.updated_at = time.monotonic()
+
+        self.paused_until = 0.0
+
+        self._lock = asyncio.Lock()
+
+    def _refill(self, now: float) -> None:
+
+        # Під час паузи updated_at у майбутньому - токени не накопичуються до її кінця
+
+        self.tokens = min(
+            self.capacity, self.tokens + max(0.0, now - self.updated_at) * self.rate
+        )
+
+        self.updated_at = max(self.updated_at, now)
+
+    def consume(self, amount: float = 1.0) -> None:
+        """Списує токени без очікування (баланс може стати від'ємним - інші почекають довше)."""
+
+        self._refill(time.monotonic())
+
+        self.tokens -= amount
+
+    def pause(self, seconds: float) -> None:
+        """Зупиняє видачу токенів (наприклад, після RetryAfter від Telegram)."""
+
+        self.paused_until = max(self.paused_until, time.monotonic() + seconds)
+
+        self.tokens = 0.0
+
+        # Відлік поповнення - від кінця паузи, інакше одразу після неї піде пачка запитів
+
+        self.updated_at = max(self.updated_at, self.paused_until)
+
+    async def acquire(self) -> None:
+
+        async with self._lock:
+
+            while True:
+
+                now = time.monotonic()
+
+                if now < self.paused_until:
+
+                    await asyncio.sleep(self.paused_until - now)
+
+                    continue
+
+                self._refill(now)
+
+                if self.tokens >= 1:
+
+                    self.tokens -= 1
+
+                    return
+
+                await asyncio.sleep((1 - self.tokens) / self.rate)
+
+
+async def _maybe_await(result: Any) -> None:
+
+    if inspect.isawaitable(result):
+
+        await result
+
+
+async def run_broadcast(
+    recipients: Iterable[int],
+    send_one: Callable[[int], Awaitable[Any]],
+    *,
+    total: int | None = None,
+    rate_per_second: float | None = None,
+    concurrency: int | None = None,
+    max_retries: int | None = None,
+    bucket: TokenBucket | None = None,
+    throttle: bool = True,
+    on_success: Callable[[int], Any] | None = None,
+    on_failure: Callable[[int, Exception], Any] | None = None,
+    on_progress: Callable[[dict], Any] | None = None,
+    progress_interval: int = 50,
+) -> dict:
+    """
+    Розсилає send_one(user_id) усім отримувачам з обмеженням швидкості та паралелізму.
+
+    recipients може бути будь-яким ітерованим (у т.ч. генератором) - воркери
+    беруть отримувачів по одному, тож увесь список не тримається в пам'яті.
+    on_success/on_failure/on_progress можуть бути як звичайними функціями, так і корутинами.
+    throttle=False вимикає власне відро рушія - коли швидкість уже обмежує
+    спільний планувальник запитів бота (telegram_rate_limiter.LaneRateLimiter).
+
+    Повертає статистику: {"total", "sent", "failed", "retried", "duration"}.
+
+    """
+
+    rate_per_second = rate_per_second or BROADCAST_RATE_PER_SECOND
+
+    concurrency = concurrency or BROADCAST_CONCURRENCY
+
+    max_retries = BROADCAST_MAX_RETRIES if max_retries is None else max_retries
+
+    if bucket is None and throttle:
+
+        bucket = TokenBucket(rate_per_second)
+
+    stats = {"total": total, "sent": 0, "failed": 0, "retried": 0, "duration": 0.0}
+
+    recipients_iter = iter(recipients)
+
+    started_at = time.monotonic()
+
+    progress_lock = asyncio.Lock()
+
+    async def report_progress(force: bool = False) -> None:
+
+        if on_progress is None:
+
+            return
+
+        done = stats["sent"] + stats["failed"]
+
+        if force or (done and done % progress_interval == 0):
+
+            stats["duration"] = time.monotonic() - started_at
+
+            async with progress_lock:
+
+                try:
+
+                    await _maybe_await(on_progress(dict(stats)))
+
+                except Exception as e:
+
+                    logger.warning(f"Розсилка: помилка колбеку прогресу: {e}")
+
+    async def deliver(user_id: int) -> None:
+
+        attempt = 0
+
+        while True:
+
+            if bucket is not None:
+
+                await bucket.acquire()
+
+            try:
+
+                await send_one(user_id)
+
+            except Exception as e:
+
+                retry_after = getattr(e, "retry_after", None)
+
+                if retry_after is not None and attempt < max_retries:
+
+                    # RetryAfter стосується всього бота, тому зупиняємо відро для всіх воркерів
+
+                    if hasattr(retry_after, "total_seconds"):
+
+                        retry_after = retry_after.total_seconds()
+
+                    attempt += 1
+
+                    stats["retried"] += 1
+
+                    logger.warning(
+                        f"Розсилка: RetryAfter {retry_after} с для {user_id}, спроба {attempt}/{max_retries}."
+                    )
+
+                    if bucket is not None:
+
+                        bucket.pause(float(retry_after))
+
+                    else:
+
+                        await asyncio.sleep(float(retry_after))
+
+                    continue
+
+                stats["failed"] += 1
+
+                if on_failure is not None:
+
+                    await _maybe_await(on_failure(user_id, e))
+
+                return
+
+            stats["sent"] += 1
+
+            if on_success is not None:
+
+                await _maybe_await(on_success(user_id))
+
+            return
+
+    async def worker() -> None:
+
+        for user_id in recipients_iter:
+
+            await deliver(user_id)
+
+            await report_progress()
+
+    await asyncio.gather(*(worker() for _ in range(max(1, concurrency))))
+
+    stats["duration"] = time.monotonic() - started_at
+
+    if stats["total"] is None:
+
+        stats["total"] = stats["sent"] + stats["failed"]
+
+    await report_progress(force=True)
+
+    return stats
@@ -0,0 +1,84 @@
+"""
+HyperLogLog - оцінка кількості унікальних елементів у фіксованій пам'яті.
+
+Скетч з precision=p займає 2**p байт (p=11 - 2 КіБ, похибка ~2.3%) незалежно
+від кількості доданих елементів. Скетчі об'єднуються поелементним максимумом
+регістрів, тож WAU/MAU - це злиття денних скетчів без зберігання ID користувачів.
+"""
+
+import hashlib
+import math
+
+DEFAULT_PRECISION = 11
+
+
+class HyperLogLog:
+
+    __slots__ = ("precision", "registers")
+
+    def __init__(self, precision: int = DEFAULT_PRECISION, registers: bytes | None = None):
+
+        self.precision = precision
+
+        size = 1 << precision
+
+        if registers is not None and len(registers) != size:
+
+            raise ValueError(f"Очікувалось {size} регістрів, отримано {len(registers)}")
+
+        self.registers = bytearray(registers) if registers is not None else bytearray(size)
+
+    @classmethod
+    def from_bytes(cls, data: bytes) -> "HyperLogLog":
+
+        return cls(precision=(len(data)).bit_length() - 1, registers=data)
+
+    def to_bytes(self) -> bytes:
+
+        return bytes(self.registers)
+
+    def add(self, value: int | str) -> None:
+
+        hashed = int.from_bytes(
+            hashlib.blake2b(str(value).encode("utf-8"), digest_size=8).digest(), "big"
+        )
+
+        index = hashed >> (64 - self.precision)
+
+        remaining_bits = 64 - self.precision
+
+        remainder = hashed & ((1 << remaining_bits) - 1)
+
+        # Позиція першої одиниці в решті хешу (1..remaining_bits + 1)
+
+        rank = remaining_bits - remainder.bit_length() + 1
+
+        if rank > self.registers[index]:
+
+            self.registers[index] = rank
+
+    def merge(self, other: "HyperLogLog") -> None:
+
+        if other.precision != self.precision:
+
+            raise ValueError("Не можна об'єднати скетчі різної точності")
+
+        self.registers = bytearray(map(max, self.registers, other.registers))
+
+    def count(self) -> int:
+
+        size = len(self.registers)
+
+        alpha = 0.7213 / (1 + 1.079 / size)
+
+        estimate = alpha * size * size / sum(2.0**-register for register in self.registers)
+
+        empty_registers = self.registers.count(0)
+
+        # Для малих кардинальностей точніший лінійний підрахунок
+
+        if estimate <= 2.5 * size and empty_registers:
+
+            estimate = size * math.log(size / empty_registers)
+
+        return round(estimate)
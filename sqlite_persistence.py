@@ -0,0 +1,362 @@
+"""
+Персистентність python-telegram-bot у SQLite з відкладеним (write-behind) записом.
+
+Application вже накопичує зміни і викликає update_*() раз на update_interval.
+SQLitePersistence додатково:
+
+- відкидає незмінені дані (dirty tracking за хешем серіалізованого значення),
+  бо Application позначає користувача зміненим після будь-якого оновлення;
+- збирає всі зміни одного циклу і пише їх однією транзакцією через
+  PERSISTENCE_WRITE_DELAY_SECONDS (flush() при зупинці пише одразу).
+
+Таблиці створює initialize_database() в основному модулі.
+"""
+
+import asyncio
+import hashlib
+import json
+import logging
+import os
+import pickle
+import sqlite3
+import time
+from typing import Any, Callable
+
+from telegram.ext import BasePersistence, PersistenceInput
+
+logger = logging.getLogger(__name__)
+
+PERSISTENCE_UPDATE_INTERVAL_SECONDS = float(os.getenv("PERSISTENCE_UPDATE_INTERVAL", "30"))
+
+PERSISTENCE_WRITE_DELAY_SECONDS = 1.0
+
+_DELETED = object()  # Маркер видалення в черзі запису
+
+
+def _serialize(value: Any) -> bytes:
+
+    return pickle.dumps(value, protocol=pickle.HIGHEST_PROTOCOL)
+
+
+def _digest(payload: bytes) -> bytes:
+
+    return hashlib.blake2b(payload, digest_size=16).digest()
+
+
+class SQLitePersistence(BasePersistence[dict, dict, dict]):
+    """user_data, chat_data, bot_data та стани ConversationHandler у SQLite."""
+
+    def __init__(
+        self,
+        connect: Callable[[], sqlite3.Connection],
+        update_interval: float = PERSISTENCE_UPDATE_INTERVAL_SECONDS,
+        write_delay: float = PERSISTENCE_WRITE_DELAY_SECONDS,
+    ):
+
+        super().__init__(
+            store_data=PersistenceInput(
+                bot_data=True, chat_data=True, user_data=True, callback_data=False
+            ),
+            update_interval=update_interval,
+        )
+
+        self.connect = connect
+
+        self.write_delay = write_delay
+
+        # Хеші останніх записаних значень: (таблиця, ключ) -> digest
+
+        self._digests: dict[tuple[str, Any], bytes] = {}
+
+        # Черга запису: (таблиця, ключ) -> серіалізоване значення або _DELETED
+
+        self._pending: dict[tuple[str, Any], Any] = {}
+
+        self._flush_task: asyncio.Task | None = None
+
+    # --- Завантаження при старті ---
+
+    def _load_rows(self, table: str, key_column: str) -> dict:
+
+        loaded = {}
+
+        try:
+
+            with self.connect() as conn:
+
+                rows = conn.execute(f"SELECT {key_column}, data FROM {table}").fetchall()
+
+        except sqlite3.Error as e:
+
+            logger.error(f"Персистентність: не вдалося прочитати {table}: {e}")
+
+            return loaded
+
+        for key, payload in rows:
+
+            try:
+
+                loaded[key] = pickle.loads(payload)
+
+            except Exception as e:
+
+                logger.warning(f"Персистентність: пошкоджений запис {table}[{key}] пропущено: {e}")
+
+                continue
+
+            self._digests[(table, key)] = _digest(payload)
+
+        return loaded
+
+    async def get_user_data(self) -> dict[int, dict]:
+
+        return self._load_rows("persisted_user_data", "user_id")
+
+    async def get_chat_data(self) -> dict[int, dict]:
+
+        return self._load_rows("persisted_chat_data", "chat_id")
+
+    async def get_bot_data(self) -> dict:
+
+        return self._load_rows("persisted_bot_data", "id").get(1, {})
+
+    async def get_callback_data(self) -> None:
+
+        return None  # Довільні callback_data бот не використовує
+
+    async def get_conversations(self, name: str) -> dict:
+
+        conversations = {}
+
+        try:
+
+            with self.connect() as conn:
+
+                rows = conn.execute(
+                    "SELECT conversation_key, state FROM persisted_conversations WHERE name = ?",
+                    (name,),
+                ).fetchall()
+
+        except sqlite3.Error as e:
+
+            logger.error(f"Персистентність: не вдалося прочитати розмови '{name}': {e}")
+
+            rows = []
+
+        for conversation_key, payload in rows:
+
+            try:
+
+                conversations[tuple(json.loads(conversation_key))] = pickle.loads(payload)
+
+            except Exception as e:
+
+                logger.warning(
+                    f"Персистентність: пошкоджений стан '{name}' {conversation_key}: {e}"
+                )
+
+                continue
+
+            self._digests[("persisted_conversations", (name, conversation_key))] = _digest(payload)
+
+        return conversations
+
+    # --- Зміни від Application (лише ставлять у чергу) ---
+
+    def _enqueue(self, table: str, key: Any, value: Any) -> None:
+
+        if value is _DELETED:
+
+            if (table, key) not in self._digests and (table, key) not in self._pending:
+
+                return
+
+            self._pending[(table, key)] = _DELETED
+
+            self._schedule_flush()
+
+            return
+
+        try:
+
+            payload = _serialize(value)
+
+        except Exception as e:
+
+            logger.error(f"Персистентність: не вдалося серіалізувати {table}[{key}]: {e}")
+
+            return
+
+        # Dirty tracking: незмінене значення не пишемо
+
+        if self._digests.get((table, key)) == _digest(payload):
+
+            self._pending.pop((table, key), None)
+
+            return
+
+        self._pending[(table, key)] = payload
+
+        self._schedule_flush()
+
+    def _schedule_flush(self) -> None:
+
+        if self._flush_task is not None and not self._flush_task.done():
+
+            return
+
+        try:
+
+            self._flush_task = asyncio.get_running_loop().create_task(self._delayed_flush())
+
+        except RuntimeError:
+
+            self._write_pending()  # Поза циклом подій (напр. при зупинці) - пишемо одразу
+
+    async def _delayed_flush(self) -> None:
+
+        # Зміни одного циклу update_persistence() надходять пачкою - збираємо їх в одну транзакцію
+
+        await asyncio.sleep(self.write_delay)
+
+        self._write_pending()
+
+    def _write_pending(self) -> int:
+
+        if not self._pending:
+
+            return 0
+
+        pending, self._pending = self._pending, {}
+
+        now = int(time.time())
+
+        try:
+
+            with self.connect() as conn:
+
+                for (table, key), payload in pending.items():
+
+                    if table == "persisted_conversations":
+
+                        name, conversation_key = key
+
+                        if payload is _DELETED:
+
+                            conn.execute(
+                                "DELETE FROM persisted_conversations "
+                                "WHERE name = ? AND conversation_key = ?",
+                                (name, conversation_key),
+                            )
+
+                        else:
+
+                            conn.execute(
+                                "INSERT OR REPLACE INTO persisted_conversations "
+                                "(name, conversation_key, state, updated_at) VALUES (?, ?, ?, ?)",
+                                (name, conversation_key, payload, now),
+                            )
+
+                        continue
+
+                    key_column = {
+                        "persisted_user_data": "user_id",
+                        "persisted_chat_data": "chat_id",
+                        "persisted_bot_data": "id",
+                    }[table]
+
+                    if payload is _DELETED:
+
+                        conn.execute(f"DELETE FROM {table} WHERE {key_column} = ?", (key,))
+
+                    else:
+
+                        conn.execute(
+                            f"INSERT OR REPLACE INTO {table} ({key_column}, data, updated_at) "
+                            "VALUES (?, ?, ?)",
+                            (key, payload, now),
+                        )
+
+                conn.commit()
+
+        except sqlite3.Error as e:
+
+            logger.error(f"Персистентність: помилка запису {len(pending)} змін: {e}")
+
+            # Повертаємо в чергу, не перетираючи новіші зміни
+
+            for item_key, payload in pending.items():
+
+                self._pending.setdefault(item_key, payload)
+
+            return 0
+
+        for item_key, payload in pending.items():
+
+            if payload is _DELETED:
+
+                self._digests.pop(item_key, None)
+
+            else:
+
+                self._digests[item_key] = _digest(payload)
+
+        logger.debug(f"Персистентність: записано {len(pending)} змін однією транзакцією.")
+
+        return len(pending)
+
+    async def update_user_data(self, user_id: int, data: dict) -> None:
+
+        self._enqueue("persisted_user_data", user_id, data)
+
+    async def update_chat_data(self, chat_id: int, data: dict) -> None:
+
+        self._enqueue("persisted_chat_data", chat_id, data)
+
+    async def update_bot_data(self, data: dict) -> None:
+
+        self._enqueue("persisted_bot_data", 1, data)
+
+    async def update_callback_data(self, data) -> None:
+
+        return None
+
+    async def update_conversation(self, name: str, key: tuple, new_state: object | None) -> None:
+
+        # None - розмова завершена: запис видаляється
+        self._enqueue(
+            "persisted_conversations",
+            (name, json.dumps(list(key))),
+            _DELETED if new_state is None else new_state,
+        )
+
+    async def drop_user_data(self, user_id: int) -> None:
+
+        self._enqueue("persisted_user_data", user_id, _DELETED)
+
+    async def drop_chat_data(self, chat_id: int) -> None:
+
+        self._enqueue("persisted_chat_data", chat_id, _DELETED)
+
+    async def refresh_user_data(self, user_id: int, user_data: dict) -> None:
+
+        return None  # Дані в пам'яті - джерело істини, БД лише їх копія
+
+    async def refresh_chat_data(self, chat_id: int, chat_data: dict) -> None:
+
+        return None
+
+    async def refresh_bot_data(self, bot_data: dict) -> None:
+
+        return None
+
+    async def flush(self) -> None:
+        """Викликається Application при зупинці: дописує все, що ще в черзі."""
+
+        if self._flush_task is not None and not self._flush_task.done():
+
+            self._flush_task.cancel()
+
+        written = self._write_pending()
+
+        logger.info(f"Персистентність: при зупинці записано {written} змін.")
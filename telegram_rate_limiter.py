@@ -0,0 +1,211 @@
+"""
+Спільний планувальник вихідних запитів до Telegram Bot API з пріоритетними смугами.
+
+Кожен запит бота проходить через LaneRateLimiter (Application.builder().rate_limiter(...)):
+
+- "interactive" (за замовчуванням) - відповіді користувачам: edit_message_text,
+  query.answer, reply_text. Ніколи не чекають на масовий трафік: лише списують
+  токен з глобального відра, тож масові смуги автоматично пригальмовують.
+- масові смуги ("broadcast", "dlq") - розсилки (зокрема відкладені оголошення) і повторна
+  доставка DLQ. Кожна має власну квоту і додатково чекає на глобальне відро.
+
+Смуга задається через rate_limit_args={"lane": "..."} у виклику методу бота.
+Для кожного чату діє окреме відро (Telegram обмежує ~1 повідомлення/с у чат).
+"""
+
+import asyncio
+import logging
+import os
+import time
+from typing import Any, Callable, Coroutine
+
+from telegram.error import RetryAfter
+from telegram.ext import BaseRateLimiter
+
+from bot_metrics import TELEGRAM_API_ERRORS, TELEGRAM_API_LATENCY
+from bot_tracing import record_span
+from broadcast_engine import TokenBucket
+
+logger = logging.getLogger(__name__)
+
+LANE_INTERACTIVE = "interactive"
+
+LANE_BROADCAST = "broadcast"
+
+LANE_DLQ = "dlq"
+
+GLOBAL_RATE_PER_SECOND = float(os.getenv("TELEGRAM_GLOBAL_RATE_PER_SECOND", "28"))
+
+BULK_LANE_RATES = {
+    LANE_BROADCAST: float(os.getenv("BROADCAST_RATE_PER_SECOND", "25")),
+    LANE_DLQ: float(os.getenv("DLQ_RATE_PER_SECOND", "5")),
+}
+
+PRIVATE_CHAT_RATE_PER_SECOND = 1.0
+
+PRIVATE_CHAT_BURST = 3
+
+GROUP_CHAT_RATE_PER_SECOND = 20 / 60  # Групи: ~20 повідомлень на хвилину
+
+CHAT_BUCKETS_PRUNE_THRESHOLD = 5000
+
+
+class LaneRateLimiter(BaseRateLimiter[dict]):
+    """Глобальне + по-чатове обмеження швидкості з пріоритетом інтерактивних відповідей."""
+
+    def __init__(self, max_interactive_retries: int = 1):
+
+        self.max_interactive_retries = max_interactive_retries
+
+        self.global_bucket: TokenBucket | None = None
+
+        self.lane_buckets: dict[str, TokenBucket] = {}
+
+        self.chat_buckets: dict[int, TokenBucket] = {}
+
+    async def initialize(self) -> None:
+
+        # Відра створюються тут, щоб asyncio.Lock належали циклу подій застосунку
+
+        self.global_bucket = TokenBucket(GLOBAL_RATE_PER_SECOND, capacity=GLOBAL_RATE_PER_SECOND / 5)
+
+        self.lane_buckets = {lane: TokenBucket(rate) for lane, rate in BULK_LANE_RATES.items()}
+
+        self.chat_buckets = {}
+
+    async def shutdown(self) -> None:
+
+        self.chat_buckets.clear()
+
+    def _get_chat_bucket(self, chat_id: Any) -> TokenBucket | None:
+
+        try:
+
+            chat_id = int(chat_id)
+
+        except (TypeError, ValueError):
+
+            return None  # @username каналу тощо - без по-чатового обмеження
+
+        bucket = self.chat_buckets.get(chat_id)
+
+        if bucket is None:
+
+            if len(self.chat_buckets) > CHAT_BUCKETS_PRUNE_THRESHOLD:
+
+                self._prune_chat_buckets()
+
+            if chat_id < 0:
+
+                bucket = TokenBucket(GROUP_CHAT_RATE_PER_SECOND, capacity=PRIVATE_CHAT_BURST)
+
+            else:
+
+                bucket = TokenBucket(PRIVATE_CHAT_RATE_PER_SECOND, capacity=PRIVATE_CHAT_BURST)
+
+            self.chat_buckets[chat_id] = bucket
+
+        return bucket
+
+    def _prune_chat_buckets(self) -> None:
+        """Видаляє відра чатів, які давно не використовувались (вони вже повністю наповнені)."""
+
+        now = time.monotonic()
+
+        idle_chat_ids = [
+            chat_id for chat_id, bucket in self.chat_buckets.items() if now - bucket.updated_at > 60
+        ]
+
+        for chat_id in idle_chat_ids:
+
+            del self.chat_buckets[chat_id]
+
+    async def process_request(
+        self,
+        callback: Callable[..., Coroutine[Any, Any, Any]],
+        args: Any,
+        kwargs: dict[str, Any],
+        endpoint: str,
+        data: dict[str, Any],
+        rate_limit_args: dict | None,
+    ) -> Any:
+
+        lane = (rate_limit_args or {}).get("lane", LANE_INTERACTIVE)
+
+        chat_bucket = self._get_chat_bucket(data.get("chat_id")) if "chat_id" in data else None
+
+        attempt = 0
+
+        requested_at = time.perf_counter()
+
+        while True:
+
+            if lane == LANE_INTERACTIVE:
+
+                # Інтерактивні запити не стають у чергу за масовими - лише "позичають" токен
+
+                self.global_bucket.consume()
+
+            else:
+
+                await self.lane_buckets.get(lane, self.lane_buckets[LANE_BROADCAST]).acquire()
+
+                await self.global_bucket.acquire()
+
+            if chat_bucket is not None:
+
+                await chat_bucket.acquire()
+
+            started_at = time.perf_counter()
+
+            try:
+
+                return await callback(*args, **kwargs)
+
+            except RetryAfter as e:
+
+                TELEGRAM_API_ERRORS.inc(endpoint=endpoint, error="RetryAfter")
+
+                retry_after = e.retry_after
+
+                if hasattr(retry_after, "total_seconds"):
+
+                    retry_after = retry_after.total_seconds()
+
+                # Flood control діє на весь бот: зупиняємо масові смуги
+
+                self.global_bucket.pause(float(retry_after))
+
+                logger.warning(f"Telegram API: RetryAfter {retry_after} с ({endpoint}, смуга {lane}).")
+
+                if lane != LANE_INTERACTIVE or attempt >= self.max_interactive_retries:
+
+                    raise  # Масові смуги повторює broadcast_engine / DLQ
+
+                attempt += 1
+
+            except Exception as e:
+
+                TELEGRAM_API_ERRORS.inc(endpoint=endpoint, error=type(e).__name__)
+
+                raise
+
+            finally:
+
+                duration = time.perf_counter() - started_at
+
+                TELEGRAM_API_LATENCY.observe(duration, endpoint=endpoint, lane=lane)
+
+                # queued_ms - скільки запит чекав на відра швидкості до відправки
+
+                record_span(
+                    endpoint,
+                    "telegram_api",
+                    duration,
+                    lane=lane,
+                    queued_ms=round((started_at - requested_at) * 1000, 3),
+                )
+
+            # Сюди доходить лише інтерактивний запит після RetryAfter - чекаємо поза заміром часу
+
+            await asyncio.sleep(float(retry_after))
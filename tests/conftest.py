@@ -0,0 +1,6 @@
+import os
+import sys
+
+# Модулі бота лежать у корені репозиторію (без пакета)
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
@@ -0,0 +1,47 @@
+import sqlite3
+
+from bot_metrics import DB_QUERY_LATENCY, TimedConnection
+
+
+def query_count(operation: str) -> int:
+
+    state = DB_QUERY_LATENCY._values.get((operation,))
+
+    return state["count"] if state else 0
+
+
+def test_connection_execute_records_query_latency():
+
+    conn = sqlite3.connect(":memory:", factory=TimedConnection)
+
+    before = query_count("SELECT")
+
+    conn.execute("SELECT 1").fetchone()
+
+    assert query_count("SELECT") == before + 1
+
+
+def test_cursor_execute_records_query_latency():
+
+    conn = sqlite3.connect(":memory:", factory=TimedConnection)
+
+    before = query_count("SELECT")
+
+    conn.cursor().execute("SELECT 1").fetchone()
+
+    assert query_count("SELECT") == before + 1
+
+
+def test_connection_executemany_records_query_latency():
+
+    conn = sqlite3.connect(":memory:", factory=TimedConnection)
+
+    conn.execute("CREATE TABLE items (value INTEGER)")
+
+    before = query_count("INSERT")
+
+    conn.executemany("INSERT INTO items (value) VALUES (?)", [(1,), (2,)])
+
+    assert query_count("INSERT") == before + 1
+
+    assert conn.execute("SELECT COUNT(*) FROM items").fetchone()[0] == 2
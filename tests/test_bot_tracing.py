@@ -0,0 +1,79 @@
+import sqlite3
+
+from bot_metrics import TimedConnection
+from bot_tracing import span, trace_update
+
+
+def test_connection_execute_inside_trace_produces_db_span():
+
+    conn = sqlite3.connect(":memory:", factory=TimedConnection)
+
+    with trace_update("update", sample_rate=1.0) as trace:
+
+        conn.execute("SELECT 1").fetchone()
+
+    db_spans = [span_data for span_data in trace.spans if span_data["kind"] == "db"]
+
+    assert [span_data["name"] for span_data in db_spans] == ["SELECT"]
+
+
+def test_nested_spans_reference_their_parent():
+
+    with trace_update("update", sample_rate=1.0) as trace:
+
+        with span("outer"):
+
+            with span("inner"):
+
+                pass
+
+        with span("sibling"):
+
+            pass
+
+    spans = {span_data["name"]: span_data for span_data in trace.spans}
+
+    assert spans["outer"]["parent_id"] is None
+
+    assert spans["inner"]["parent_id"] == spans["outer"]["id"]
+
+    assert spans["sibling"]["parent_id"] is None
+
+    assert len({span_data["id"] for span_data in trace.spans}) == 3
+
+
+def test_span_outside_trace_is_noop():
+
+    with span("orphan") as attributes:
+
+        assert attributes is None
+
+
+def test_unsampled_update_yields_no_trace():
+
+    with trace_update("update", sample_rate=0.0) as trace:
+
+        with span("child") as attributes:
+
+            assert attributes is None
+
+    assert trace is None
+
+
+def test_error_is_recorded_on_trace_and_span():
+
+    try:
+
+        with trace_update("update", sample_rate=1.0) as trace:
+
+            with span("failing"):
+
+                raise ValueError("boom")
+
+    except ValueError:
+
+        pass
+
+    assert trace.error == "ValueError"
+
+    assert trace.spans[0]["error"] == "ValueError"
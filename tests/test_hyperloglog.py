@@ -0,0 +1,81 @@
+import pytest
+
+from hyperloglog import HyperLogLog
+
+
+def test_empty_sketch_counts_zero():
+
+    assert HyperLogLog().count() == 0
+
+
+def test_small_cardinality_uses_linear_counting():
+
+    sketch = HyperLogLog()
+
+    for user_id in range(100):
+
+        sketch.add(user_id)
+
+        sketch.add(user_id)  # Повтори не впливають на оцінку
+
+    assert abs(sketch.count() - 100) <= 5
+
+
+@pytest.mark.parametrize("cardinality", [1_000, 20_000])
+def test_estimate_within_expected_error(cardinality):
+
+    sketch = HyperLogLog()
+
+    for user_id in range(cardinality):
+
+        sketch.add(user_id)
+
+    # Стандартна похибка для p=11 ~2.3%; допускаємо 3 сигми
+
+    assert abs(sketch.count() - cardinality) / cardinality < 0.07
+
+
+def test_merge_counts_union():
+
+    first, second = HyperLogLog(), HyperLogLog()
+
+    for user_id in range(0, 3_000):
+
+        first.add(user_id)
+
+    for user_id in range(2_000, 5_000):
+
+        second.add(user_id)
+
+    first.merge(second)
+
+    assert abs(first.count() - 5_000) / 5_000 < 0.07
+
+
+def test_merge_rejects_different_precision():
+
+    with pytest.raises(ValueError):
+
+        HyperLogLog(precision=10).merge(HyperLogLog(precision=11))
+
+
+def test_bytes_round_trip():
+
+    sketch = HyperLogLog()
+
+    for user_id in range(500):
+
+        sketch.add(user_id)
+
+    restored = HyperLogLog.from_bytes(sketch.to_bytes())
+
+    assert restored.precision == sketch.precision
+
+    assert restored.count() == sketch.count()
+
+
+def test_registers_length_is_validated():
+
+    with pytest.raises(ValueError):
+
+        HyperLogLog(precision=11, registers=b"\x00" * 100)
@@ -0,0 +1,167 @@
+import asyncio
+import sqlite3
+
+import pytest
+
+pytest.importorskip("telegram.ext")
+
+from sqlite_persistence import _DELETED, SQLitePersistence  # noqa: E402
+
+SCHEMA = """
+CREATE TABLE persisted_user_data (user_id INTEGER PRIMARY KEY, data BLOB, updated_at INTEGER);
+CREATE TABLE persisted_chat_data (chat_id INTEGER PRIMARY KEY, data BLOB, updated_at INTEGER);
+CREATE TABLE persisted_bot_data (id INTEGER PRIMARY KEY, data BLOB, updated_at INTEGER);
+CREATE TABLE persisted_conversations (
+    name TEXT, conversation_key TEXT, state BLOB, updated_at INTEGER,
+    PRIMARY KEY (name, conversation_key)
+);
+"""
+
+
+class CountingConnection(sqlite3.Connection):
+    """Рахує записи (INSERT/DELETE), щоб перевіряти dirty tracking."""
+
+    writes = 0
+
+    def execute(self, sql, parameters=(), /):
+
+        if sql.lstrip().upper().startswith(("INSERT", "DELETE")):
+
+            CountingConnection.writes += 1
+
+        return super().execute(sql, parameters)
+
+
+@pytest.fixture
+def persistence(tmp_path):
+
+    db_path = tmp_path / "bot.db"
+
+    with sqlite3.connect(db_path) as conn:
+
+        conn.executescript(SCHEMA)
+
+    CountingConnection.writes = 0
+
+    # Велика затримка: відкладений запис не спрацює сам, тести викликають _write_pending()
+
+    return SQLitePersistence(
+        lambda: sqlite3.connect(db_path, factory=CountingConnection), write_delay=3600
+    )
+
+
+def run_in_loop(persistence, scenario) -> None:
+    """Виконує сценарій у циклі подій (як у боті) і скасовує відкладений запис."""
+
+    async def runner():
+
+        try:
+
+            await scenario()
+
+        finally:
+
+            if persistence._flush_task is not None:
+
+                persistence._flush_task.cancel()
+
+    asyncio.run(runner())
+
+
+def test_changes_are_batched_until_flush(persistence):
+
+    async def scenario():
+
+        await persistence.update_user_data(1, {"group": "КН-21"})
+
+        await persistence.update_user_data(2, {"group": "КН-22"})
+
+        assert CountingConnection.writes == 0
+
+        assert persistence._write_pending() == 2
+
+        assert await persistence.get_user_data() == {1: {"group": "КН-21"}, 2: {"group": "КН-22"}}
+
+    run_in_loop(persistence, scenario)
+
+
+def test_unchanged_value_is_not_rewritten(persistence):
+
+    async def scenario():
+
+        await persistence.update_user_data(1, {"group": "КН-21"})
+
+        persistence._write_pending()
+
+        writes_after_first_flush = CountingConnection.writes
+
+        await persistence.update_user_data(1, {"group": "КН-21"})
+
+        assert persistence._pending == {}
+
+        assert persistence._write_pending() == 0
+
+        assert CountingConnection.writes == writes_after_first_flush
+
+    run_in_loop(persistence, scenario)
+
+
+def test_delete_of_never_written_key_is_skipped(persistence):
+
+    async def scenario():
+
+        persistence._enqueue("persisted_user_data", 42, _DELETED)
+
+        assert persistence._pending == {}
+
+    run_in_loop(persistence, scenario)
+
+
+def test_failed_write_is_requeued_without_overwriting_newer_changes(persistence):
+
+    async def scenario():
+
+        await persistence.update_user_data(1, {"step": 1})
+
+        await persistence.update_user_data(2, {"step": 1})
+
+        real_connect = persistence.connect
+
+        def broken_connect():
+
+            raise sqlite3.OperationalError("database is locked")
+
+        persistence.connect = broken_connect
+
+        assert persistence._write_pending() == 0
+
+        # Поки запис не вдався, користувач 1 встиг змінитися ще раз
+
+        await persistence.update_user_data(1, {"step": 2})
+
+        persistence.connect = real_connect
+
+        assert persistence._write_pending() == 2
+
+        assert await persistence.get_user_data() == {1: {"step": 2}, 2: {"step": 1}}
+
+    run_in_loop(persistence, scenario)
+
+
+def test_conversation_end_deletes_row(persistence):
+
+    async def scenario():
+
+        await persistence.update_conversation("raffle", (10, 10), 3)
+
+        persistence._write_pending()
+
+        assert await persistence.get_conversations("raffle") == {(10, 10): 3}
+
+        await persistence.update_conversation("raffle", (10, 10), None)
+
+        persistence._write_pending()
+
+        assert await persistence.get_conversations("raffle") == {}
+
+    run_in_loop(persistence, scenario)
@@ -0,0 +1,67 @@
+import broadcast_engine
+from broadcast_engine import TokenBucket
+
+
+class FakeClock:
+
+    def __init__(self):
+
+        self.now = 1000.0
+
+    def __call__(self) -> float:
+
+        return self.now
+
+
+def make_bucket(monkeypatch, rate: float = 10.0, capacity: float = 5.0):
+
+    clock = FakeClock()
+
+    monkeypatch.setattr(broadcast_engine.time, "monotonic", clock)
+
+    return TokenBucket(rate, capacity=capacity), clock
+
+
+def test_consume_refills_at_rate(monkeypatch):
+
+    bucket, clock = make_bucket(monkeypatch)
+
+    bucket.consume(5)
+
+    clock.now += 0.2
+
+    bucket.consume(0)
+
+    assert abs(bucket.tokens - 2.0) < 1e-9
+
+
+def test_pause_does_not_refill_until_it_ends(monkeypatch):
+
+    bucket, clock = make_bucket(monkeypatch)
+
+    bucket.pause(3)
+
+    clock.now += 3  # Рівно кінець паузи - токенів ще немає
+
+    bucket.consume(0)
+
+    assert bucket.tokens == 0.0
+
+    clock.now += 0.1
+
+    bucket.consume(0)
+
+    assert abs(bucket.tokens - 1.0) < 1e-9
+
+
+def test_consume_during_pause_does_not_go_further_negative(monkeypatch):
+
+    bucket, clock = make_bucket(monkeypatch)
+
+    bucket.pause(3)
+
+    clock.now += 1
+
+    bucket.consume()
+
+    assert bucket.tokens == -1.0